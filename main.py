@@ -5,7 +5,7 @@ Marvel Collector Bot - Main Entry Point
 Enhanced with performance optimization to prevent slowdowns
 """
 import asyncio
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 import gc
 import logging
 import os
@@ -206,71 +206,7 @@ from modules.safari import safari_command, enter_command, exit_command, hunt_com
 from modules.team import setup_team_handlers, team_command, addteam_command, removeteam_command
 from modules.battle import battle_command, battleinfo_command, mybattle_command, testteam_command, clearbattles_command, setup_battle_handlers
 from modules.exchange import exchange_command, exchange_history_command, exchange_callback_handler, init_exchange_system
-# Background loop: Loan reminders
-async def loan_reminder_loop(client: Client):
-    from modules.postgres_database import get_database
-    from modules.tokens import LOAN_TEST_MINUTES
-    while True:
-        try:
-            db = get_database()
-            # Ensure loan columns exist
-            try:
-                await db.ensure_loan_columns()
-            except Exception:
-                pass
-            # Frequency: daily; if testing minutes are enabled, check every minute
-            sleep_seconds = 60 if (LOAN_TEST_MINUTES and LOAN_TEST_MINUTES > 0) else 3600
-            # Determine min hours since last reminder
-            min_hours = 1 if (LOAN_TEST_MINUTES and LOAN_TEST_MINUTES > 0) else 24
-            users = await db.get_users_with_active_loans_for_reminder(min_hours_since_last=min_hours)
-            now = datetime.now(timezone.utc)
-            for u in users:
-                try:
-                    user_id = u.get('user_id')
-                    loan_amount = int(u.get('loan_amount') or 0)
-                    loan_due = u.get('loan_due')
-                    if isinstance(loan_due, str):
-                        from datetime import datetime as _dt
-                        try:
-                            loan_due_dt = _dt.fromisoformat(loan_due)
-                        except Exception:
-                            loan_due_dt = None
-                    else:
-                        loan_due_dt = loan_due
-                    # Normalize to timezone-aware UTC
-                    if loan_due_dt and loan_due_dt.tzinfo is None:
-                        try:
-                            loan_due_dt = loan_due_dt.replace(tzinfo=timezone.utc)
-                        except Exception:
-                            pass
-                    # Time left / overdue
-                    if loan_due_dt:
-                        delta = loan_due_dt - now
-                        if delta.total_seconds() > 0:
-                            days = delta.days
-                            hours = (delta.seconds // 3600)
-                            status = f"⏳ <b>Time left:</b> {days}d {hours}h"
-                        else:
-                            overdue_days = abs(delta.days)
-                            overdue_hours = abs((delta.seconds // 3600))
-                            status = f"⚠️ <b>Overdue:</b> {overdue_days}d {overdue_hours}h"
-                    else:
-                        status = ""
-                    text = (
-                        "📢 <b>Loan Reminder</b>\n\n"
-                        f"• <b>Principal:</b> <code>{loan_amount:,}</code>\n"
-                        f"• <b>Due Date (UTC):</b> <code>{loan_due_dt.strftime('%Y-%m-%d %H:%M') if loan_due_dt else 'Unknown'}</code>\n"
-                        f"{status}\n\n"
-                        "Please repay using <code>/repay</code>. Late penalties apply after the due date."
-                    )
-                    await client.send_message(user_id, text)
-                    await db.mark_loan_reminder_sent(user_id)
-                except Exception:
-                    pass
-            await asyncio.sleep(sleep_seconds)
-        except Exception:
-            # Backoff on unexpected errors
-            await asyncio.sleep(60)
+from modules.loan_reminders import loan_reminder_loop
 
 from modules.top import (
     btop_command,
@@ -333,6 +269,7 @@ from modules.upload import (
     start_character_upload,
 )
 from modules.vid import vadd_command, vedit_command
+from modules.bulk_import import bulkimport_command
 from modules.vidcollection import (
     handle_vidcollection_pagination,
     handle_vidlist_pagination,
@@ -403,6 +340,14 @@ async def startup_initialization():
         print("❌ Failed to initialize database. Bot may not work properly.")
         return False
     
+    # Start the shared outbound HTTP client (pooled connections for PokeAPI, uploads, etc.)
+    try:
+        from modules.http_client import init_http_client
+        await init_http_client()
+        print("✅ Shared HTTP client started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start shared HTTP client: {e}")
+    
     # Initialize drop weights and limits
     try:
         db = get_database()
@@ -476,10 +421,68 @@ async def startup_initialization():
         import traceback
         traceback.print_exc()
 
+    # Restore active gift/trade/sell/loan actions into the in-memory registry
+    try:
+        from modules.action_registry import action_manager
+        restored = await action_manager.load(get_database())
+        print(f"✅ Restored {restored} active actions")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to restore active actions: {e}")
+
     print("✅ Database initialized successfully")
     print("✅ Bot is ready to handle commands!")
     return True
 
+async def post_start_tasks():
+    """Start background work that sends messages; runs once the client is connected"""
+    # Reload running auctions and start the end-time scheduler
+    try:
+        from modules.auction import start_auctions
+        restored = await start_auctions(app)
+        print(f"✅ Auction scheduler started ({restored} active auctions)")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start auction scheduler: {e}")
+
+    # Continue broadcasts that were interrupted by a restart
+    try:
+        from modules.broadcast_engine import broadcast_engine
+        resumed = await broadcast_engine.resume(app)
+        if resumed:
+            print(f"✅ Resumed {resumed} interrupted broadcasts")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to resume broadcasts: {e}")
+
+async def shutdown_cleanup():
+    """Release shared resources before the process exits"""
+    try:
+        from modules.currency_ledger import currency_ledger
+        await currency_ledger.close()
+        print("✅ Currency ledger flushed")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to flush currency ledger: {e}")
+    try:
+        from modules.action_registry import get_action_manager
+        await get_action_manager().close()
+        print("✅ Active actions flushed")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to flush active actions: {e}")
+    try:
+        from modules.http_client import close_http_client
+        await close_http_client()
+        print("✅ Shared HTTP client closed")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to close shared HTTP client: {e}")
+
+async def run_bot():
+    """Start the client, wait for a stop signal, then shut down cleanly"""
+    await app.start()
+    try:
+        await post_start_tasks()
+        await idle()
+    finally:
+        await shutdown_cleanup()
+        await app.stop()
+
 # Database initialization decorator
 def require_database(func):
     """Decorator to ensure database is initialized before executing any command"""
@@ -1069,10 +1072,13 @@ async def sethandler_handler(client: Client, message: Message):
         return
     # Deduct cost
     try:
-        await db.update_user(user_id, {"wallet": user.get('wallet', 0) - 500000})
+        charged = await db.debit(user_id, 'wallet', 500000, 'set_handler')
     except Exception:
         await message.reply_text("<b>❌ Failed to deduct tokens. Try again later.</b>")
         return
+    if charged is None:
+        await message.reply_text("<b>You don't have enough tokens.\nYou need 500,000 tokens to set a custom handler.</b>")
+        return
     # Try to set; unique index enforces uniqueness (double-check race)
     success = await db.set_collection_handler(user_id, handler)
     if success:
@@ -1080,7 +1086,7 @@ async def sethandler_handler(client: Client, message: Message):
     else:
         # Refund on failure
         try:
-            await db.update_user(user_id, {"wallet": (user.get('wallet', 0))})
+            await db.credit(user_id, 'wallet', 500000, 'set_handler_refund')
         except Exception:
             pass
         # Check if taken by someone else (race)
@@ -1128,10 +1134,13 @@ async def changehandler_handler(client: Client, message: Message):
         return
     # Deduct cost
     try:
-        await db.update_user(user_id, {"wallet": user.get('wallet', 0) - 200000})
+        charged = await db.debit(user_id, 'wallet', 200000, 'change_handler')
     except Exception:
         await message.reply_text("❌ Failed to deduct tokens. Try again later.")
         return
+    if charged is None:
+        await message.reply_text("<b>❌ You need 200000 tokens to change your handler.</b>")
+        return
     # Attempt to set
     success = await db.set_collection_handler(user_id, handler)
     if success:
@@ -1139,7 +1148,7 @@ async def changehandler_handler(client: Client, message: Message):
     else:
         # Refund on failure
         try:
-            await db.update_user(user_id, {"wallet": (user.get('wallet', 0))})
+            await db.credit(user_id, 'wallet', 200000, 'change_handler_refund')
         except Exception:
             pass
         # Check if taken by someone else (race)
@@ -1169,6 +1178,10 @@ async def collection_callback_handler(client: Client, callback_query: CallbackQu
 async def vadd_handler(client: Client, message: Message):
     await vadd_command(client, message)
 
+@app.on_message(filters.command("bulkimport", prefixes=["/", ".", "!"]))
+async def bulkimport_handler(client: Client, message: Message):
+    await bulkimport_command(client, message)
+
 @app.on_message(filters.command("vidcollection", prefixes=["/", ".", "!"]))
 @auto_register_user
 async def vidcollection_handler(client: Client, message: Message):
@@ -1945,4 +1958,4 @@ if __name__ == "__main__":
     loop.run_until_complete(startup_initialization())
     print("🔄 Starting bot...")
     
-    app.run()
+    loop.run_until_complete(run_bot())
@@ -0,0 +1,234 @@
+"""
+Active action registry.
+
+Gift, trade, sell, masssell, massgift, fusion and loan requests mark the user
+as busy with an ``active_action`` so two confirmations can't interleave.
+``ActionManager`` keeps these in memory: busy checks are dictionary lookups
+instead of a ``SELECT *`` of the user row.
+
+The ``users.active_action`` column is only used for crash recovery. Changes
+are written behind in batches by a background flusher, and ``load()``
+rehydrates the registry from it at startup; ``close()`` writes whatever is
+still pending at shutdown. Actions older than their TTL expire and are
+cleared in the database as well.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+ACTION_TTL = 30 * 60  # seconds before an unconfirmed action is considered stale
+ACTION_TTLS = {
+    'loan_request': None,  # waits for the owner's decision, never expires
+}
+FLUSH_INTERVAL = 1.0  # seconds between write-behind flushes
+SWEEP_INTERVAL = 60.0  # seconds between expiry sweeps
+
+
+def _normalize(action) -> Optional[Dict]:
+    """Coerce a persisted action into {'type', 'data', 'timestamp'}, or None if unusable"""
+    if isinstance(action, str):
+        try:
+            action = json.loads(action)
+        except (TypeError, ValueError):
+            return None
+    if not isinstance(action, dict) or not action.get('type'):
+        return None
+    if 'data' not in action:
+        # Loan requests used to store their fields next to 'type'
+        data = {k: v for k, v in action.items() if k not in ('type', 'timestamp')}
+        action = {'type': action['type'], 'data': data, 'timestamp': action.get('timestamp')}
+    if not isinstance(action.get('timestamp'), (int, float)):
+        action['timestamp'] = time.time()
+    return action
+
+
+class ActionManager:
+    """In-memory registry of each user's active action with write-behind persistence"""
+
+    def __init__(self):
+        self.active_actions: Dict[int, Dict] = {}
+        self._dirty: Dict[int, Optional[Dict]] = {}  # user_id -> action to persist (None clears)
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._last_sweep = time.monotonic()
+        self.loaded = False
+        self.stats = {
+            'set': 0,
+            'cleared': 0,
+            'expired': 0,
+            'flushes': 0,
+            'written': 0,
+            'failed_flushes': 0,
+        }
+
+    def _expired(self, action: Dict, now: float) -> bool:
+        ttl = ACTION_TTLS.get(action.get('type'), ACTION_TTL)
+        return ttl is not None and now - action.get('timestamp', now) > ttl
+
+    def _mark(self, user_id: int, action: Optional[Dict]):
+        self._dirty[user_id] = action
+        self._ensure_flusher()
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        """The user's active action dict, or None if idle or expired"""
+        action = self.active_actions.get(user_id)
+        if action is not None and self._expired(action, time.time()):
+            del self.active_actions[user_id]
+            self.stats['expired'] += 1
+            self._mark(user_id, None)
+            return None
+        return action
+
+    def get_action_data(self, user_id: int) -> Dict:
+        action = self.get(user_id)
+        data = action.get('data') if action else None
+        return data if isinstance(data, dict) else {}
+
+    async def is_user_busy(self, db, user_id):
+        return self.get(user_id) is not None
+
+    async def get_user_action(self, db, user_id):
+        action = self.get(user_id)
+        return action.get('type') if action else None
+
+    async def set_user_action(self, db, user_id, action_type, data):
+        action_data = {
+            'type': action_type,
+            'data': data,
+            'timestamp': datetime.now().timestamp()
+        }
+        self.active_actions[user_id] = action_data
+        self.stats['set'] += 1
+        self._mark(user_id, action_data)
+
+    async def clear_user_action(self, db, user_id):
+        if self.active_actions.pop(user_id, None) is not None:
+            self.stats['cleared'] += 1
+        self._mark(user_id, None)
+
+    def get_action_message(self, action_type):
+        messages = {
+            'gift': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ɢɪғᴛ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
+            'trade': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴛʀᴀᴅᴇ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
+            'sell': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ sᴇʟʟ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
+            'fusion': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ғᴜsɪᴏɴ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
+            'massgift': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴍᴀssɢɪғᴛ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
+            'masssell': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴍᴀsssᴇʟʟ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ."
+        }
+        return messages.get(action_type, "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.")
+
+    async def load(self, db) -> int:
+        """Rehydrate the registry from users.active_action; returns how many actions were restored."""
+        if not hasattr(db, 'get_active_actions'):
+            self.loaded = True
+            return 0
+        rows = await db.get_active_actions()
+        now = time.time()
+        restored = 0
+        for user_id, raw in rows:
+            if user_id in self.active_actions or user_id in self._dirty:
+                continue  # changed since startup, memory wins
+            action = _normalize(raw)
+            if action is None or self._expired(action, now):
+                self.stats['expired'] += 1
+                self._mark(user_id, None)
+                continue
+            self.active_actions[user_id] = action
+            restored += 1
+        self.loaded = True
+        return restored
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            # No running loop (scripts); changes are written on the next explicit flush()
+            self._flusher = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+                self.sweep()
+            await self.flush()
+
+    def sweep(self) -> int:
+        """Expire stale actions; returns how many were removed."""
+        self._last_sweep = time.monotonic()
+        now = time.time()
+        stale = [uid for uid, action in self.active_actions.items() if self._expired(action, now)]
+        for user_id in stale:
+            del self.active_actions[user_id]
+            self._dirty[user_id] = None
+        self.stats['expired'] += len(stale)
+        return len(stale)
+
+    async def flush(self) -> int:
+        """Persist pending changes now; returns how many users were written."""
+        if not self._dirty:
+            return 0
+        pending, self._dirty = self._dirty, {}
+        try:
+            from modules.postgres_database import get_database
+            db = get_database()
+            if hasattr(db, 'set_active_actions_bulk'):
+                user_ids = list(pending)
+                actions = [db._user_column_value('active_action', pending[uid]) for uid in user_ids]
+                await db.set_active_actions_bulk(user_ids, actions)
+            else:
+                for user_id, action in pending.items():
+                    await db.update_user(user_id, {'active_action': action})
+        except Exception as e:
+            self.stats['failed_flushes'] += 1
+            logger.error(f"Error persisting {len(pending)} active actions: {e}")
+            # Retry on the next flush unless the user changed again meanwhile
+            for user_id, action in pending.items():
+                self._dirty.setdefault(user_id, action)
+            return 0
+        self.stats['flushes'] += 1
+        self.stats['written'] += len(pending)
+        return len(pending)
+
+    async def close(self):
+        """Stop the background flusher and persist the remaining changes."""
+        if self._flusher is not None and not self._flusher.done():
+            # Let the flusher finish the batch it may be writing rather than cancel it mid-flush
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._flusher
+            finally:
+                self._stopping = False
+        self._flusher = None
+        await self.flush()
+        if self._dirty:
+            logger.error(f"{len(self._dirty)} active action changes could not be written at shutdown")
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['active'] = len(self.active_actions)
+        stats['pending_writes'] = len(self._dirty)
+        return stats
+
+
+# Global action manager instance
+action_manager = ActionManager()
+
+
+def get_action_manager() -> ActionManager:
+    """Get the process-wide action registry"""
+    return action_manager
@@ -13,6 +13,8 @@ import random
 from modules.collection import batch_fetch_characters
 from pyrogram.enums import ChatType
 from modules.logging_utils import send_admin_log
+from modules.search_index import invalidate_search_index
+from modules.region_directory import get_region_directory
 import subprocess
 import shutil
 import os
@@ -731,18 +733,18 @@ Character IDs: {', '.join(map(str, user_data_before.get('characters', [])))}"""
 async def create_pastebin_link(content, title):
     """Create a pastebin link for large content"""
     try:
-        import requests
-        response = requests.post(
+        from modules.http_client import http_client
+        response = await http_client.post(
             'https://pastebin.com/api/api_post.php',
             data={
                 'api_dev_key': 'Ed2mAdn5OTuHnN6rsrZs56DqH_BQ2xt4',  # You'll need to get this
-            'api_option': 'paste',
-            'api_paste_code': content,
+                'api_option': 'paste',
+                'api_paste_code': content,
                 'api_paste_name': title
             }
         )
-        if response.status_code == 200:
-            return response.text
+        if response.status == 200:
+            return response.text()
         else:
             return None
     except Exception as e:
@@ -841,6 +843,9 @@ async def postgrescap_command(client: Client, message: Message):
                             # If edit fails, just continue
                             pass
             
+            if updated_count:
+                invalidate_search_index()
+
             # Final status update
             final_message = f"""<b>✅ Capitalization process completed!</b>
 
@@ -886,38 +891,51 @@ def simple_capitalize(text):
 
 # Database monitoring commands
 
+async def _count_characters_by_anime(db):
+    """Count characters per anime by scanning the whole catalog (MongoDB)"""
+    characters = await db.get_all_characters()
+    
+    # Count characters by anime
+    anime_counts = {}
+    total_characters = 0
+    
+    for char in characters or []:
+        anime = char.get('anime', 'Unknown')
+        if anime:
+            anime = anime.strip()
+            if anime:
+                anime_counts[anime] = anime_counts.get(anime, 0) + 1
+            else:
+                anime_counts['Unknown'] = anime_counts.get('Unknown', 0) + 1
+        else:
+            anime_counts['Unknown'] = anime_counts.get('Unknown', 0) + 1
+        total_characters += 1
+    
+    # Sort by count (descending)
+    sorted_anime = sorted(anime_counts.items(), key=lambda x: x[1], reverse=True)
+    return sorted_anime, anime_counts, total_characters
+
 @admin_only
 async def sanime_command(client: Client, message: Message):
     """Admin command to check how many characters are there from each anime"""
     try:
         db = get_database()
         
-        # Get all characters with anime field
-        characters = await db.get_all_characters()
+        if hasattr(db, 'pool'):  # PostgreSQL
+            # Counts come from the in-memory region directory
+            directory = await get_region_directory(db)
+            anime_counts = dict(directory.counts())
+            if directory.unassigned:
+                anime_counts['Unknown'] = anime_counts.get('Unknown', 0) + directory.unassigned
+            sorted_anime = sorted(anime_counts.items(), key=lambda x: x[1], reverse=True)
+            total_characters = sum(anime_counts.values())
+        else:
+            sorted_anime, anime_counts, total_characters = await _count_characters_by_anime(db)
         
-        if not characters:
+        if not total_characters:
             await message.reply_text("❌ No characters found in the database.")
             return
         
-        # Count characters by anime
-        anime_counts = {}
-        total_characters = 0
-        
-        for char in characters:
-            anime = char.get('anime', 'Unknown')
-            if anime:
-                anime = anime.strip()
-                if anime:
-                    anime_counts[anime] = anime_counts.get(anime, 0) + 1
-                else:
-                    anime_counts['Unknown'] = anime_counts.get('Unknown', 0) + 1
-            else:
-                anime_counts['Unknown'] = anime_counts.get('Unknown', 0) + 1
-            total_characters += 1
-        
-        # Sort by count (descending)
-        sorted_anime = sorted(anime_counts.items(), key=lambda x: x[1], reverse=True)
-        
         # Create the response message
         response = f"📊 <b>Anime Character Distribution</b>\n\n"
         
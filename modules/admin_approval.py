@@ -173,9 +173,12 @@ async def execute_approved_action(client: Client, action: AdminAction) -> bool:
             
         elif action.action_type == 'massgive':
             char_ids = action.details.get('char_ids', [])
-            # Add each character individually using the existing method
-            for char_id in char_ids:
-                await db.add_character_to_user(action.target_id, char_id, source='give')
+            if hasattr(db, 'add_characters'):
+                # Add all characters and their history entries in one statement
+                await db.add_characters(action.target_id, char_ids, source='give')
+            else:
+                for char_id in char_ids:
+                    await db.add_character_to_user(action.target_id, char_id, source='give')
             
         elif action.action_type == 'gbheek':
             amount = action.details.get('amount', 0)
@@ -189,18 +192,13 @@ async def execute_approved_action(client: Client, action: AdminAction) -> bool:
                     'wallet': amount
                 })
             else:
-                new_balance = target_data.get('wallet', 0) + amount
-                await db.update_user(action.target_id, {'wallet': new_balance})
+                await db.credit(action.target_id, 'wallet', amount, 'admin_give', counterparty=action.admin_id)
                 
         elif action.action_type == 'tbheek':
             amount = action.details.get('amount', 0)
             target_data = await db.get_user(action.target_id)
             if target_data:
-                wallet = target_data.get('wallet', 0)
-                if wallet >= amount:
-                    new_balance = wallet - amount
-                    await db.update_user(action.target_id, {'wallet': new_balance})
-                else:
+                if await db.debit(action.target_id, 'wallet', amount, 'admin_take', counterparty=action.admin_id) is None:
                     return False  # Insufficient balance
             else:
                 return False  # User not found
@@ -0,0 +1,214 @@
+"""
+Auction engine.
+
+Auctions used to live only in ``auction.ACTIVE_AUCTIONS``, each with its own
+task sleeping for the whole duration. Bids moved tokens through a wallet
+method the Postgres backend doesn't have, and a restart lost every running
+auction together with the escrowed tokens.
+
+Auctions and bids are now rows in ``auctions`` and ``auction_bids``:
+
+- ``PostgresDatabase.place_auction_bid`` escrows a bid with a guarded wallet
+  UPDATE and refunds the previous top bidder in the same statement;
+- ``close_auction`` settles (character to the winner) or cancels (escrow
+  back to the bidder) in one statement.
+
+``AuctionEngine`` mirrors the active auctions in memory for listings and
+serialises bids per auction with the lock manager. During a sniping burst,
+bids that are already outbid are rejected from memory without a database
+round trip. A single scheduler task sleeps until the next end time and
+closes due auctions through the indexed ``end_time`` query. ``start()``
+reloads active auctions after a restart, and auctions that ended while the
+bot was down are settled right away. It runs once the client is connected;
+a result announcement that still fails is retried by the scheduler.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from modules.lock_manager import lock_manager
+from modules.postgres_database import get_database
+
+logger = logging.getLogger(__name__)
+
+MIN_INCREMENT = 10000  # tokens a new bid must add over the current highest
+MAX_SLEEP = 60.0  # seconds; the scheduler re-checks the database at least this often
+ANNOUNCE_RETRY_DELAY = 30.0  # seconds between retries of a failed result announcement
+ANNOUNCE_ATTEMPTS = 5
+
+
+def min_next_bid(auction: Dict) -> int:
+    """Smallest bid the auction currently accepts"""
+    if not auction.get('highest_bid'):
+        return auction['base_price']
+    return auction['highest_bid'] + auction.get('min_increment', MIN_INCREMENT)
+
+
+class AuctionEngine:
+    """Active auctions in memory, persisted bids/escrow, one end-time scheduler"""
+
+    def __init__(self):
+        self.auctions: Dict[str, Dict] = {}  # auction_id -> auction row plus 'character'
+        self._on_close: Optional[Callable[[Dict], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._unannounced: List[Dict] = []  # settled auctions whose announcement failed
+        self.stats = {
+            'bids': 0,
+            'rejected_in_memory': 0,
+            'rejected': 0,
+            'settled': 0,
+            'cancelled': 0,
+            'announce_failures': 0,
+        }
+
+    async def start(self, on_close: Callable[[Dict], Awaitable[None]]) -> int:
+        """Load active auctions and start the scheduler; returns how many were restored."""
+        self._on_close = on_close
+        db = get_database()
+        for row in await db.get_active_auctions():
+            row['character'] = await db.get_character(row['character_id']) or {
+                'character_id': row['character_id'], 'name': f"#{row['character_id']}", 'rarity': '?'
+            }
+            self.auctions[row['auction_id']] = row
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return len(self.auctions)
+
+    def get(self, auction_id: str) -> Optional[Dict]:
+        return self.auctions.get(auction_id)
+
+    def by_character(self, character_id: int) -> Optional[Dict]:
+        for auction in self.auctions.values():
+            if auction['character_id'] == character_id:
+                return auction
+        return None
+
+    def active(self) -> List[Dict]:
+        """Active auctions, soonest ending first"""
+        return sorted(self.auctions.values(), key=lambda auction: auction['end_time'])
+
+    async def create(self, auction_id: str, character: Dict, base_price: int, end_time: datetime,
+                     creator_id: int) -> Optional[Dict]:
+        """Persist a new auction; returns None if the character is already being auctioned."""
+        row = await get_database().create_auction(
+            auction_id, character['character_id'], base_price, end_time, creator_id, MIN_INCREMENT
+        )
+        if row is None:
+            return None
+        row['character'] = character
+        self.auctions[auction_id] = row
+        if self._wakeup is not None:
+            self._wakeup.set()  # the new auction may end before the scheduler's next wake-up
+        return row
+
+    async def bid(self, auction_id: str, user_id: int, amount: int) -> Dict:
+        """Place a bid. ``result['status']`` is 'ok', 'closed', 'top_bidder', 'too_low' or 'funds'."""
+        async with lock_manager.lock(('auction', auction_id)):
+            auction = self.auctions.get(auction_id)
+            now = datetime.now(timezone.utc)
+            status = None
+            if auction is None or auction['end_time'] <= now:
+                status = 'closed'
+            elif auction.get('highest_bidder') == user_id:
+                status = 'top_bidder'
+            elif amount < min_next_bid(auction):
+                status = 'too_low'
+            if status:
+                self.stats['rejected_in_memory'] += 1
+                return {'status': status, 'auction': auction, 'min_bid': min_next_bid(auction) if auction else None}
+
+            result = await get_database().place_auction_bid(auction_id, user_id, amount, now)
+            if not result['open']:
+                status = 'closed'
+            elif result['wallet'] is not None:
+                auction['highest_bid'] = amount
+                auction['highest_bidder'] = user_id
+                self.stats['bids'] += 1
+                return {'status': 'ok', 'auction': auction, 'min_bid': min_next_bid(auction),
+                        'wallet': result['wallet'], 'previous_bidder': result['previous_bidder']}
+            else:
+                # The database is authoritative; keep memory in step with what it saw
+                auction['highest_bid'] = result['previous_bid']
+                auction['highest_bidder'] = result['previous_bidder']
+                if result['previous_bidder'] == user_id:
+                    status = 'top_bidder'
+                elif amount < result['min_bid']:
+                    status = 'too_low'
+                else:
+                    status = 'funds'
+            self.stats['rejected'] += 1
+            return {'status': status, 'auction': auction, 'min_bid': result['min_bid']}
+
+    async def cancel(self, auction_id: str) -> Optional[Dict]:
+        """Cancel an active auction and refund the escrowed top bid."""
+        return await self._close(auction_id, cancel=True)
+
+    async def _close(self, auction_id: str, cancel: bool = False) -> Optional[Dict]:
+        async with lock_manager.lock(('auction', auction_id)):
+            closed = await get_database().close_auction(auction_id, datetime.now(timezone.utc), cancel=cancel)
+            cached = self.auctions.pop(auction_id, None)
+        if closed is None:
+            return None
+        closed['character'] = cached['character'] if cached else await get_database().get_character(closed['character_id'])
+        self.stats['cancelled' if cancel else 'settled'] += 1
+        if not cancel and not await self._announce(closed):
+            self._unannounced.append(closed)
+        return closed
+
+    async def _announce(self, closed: Dict) -> bool:
+        """Post a result; False means it failed and should be retried later."""
+        if self._on_close is None:
+            return True
+        closed['announce_attempts'] = closed.get('announce_attempts', 0) + 1
+        try:
+            await self._on_close(closed)
+            return True
+        except Exception as e:
+            self.stats['announce_failures'] += 1
+            logger.error(f"Error announcing auction {closed['auction_id']} "
+                         f"(attempt {closed['announce_attempts']}/{ANNOUNCE_ATTEMPTS}): {e}")
+            # Give up after the last attempt; the settlement itself is already in the database
+            return closed['announce_attempts'] >= ANNOUNCE_ATTEMPTS
+
+    async def _retry_announcements(self):
+        pending, self._unannounced = self._unannounced, []
+        for closed in pending:
+            if not await self._announce(closed):
+                self._unannounced.append(closed)
+
+    async def _run(self):
+        while True:
+            await self._retry_announcements()
+            try:
+                for auction_id in await get_database().get_due_auction_ids(datetime.now(timezone.utc)):
+                    await self._close(auction_id)
+            except Exception as e:
+                logger.error(f"Error settling auctions: {e}")
+            upcoming = [auction['end_time'] for auction in self.auctions.values()]
+            delay = ANNOUNCE_RETRY_DELAY if self._unannounced else MAX_SLEEP
+            if upcoming:
+                delay = min(delay, max(0.5, (min(upcoming) - datetime.now(timezone.utc)).total_seconds()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['active'] = len(self.auctions)
+        stats['unannounced'] = len(self._unannounced)
+        return stats
+
+
+# Global instance
+auction_engine = AuctionEngine()
+
+
+def get_auction_engine() -> AuctionEngine:
+    """Get the process-wide auction engine"""
+    return auction_engine
@@ -1,14 +1,16 @@
 from datetime import datetime
+from functools import lru_cache
 from typing import List, Dict, Optional, Tuple
 import random
 import asyncio
+import html
 from pyrogram import Client, filters
+from pyrogram.errors import MessageNotModified
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from modules.postgres_database import get_database, get_postgres_pool
-import aiohttp
 from modules.decorators import auto_register_user
 from modules.team import TeamManager
-import json
+from modules.user_cache import user_cache
 import time
 
 
@@ -464,6 +466,61 @@ class BattlePokemon:
             'fainted': fainted
         }
 
+
+BATTLE_TYPE_EMOJIS = {
+    "Normal": "⚪",
+    "Fire": "🔥",
+    "Water": "💧",
+    "Electric": "⚡",
+    "Grass": "🌱",
+    "Ice": "❄️",
+    "Fighting": "👊",
+    "Poison": "☠️",
+    "Ground": "🌍",
+    "Flying": "🦅",
+    "Psychic": "🔮",
+    "Bug": "🐛",
+    "Rock": "🪨",
+    "Ghost": "👻",
+    "Dragon": "🐉",
+    "Dark": "🌑",
+    "Steel": "⚙️",
+    "Fairy": "🧚"
+}
+
+
+@lru_cache(maxsize=4096)
+def _render_hp_bar(current_hp: int, max_hp: int) -> str:
+    """Create a visual HP bar with color coding"""
+    if max_hp <= 0:
+        return "███████████"
+    
+    percentage = current_hp / max_hp
+    filled_bars = int(percentage * 11)  # 11 bars total
+    empty_bars = 11 - filled_bars
+    
+    # Color code based on HP percentage
+    if percentage > 0.6:
+        bar_char = "█"  # Green for high HP
+    elif percentage > 0.3:
+        bar_char = "▓"  # Yellow for medium HP
+    else:
+        bar_char = "▒"  # Red for low HP
+    
+    return bar_char * filled_bars + "░" * empty_bars
+
+
+def _render_signature(text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> tuple:
+    """Comparable snapshot of a rendered message (text plus button labels/data)."""
+    rows = ()
+    if reply_markup is not None and getattr(reply_markup, 'inline_keyboard', None):
+        rows = tuple(
+            tuple((button.text, button.callback_data, getattr(button, 'url', None)) for button in row)
+            for row in reply_markup.inline_keyboard
+        )
+    return text, rows
+
+
 class Battle:
     """Represents a battle between two players"""
     
@@ -507,8 +564,19 @@ class Battle:
         # Run (forfeit) tracking
         self.run_votes = set()  # user_ids who pressed Run
         
+        # Result details recorded into battle_results when the battle finishes
+        self.result_outcome = None  # win, draw, forfeit, ended
+        self.forfeited_by = None
+        self.reward_tokens = 0
+        self.penalty_tokens = 0
+        
         # Concurrency control for this battle's UI updates
         self.ui_lock = asyncio.Lock()
+        
+        # Render cache: static per-Pokemon segments (headers, move lists, move
+        # buttons, roster lines) plus the last text/keyboard sent to Telegram
+        self._render_cache: Dict[tuple, object] = {}
+        self._last_rendered: Optional[tuple] = None
     
     async def initialize_teams(self):
         """Initialize both players' teams"""
@@ -577,18 +645,17 @@ class Battle:
             # Lazy import to avoid circular dependency
             from modules.poke import fetch_pokeapi_stats, _fetch_pokeapi_moves, _get_necrozma_form_data
             
-            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60)) as session:
-                # Create concurrent tasks for all Pokemon
-                tasks = []
-                for p in pokemon_list:
-                    name = (p.get('name') or '').strip()
-                    if name:
-                        tasks.append(self._enrich_single_pokemon(p, name, session, fetch_pokeapi_stats, _fetch_pokeapi_moves, _get_necrozma_form_data))
-                
-                # Execute all API calls concurrently with a reasonable timeout
-                if tasks:
-                    print(f"Starting concurrent enrichment for {len(tasks)} Pokemon...")
-                    await asyncio.gather(*tasks, return_exceptions=True)
+            # PokeAPI calls share the pooled HTTP client, so no per-battle session here
+            tasks = []
+            for p in pokemon_list:
+                name = (p.get('name') or '').strip()
+                if name:
+                    tasks.append(self._enrich_single_pokemon(p, name, fetch_pokeapi_stats, _fetch_pokeapi_moves, _get_necrozma_form_data))
+
+            # Execute all API calls concurrently with a reasonable timeout
+            if tasks:
+                print(f"Starting concurrent enrichment for {len(tasks)} Pokemon...")
+                await asyncio.gather(*tasks, return_exceptions=True)
                     
             elapsed = time.time() - start_time
             print(f"Pokemon enrichment completed in {elapsed:.3f}s (concurrent mode)")
@@ -596,7 +663,7 @@ class Battle:
         except Exception as e:
             print(f"Error in concurrent Pokemon enrichment: {e}")
     
-    async def _enrich_single_pokemon(self, pokemon_data: Dict, name: str, session, fetch_pokeapi_stats, _fetch_pokeapi_moves, _get_necrozma_form_data):
+    async def _enrich_single_pokemon(self, pokemon_data: Dict, name: str, fetch_pokeapi_stats, _fetch_pokeapi_moves, _get_necrozma_form_data):
         """Enrich a single Pokemon with API data"""
         try:
             # First, try local Necrozma JSON for forms (fast)
@@ -626,7 +693,7 @@ class Battle:
             
             # Concurrently fetch both stats and moves from PokeAPI
             stats_task = asyncio.create_task(fetch_pokeapi_stats(name))
-            moves_task = asyncio.create_task(_fetch_pokeapi_moves(name, session))
+            moves_task = asyncio.create_task(_fetch_pokeapi_moves(name))
             
             # Wait for both with timeout
             api_stats, api_moves = await asyncio.gather(
@@ -775,10 +842,6 @@ class Battle:
     
     async def get_battle_ui(self, current_turn_user_id: int, client: Client = None) -> tuple[str, InlineKeyboardMarkup]:
         """Get the battle UI with current state and move buttons"""
-        print(f"Getting battle UI for user: {current_turn_user_id}")
-        print(f"Challenger team size: {len(self.challenger_team)}")
-        print(f"Opponent team size: {len(self.opponent_team)}")
-        
         # Get active Pokemon using indices
         challenger_pokemon = None
         opponent_pokemon = None
@@ -789,15 +852,10 @@ class Battle:
         if self.opponent_active_pokemon_index < len(self.opponent_team):
             opponent_pokemon = self.opponent_team[self.opponent_active_pokemon_index]
         
-        print(f"Challenger pokemon alive: {challenger_pokemon is not None and challenger_pokemon.is_alive()}")
-        print(f"Opponent pokemon alive: {opponent_pokemon is not None and opponent_pokemon.is_alive()}")
-        
         if not challenger_pokemon or not opponent_pokemon:
-            print("No Pokemon found, returning battle ended message")
             return "Battle ended!", InlineKeyboardMarkup([])
         
         if not challenger_pokemon.is_alive() or not opponent_pokemon.is_alive():
-            print("One or both Pokemon are fainted, returning battle ended message")
             return "Battle ended!", InlineKeyboardMarkup([])
         
         # Determine whose turn it is
@@ -805,23 +863,15 @@ class Battle:
         current_pokemon = challenger_pokemon if is_challenger_turn else opponent_pokemon
         opponent_pokemon_display = opponent_pokemon if is_challenger_turn else challenger_pokemon
         
-        # Create battle UI text without round number
-        battle_text = ""
-        
-        # Show opponent Pokemon with improved formatting
-        opponent_hp_bar = self._create_hp_bar(opponent_pokemon_display.current_hp, opponent_pokemon_display.max_hp)
-        opponent_hp_percentage = int((opponent_pokemon_display.current_hp / opponent_pokemon_display.max_hp) * 100)
-        
-        battle_text += f"<b>Opponent's {opponent_pokemon_display.name} {self._format_types(opponent_pokemon_display)}</b>\n"
-        battle_text += f"Lv. 100 • HP {opponent_pokemon_display.current_hp}/{opponent_pokemon_display.max_hp} ({opponent_hp_percentage}%)\n"
-        battle_text += f"{opponent_hp_bar}\n\n"
+        # Show opponent Pokemon (cached header, fresh HP segment)
+        battle_text = f"<b>Opponent's {self._pokemon_header(opponent_pokemon_display)}</b>\n"
+        battle_text += self._hp_segment(opponent_pokemon_display)
         
         # Show current turn indicator with actual user name as hyperlink
         turn_name = "Unknown"
         if client:
             try:
-                user = await client.get_users(current_turn_user_id)
-                turn_name = user.first_name or "Unknown"
+                turn_name = await user_cache.get_display_name(client, current_turn_user_id)
                 # Create hyperlink to user
                 turn_name = f'<a href="tg://user?id={current_turn_user_id}">{turn_name}</a>'
             except:
@@ -831,59 +881,15 @@ class Battle:
         
         battle_text += f"<b>Current turn: {turn_name}</b>\n"
         
-        # Show current Pokemon with improved formatting
-        current_hp_bar = self._create_hp_bar(current_pokemon.current_hp, current_pokemon.max_hp)
-        current_hp_percentage = int((current_pokemon.current_hp / current_pokemon.max_hp) * 100)
+        # Show current Pokemon
+        battle_text += f"<b>{self._pokemon_header(current_pokemon)}</b>\n"
+        battle_text += self._hp_segment(current_pokemon)
         
-        battle_text += f"<b>{current_pokemon.name} {self._format_types(current_pokemon)}</b>\n"
-        battle_text += f"Lv. 100 • HP {current_pokemon.current_hp}/{current_pokemon.max_hp} ({current_hp_percentage}%)\n"
-        battle_text += f"{current_hp_bar}\n\n"
-        
-        # Show moves with improved formatting (safe defaults for API-provided moves)
-        battle_text += "<b>Available Moves:</b>\n"
-        for i, move in enumerate(current_pokemon.moves, 1):
-            # Safe extraction with defaults
-            mname = move.get('name', 'Unknown')
-            mtype = move.get('type', 'Normal')
-            mpower = move.get('power')
-            macc = move.get('accuracy')
-            meffect = move.get('effect', '')
-            # Add move type emoji
-            type_emoji = self._get_type_emoji(mtype)
-            battle_text += f"{i}. <b>{mname}</b> {type_emoji} [{mtype}]\n"
-            power_str = f"{mpower:>3}" if isinstance(mpower, int) else " - "
-            acc_str = f"{macc:>3}%" if isinstance(macc, int) else "  - %"
-            if meffect:
-                battle_text += f"   Power: {power_str} | Accuracy: {acc_str} | {meffect}\n"
-            else:
-                battle_text += f"   Power: {power_str} | Accuracy: {acc_str}\n"
-        
-        # Create move buttons as a 2x2 grid (up to 4 moves), then Pokemon and Run buttons below
-        keyboard = []
-        encoded_battle_id = self.battle_id.replace("_", "-")
-        move_row = []
-        for i, move in enumerate((current_pokemon.moves or [])[:4], 1):
-            mtype = move.get('type', 'Normal')
-            mname = move.get('name', 'Move')
-            mpower = move.get('power')
-            type_emoji = self._get_type_emoji(mtype)
-            label_power = mpower if isinstance(mpower, int) else "-"
-            move_row.append(InlineKeyboardButton(
-                f"{type_emoji} {mname} ({label_power})",
-                callback_data=f"use_move_{encoded_battle_id}_{i-1}"
-            ))
-            if len(move_row) == 2:
-                keyboard.append(move_row)
-                move_row = []
-        if move_row:
-            keyboard.append(move_row)
-
-        # Add Pokemon (switch) button below moves
-        keyboard.append([InlineKeyboardButton("🔄 Pokemon", callback_data=f"open_switch_{encoded_battle_id}")])
-
-        # Add Run button as the last row
-        keyboard.append([InlineKeyboardButton("🏃 Run", callback_data=f"run_battle_{encoded_battle_id}")])
+        # Moves text and buttons only depend on the Pokemon, so they are built once
+        moves_text, move_rows = self._moves_section(current_pokemon)
+        battle_text += moves_text
         
+        keyboard = list(move_rows) + self._battle_footer_rows()
         return battle_text, InlineKeyboardMarkup(keyboard)
     
     async def get_switch_pokemon_ui(self, user_id: int, client: Client = None, voluntary: bool = False) -> tuple[str, InlineKeyboardMarkup]:
@@ -914,12 +920,8 @@ class Battle:
         switch_text = ""
         
         # Show opponent Pokemon
-        opponent_hp_bar = self._create_hp_bar(opponent_pokemon.current_hp, opponent_pokemon.max_hp)
-        opponent_hp_percentage = int((opponent_pokemon.current_hp / opponent_pokemon.max_hp) * 100)
-        
         switch_text += f"<b>Opponent's {opponent_pokemon.name} [{opponent_pokemon.rarity}]</b>\n"
-        switch_text += f"Lv. 100 • HP {opponent_pokemon.current_hp}/{opponent_pokemon.max_hp} ({opponent_hp_percentage}%)\n"
-        switch_text += f"{opponent_hp_bar}\n\n"
+        switch_text += self._hp_segment(opponent_pokemon)
         
         # Show the fainted Pokemon only when forced switch
         if not voluntary and self.fainted_pokemon_name:
@@ -974,7 +976,8 @@ class Battle:
         # Create team view text
         team_text = "<b>🏆 Your Team</b>\n\n"
         
-        for i, pokemon in enumerate(user_team, 1):
+        roster = self._roster_lines(user_id, user_team)
+        for pokemon, roster_line in zip(user_team, roster):
             if pokemon.is_alive():
                 status = "✅ Alive"
                 hp_info = f"HP {pokemon.current_hp}/{pokemon.max_hp}"
@@ -982,7 +985,7 @@ class Battle:
                 status = "❌ Fainted"
                 hp_info = "HP 0/0"
             
-            team_text += f"<b>{i}. {pokemon.name} [{pokemon.rarity}]</b>\n"
+            team_text += roster_line
             team_text += f"   {status} • {hp_info}\n\n"
         
         team_text += "<b>Choose your next Pokemon:</b>\n"
@@ -1019,27 +1022,7 @@ class Battle:
     
     def _get_type_emoji(self, move_type: str) -> str:
         """Get emoji for move type"""
-        type_emojis = {
-            "Normal": "⚪",
-            "Fire": "🔥",
-            "Water": "💧",
-            "Electric": "⚡",
-            "Grass": "🌱",
-            "Ice": "❄️",
-            "Fighting": "👊",
-            "Poison": "☠️",
-            "Ground": "🌍",
-            "Flying": "🦅",
-            "Psychic": "🔮",
-            "Bug": "🐛",
-            "Rock": "🪨",
-            "Ghost": "👻",
-            "Dragon": "🐉",
-            "Dark": "🌑",
-            "Steel": "⚙️",
-            "Fairy": "🧚"
-        }
-        return type_emojis.get(move_type, "⚪")
+        return BATTLE_TYPE_EMOJIS.get(move_type, "⚪")
     
     def _format_types(self, pokemon: BattlePokemon) -> str:
         """Format a Pokemon's types as [Type1 / Type2]."""
@@ -1050,66 +1033,119 @@ class Battle:
 
     def _create_hp_bar(self, current_hp: int, max_hp: int) -> str:
         """Create a visual HP bar with color coding"""
-        if max_hp <= 0:
-            return "███████████"
-        
-        percentage = current_hp / max_hp
-        filled_bars = int(percentage * 11)  # 11 bars total
-        empty_bars = 11 - filled_bars
-        
-        # Color code based on HP percentage
-        if percentage > 0.6:
-            bar_char = "█"  # Green for high HP
-        elif percentage > 0.3:
-            bar_char = "▓"  # Yellow for medium HP
-        else:
-            bar_char = "▒"  # Red for low HP
-        
-        return bar_char * filled_bars + "░" * empty_bars
+        return _render_hp_bar(current_hp, max_hp)
+    
+    def _pokemon_header(self, pokemon: BattlePokemon) -> str:
+        """Name and type badge for a Pokemon; static for the whole battle."""
+        key = ('header', id(pokemon))
+        header = self._render_cache.get(key)
+        if header is None:
+            header = f"{pokemon.name} {self._format_types(pokemon)}"
+            self._render_cache[key] = header
+        return header
+    
+    def _hp_segment(self, pokemon: BattlePokemon) -> str:
+        """The part of the caption that changes every turn."""
+        hp_percentage = int((pokemon.current_hp / pokemon.max_hp) * 100) if pokemon.max_hp else 0
+        return (
+            f"Lv. 100 • HP {pokemon.current_hp}/{pokemon.max_hp} ({hp_percentage}%)\n"
+            f"{self._create_hp_bar(pokemon.current_hp, pokemon.max_hp)}\n\n"
+        )
     
-    async def _save_battle_to_database(self, battle: 'Battle'):
-        """Save battle results to the database"""
+    def _moves_section(self, pokemon: BattlePokemon) -> tuple:
+        """Move list text and the 2x2 move button rows for a Pokemon (cached)."""
+        key = ('moves', id(pokemon))
+        cached = self._render_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        # Safe defaults for API-provided moves
+        moves_text = "<b>Available Moves:</b>\n"
+        for i, move in enumerate(pokemon.moves, 1):
+            mname = move.get('name', 'Unknown')
+            mtype = move.get('type', 'Normal')
+            mpower = move.get('power')
+            macc = move.get('accuracy')
+            meffect = move.get('effect', '')
+            type_emoji = self._get_type_emoji(mtype)
+            moves_text += f"{i}. <b>{mname}</b> {type_emoji} [{mtype}]\n"
+            power_str = f"{mpower:>3}" if isinstance(mpower, int) else " - "
+            acc_str = f"{macc:>3}%" if isinstance(macc, int) else "  - %"
+            if meffect:
+                moves_text += f"   Power: {power_str} | Accuracy: {acc_str} | {meffect}\n"
+            else:
+                moves_text += f"   Power: {power_str} | Accuracy: {acc_str}\n"
+        
+        # Move buttons as a 2x2 grid (up to 4 moves)
+        encoded_battle_id = self.battle_id.replace("_", "-")
+        rows = []
+        move_row = []
+        for i, move in enumerate((pokemon.moves or [])[:4], 1):
+            mtype = move.get('type', 'Normal')
+            mname = move.get('name', 'Move')
+            mpower = move.get('power')
+            label_power = mpower if isinstance(mpower, int) else "-"
+            move_row.append(InlineKeyboardButton(
+                f"{self._get_type_emoji(mtype)} {mname} ({label_power})",
+                callback_data=f"use_move_{encoded_battle_id}_{i-1}"
+            ))
+            if len(move_row) == 2:
+                rows.append(move_row)
+                move_row = []
+        if move_row:
+            rows.append(move_row)
+        
+        cached = (moves_text, rows)
+        self._render_cache[key] = cached
+        return cached
+    
+    def _battle_footer_rows(self) -> list:
+        """Pokemon (switch) and Run rows shown under the move buttons."""
+        rows = self._render_cache.get(('footer',))
+        if rows is None:
+            encoded_battle_id = self.battle_id.replace("_", "-")
+            rows = [
+                [InlineKeyboardButton("🔄 Pokemon", callback_data=f"open_switch_{encoded_battle_id}")],
+                [InlineKeyboardButton("🏃 Run", callback_data=f"run_battle_{encoded_battle_id}")],
+            ]
+            self._render_cache[('footer',)] = rows
+        return rows
+    
+    def _roster_lines(self, user_id: int, team: List[BattlePokemon]) -> List[str]:
+        """Numbered name/rarity lines for a team view (cached per player)."""
+        key = ('roster', user_id)
+        lines = self._render_cache.get(key)
+        if lines is None:
+            lines = [f"<b>{i}. {p.name} [{p.rarity}]</b>\n" for i, p in enumerate(team, 1)]
+            self._render_cache[key] = lines
+        return lines
+    
+    def remember_rendered(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Record what the battle message currently shows."""
+        self._last_rendered = _render_signature(text, reply_markup)
+    
+    async def edit_battle_message(self, client: Client, text: str,
+                                  reply_markup: Optional[InlineKeyboardMarkup] = None, **kwargs) -> bool:
+        """Edit the battle message, skipping the API call when nothing changed.
+        
+        Returns True if an edit was sent.
+        """
+        signature = _render_signature(text, reply_markup)
+        if signature == self._last_rendered:
+            return False
         try:
-            pool = get_postgres_pool()
-            if not pool:
-                print("No database pool available for saving battle")
-                return
-                
-            async with pool.acquire() as conn:
-                # Insert or update the battle record
-                await conn.execute('''
-                    INSERT INTO battles (
-                        battle_id, challenger_id, opponent_id, chat_id, status,
-                        challenger_team, opponent_team, battle_log, current_round,
-                        winner_id, created_at, finished_at
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
-                    ON CONFLICT (battle_id) DO UPDATE SET
-                        status = EXCLUDED.status,
-                        winner_id = EXCLUDED.winner_id,
-                        finished_at = EXCLUDED.finished_at,
-                        updated_at = CURRENT_TIMESTAMP
-                ''', 
-                battle.battle_id,
-                battle.challenger_id,
-                battle.opponent_id,
-                battle.chat_id,
-                battle.status,
-                json.dumps([p.to_dict() for p in battle.challenger_team]),
-                json.dumps([p.to_dict() for p in battle.opponent_team]),
-                json.dumps(battle.battle_log),
-                battle.current_round,
-                battle.winner_id,
-                battle.created_at,
-                battle.finished_at
-                )
-                
-                print(f"Saved battle {battle.battle_id} to database with winner_id: {battle.winner_id}")
-        except Exception as e:
-            print(f"Error saving battle to database: {e}")
-            import traceback
-            traceback.print_exc()
-
-
+            await client.edit_message_text(
+                self.chat_id,
+                self.battle_message_id,
+                text,
+                reply_markup=reply_markup,
+                **kwargs
+            )
+        except MessageNotModified:
+            pass
+        self._last_rendered = signature
+        return True
+    
 class BattleManager:
     """Manages all battles in the system"""
     
@@ -1119,7 +1155,12 @@ class BattleManager:
         self.battle_timeouts = {}  # battle_id -> timeout_task
     
     async def _save_battle_to_database(self, battle: 'Battle'):
-        """Save battle state/results to the database (idempotent upsert by battle_id)."""
+        """Save battle state/results to the database (idempotent upsert by battle_id).
+        
+        The battles row only tracks status. Once the battle is finished its
+        compact result, both players' win/loss counters and the cold-stored
+        teams/log are written through record_battle_result.
+        """
         try:
             pool = get_postgres_pool()
             if not pool:
@@ -1130,11 +1171,11 @@ class BattleManager:
                     '''
                     INSERT INTO battles (
                         battle_id, challenger_id, opponent_id, chat_id, status,
-                        challenger_team, opponent_team, battle_log, current_round,
-                        winner_id, created_at, finished_at
-                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                        current_round, winner_id, created_at, finished_at
+                    ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
                     ON CONFLICT (battle_id) DO UPDATE SET
                         status = EXCLUDED.status,
+                        current_round = EXCLUDED.current_round,
                         winner_id = EXCLUDED.winner_id,
                         finished_at = EXCLUDED.finished_at,
                         updated_at = CURRENT_TIMESTAMP
@@ -1144,20 +1185,48 @@ class BattleManager:
                     battle.opponent_id,
                     battle.chat_id,
                     battle.status,
-                    json.dumps([p.to_dict() for p in battle.challenger_team]),
-                    json.dumps([p.to_dict() for p in battle.opponent_team]),
-                    json.dumps(battle.battle_log),
                     battle.current_round,
                     battle.winner_id,
                     battle.created_at,
                     battle.finished_at,
                 )
-                print(f"Saved battle {battle.battle_id} to database with winner_id: {battle.winner_id}")
+            
+            if battle.status == "finished":
+                await get_database().record_battle_result(
+                    self._battle_result(battle),
+                    challenger_team=[p.to_dict() for p in battle.challenger_team],
+                    opponent_team=[p.to_dict() for p in battle.opponent_team],
+                    battle_log=battle.battle_log,
+                )
         except Exception as e:
             print(f"Error saving battle to database: {e}")
             import traceback
             traceback.print_exc()
     
+    @staticmethod
+    def _battle_result(battle: 'Battle') -> Dict:
+        """Compact result row for a finished battle."""
+        winner_id = battle.winner_id
+        loser_id = None
+        if winner_id:
+            loser_id = battle.opponent_id if winner_id == battle.challenger_id else battle.challenger_id
+        elif battle.forfeited_by:
+            loser_id = battle.forfeited_by
+        finished_at = battle.finished_at or datetime.now()
+        return {
+            'battle_id': battle.battle_id,
+            'challenger_id': battle.challenger_id,
+            'opponent_id': battle.opponent_id,
+            'winner_id': winner_id,
+            'loser_id': loser_id,
+            'outcome': battle.result_outcome or ('win' if winner_id else 'draw'),
+            'rounds': battle.current_round,
+            'duration_seconds': max(0, int((finished_at - battle.created_at).total_seconds())),
+            'winner_tokens': battle.reward_tokens,
+            'loser_tokens': battle.penalty_tokens,
+            'finished_at': finished_at,
+        }
+    
     async def _start_turn_timeout(self, battle: Battle, client: Client):
         """Start a 5-minute timeout for the current turn"""
         # Cancel any existing timeout
@@ -1198,8 +1267,7 @@ class BattleManager:
             
             if inactive_user_id not in battle.timeout_warnings_sent:
                 try:
-                    inactive_user = await client.get_users(inactive_user_id)
-                    inactive_name = inactive_user.first_name or "Unknown"
+                    inactive_name = await user_cache.get_display_name(client, inactive_user_id)
                     
                     # Update battle UI with warning
                     if battle.status == "active":
@@ -1212,12 +1280,7 @@ class BattleManager:
                     )
                     
                     async with battle.ui_lock:
-                        await client.edit_message_text(
-                            battle.chat_id,
-                            battle.battle_message_id,
-                            warning_text + battle_text,
-                            reply_markup=keyboard
-                        )
+                        await battle.edit_battle_message(client, warning_text + battle_text, reply_markup=keyboard)
                     
                     battle.timeout_warnings_sent.add(inactive_user_id)
                     print(f"Sent timeout warning for battle {battle.battle_id}, user {inactive_user_id}")
@@ -1257,22 +1320,21 @@ class BattleManager:
             battle.status = "finished"
             battle.winner_id = None  # No winner in forfeit scenario
             battle.finished_at = datetime.now()
+            battle.result_outcome = "forfeit"
+            battle.forfeited_by = forfeiting_user_id
             
             # Get user names for display
-            try:
-                other_user = await client.get_users(other_user_id)
-                other_user_name = other_user.first_name or "Unknown"
-            except:
-                other_user_name = f"User {other_user_id}"
-            
-            try:
-                forfeiting_user = await client.get_users(forfeiting_user_id)
-                forfeiting_user_name = forfeiting_user.first_name or "Unknown"
-            except:
-                forfeiting_user_name = f"User {forfeiting_user_id}"
+            names = await user_cache.get_display_names(
+                client,
+                [other_user_id, forfeiting_user_id],
+                {other_user_id: f"User {other_user_id}", forfeiting_user_id: f"User {forfeiting_user_id}"}
+            )
+            other_user_name = names[other_user_id]
+            forfeiting_user_name = names[forfeiting_user_id]
             
             # Process forfeit penalties (only forfeiting user loses tokens)
             forfeit_penalty_tokens = 10000
+            battle.penalty_tokens = forfeit_penalty_tokens
             
             try:
                 # Only deduct tokens from the forfeiting user
@@ -1292,12 +1354,7 @@ class BattleManager:
             )
             
             # Update battle message
-            await client.edit_message_text(
-                battle.chat_id,
-                battle.battle_message_id,
-                forfeit_text,
-                disable_web_page_preview=True
-            )
+            await battle.edit_battle_message(client, forfeit_text, disable_web_page_preview=True)
             
             # Remove from active battles
             if battle.battle_id in self.active_battles:
@@ -1556,6 +1613,9 @@ class BattleManager:
             return False
         
         try:
+            # Resolve both players once so every later turn renders from the user cache
+            await user_cache.resolve_many(client, [battle.challenger_id, battle.opponent_id])
+            
             # Send initial battle UI using speed-decided turn owner
             ui_start_time = time.time()
             battle_text, keyboard = await battle.get_battle_ui(battle.current_turn_user_id, client)
@@ -1589,6 +1649,7 @@ class BattleManager:
                 battle_message = await client.send_message(chat_id, battle_text, reply_markup=keyboard)
                 battle.battle_message_id = battle_message.id
                 battle.chat_id = chat_id
+                battle.remember_rendered(battle_text, keyboard)
             
             print(f"Battle message sent successfully with ID: {battle_message.id}")
             
@@ -1680,12 +1741,7 @@ class BattleManager:
                     switch_text = result_message + switch_text
                     
                     async with battle.ui_lock:
-                        await client.edit_message_text(
-                            battle.chat_id,
-                            battle.battle_message_id,
-                            switch_text,
-                            reply_markup=switch_keyboard
-                        )
+                        await battle.edit_battle_message(client, switch_text, reply_markup=switch_keyboard)
                     return
             
             # Update turn
@@ -1718,12 +1774,7 @@ class BattleManager:
             battle_text = result_message + battle_text
             
             async with battle.ui_lock:
-                await client.edit_message_text(
-                    battle.chat_id,
-                    battle.battle_message_id,
-                    battle_text,
-                    reply_markup=keyboard
-                )
+                await battle.edit_battle_message(client, battle_text, reply_markup=keyboard)
         except Exception as e:
             print(f"Error updating battle UI with move result: {e}")
             import traceback
@@ -1743,25 +1794,23 @@ class BattleManager:
             except Exception:
                 last_move_text = ""
             if winner_id:
-                try:
-                    winner_user = await client.get_users(winner_id)
+                loser_id = battle.opponent_id if winner_id == battle.challenger_id else battle.challenger_id
+                # Both players are resolved with one cached/batched lookup
+                resolved = await user_cache.resolve_many(client, [winner_id, loser_id])
+                winner_user = resolved.get(winner_id)
+                loser_user = resolved.get(loser_id)
+                if winner_user:
                     winner_name = winner_user.first_name or "Unknown"
                     winner_username = winner_user.username or f"user{winner_id}"
-                    
-                    # Get loser info
-                    loser_id = battle.opponent_id if winner_id == battle.challenger_id else battle.challenger_id
-                    try:
-                        loser_user = await client.get_users(loser_id)
-                        loser_name = loser_user.first_name or "Unknown"
-                        loser_username = loser_user.username or f"user{loser_id}"
-                    except:
-                        loser_name = f"User {loser_id}"
-                        loser_username = f"user{loser_id}"
-                except:
+                else:
                     winner_name = f"User {winner_id}"
                     winner_username = f"user{winner_id}"
-                    loser_name = "Unknown"
-                    loser_username = "unknown"
+                if loser_user:
+                    loser_name = loser_user.first_name or "Unknown"
+                    loser_username = loser_user.username or f"user{loser_id}"
+                else:
+                    loser_name = f"User {loser_id}"
+                    loser_username = f"user{loser_id}"
                 
                 # Calculate battle statistics
                 total_rounds = battle.current_round
@@ -1794,6 +1843,10 @@ class BattleManager:
                 else:
                     winner_reward_tokens = 0
 
+                battle.result_outcome = "win"
+                battle.reward_tokens = winner_reward_tokens
+                battle.penalty_tokens = loser_penalty_tokens
+
                 # Only tokens (no shards) are awarded now
                 try:
                     await self._give_rewards(winner_id, winner_reward_tokens, 0)
@@ -1819,12 +1872,7 @@ class BattleManager:
                 body = "\n".join(rewards_lines) + "\n\n"
                 result_text = header + last_move_block + body
                 
-                await client.edit_message_text(
-                    battle.chat_id,
-                    battle.battle_message_id,
-                    result_text,
-                    disable_web_page_preview=True
-                )
+                await battle.edit_battle_message(client, result_text, disable_web_page_preview=True)
             else:
                 # Include last move on draw as well
                 draw_text = (
@@ -1832,15 +1880,12 @@ class BattleManager:
                 )
                 if last_move_text:
                     draw_text = f"🤝 <b>Battle Results</b> 🤝\n\n<b>Last Move:</b> {last_move_text}\n\nIt was a draw! Both trainers fought valiantly!"
-                await client.edit_message_text(
-                    battle.chat_id,
-                    battle.battle_message_id,
-                    draw_text
-                )
+                await battle.edit_battle_message(client, draw_text)
                 
                 # For draws, set winner_id to None and save to database
                 battle.winner_id = None
                 battle.finished_at = datetime.now()
+                battle.result_outcome = "draw"
             
             # Cancel any remaining timeout
             await self._cancel_turn_timeout(battle)
@@ -1861,11 +1906,9 @@ class BattleManager:
                 del self.active_battles[battle.battle_id]
                 print(f"Battle {battle.battle_id} removed from active battles after error")
     
-    def get_battle_history(self, user_id: int, limit: int = 5) -> List[Dict]:
+    async def get_battle_history(self, user_id: int, limit: int = 5) -> List[Dict]:
         """Get battle history for a user"""
-        # This would typically query the database
-        # For now, return empty list
-        return []
+        return await get_database().get_battle_history(user_id, limit)
     
     def clear_all_battles(self):
         """Clear all active battles (for debugging/testing)"""
@@ -1878,27 +1921,8 @@ class BattleManager:
     async def _give_rewards(self, user_id: int, tokens: int, shards: int):
         """Give rewards to the winner"""
         try:
-            pool = get_postgres_pool()
-            if not pool:
-                print("No database pool available for rewards")
-                return
-                
-            async with pool.acquire() as conn:
-                # Update wallet (tokens)
-                await conn.execute('''
-                    UPDATE users 
-                    SET wallet = wallet + $1 
-                    WHERE user_id = $2
-                ''', tokens, user_id)
-                
-                # Update shards
-                await conn.execute('''
-                    UPDATE users 
-                    SET shards = shards + $1 
-                    WHERE user_id = $2
-                ''', shards, user_id)
-                
-                print(f"Gave {tokens} tokens and {shards} shards to user {user_id}")
+            await get_database().apply_currency(user_id, {'wallet': tokens, 'shards': shards}, 'battle_win')
+            print(f"Gave {tokens} tokens and {shards} shards to user {user_id}")
         except Exception as e:
             print(f"Error giving rewards: {e}")
     
@@ -2001,12 +2025,7 @@ class BattleManager:
             battle_text = switch_message + battle_text
             
             async with battle.ui_lock:
-                await client.edit_message_text(
-                    battle.chat_id,
-                    battle.battle_message_id,
-                    battle_text,
-                    reply_markup=keyboard
-                )
+                await battle.edit_battle_message(client, battle_text, reply_markup=keyboard)
             
             print(f"Successfully switched to {selected_pokemon.name}")
             
@@ -2027,12 +2046,7 @@ class BattleManager:
             # Show voluntary switch UI
             switch_text, switch_keyboard = await battle.get_switch_pokemon_ui(user_id, client, voluntary=True)
             async with battle.ui_lock:
-                await client.edit_message_text(
-                    battle.chat_id,
-                    battle.battle_message_id,
-                    switch_text,
-                    reply_markup=switch_keyboard
-                )
+                await battle.edit_battle_message(client, switch_text, reply_markup=switch_keyboard)
             # Mark that we're awaiting a switch from this user
             battle.status = "waiting_for_switch"
             battle.waiting_for_switch_user_id = user_id
@@ -2050,7 +2064,6 @@ class BattleManager:
 battle_manager = BattleManager()
 
 # Command handlers
-import html
 
 
 def _user_link(u) -> str:
@@ -2077,6 +2090,7 @@ async def battle_command(client: Client, message: Message):
         try:
             opponent_user = await client.get_users(username)
             opponent_id = opponent_user.id
+            user_cache.observe(opponent_user)
         except Exception as e:
             await message.reply_text("❌ User not found! Please provide a valid username.")
             return
@@ -2084,6 +2098,7 @@ async def battle_command(client: Client, message: Message):
     elif message.reply_to_message:
         opponent_user = message.reply_to_message.from_user
         opponent_id = opponent_user.id
+        user_cache.observe(opponent_user)
     else:
         await message.reply_text(
             "<b>⚔️ Pokemon Battle Challenge</b>\n\n"
@@ -2237,12 +2252,12 @@ async def mybattle_command(client: Client, message: Message):
             battle_text += "<b>You are:</b> Opponent\n"
         
         # Get opponent name
-        try:
-            opponent_user = await client.get_users(opponent_id)
+        opponent_user = await user_cache.resolve(client, opponent_id)
+        if opponent_user:
             opponent_name = opponent_user.first_name or "Unknown"
             opponent_username = opponent_user.username or f"user{opponent_id}"
             battle_text += f"<b>Opponent:</b> <a href='https://t.me/{opponent_username}'>{opponent_name}</a>\n"
-        except:
+        else:
             battle_text += f"<b>Opponent:</b> User {opponent_id}\n"
         
         await message.reply_text(battle_text)
@@ -2251,8 +2266,8 @@ async def mybattle_command(client: Client, message: Message):
     # Check for pending challenge
     pending_challenge = battle_manager.get_pending_challenge(user_id)
     if pending_challenge:
-        try:
-            challenger_user = await client.get_users(pending_challenge)
+        challenger_user = await user_cache.resolve(client, pending_challenge)
+        if challenger_user:
             challenger_name = challenger_user.first_name or "Unknown"
             challenger_username = challenger_user.username or f"user{pending_challenge}"
             battle_text = (
@@ -2262,15 +2277,39 @@ async def mybattle_command(client: Client, message: Message):
             )
             await message.reply_text(battle_text, disable_web_page_preview=True)
             return
-        except:
-            pass
     
-    # No active battle or challenge
-    await message.reply_text(
+    # No active battle or challenge: show record and recent results instead
+    db = get_database()
+    record = await db.get_battle_record(user_id)
+    history = await battle_manager.get_battle_history(user_id, 5)
+    
+    battle_text = (
         "⚔️ <b>No Active Battle</b>\n\n"
         "You are not currently in a battle.\n"
-        "Use <code>/battle</code> to challenge someone, or wait for a challenge!"
+        "Use <code>/battle</code> to challenge someone, or wait for a challenge!\n\n"
+        f"<b>Record:</b> {record['wins']}W / {record['losses']}L / {record['draws']}D\n"
+        f"<b>This week:</b> {record['weekly_wins']}W / {record['weekly_losses']}L\n"
     )
+    
+    if history:
+        opponent_ids = [r['opponent_id'] if r['challenger_id'] == user_id else r['challenger_id'] for r in history]
+        names = await user_cache.get_display_names(client, opponent_ids)
+        battle_text += "\n<b>Recent Battles:</b>\n"
+        for result, opponent_id in zip(history, opponent_ids):
+            if result['winner_id'] == user_id:
+                outcome = "🏆 Won"
+            elif result['loser_id'] == user_id:
+                outcome = "😔 Lost" if result['outcome'] != 'forfeit' else "⏰ Forfeited"
+            elif result['outcome'] == 'ended':
+                outcome = "🏃 Ended"
+            else:
+                outcome = "🤝 Draw"
+            battle_text += (
+                f"• {outcome} vs <a href='tg://user?id={opponent_id}'>{html.escape(names[opponent_id])}</a>"
+                f" ({result['rounds']} rounds)\n"
+            )
+    
+    await message.reply_text(battle_text, disable_web_page_preview=True)
 
 @auto_register_user
 async def testteam_command(client: Client, message: Message):
@@ -2489,12 +2528,7 @@ async def battle_callback_handler(client: Client, callback_query: CallbackQuery)
         # Show switch UI
         switch_text, switch_keyboard = await battle.get_switch_pokemon_ui(user_id, client)
         async with battle.ui_lock:
-            await client.edit_message_text(
-                battle.chat_id,
-                battle.battle_message_id,
-                switch_text,
-                reply_markup=switch_keyboard
-            )
+            await battle.edit_battle_message(client, switch_text, reply_markup=switch_keyboard)
         await callback_query.answer("🔙 Back to switch!", show_alert=True)
     
     elif data.startswith("switch_pokemon_"):
@@ -2549,28 +2583,21 @@ async def battle_callback_handler(client: Client, callback_query: CallbackQuery)
         if battle.challenger_id in battle.run_votes and battle.opponent_id in battle.run_votes:
             battle.status = "finished"
             battle.finished_at = datetime.now()
+            battle.result_outcome = "ended"
             # No winner/loser or token adjustments for mutual run
-            try:
-                challenger_user = await client.get_users(battle.challenger_id)
-                challenger_name = challenger_user.first_name or "Unknown"
-            except:
-                challenger_name = f"User {battle.challenger_id}"
-            try:
-                opponent_user = await client.get_users(battle.opponent_id)
-                opponent_name = opponent_user.first_name or "Unknown"
-            except:
-                opponent_name = f"User {battle.opponent_id}"
+            names = await user_cache.get_display_names(
+                client,
+                [battle.challenger_id, battle.opponent_id],
+                {battle.challenger_id: f"User {battle.challenger_id}", battle.opponent_id: f"User {battle.opponent_id}"}
+            )
+            challenger_name = names[battle.challenger_id]
+            opponent_name = names[battle.opponent_id]
             end_text = (
                 f"🤝 <b>Battle Ended</b> 🤝\n\n"
                 f"<a href='tg://user?id={battle.challenger_id}'>{challenger_name}</a> & "
                 f"<a href='tg://user?id={battle.opponent_id}'>{opponent_name}</a> both have decided to end this match here!!"
             )
-            await client.edit_message_text(
-                battle.chat_id,
-                battle.battle_message_id,
-                end_text,
-                disable_web_page_preview=True
-            )
+            await battle.edit_battle_message(client, end_text, disable_web_page_preview=True)
             # Cancel any remaining timeout
             await battle_manager._cancel_turn_timeout(battle)
             
@@ -2591,12 +2618,7 @@ async def battle_callback_handler(client: Client, callback_query: CallbackQuery)
             waiter_banner = (
                 f"<b>🏃 Run requested.</b> Waiting for <a href='tg://user?id={pending_user_id}'>the other trainer</a> to confirm.\n\n"
             )
-            await client.edit_message_text(
-                battle.chat_id,
-                battle.battle_message_id,
-                waiter_banner + waiter_text,
-                reply_markup=keyboard
-            )
+            await battle.edit_battle_message(client, waiter_banner + waiter_text, reply_markup=keyboard)
             await callback_query.answer("⏳ Waiting for the other trainer to Run.", show_alert=False)
     
     elif data.startswith("open_switch_"):
@@ -2643,12 +2665,7 @@ async def battle_callback_handler(client: Client, callback_query: CallbackQuery)
         # Show battle UI
         battle_text, keyboard = await battle.get_battle_ui(battle.current_turn_user_id, client)
         async with battle.ui_lock:
-            await client.edit_message_text(
-                battle.chat_id,
-                battle.battle_message_id,
-                battle_text,
-                reply_markup=keyboard
-            )
+            await battle.edit_battle_message(client, battle_text, reply_markup=keyboard)
         await callback_query.answer("🔙 Back to battle!", show_alert=False)
 
 def setup_battle_handlers(app: Client):
@@ -0,0 +1,299 @@
+"""
+Broadcast engine.
+
+``/broadcast`` used to walk every user and group one at a time with a fixed
+50 ms sleep, call ``get_chat`` before each group message, and keep all ids
+in memory. A FloodWait aborted that chat's delivery, and a restart lost the
+broadcast half way through.
+
+``BroadcastEngine`` sends through a bounded pool of workers that share one
+token bucket. The bucket is sized for Telegram's global bot limit, and a
+FloodWait pauses the whole bucket for the requested time before the message
+is retried. Each chat receives the message once, so the per-chat limit only
+matters for those retries.
+
+Recipients are read in keyset pages (``get_broadcast_targets``). Progress is
+checkpointed in the ``broadcasts`` table: the phase, the last id below which
+every recipient was handled, and the counters. ``resume()`` continues
+running broadcasts once the client is connected. Groups the bot can
+definitely no longer post in are pruned from the database at each checkpoint.
+Other errors, such as an unknown peer that may just be missing from the local
+cache, and users who blocked the bot are only counted as failures. If the
+client itself is down or disconnected, the page stops without marking its
+remaining recipients as handled, and the job continues from its checkpoint
+after a pause.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from pyrogram.errors import (
+    ChannelPrivate, ChatAdminRequired, ChatWriteForbidden, FloodWait, UserBannedInChannel
+)
+
+from modules.postgres_database import get_database
+
+logger = logging.getLogger(__name__)
+
+RATE = 25.0  # messages per second across all chats (Telegram allows about 30)
+BURST = 30
+WORKERS = 20
+PAGE_SIZE = 500
+CHECKPOINT_INTERVAL = 2.0  # seconds between progress checkpoints
+MAX_ATTEMPTS = 3  # FloodWait retries per chat
+RESUME_DELAY = 30.0  # seconds before a job stopped by a client error continues
+MAX_RESUMES = 10  # client-error restarts per job before it is left for the next startup
+PHASES = ('users', 'groups')
+REMOVED_GROUPS_FILE = "removed_groups.txt"
+
+SENDERS = {
+    'text': 'send_message',
+    'photo': 'send_photo',
+    'video': 'send_video',
+    'document': 'send_document',
+}
+
+# The bot can no longer post in the group; groups raising these are pruned
+DEAD_CHAT_ERRORS = (ChatWriteForbidden, ChannelPrivate, UserBannedInChannel, ChatAdminRequired)
+
+# The client is not started or lost its connection; nothing was learned about the chat
+CLIENT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError)
+
+
+class ClientUnavailable(Exception):
+    """Raised when a send failed because of the client, not the recipient"""
+
+
+class TokenBucket:
+    """Token bucket shared by all workers; ``pause()`` holds everyone back after a FloodWait"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+class BroadcastEngine:
+    """Rate-limited, checkpointed delivery of broadcasts to every user and group"""
+
+    def __init__(self):
+        self.bucket = TokenBucket(RATE, BURST)
+        self.jobs: Dict[int, Dict] = {}  # broadcast id -> job row with live counters
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self.stats = {
+            'sent': 0,
+            'failed': 0,
+            'flood_waits': 0,
+            'pruned': 0,
+        }
+
+    def running(self) -> List[Dict]:
+        return [self.jobs[job_id] for job_id, task in self._tasks.items() if not task.done()]
+
+    async def start(self, client, started_by: int, kind: str, args: Dict) -> int:
+        """Persist a new broadcast and start delivering it; returns its id."""
+        payload = {'kind': kind, 'args': args}
+        job_id = await get_database().create_broadcast(started_by, payload)
+        job = {
+            'id': job_id, 'started_by': started_by, 'payload': payload, 'phase': PHASES[0],
+            'cursor_id': None, 'sent': 0, 'failed': 0, 'pruned': 0,
+        }
+        self._launch(client, job)
+        return job_id
+
+    async def resume(self, client) -> int:
+        """Continue broadcasts interrupted by a restart; returns how many were resumed."""
+        resumed = 0
+        for job in await get_database().get_running_broadcasts():
+            if job['id'] not in self._tasks:
+                self._launch(client, job)
+                resumed += 1
+        return resumed
+
+    def _launch(self, client, job: Dict):
+        self.jobs[job['id']] = job
+        self._tasks[job['id']] = asyncio.get_running_loop().create_task(self._run(client, job))
+
+    async def _run(self, client, job: Dict):
+        db = get_database()
+        send = getattr(client, SENDERS[job['payload']['kind']])
+        args = job['payload']['args']
+        dead: List[int] = []
+        resumes = 0
+        try:
+            while True:
+                try:
+                    await self._send_from_checkpoint(db, job, send, args, dead)
+                    break
+                except ClientUnavailable as e:
+                    resumes += 1
+                    if resumes > MAX_RESUMES:
+                        raise
+                    logger.warning(f"Broadcast {job['id']} paused, client unavailable: {e}")
+                    await asyncio.sleep(RESUME_DELAY)
+            await self._checkpoint(job, PHASES[-1], None, dead, status='done')
+        except Exception as e:
+            # The job stays 'running' in the database and resumes from its checkpoint on the next start
+            logger.error(f"Broadcast {job['id']} stopped: {e}")
+            return
+        finally:
+            self._tasks.pop(job['id'], None)
+            self.jobs.pop(job['id'], None)
+        await self._report(client, job)
+
+    async def _send_from_checkpoint(self, db, job: Dict, send, args: Dict, dead: List[int]):
+        for phase in PHASES[PHASES.index(job['phase']):]:
+            cursor = job['cursor_id'] if phase == job['phase'] else None
+            while True:
+                page = await db.get_broadcast_targets(phase, cursor, PAGE_SIZE)
+                if not page:
+                    break
+                await self._send_page(job, phase, page, send, args, dead)
+                cursor = page[-1]
+                await self._checkpoint(job, phase, cursor, dead)
+
+    async def _send_page(self, job: Dict, phase: str, page: List[int], send, args: Dict, dead: List[int]):
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, chat_id in enumerate(page):
+            queue.put_nowait((index, chat_id))
+        done = [False] * len(page)
+
+        async def worker():
+            while True:
+                try:
+                    index, chat_id = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._deliver(job, phase, chat_id, send, args, dead)
+                done[index] = True
+
+        pending = {asyncio.create_task(worker()) for _ in range(min(WORKERS, len(page)))}
+        watermark = -1
+
+        async def advance():
+            nonlocal watermark
+            moved = False
+            while watermark + 1 < len(page) and done[watermark + 1]:
+                watermark += 1
+                moved = True
+            if moved:
+                await self._checkpoint(job, phase, page[watermark], dead)
+
+        try:
+            while pending:
+                finished, pending = await asyncio.wait(pending, timeout=CHECKPOINT_INTERVAL)
+                errors = [task.exception() for task in finished if task.exception() is not None]
+                if errors:
+                    # Stop here; the checkpoint only covers recipients that were handled
+                    await advance()
+                    raise errors[0]
+                if not pending:
+                    break
+                await advance()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _deliver(self, job: Dict, phase: str, chat_id: int, send, args: Dict, dead: List[int]):
+        for _ in range(MAX_ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await send(chat_id, **args)
+            except FloodWait as e:
+                self.stats['flood_waits'] += 1
+                self.bucket.pause(e.value + 1)
+                continue
+            except DEAD_CHAT_ERRORS:
+                if phase == 'groups':
+                    dead.append(chat_id)
+                break
+            except CLIENT_ERRORS as e:
+                raise ClientUnavailable(str(e) or type(e).__name__) from e
+            except Exception as e:
+                logger.debug(f"Broadcast {job['id']} to {chat_id} failed: {e}")
+                break
+            job['sent'] += 1
+            self.stats['sent'] += 1
+            return
+        job['failed'] += 1
+        self.stats['failed'] += 1
+
+    async def _checkpoint(self, job: Dict, phase: str, cursor: Optional[int], dead: List[int],
+                          status: str = 'running'):
+        # Prune before the cursor moves past the dead groups, so a crash can't skip them
+        if dead:
+            await self._prune(job, dead)
+        job['phase'], job['cursor_id'] = phase, cursor
+        try:
+            await get_database().checkpoint_broadcast(
+                job['id'], phase, cursor, job['sent'], job['failed'], job['pruned'], status
+            )
+        except Exception as e:
+            logger.error(f"Error checkpointing broadcast {job['id']}: {e}")
+
+    async def _prune(self, job: Dict, dead: List[int]):
+        chat_ids, dead[:] = list(dead), []
+        try:
+            pruned = await get_database().prune_dead_chats(chat_ids)
+        except Exception as e:
+            logger.error(f"Error pruning {len(chat_ids)} dead groups: {e}")
+            return
+        job['pruned'] += pruned
+        self.stats['pruned'] += pruned
+        try:
+            with open(REMOVED_GROUPS_FILE, "a") as f:
+                f.writelines(f"{chat_id}\n" for chat_id in chat_ids)
+        except OSError:
+            pass
+
+    async def _report(self, client, job: Dict):
+        if not job.get('started_by'):
+            return
+        try:
+            await client.send_message(
+                job['started_by'],
+                f"Broadcast #{job['id']} finished.\n"
+                f"Delivered: {job['sent']}\nFailed: {job['failed']}\nGroups pruned: {job['pruned']}"
+            )
+        except Exception as e:
+            logger.error(f"Error reporting broadcast {job['id']}: {e}")
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['running'] = len(self.running())
+        stats['paused_for'] = max(0.0, round(self.bucket.paused_until - time.monotonic(), 1))
+        return stats
+
+
+# Global instance
+broadcast_engine = BroadcastEngine()
+
+
+def get_broadcast_engine() -> BroadcastEngine:
+    """Get the process-wide broadcast engine"""
+    return broadcast_engine
@@ -0,0 +1,378 @@
+"""
+Bulk character import.
+
+Adding characters through the admin panel takes six conversational steps per
+character, with an upload in the middle. Onboarding a region means hundreds
+of them. ``/bulkimport`` takes a CSV or JSON manifest instead, sent as a
+document or as a reply to one. It:
+
+- validates every row up front,
+- uploads media for rows that reference a Telegram ``file_id`` through the
+  shared upload pipeline, in parallel,
+- inserts every good row with one ``INSERT ... SELECT FROM unnest(...)``,
+- refreshes the search index once,
+- reports which rows failed and why.
+
+Manifest columns (CSV header or JSON object keys):
+    name, rarity                    required
+    anime | region                  defaults to the command argument
+    type                            optional
+    img_url | url                   already hosted media, stored as-is
+    file_id                         Telegram media, uploaded to Catbox/Cloudinary
+    is_video | video                true/false; guessed from the URL when omitted
+
+The same import can be run from a shell with
+``python -m modules.bulk_import manifest.csv --anime Kalos``. Rows that only
+have a ``file_id`` need the bot client and fail there.
+"""
+
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from pyrogram import Client
+from pyrogram.types import Message
+
+from .decorators import admin_only
+from .drop_warmup import get_drop_warmup
+from .media_upload import upload_media
+from .postgres_database import get_database, RARITIES
+from .search_index import get_loaded_search_index
+
+logger = logging.getLogger(__name__)
+
+MAX_MANIFEST_ROWS = 2000
+MAX_MANIFEST_BYTES = 5 * 1024 * 1024
+PROGRESS_INTERVAL = 5  # seconds between status message edits
+FAILURES_INLINE = 15  # failures listed in the reply; the rest go in a CSV
+
+VIDEO_EXTENSIONS = ('.mp4', '.webm', '.mov', '.mkv', '.gif')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'video'}
+
+_RARITY_LOOKUP = {name.lower(): name for name in RARITIES}
+
+
+@dataclass
+class ManifestRow:
+    line: int
+    name: str
+    rarity: str
+    anime: str
+    type: Optional[str] = None
+    img_url: Optional[str] = None
+    file_id: Optional[str] = None
+    is_video: bool = False
+
+    def to_character(self, added_by: Optional[int]) -> Dict:
+        return {
+            'name': self.name,
+            'anime': self.anime,
+            'type': self.type,
+            'rarity': self.rarity,
+            'file_id': self.file_id,
+            'img_url': self.img_url,
+            'is_video': self.is_video,
+            'added_by': added_by,
+            'mega': self.rarity == 'Mega Evolution',
+        }
+
+
+@dataclass
+class ImportReport:
+    total: int = 0
+    inserted: List[Tuple[int, int, str]] = field(default_factory=list)  # (line, character_id, name)
+    failures: List[Tuple[int, str, str]] = field(default_factory=list)  # (line, name, reason)
+    uploaded: int = 0
+    elapsed: float = 0.0
+
+    def fail(self, line: int, name: str, reason: str):
+        self.failures.append((line, name or '', reason))
+
+    def summary_text(self) -> str:
+        text = (
+            f"<b>📦 Bulk import finished</b>\n\n"
+            f"📄 <b>Rows:</b> <code>{self.total}</code>\n"
+            f"✅ <b>Added:</b> <code>{len(self.inserted)}</code>\n"
+            f"📤 <b>Media uploaded:</b> <code>{self.uploaded}</code>\n"
+            f"❌ <b>Failed:</b> <code>{len(self.failures)}</code>\n"
+            f"⏱ <b>Time:</b> <code>{self.elapsed:.1f}s</code>"
+        )
+        if self.inserted:
+            ids = [character_id for _, character_id, _ in self.inserted]
+            text += f"\n🆔 <b>IDs:</b> <code>{min(ids)}</code> – <code>{max(ids)}</code>"
+        if self.failures:
+            text += "\n\n<b>Failures:</b>\n"
+            for line, name, reason in sorted(self.failures)[:FAILURES_INLINE]:
+                text += f"• Row {line} {name}: {reason}\n"
+            if len(self.failures) > FAILURES_INLINE:
+                text += f"<i>…and {len(self.failures) - FAILURES_INLINE} more (see attached file)</i>"
+        return text
+
+    def failures_csv(self) -> io.BytesIO:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['row', 'name', 'reason'])
+        writer.writerows(sorted(self.failures))
+        document = io.BytesIO(buffer.getvalue().encode('utf-8'))
+        document.name = 'bulk_import_failures.csv'
+        return document
+
+
+def _first(record: Dict, *keys) -> Optional[str]:
+    for key in keys:
+        value = record.get(key)
+        if value is not None and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def _is_json(text: str, filename: str) -> bool:
+    return filename.lower().endswith('.json') or text.lstrip().startswith(('[', '{'))
+
+
+def _load_records(text: str, filename: str) -> List[Dict]:
+    if _is_json(text, filename):
+        payload = json.loads(text)
+        if isinstance(payload, dict):
+            payload = payload.get('characters', [])
+        if not isinstance(payload, list):
+            raise ValueError("JSON manifest must be a list of characters")
+        return [r if isinstance(r, dict) else {} for r in payload]
+    reader = csv.DictReader(io.StringIO(text))
+    return [{(k or '').strip().lower(): v for k, v in record.items()} for record in reader]
+
+
+def parse_manifest(data: bytes, filename: str, default_anime: Optional[str] = None) -> Tuple[List[ManifestRow], ImportReport]:
+    """Validate a manifest; bad rows go straight into the returned report."""
+    text = data.decode('utf-8-sig')
+    records = _load_records(text, filename)
+    if len(records) > MAX_MANIFEST_ROWS:
+        raise ValueError(f"Manifest has {len(records)} rows; the limit is {MAX_MANIFEST_ROWS}")
+
+    report = ImportReport(total=len(records))
+    rows: List[ManifestRow] = []
+    # Header is line 1 in a CSV; JSON entries are numbered from 1
+    first_line = 1 if _is_json(text, filename) else 2
+    for line, record in enumerate(records, start=first_line):
+        record = {str(k).lower(): v for k, v in record.items()}
+        name = _first(record, 'name')
+        if not name or not 2 <= len(name) <= 50:
+            report.fail(line, name, "name must be 2-50 characters")
+            continue
+        rarity = _RARITY_LOOKUP.get((_first(record, 'rarity') or '').lower())
+        if not rarity:
+            report.fail(line, name, f"unknown rarity '{_first(record, 'rarity') or ''}'")
+            continue
+        anime = _first(record, 'anime', 'region') or default_anime
+        if not anime:
+            report.fail(line, name, "no anime/region given")
+            continue
+        img_url = _first(record, 'img_url', 'url')
+        file_id = _first(record, 'file_id')
+        if not img_url and not file_id:
+            report.fail(line, name, "no img_url or file_id")
+            continue
+        if img_url and not img_url.startswith(('http://', 'https://')):
+            report.fail(line, name, "img_url must be an http(s) URL")
+            continue
+        video_flag = _first(record, 'is_video', 'video')
+        if video_flag is not None:
+            is_video = video_flag.lower() in TRUE_VALUES
+        else:
+            is_video = bool(img_url) and img_url.lower().split('?')[0].endswith(VIDEO_EXTENSIONS)
+        rows.append(ManifestRow(line, name, rarity, anime, _first(record, 'type'), img_url, file_id, is_video))
+    return rows, report
+
+
+def _drop_existing(rows: List[ManifestRow], report: ImportReport, existing: Dict[Tuple[str, str], int]) -> List[ManifestRow]:
+    """Skip rows already in the catalog or repeated in the manifest, so reruns are safe."""
+    seen = dict(existing)
+    kept = []
+    for row in rows:
+        key = (row.name.lower(), row.anime.lower())
+        if key in seen:
+            where = f"ID {seen[key]}" if seen[key] else "an earlier row"
+            report.fail(row.line, row.name, f"already exists ({where})")
+            continue
+        seen[key] = 0
+        kept.append(row)
+    return kept
+
+
+async def _existing_keys(db) -> Dict[Tuple[str, str], int]:
+    if not hasattr(db, 'pool'):
+        return {}
+    index = await get_loaded_search_index(db)
+    return {
+        ((c.get('name') or '').lower(), (c.get('anime') or '').lower()): char_id
+        for char_id, c in index.characters.items()
+    }
+
+
+async def _ingest_media(client, rows: List[ManifestRow], report: ImportReport, on_progress) -> List[ManifestRow]:
+    """Upload media for rows that only have a Telegram file_id, all in parallel."""
+    pending = [row for row in rows if not row.img_url]
+    if not pending:
+        return rows
+    if client is None:
+        for row in pending:
+            report.fail(row.line, row.name, "file_id media needs the bot; use /bulkimport")
+        return [row for row in rows if row.img_url]
+
+    done = {'count': 0}
+
+    async def ingest(row: ManifestRow):
+        url = await upload_media(client, row.file_id, 'video' if row.is_video else 'photo')
+        done['count'] += 1
+        if url:
+            row.img_url = url
+            report.uploaded += 1
+        else:
+            report.fail(row.line, row.name, "media upload failed")
+        await on_progress(done['count'], len(pending))
+
+    # The upload pipeline bounds how many of these run at once
+    await asyncio.gather(*(ingest(row) for row in pending))
+    return [row for row in rows if row.img_url]
+
+
+async def _insert_rows(db, rows: List[ManifestRow], report: ImportReport, added_by: Optional[int]):
+    characters = [row.to_character(added_by) for row in rows]
+    if hasattr(db, 'add_characters_bulk'):
+        try:
+            ids = await db.add_characters_bulk(characters)
+        except Exception as e:
+            logger.error(f"Bulk insert failed: {e}")
+            for row in rows:
+                report.fail(row.line, row.name, f"database insert failed: {e}")
+            return
+        for row, character_id in zip(rows, ids):
+            report.inserted.append((row.line, character_id, row.name))
+        return
+    # MongoDB has no multi-row insert helper; fall back to one insert per row
+    for row, character in zip(rows, characters):
+        try:
+            character_id = await db.add_character(character)
+            report.inserted.append((row.line, character_id, row.name))
+        except Exception as e:
+            report.fail(row.line, row.name, f"database insert failed: {e}")
+
+
+async def _remember_media_refs(db, rows: List[ManifestRow], report: ImportReport):
+    """Rows uploaded from a file_id already have a Telegram reference for their new URL."""
+    if not hasattr(db, 'save_media_ref'):
+        return
+    by_line = {row.line: row for row in rows}
+    for line, character_id, _ in report.inserted:
+        row = by_line.get(line)
+        if row is None or not row.file_id:
+            continue
+        try:
+            await db.save_media_ref(character_id, 'video' if row.is_video else 'photo', row.file_id, None, row.img_url)
+        except Exception as e:
+            logger.warning(f"Could not save media ref for character {character_id}: {e}")
+
+
+async def run_bulk_import(db, rows: List[ManifestRow], report: ImportReport, client=None,
+                          added_by: Optional[int] = None, on_progress=None) -> ImportReport:
+    """Upload, insert and index a parsed manifest."""
+    started = time.time()
+
+    async def progress(done: int, total: int):
+        if on_progress is not None:
+            await on_progress(done, total, report)
+
+    rows = _drop_existing(rows, report, await _existing_keys(db))
+    rows = await _ingest_media(client, rows, report, progress)
+    if rows:
+        await _insert_rows(db, rows, report, added_by)
+        await _remember_media_refs(db, rows, report)
+        # add_characters_bulk dropped the search index once; rebuild it for the whole batch
+        if hasattr(db, 'pool'):
+            await get_loaded_search_index(db)
+        # The drop sampler caches the catalog; queued drops would miss the new characters
+        get_drop_warmup().clear()
+    report.elapsed = time.time() - started
+    return report
+
+
+@admin_only
+async def bulkimport_command(client: Client, message: Message):
+    """/bulkimport [default region] — send with, or reply to, a CSV/JSON manifest"""
+    source = message if message.document else message.reply_to_message
+    document = source.document if source else None
+    if not document:
+        await message.reply_text(
+            "<b>❌ Send a CSV/JSON manifest with /bulkimport as caption, or reply to one.</b>\n"
+            "<i>Columns: name, rarity, anime/region, type, img_url or file_id, is_video</i>"
+        )
+        return
+    if document.file_size and document.file_size > MAX_MANIFEST_BYTES:
+        await message.reply_text("<b>❌ Manifest is too large (max 5 MB).</b>")
+        return
+
+    text = message.text or message.caption or ''
+    parts = text.split(maxsplit=1)
+    default_anime = parts[1].strip() if len(parts) > 1 else None
+
+    status = await message.reply_text("<i>Reading manifest...</i>")
+    try:
+        data = await client.download_media(source, in_memory=True)
+        rows, report = parse_manifest(bytes(data.getbuffer()), document.file_name or 'manifest.csv', default_anime)
+    except Exception as e:
+        await status.edit_text(f"<b>❌ Could not read manifest:</b> {e}")
+        return
+
+    last_edit = {'at': 0.0}
+
+    async def on_progress(done: int, total: int, report: ImportReport):
+        now = time.time()
+        if done < total and now - last_edit['at'] < PROGRESS_INTERVAL:
+            return
+        last_edit['at'] = now
+        try:
+            await status.edit_text(
+                f"<i>Uploading media: {done}/{total} "
+                f"({len(report.failures)} failed so far)...</i>"
+            )
+        except Exception:
+            pass
+
+    await status.edit_text(f"<i>Importing {len(rows)} valid rows of {report.total}...</i>")
+    db = get_database()
+    report = await run_bulk_import(db, rows, report, client, message.from_user.id, on_progress)
+
+    await status.edit_text(report.summary_text())
+    if len(report.failures) > FAILURES_INLINE:
+        await message.reply_document(report.failures_csv(), caption="❌ Rows that were not imported")
+
+
+async def _main(argv: List[str]):
+    import argparse
+    from config import NEON_URI
+    from .postgres_database import init_database
+
+    parser = argparse.ArgumentParser(description="Bulk import characters from a CSV/JSON manifest")
+    parser.add_argument('manifest')
+    parser.add_argument('--anime', help="region for rows that do not name one")
+    parser.add_argument('--added-by', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.manifest, 'rb') as f:
+        rows, report = parse_manifest(f.read(), os.path.basename(args.manifest), args.anime)
+    await init_database(NEON_URI)
+    report = await run_bulk_import(get_database(), rows, report, added_by=args.added_by)
+    print(f"Added {len(report.inserted)} of {report.total} rows in {report.elapsed:.1f}s")
+    for line, name, reason in sorted(report.failures):
+        print(f"row {line} {name}: {reason}")
+
+
+if __name__ == '__main__':
+    import sys
+    asyncio.run(_main(sys.argv[1:]))
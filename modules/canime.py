@@ -1,6 +1,7 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from modules.postgres_database import get_database
+from modules.region_directory import get_region_directory
 import logging
 
 logger = logging.getLogger(__name__)
@@ -80,17 +81,14 @@ async def handle_canime_letter_callback(client: Client, callback_query: Callback
             # For 0, show anime names that start with numbers
             letter = "0-9"
         
-        # Get anime names starting with the selected letter
+        # Anime buttons for the selected letter (paginated) - start with page 0
         db = get_database()
-        anime_names = await get_anime_names_by_letter(db, letter)
+        keyboard = await get_anime_keyboard(db, letter, 0)
         
-        if not anime_names:
+        if not keyboard:
             await callback_query.answer("No anime found starting with this character!")
             return
         
-        # Create anime buttons (paginated) - start with page 0
-        keyboard = create_anime_keyboard(anime_names, 0, letter)
-        
         # Update the message
         await callback_query.message.edit_text(
             f"ℹ️ <b>CHOOSE A REGION TO SEE ITS ALL POKEMON:</b>\n\n",
@@ -118,9 +116,6 @@ async def handle_canime_anime_callback(client: Client, callback_query: CallbackQ
         
         anime_name = parts[2]
         
-        # Get bot username for the search query
-        bot_username = (await client.get_me()).username
-        
         # Create inline query button for character search
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton(
@@ -165,19 +160,9 @@ async def get_anime_names_by_letter(db, letter):
     """Get anime names starting with a specific letter"""
     try:
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                if letter == "0-9":
-                    # For numbers, get anime names starting with digits
-                    result = await conn.fetch(
-                        "SELECT DISTINCT anime FROM characters WHERE anime ~ '^[0-9]' ORDER BY anime"
-                    )
-                else:
-                    # For letters and special characters
-                    result = await conn.fetch(
-                        "SELECT DISTINCT anime FROM characters WHERE anime ILIKE $1 ORDER BY anime",
-                        f"{letter}%"
-                    )
-                return [row['anime'] for row in result]
+            # Served from the in-memory region directory
+            directory = await get_region_directory(db)
+            return directory.names_for(letter)
         else:  # MongoDB
             if letter == "0-9":
                 # For numbers, get anime names starting with digits
@@ -201,6 +186,18 @@ async def get_anime_names_by_letter(db, letter):
         logger.error(f"Error getting anime names by letter: {e}")
         return []
 
+async def get_anime_keyboard(db, letter, page):
+    """Get the keyboard for one page of a letter, or None if no anime starts with it"""
+    if hasattr(db, 'pool'):  # PostgreSQL
+        # Pages are rendered once per catalog version and reused
+        directory = await get_region_directory(db)
+        anime_names = directory.names_for(letter)
+        if not anime_names:
+            return None
+        return directory.page(('canime', letter, page), lambda: create_anime_keyboard(anime_names, page, letter))
+    anime_names = await get_anime_names_by_letter(db, letter)
+    return create_anime_keyboard(anime_names, page, letter) if anime_names else None
+
 def create_anime_keyboard(anime_names, page, letter):
     """Create keyboard for anime selection with pagination - one anime per row"""
     start_idx = page * ITEMS_PER_PAGE
@@ -271,20 +268,14 @@ async def handle_canime_page_callback(client: Client, callback_query: CallbackQu
         elif letter == "0":
             letter = "0-9"
         
-        # Get anime names for the selected letter
+        # Keyboard for the selected page
         db = get_database()
-        anime_names = await get_anime_names_by_letter(db, letter)
+        keyboard = await get_anime_keyboard(db, letter, page)
         
-        if not anime_names:
+        if not keyboard:
             await callback_query.answer("No anime found!")
             return
         
-        # Create keyboard for the selected page
-        keyboard = create_anime_keyboard(anime_names, page, letter)
-        
-        # Calculate total pages
-        total_pages = (len(anime_names) + ITEMS_PER_PAGE - 1) // ITEMS_PER_PAGE
-        
         # Update the message
         await callback_query.message.edit_text(
             f"ℹ️ <b>CHOOSE A REGION TO SEE ITS ALL POKEMON:</b>\n\n",
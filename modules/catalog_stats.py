@@ -0,0 +1,79 @@
+"""
+Catalog statistics and rarity listings.
+
+``/srarity`` paged each rarity with ``COUNT(*)`` plus ``ORDER BY character_id
+LIMIT/OFFSET``, which gets slower the deeper a user pages into Common.
+``/stats``, ``/status`` and the daily goal rewards each ran their own
+``COUNT``/``GROUP BY`` over the characters table. ``CatalogStats`` keeps
+per-rarity id arrays sorted by id, per-rarity and video counts, the newest
+characters and rendered listing pages, so all of these read memory.
+"""
+
+import logging
+from typing import Dict, List, Tuple
+
+from modules.search_index import CatalogSearchIndex, DerivedView, load_derived_view
+
+logger = logging.getLogger(__name__)
+
+LATEST_COUNT = 5
+
+
+class CatalogStats(DerivedView):
+    """Per-rarity id arrays and counts for the whole catalog"""
+
+    def __init__(self):
+        super().__init__()
+        self.total = 0
+        self.videos = 0
+        self.by_rarity: Dict[str, int] = {}
+        self.videos_by_rarity: Dict[str, int] = {}
+        self.latest: List[Dict] = []
+        self._characters: Dict[int, Dict] = {}
+        self._rarity_ids: Dict[str, List[int]] = {}
+
+    def _build(self, index: CatalogSearchIndex):
+        rarity_ids: Dict[str, List[int]] = {}
+        videos_by_rarity: Dict[str, int] = {}
+        videos = 0
+        ids = sorted(index.characters)
+        for char_id in ids:
+            row = index.characters[char_id]
+            rarity = row.get('rarity')
+            rarity_ids.setdefault(rarity, []).append(char_id)
+            if row.get('is_video'):
+                videos += 1
+                videos_by_rarity[rarity] = videos_by_rarity.get(rarity, 0) + 1
+
+        # The index swaps in a new dict on rebuild, so this stays a consistent snapshot
+        self._characters = index.characters
+        self._rarity_ids = rarity_ids
+        self.total = len(ids)
+        self.videos = videos
+        self.by_rarity = {rarity: len(bucket) for rarity, bucket in rarity_ids.items()}
+        self.videos_by_rarity = videos_by_rarity
+        self.latest = [index.characters[i] for i in reversed(ids[-LATEST_COUNT:])]
+        logger.info(f"Catalog stats built: {self.total} characters, {len(rarity_ids)} rarities")
+
+    def count(self, rarity: str) -> int:
+        return self.by_rarity.get(rarity, 0)
+
+    def rarity_ids(self, rarity: str) -> List[int]:
+        """Character ids of one rarity, ascending."""
+        return self._rarity_ids.get(rarity, [])
+
+    def rarity_page(self, rarity: str, page: int, per_page: int) -> Tuple[List[Dict], int]:
+        """Return ``(rows, total_pages)`` for a 1-based page of one rarity."""
+        ids = self.rarity_ids(rarity)
+        total_pages = (len(ids) + per_page - 1) // per_page or 1
+        start = (page - 1) * per_page
+        return [self._characters[i] for i in ids[start:start + per_page]], total_pages
+
+
+# Global instance
+catalog_stats = CatalogStats()
+
+
+async def get_catalog_stats(db) -> CatalogStats:
+    """Get catalog statistics, rebuilding them if the catalog changed"""
+    return await load_derived_view(catalog_stats, db)
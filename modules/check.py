@@ -6,6 +6,8 @@ import os
 
 # Import database based on configuration
 from modules.postgres_database import get_database
+from modules.user_cache import user_cache
+from modules.media_utils import reply_character_media
 
 # Rarity emoji mapping
 RARITY_EMOJIS = {
@@ -25,6 +27,13 @@ RARITY_EMOJIS = {
     "Mega Evolution": "🧬"
 }
 
+def _collector_name(collector: dict) -> tuple:
+    """Prefer the freshest known profile over the stored database name."""
+    cached = user_cache.peek(collector['user_id'])
+    if cached:
+        return cached.first_name or collector['name'], cached.username or ''
+    return collector['name'], collector.get('username', '')
+
 async def check_command(client: Client, message: Message):
     """Check character details and collectors"""
     try:
@@ -60,8 +69,7 @@ async def check_command(client: Client, message: Message):
             )
             return
         # Get global collector count
-        global_collectors = await db.get_character_collectors(character_id)
-        unique_count = len(global_collectors)
+        unique_count = await db.get_character_collector_count(character_id)
         # Create message text
         name = character.get('name', 'Unknown')
         rarity = character.get('rarity', 'Unknown')
@@ -82,20 +90,12 @@ async def check_command(client: Client, message: Message):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         # Send character media with details
-        if character.get('is_video', False):
-            await message.reply_video(
-                video=character['img_url'],
-                caption=message_text,
-                reply_markup=reply_markup
-            )
-        else:
-            # Use img_url if available, fallback to file_id
-            photo = character.get('img_url', character['file_id'])
-            await message.reply_photo(
-                photo=photo,
-                caption=message_text,
-                reply_markup=reply_markup
-            )
+        await reply_character_media(
+            message,
+            character,
+            caption=message_text,
+            reply_markup=reply_markup
+        )
     except Exception as e:
         print(f"Error in check command: {e}")
         await message.reply_text(
@@ -127,8 +127,7 @@ async def collectors_here_callback(client: Client, callback_query: CallbackQuery
             f"<b>👥 Collectors Here:</b>\n"
         )
         for i, collector in enumerate(collectors, 1):
-            name = collector['name']
-            username = collector.get('username', '')
+            name, username = _collector_name(collector)
             count = collector['count']
             if username:
                 collectors_text += f"{i}. [{name}](https://t.me/{username}) (x{count})\n"
@@ -179,8 +178,7 @@ async def top_collectors_callback(client: Client, callback_query: CallbackQuery)
         )
         
         for i, collector in enumerate(top_collectors, 1):
-            name = collector['name']
-            username = collector.get('username', '')
+            name, username = _collector_name(collector)
             count = collector['count']
             if username:
                 message_text += f"{i}. [{name}](https://t.me/{username}) (x{count})\n"
@@ -213,8 +211,7 @@ async def back_to_character_callback(client: Client, callback_query: CallbackQue
             return
         
         # Get global collector count
-        global_collectors = await db.get_character_collectors(char_id)
-        unique_count = len(global_collectors)
+        unique_count = await db.get_character_collector_count(char_id)
 
         # Create message text
         name = character.get('name', 'Unknown')
@@ -1,18 +1,24 @@
-from pyrogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, InlineQuery, InlineQueryResultPhoto, InlineQueryResultVideo, InlineQueryResultArticle, InputTextMessageContent, InputMediaPhoto, InputMediaVideo
+from pyrogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, InlineQuery, InlineQueryResultPhoto, InlineQueryResultVideo, InlineQueryResultArticle, InputTextMessageContent
 from pyrogram.errors import MessageNotModified
 import os
 
 # Import database based on configuration
 from modules.postgres_database import get_database
-import random
+from modules.collection_view import get_collection_view
+from modules.region_directory import get_region_directory
+from modules.user_cache import user_cache
+from modules.media_utils import edit_character_media, reply_character_media
+from cachetools import LRUCache
 import re
-from collections import Counter
 import asyncio
 from datetime import datetime
 
 ITEMS_PER_PAGE = 10
 DEFAULT_ITEMS_PER_PAGE = 5
 
+# Inline collection searches, keyed by (user_id, collection view version, search string)
+_inline_collection_cache = LRUCache(maxsize=512)
+
 # Type emojis mapping
 TYPE_EMOJIS = {
     "Normal": "🔘",
@@ -193,9 +199,9 @@ async def collection_command(client, message: Message):
         rarity_filter = preferences.get('filter', None)
         sort_by = preferences.get('sort_by', None)
 
-        # Get unique character count using optimized method
-        collection = await db.get_user_collection(user_id)
-        unique_count = len(collection)
+        # Unique count comes from the cached view that show_collection_page reuses
+        view = await get_collection_view(db, user_id, user_data.get('characters'))
+        unique_count = view.unique_count
 
         # Create keyboard with inline query button
         keyboard = InlineKeyboardMarkup([
@@ -273,13 +279,10 @@ async def get_anime_statistics(db, collection):
     # Get total available characters for each anime
     try:
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                for anime_name in anime_stats.keys():
-                    result = await conn.fetchval(
-                        "SELECT COUNT(*) FROM characters WHERE anime = $1",
-                        anime_name
-                    )
-                    anime_stats[anime_name]['total_available'] = result or 0
+            # Region sizes come from the in-memory region directory
+            directory = await get_region_directory(db)
+            for anime_name in anime_stats.keys():
+                anime_stats[anime_name]['total_available'] = directory.count(anime_name)
         else:  # MongoDB
             for anime_name in anime_stats.keys():
                 count = await db.characters.count_documents({'anime': anime_name})
@@ -302,39 +305,14 @@ async def show_collection_page(client, message, user_id: int, page: int, mode='d
         else:  # MongoDB
             user_data = await db.users.find_one({"user_id": user_id}, {"user_id": 1, "first_name": 1, "favorite_character": 1})
         
-        collection = await db.get_user_collection(user_id)
-        total_items = len(collection)
-        if rarity_filter:
-            collection = [c for c in collection if c['rarity'] == rarity_filter]
-
-        # Apply sorting by anime if requested
-        if sort_by in ("anime_count", "anime_alpha"):
-            # Build counts per anime based on the (possibly filtered) collection
-            anime_counts = {}
-            for item in collection:
-                anime_name = item.get('anime', 'Unknown Anime')
-                anime_counts[anime_name] = anime_counts.get(anime_name, 0) + max(1, item.get('count', 1))
-            if sort_by == "anime_count":
-                # Sort by total owned per anime (desc), then anime name, then character name
-                collection.sort(key=lambda x: (
-                    -anime_counts.get(x.get('anime', 'Unknown Anime'), 0),
-                    (x.get('anime') or 'Unknown Anime').lower(),
-                    (x.get('name') or '').lower()
-                ))
-            elif sort_by == "anime_alpha":
-                # Sort by anime name alphabetically, then character name
-                collection.sort(key=lambda x: (
-                    (x.get('anime') or 'Unknown Anime').lower(),
-                    (x.get('name') or '').lower()
-                ))
-        
+        # Filtering and sorting are precomputed on the view; a page is a slice
+        view = await get_collection_view(db, user_id, user_data.get('characters') if user_data else None)
+        total_items = view.unique_count
+        collection = view.ordered(sort_by, rarity_filter)
+
         # Use different pagination limits based on mode
         items_per_page = DEFAULT_ITEMS_PER_PAGE if mode == 'default' else ITEMS_PER_PAGE
-        total_pages = max(1, (len(collection) + items_per_page - 1) // items_per_page)
-        page = max(1, min(page, total_pages))
-        start_idx = (page - 1) * items_per_page
-        end_idx = min(start_idx + items_per_page, len(collection))
-        current_page_items = collection[start_idx:end_idx]
+        current_page_items, page, total_pages = view.page(page, items_per_page, sort_by, rarity_filter)
         
         # Get anime statistics for the current page items
         anime_stats = await get_anime_statistics(db, current_page_items)
@@ -372,8 +350,7 @@ async def show_collection_page(client, message, user_id: int, page: int, mode='d
             
             if char_docs:
                 # Check if user actually owns this character (use full collection, not filtered)
-                full_collection = await db.get_user_collection(user_id)
-                if favorite_id in [char['character_id'] for char in full_collection]:
+                if view.owns(favorite_id):
                     favorite_char = char_docs[0]
                 else:
                     # User doesn't own this character anymore, clear favorite
@@ -388,9 +365,8 @@ async def show_collection_page(client, message, user_id: int, page: int, mode='d
         if not favorite_id and collection:
             # If no favorite is set, set a random character as favorite and save it
             # Use the full collection (before rarity filter) for random selection
-            full_collection = await db.get_user_collection(user_id)
-            if full_collection:
-                random_char = random.choice(full_collection)
+            random_char = view.random_row()
+            if random_char:
                 await db.update_user(user_id, {'favorite_character': random_char['character_id']})
                 # Get the full character data for display
                 if hasattr(db, 'pool'):  # PostgreSQL
@@ -408,92 +384,47 @@ async def show_collection_page(client, message, user_id: int, page: int, mode='d
         elif not favorite_id:
             favorite_char = None
         if favorite_char:
-            is_video = favorite_char.get('is_video', False)
-            if is_video:
-                # For video characters, prefer img_url (Cloudinary URL) over file_id
-                video_source = favorite_char.get('img_url') or favorite_char.get('file_id')
-                if callback_query:
-                    try:
-                        if reply_markup:
-                            await callback_query.edit_message_media(
-                                media=InputMediaVideo(
-                                    media=video_source,
-                                    caption=text
-                                ),
-                                reply_markup=reply_markup
-                            )
-                        else:
-                            await callback_query.edit_message_media(
-                                media=InputMediaVideo(
-                                    media=video_source,
-                                    caption=text
-                                )
-                            )
-                    except MessageNotModified:
-                        pass
-                    except Exception as e:
-                        print(f"Error editing video message: {e}")
-                        # Fallback to text message
-                        await callback_query.edit_message_text(
-                            text,
-                            reply_markup=reply_markup
-                        )
-                else:
-                    try:
-                        await message.reply_video(
-                            video=video_source,
+            # Media comes from the cached Telegram file_id when known
+            media_kind = "video" if favorite_char.get('is_video', False) else "photo"
+            if callback_query:
+                try:
+                    if reply_markup:
+                        await edit_character_media(
+                            callback_query,
+                            favorite_char,
                             caption=text,
                             reply_markup=reply_markup
                         )
-                    except Exception as e:
-                        print(f"Error sending video message: {e}")
-                        # Fallback to text message
-                        await message.reply_text(
-                            text,
-                            reply_markup=reply_markup
+                    else:
+                        await edit_character_media(
+                            callback_query,
+                            favorite_char,
+                            caption=text
                         )
+                except MessageNotModified:
+                    pass
+                except Exception as e:
+                    print(f"Error editing {media_kind} message: {e}")
+                    # Fallback to text message
+                    await callback_query.edit_message_text(
+                        text,
+                        reply_markup=reply_markup
+                    )
             else:
-                photo = favorite_char.get('img_url', favorite_char['file_id'])
-                if callback_query:
-                    try:
-                        if reply_markup:
-                            await callback_query.edit_message_media(
-                                media=InputMediaPhoto(
-                                    media=photo,
-                                    caption=text
-                                ),
-                                reply_markup=reply_markup
-                            )
-                        else:
-                            await callback_query.edit_message_media(
-                                media=InputMediaPhoto(
-                                    media=photo,
-                                    caption=text
-                                )
-                            )
-                    except MessageNotModified:
-                        pass
-                    except Exception as e:
-                        print(f"Error editing photo message: {e}")
-                        # Fallback to text message
-                        await callback_query.edit_message_text(
-                            text,
-                            reply_markup=reply_markup
-                        )
-                else:
-                    try:
-                        await message.reply_photo(
-                            photo=photo,
-                            caption=text,
-                            reply_markup=reply_markup
-                        )
-                    except Exception as e:
-                        print(f"Error sending photo message: {e}")
-                        # Fallback to text message
-                        await message.reply_text(
-                            text,
-                            reply_markup=reply_markup
-                        )
+                try:
+                    await reply_character_media(
+                        message,
+                        favorite_char,
+                        caption=text,
+                        reply_markup=reply_markup
+                    )
+                except Exception as e:
+                    print(f"Error sending {media_kind} message: {e}")
+                    # Fallback to text message
+                    await message.reply_text(
+                        text,
+                        reply_markup=reply_markup
+                    )
         else:
             if callback_query:
                 try:
@@ -738,18 +669,15 @@ async def sort_collection(client, message, user_id: int, sort_type: str, callbac
     if not user_data or not user_data.get('characters', []):
         return
 
-    char_ids = user_data['characters']
-    characters = []
-
-    for char_id in char_ids:
-        char = await db.get_character(char_id)
-        if char:
-            characters.append(char)
+    view = await get_collection_view(db, user_id, user_data['characters'])
 
+    # Stable sort of the stored order, so ties and other sort types keep their positions
+    rows = {row['character_id']: row for row in view.rows}
+    characters = [rows[char_id] for char_id in user_data['characters'] if char_id in rows]
     if sort_type == "name":
-        characters.sort(key=lambda x: x['name'].lower())
+        characters.sort(key=lambda x: (x.get('name') or '').lower())
     elif sort_type == "rarity":
-        characters.sort(key=lambda x: get_rarity_level(x['rarity']), reverse=True)
+        characters.sort(key=lambda x: get_rarity_level(x.get('rarity') or ''), reverse=True)
 
     # Update user's character order
     new_char_ids = [char['character_id'] for char in characters]
@@ -911,6 +839,118 @@ def create_inline_result(character, user_name):
             )
         )
 
+def _build_collection_inline_result(char, user_name):
+    """Build the inline result for one collection entry"""
+    rarity_emoji = RARITY_DATA.get(char['rarity'], {}).get('emoji', '⭐')
+    count_display = f" [x{char['count']}]" if char.get('count', 1) > 1 else ""
+    # Format the type with emojis
+    pokemon_type = char.get('type', 'Unknown')
+    formatted_type = format_pokemon_type(pokemon_type)
+    
+    caption = (
+        f"<b>{user_name}'s {char['rarity']} Collect</b>\n\n"
+        f"👤<b>Name</b>: {char['name']}{count_display}\n"
+        f"{rarity_emoji}<b>Rarity</b>:  {char['rarity']} \n"
+        f"<b>⛩ Region</b>: {char['anime']}\n\n"
+        f"<b>{formatted_type}</b>\n"
+        f"🔖<b>ID</b>: {char['character_id']}"
+    )
+    title = f"{char['name']} ({char['rarity']})"
+    description = f"ID: {char['character_id']}"
+    if char.get('img_url'):
+        if char.get('is_video', False):
+            return InlineQueryResultVideo(
+                id=str(char['character_id']),
+                video_url=char['img_url'],
+                thumb_url=char['img_url'],
+                mime_type='video/mp4',
+                title=title,
+                description=description,
+                caption=caption
+            )
+        return InlineQueryResultPhoto(
+            id=str(char['character_id']),
+            photo_url=char['img_url'],
+            thumb_url=char['img_url'],
+            title=title,
+            description=description,
+            caption=caption
+        )
+    return InlineQueryResultArticle(
+        id=str(char['character_id']),
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(
+            message_text=caption
+        )
+    )
+
+class _InlineCollectionResults:
+    """Filtered entries for one (user, collection version, search) with results built on demand"""
+
+    def __init__(self, matches, user_name):
+        self.matches = matches
+        self.user_name = user_name
+        self._built = {}
+
+    def page(self, start, limit):
+        results = []
+        for idx in range(start, min(start + limit, len(self.matches))):
+            result = self._built.get(idx)
+            if result is None:
+                result = _build_collection_inline_result(self.matches[idx], self.user_name)
+                self._built[idx] = result
+            results.append(result)
+        return results
+
+def _match_collection_entries(rows, search_str):
+    if not search_str:
+        return rows
+    return [c for c in rows if search_str in c['name'].lower() or search_str in c['rarity'].lower()]
+
+async def _get_inline_user_name(db, user_id, inline_query):
+    if inline_query.from_user and inline_query.from_user.id == user_id:
+        return inline_query.from_user.first_name or 'User'
+    cached = user_cache.peek(user_id)
+    if cached and cached.display_name:
+        return cached.display_name
+    user_data = await db.get_user(user_id)
+    return (user_data or {}).get('first_name') or 'User'
+
+async def _get_inline_collection_results(db, user_id, search_str, inline_query, version=None):
+    """Return (view version, cached results) for an inline collection search.
+
+    ``version`` pins a page request to the collection snapshot its first page came
+    from, as long as that snapshot is still cached.
+    """
+    if version is not None:
+        pinned = _inline_collection_cache.get((user_id, version, search_str))
+        if pinned is not None:
+            return version, pinned
+
+    view = await get_collection_view(db, user_id)
+    key = (user_id, view.version, search_str)
+    entry = _inline_collection_cache.get(key)
+    if entry is not None:
+        return view.version, entry
+
+    # Refining a search ("pik" -> "pika") only narrows the earlier matches
+    base = None
+    for cut in range(len(search_str) - 1, 0, -1):
+        base = _inline_collection_cache.get((user_id, view.version, search_str[:cut]))
+        if base is not None:
+            break
+    if base is not None:
+        user_name = base.user_name
+        matches = _match_collection_entries(base.matches, search_str)
+    else:
+        user_name = await _get_inline_user_name(db, user_id, inline_query)
+        matches = _match_collection_entries(view.rows, search_str)
+
+    entry = _InlineCollectionResults(matches, user_name)
+    _inline_collection_cache[key] = entry
+    return view.version, entry
+
 async def handle_inline_query(client, inline_query: InlineQuery):
     import re
     query = inline_query.query.strip()
@@ -920,15 +960,21 @@ async def handle_inline_query(client, inline_query: InlineQuery):
         return
 
     user_id = int(m.group(1))
-    search_str = m.group(2).strip() if m.group(2) else ''
+    search_str = m.group(2).strip().lower() if m.group(2) else ''
+    # Offsets look like "<collection version>:<position>"; plain positions are still accepted
+    version = None
     try:
-        offset = int(inline_query.offset) if inline_query.offset else 0
+        if ':' in (inline_query.offset or ''):
+            version_part, offset_part = inline_query.offset.split(':', 1)
+            version, offset = int(version_part), int(offset_part)
+        else:
+            offset = int(inline_query.offset) if inline_query.offset else 0
     except ValueError:
-        offset = 0
+        version, offset = None, 0
 
     db = get_database()
-    user_data = await db.get_user(user_id)
-    if not user_data or not user_data.get('characters'):
+    version, entry = await _get_inline_collection_results(db, user_id, search_str, inline_query, version)
+    if not entry.matches and not search_str:
         await inline_query.answer([
             InlineQueryResultArticle(
                 id="no_results",
@@ -941,87 +987,11 @@ async def handle_inline_query(client, inline_query: InlineQuery):
         ], cache_time=1)
         return
 
-    # Deduplicate and count characters
-    char_ids = user_data['characters']
-    char_counts = Counter(char_ids)
-    # Batch fetch all character details
-    char_docs = await batch_fetch_characters(db, list(char_counts.keys()), batch_size=500)
-    id_to_char = {c['character_id']: c for c in char_docs}
-    collection = []
-    for char_id, count in char_counts.items():
-        char = id_to_char.get(char_id)
-        if char:
-            char = dict(char)  # copy
-            char['count'] = count
-            collection.append(char)
-
-    user_name = user_data.get('first_name', 'User')
-    # Filter by search string
-    if search_str:
-        s = search_str.lower()
-        filtered = [c for c in collection if s in c['name'].lower() or s in c['rarity'].lower()]
-    else:
-        filtered = collection
-
     # Pagination
     items_per_page = 50
-    start_idx = offset
-    end_idx = min(start_idx + items_per_page, len(filtered))
-    results = []
-    for char in filtered[start_idx:end_idx]:
-        rarity_emoji = RARITY_DATA.get(char['rarity'], {}).get('emoji', '⭐')
-        count_display = f" [x{char['count']}]" if char.get('count', 1) > 1 else ""
-        # Format the type with emojis
-        pokemon_type = char.get('type', 'Unknown')
-        formatted_type = format_pokemon_type(pokemon_type)
-        
-        caption = (
-            f"<b>{user_name}'s {char['rarity']} Collect</b>\n\n"
-            f"👤<b>Name</b>: {char['name']}{count_display}\n"
-            f"{rarity_emoji}<b>Rarity</b>:  {char['rarity']} \n"
-            f"<b>⛩ Region</b>: {char['anime']}\n\n"
-            f"<b>{formatted_type}</b>\n"
-            f"🔖<b>ID</b>: {char['character_id']}"
-        )
-        title = f"{char['name']} ({char['rarity']})"
-        description = f"ID: {char['character_id']}"
-        if char.get('img_url'):
-            if char.get('is_video', False):
-                results.append(
-                    InlineQueryResultVideo(
-                        id=str(char['character_id']),
-                        video_url=char['img_url'],
-                        thumb_url=char['img_url'],
-                        mime_type='video/mp4',
-                        title=title,
-                        description=description,
-                        caption=caption
-                    )
-                )
-            else:
-                results.append(
-                    InlineQueryResultPhoto(
-                        id=str(char['character_id']),
-                        photo_url=char['img_url'],
-                        thumb_url=char['img_url'],
-                        title=title,
-                        description=description,
-                        caption=caption
-                    )
-                )
-        else:
-            results.append(
-                InlineQueryResultArticle(
-                    id=str(char['character_id']),
-                    title=title,
-                    description=description,
-                    input_message_content=InputTextMessageContent(
-                        message_text=caption
-                    )
-                )
-            )
-
-    next_offset = str(end_idx) if end_idx < len(filtered) else ""
+    results = entry.page(offset, items_per_page)
+    end_idx = min(offset + items_per_page, len(entry.matches))
+    next_offset = f"{version}:{end_idx}" if end_idx < len(entry.matches) else ""
     if not results:
         results.append(InlineQueryResultArticle(
             id="no_results",
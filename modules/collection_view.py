@@ -0,0 +1,225 @@
+"""
+Per-user collection views.
+
+``/mycollection`` paging, ``smode`` filters and favorite validation used to
+re-read the whole collection from PostgreSQL (up to three times per page) and
+re-sort it in Python on every click. A ``CollectionView`` holds the
+deduplicated, counted collection once and builds each sort order, rarity
+bucket and anime tally lazily the first time it is asked for, so a page view
+becomes slicing a precomputed list.
+
+Views are kept in an LRU cache and dropped whenever the database layer changes
+a user's characters. Callers that already hold the user's ``characters`` array
+can pass it in as well; a view built from a different array is rebuilt, which
+catches writers that bypass the database helpers.
+"""
+
+import itertools
+import logging
+import random
+from typing import Dict, List, Optional, Sequence
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+VIEW_CACHE_SIZE = 500
+
+# Sort orders understood by CollectionView.ordered()
+SORT_ID = 'id'
+SORT_RARITY = 'rarity'
+SORT_NAME = 'name'
+SORT_ANIME_COUNT = 'anime_count'
+SORT_ANIME_ALPHA = 'anime_alpha'
+
+UNKNOWN_ANIME = 'Unknown Anime'
+
+# Every built view gets a new version, so caches derived from a view can key on it
+_view_versions = itertools.count(1)
+
+
+def _fingerprint(characters: Optional[Sequence[int]]) -> tuple:
+    characters = characters or ()
+    return len(characters), hash(tuple(characters))
+
+
+def _rarity_level(rarity: str) -> int:
+    from modules.collection import get_rarity_level
+    return get_rarity_level(rarity or '')
+
+
+class CollectionView:
+    """A user's deduplicated collection with lazily built sort orders and buckets"""
+
+    def __init__(self, user_id: int, rows: List[Dict], fingerprint: Optional[tuple] = None):
+        self.user_id = user_id
+        # Rows as returned by get_user_collection: one per character, with 'count', ordered by id
+        self.rows = rows
+        self.fingerprint = fingerprint
+        self.version = next(_view_versions)
+        self._ids = None
+        self._orders: Dict[tuple, List[Dict]] = {}
+        self._rarity_buckets: Optional[Dict[str, List[Dict]]] = None
+        self._anime_buckets: Optional[Dict[str, List[Dict]]] = None
+        self._anime_counts: Dict[Optional[str], Dict[str, int]] = {}
+
+    @property
+    def unique_count(self) -> int:
+        return len(self.rows)
+
+    @property
+    def total_count(self) -> int:
+        return sum(row.get('count', 1) for row in self.rows)
+
+    def owns(self, character_id: int) -> bool:
+        if self._ids is None:
+            self._ids = {row['character_id'] for row in self.rows}
+        return character_id in self._ids
+
+    def rarity_bucket(self, rarity: Optional[str]) -> List[Dict]:
+        """Rows of one rarity (all rows when ``rarity`` is falsy), in id order."""
+        if not rarity:
+            return self.rows
+        if self._rarity_buckets is None:
+            buckets: Dict[str, List[Dict]] = {}
+            for row in self.rows:
+                buckets.setdefault(row['rarity'], []).append(row)
+            self._rarity_buckets = buckets
+        return self._rarity_buckets.get(rarity, [])
+
+    def anime_bucket(self, anime: str) -> List[Dict]:
+        """Rows from one anime/region, in id order."""
+        if self._anime_buckets is None:
+            buckets: Dict[str, List[Dict]] = {}
+            for row in self.rows:
+                buckets.setdefault(row.get('anime') or UNKNOWN_ANIME, []).append(row)
+            self._anime_buckets = buckets
+        return self._anime_buckets.get(anime, [])
+
+    def anime_counts(self, rarity: Optional[str] = None) -> Dict[str, int]:
+        """Owned copies per anime, optionally within one rarity."""
+        counts = self._anime_counts.get(rarity)
+        if counts is None:
+            counts = {}
+            for row in self.rarity_bucket(rarity):
+                anime = row.get('anime', UNKNOWN_ANIME)
+                counts[anime] = counts.get(anime, 0) + max(1, row.get('count', 1))
+            self._anime_counts[rarity] = counts
+        return counts
+
+    def ordered(self, sort_by: Optional[str] = None, rarity: Optional[str] = None) -> List[Dict]:
+        """Rows filtered by ``rarity`` and sorted by ``sort_by``; built once per combination."""
+        if sort_by not in (SORT_RARITY, SORT_NAME, SORT_ANIME_COUNT, SORT_ANIME_ALPHA):
+            sort_by = SORT_ID
+        key = (sort_by, rarity or None)
+        order = self._orders.get(key)
+        if order is not None:
+            return order
+
+        rows = self.rarity_bucket(rarity)
+        if sort_by == SORT_ID:
+            order = rows
+        elif sort_by == SORT_RARITY:
+            order = sorted(rows, key=lambda x: _rarity_level(x['rarity']), reverse=True)
+        elif sort_by == SORT_NAME:
+            order = sorted(rows, key=lambda x: (x.get('name') or '').lower())
+        elif sort_by == SORT_ANIME_COUNT:
+            counts = self.anime_counts(rarity)
+            # Most-owned anime first, then anime name, then character name
+            order = sorted(rows, key=lambda x: (
+                -counts.get(x.get('anime', UNKNOWN_ANIME), 0),
+                (x.get('anime') or UNKNOWN_ANIME).lower(),
+                (x.get('name') or '').lower()
+            ))
+        else:
+            order = sorted(rows, key=lambda x: (
+                (x.get('anime') or UNKNOWN_ANIME).lower(),
+                (x.get('name') or '').lower()
+            ))
+        self._orders[key] = order
+        return order
+
+    def page(self, page: int, per_page: int, sort_by: Optional[str] = None,
+             rarity: Optional[str] = None) -> tuple:
+        """Return ``(items, page, total_pages)`` with ``page`` clamped into range."""
+        order = self.ordered(sort_by, rarity)
+        total_pages = max(1, (len(order) + per_page - 1) // per_page)
+        page = max(1, min(page, total_pages))
+        start = (page - 1) * per_page
+        return order[start:start + per_page], page, total_pages
+
+    def random_row(self) -> Optional[Dict]:
+        return random.choice(self.rows) if self.rows else None
+
+
+class CollectionViewCache:
+    """LRU cache of CollectionView objects, invalidated on ownership changes"""
+
+    def __init__(self, maxsize: int = VIEW_CACHE_SIZE):
+        self._views: LRUCache = LRUCache(maxsize=maxsize)
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stale': 0,
+            'invalidations': 0,
+        }
+
+    async def get(self, db, user_id: int, characters: Optional[Sequence[int]] = None) -> CollectionView:
+        """Return the user's view, loading it with one ``get_user_collection`` call on a miss.
+
+        When ``characters`` (the user's raw id array) is given, a cached view built
+        from a different array is treated as stale and rebuilt.
+        """
+        fingerprint = _fingerprint(characters) if characters is not None else None
+        view = self._views.get(user_id)
+        if view is not None:
+            if fingerprint is None or view.fingerprint == fingerprint:
+                self.stats['hits'] += 1
+                return view
+            self.stats['stale'] += 1
+        else:
+            self.stats['misses'] += 1
+
+        rows = await db.get_user_collection(user_id)
+        view = CollectionView(user_id, rows, fingerprint)
+        self._views[user_id] = view
+        return view
+
+    def peek(self, user_id: int) -> Optional[CollectionView]:
+        return self._views.get(user_id)
+
+    def invalidate(self, user_id: int):
+        if self._views.pop(user_id, None) is not None:
+            self.stats['invalidations'] += 1
+
+    def clear(self):
+        self._views.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['cached'] = len(self._views)
+        return stats
+
+
+# Global instance
+collection_views = CollectionViewCache()
+
+
+def get_collection_view_cache() -> CollectionViewCache:
+    """Get the process-wide collection view cache"""
+    return collection_views
+
+
+async def get_collection_view(db, user_id: int, characters: Optional[Sequence[int]] = None) -> CollectionView:
+    """Get (or build) a user's collection view"""
+    return await collection_views.get(db, user_id, characters)
+
+
+def invalidate_collection_view(user_id: int):
+    """Drop a user's view after their characters change"""
+    collection_views.invalidate(user_id)
+
+
+def invalidate_all_collection_views():
+    """Drop every view, e.g. after a catalog-wide character change"""
+    collection_views.clear()
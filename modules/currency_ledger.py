@@ -0,0 +1,127 @@
+"""
+Currency ledger.
+
+Wallet, bank and shard changes go through ``PostgresDatabase.credit``,
+``debit``, ``transfer``, ``move_currency`` and ``apply_currency``. Each one
+is a single guarded ``UPDATE ... RETURNING``, so concurrent commands can't
+lose updates and a debit can't overdraw. This module records those mutations
+in ``currency_ledger``.
+
+Entries are buffered in memory and written in batches by a background
+flusher, so the ledger adds no round trip to the command that moved the
+money. A failed flush keeps its entries for the next attempt, up to
+``MAX_BUFFER``. ``close()`` writes whatever is left at shutdown.
+"""
+
+import asyncio
+import logging
+import time
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CURRENCIES = ('wallet', 'bank', 'shards')
+
+FLUSH_INTERVAL = 2.0  # seconds
+FLUSH_BATCH = 500  # entries that trigger an early flush
+MAX_BUFFER = 50000  # entries kept while the database is unreachable
+
+# (user_id, currency, delta, balance, reason, counterparty, created_at)
+LedgerEntry = Tuple[int, str, int, Optional[int], str, Optional[int], float]
+
+
+class CurrencyLedger:
+    """Buffers ledger entries and writes them with one INSERT per batch"""
+
+    def __init__(self):
+        self._buffer: List[LedgerEntry] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self.stats = {
+            'recorded': 0,
+            'written': 0,
+            'flushes': 0,
+            'failed_flushes': 0,
+            'dropped': 0,
+        }
+
+    def record(self, user_id: int, currency: str, delta: int, balance: Optional[int],
+               reason: str, counterparty: Optional[int] = None):
+        """Queue one entry; ``balance`` is the balance after the change."""
+        if not delta:
+            return
+        self._buffer.append((user_id, currency, delta, balance, (reason or 'unknown')[:32], counterparty, time.time()))
+        self.stats['recorded'] += 1
+        self._ensure_flusher()
+        if len(self._buffer) >= FLUSH_BATCH and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_flusher(self):
+        if self._flusher is not None and not self._flusher.done():
+            return
+        try:
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+        except RuntimeError:
+            # No running loop (scripts); entries are written on the next explicit flush()
+            self._flusher = None
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write buffered entries now; returns how many were written."""
+        if not self._buffer:
+            return 0
+        entries, self._buffer = self._buffer, []
+        try:
+            from modules.postgres_database import get_database
+            await get_database().insert_ledger_entries(entries)
+        except Exception as e:
+            self.stats['failed_flushes'] += 1
+            logger.error(f"Error writing {len(entries)} currency ledger entries: {e}")
+            # Put them back in front of anything recorded meanwhile, within the cap
+            pending = entries + self._buffer
+            overflow = max(0, len(pending) - MAX_BUFFER)
+            self._buffer = pending[overflow:]
+            self.stats['dropped'] += overflow
+            return 0
+        self.stats['flushes'] += 1
+        self.stats['written'] += len(entries)
+        return len(entries)
+
+    async def close(self):
+        """Stop the background flusher and write the remaining entries."""
+        if self._flusher is not None and not self._flusher.done():
+            # Let the flusher finish the batch it may be writing rather than cancel it mid-flush
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await self._flusher
+            finally:
+                self._stopping = False
+        self._flusher = None
+        await self.flush()
+        if self._buffer:
+            logger.error(f"{len(self._buffer)} currency ledger entries could not be written at shutdown")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['pending'] = len(self._buffer)
+        return stats
+
+
+# Global instance
+currency_ledger = CurrencyLedger()
+
+
+def get_currency_ledger() -> CurrencyLedger:
+    """Get the process-wide currency ledger"""
+    return currency_ledger
@@ -4,6 +4,7 @@ from pyrogram.types import Message, CallbackQuery
 from config import OWNER_ID
 from datetime import datetime, timezone
 from .postgres_database import get_database
+from .user_cache import user_cache
 from pyrogram.enums import ChatMemberStatus
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -228,6 +229,11 @@ def auto_register_user(func):
                             'shards': 0  # 🎐 Shards currency
                         }
                         await db.add_user(user_data)
+                    elif (existing_user.get('first_name') != user.first_name
+                          or existing_user.get('username') != user.username):
+                        # Keep stored names fresh for leaderboards and collector lists
+                        await db.sync_user_profile(user.id, user.username, user.first_name, user.last_name)
+                    user_cache.observe(user)
             except Exception as db_error:
                 # If database is not initialized, just continue without registration
                 print(f"Database not ready for auto-registration: {db_error}")
@@ -1,5 +1,4 @@
 import asyncio
-import aiohttp
 from collections import defaultdict, deque
 from datetime import datetime, timedelta
 from functools import lru_cache
@@ -34,7 +33,10 @@ from modules.postgres_database import (
 )
 
 from .decorators import admin_only, check_banned, is_og, is_owner, is_sudo
+from .drop_warmup import drop_warmup
+from .http_client import http_client
 from .logging_utils import send_drop_log
+from .media_utils import send_character_media
 from .tdgoal import track_collect_drop
 from config import TOKEN
 
@@ -53,11 +55,10 @@ async def add_collection_reaction(client: Client, message: Message):
             "reaction": [{"type": "emoji", "emoji": "⚡️"}]
         }
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data) as response:
-                result = await response.json()
-                if not result.get('ok'):
-                    print(f"Reaction API error: {result.get('description', 'Unknown error')}")
+        response = await http_client.post(url, json=data, retries=0, timeout=10)
+        result = response.json()
+        if not result.get('ok'):
+            print(f"Reaction API error: {result.get('description', 'Unknown error')}")
                     
     except Exception as e:
         # Silently ignore reaction errors to avoid disrupting the collection process
@@ -206,8 +207,6 @@ async def validate_drops_on_startup():
 # Note: validate_drops_on_startup is now async and will be called during bot startup
 
 # Drop management variables
-# Preloaded next character queue per chat with size limit
-preloaded_next_character = defaultdict(lambda: deque(maxlen=5))  # Added size limit
 collect_locks = defaultdict(asyncio.Lock)
 # Add collection locks to prevent race conditions during character collection
 collection_locks = defaultdict(asyncio.Lock)
@@ -281,12 +280,7 @@ async def jackpot_command(client: Client, message: Message):
     # Add shards to user (update shards only)
     try:
         shards_amount = jackpot['amount']
-        # For PostgreSQL, use the proper update method
-        async with db.pool.acquire() as conn:
-            await conn.execute(
-                "UPDATE users SET shards = shards + $1 WHERE user_id = $2",
-                shards_amount, user_id
-            )
+        await db.credit(user_id, 'shards', shards_amount, 'jackpot')
         # Log jackpot claim action
         await db.log_user_transaction(user_id, "jackpot_claim", {
             "amount": shards_amount,
@@ -450,7 +444,7 @@ async def handle_message(client: Client, message: Message):
         # Debug log removed
 
 async def process_drop(chat_id, client, current_time):
-    """Process character drop, using preloaded character queue if available"""
+    """Process character drop, using the group's warmed-up queue if available"""
     # Debug log removed
     try:
         db = get_database()
@@ -461,30 +455,18 @@ async def process_drop(chat_id, client, current_time):
             drop_settings = {}
         locked_rarities = drop_settings.get('locked_rarities', []) if drop_settings else []
         
-        # Use preloaded character from queue if available
-        queue = preloaded_next_character[chat_id]
-        if queue:
-            character = queue.pop(0)
+        # Prepared drops were already checked against the daily limit and had their media resolved
+        prepared = drop_warmup.take(chat_id, locked_rarities)
+        if prepared is not None:
+            character, media = prepared.character, (prepared.media, prepared.from_ref)
         else:
-            drop_manager = DropManager(db)
-            character = await drop_manager.get_random_character(locked_rarities)
+            character, media = await drop_warmup.pick_now(locked_rarities), None
+        drop_warmup.schedule_refill(chat_id)
         
         if character:
-            # Debug log removed
-            # Check daily limit
-            rarity = character['rarity']
-            try:
-                daily_drops = await db.get_daily_drops(rarity)
-                daily_limit = drop_settings.get('daily_limits', {}).get(rarity)
-                if daily_limit is not None and daily_drops >= daily_limit:
-                    # Debug log removed
-                    return
-            except:
-                pass  # Skip daily limit check if not available
-            
             # Send drop message
             # Debug log removed
-            await send_drop_message(client, chat_id, character, current_time)
+            await send_drop_message(client, chat_id, character, current_time, media)
         else:
             # Debug log removed
             return
@@ -492,8 +474,8 @@ async def process_drop(chat_id, client, current_time):
         print(f"Error in process_drop for chat {chat_id}: {e}")
         return
 
-async def send_drop_message(client, chat_id, character, current_time):
-    """Send drop message"""
+async def send_drop_message(client, chat_id, character, current_time, media=None):
+    """Send drop message; ``media`` is a ``(media, from_ref)`` pair resolved when the drop was prepared"""
     try:
         caption = random.choice(DROP_CAPTIONS)
         
@@ -502,23 +484,15 @@ async def send_drop_message(client, chat_id, character, current_time):
             [InlineKeyboardButton("🔍 CHECK DETAILS IN DM", url=f"https://t.me/{BOT_USERNAME}?start=details_{character['character_id']}")]
         ])
         
-        if character.get('is_video', False):
-            # For video characters, prefer img_url (Cloudinary URL) over file_id
-            video_source = character.get('img_url') or character.get('file_id')
-            drop_message = await client.send_video(
-                chat_id=chat_id,
-                video=video_source,
-                caption=caption,
-                reply_markup=keyboard
-            )
-        else:
-            photo = character.get('img_url') or character.get('file_id')
-            drop_message = await client.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=caption,
-                reply_markup=keyboard
-            )
+        # Sent from the cached Telegram file_id when known, else from img_url
+        drop_message = await send_character_media(
+            client,
+            chat_id,
+            character,
+            caption=caption,
+            resolved=media,
+            reply_markup=keyboard
+        )
         
         # FIXED: Don't expire previous drops - keep them active
         # Store drop info
@@ -640,9 +614,7 @@ async def collect_command(client: Client, message: Message):
                     bonus = None
                     if random.random() < 0.4:
                         bonus = random.randint(30, 50)
-                        user = await db.get_user(user_id)
-                        shards = user.get('shards', 0)
-                        await db.update_user(user_id, {'shards': shards + bonus})
+                        await db.credit(user_id, 'shards', bonus, 'collect_bonus')
                         bonus_text = f"⚡️ <b>Bonus!</b> You received <b>{bonus}</b> extra 🎐 shards for collecting!\n"
                     msg = (
                         f"<b>✅ Look You Collected A</b> <code>{escaped_rarity}</code> <b>Pokémon</b>\n\n"
@@ -765,9 +737,7 @@ async def collect_command(client: Client, message: Message):
                     bonus = None
                     if random.random() < 0.4:
                         bonus = random.randint(30, 50)
-                        user = await db.get_user(user_id)
-                        shards = user.get('shards', 0)
-                        await db.update_user(user_id, {'shards': shards + bonus})
+                        await db.credit(user_id, 'shards', bonus, 'collect_bonus')
                         bonus_text = f"⚡️ <b>Bonus!</b> You received <b>{bonus}</b> extra 🎐 shards for collecting!\n"
                     msg = (
                         f"<b>✅ Look You Collected A</b> <code>{escaped_rarity}</code> <b>Pokémon</b>\n\n"
@@ -1104,26 +1074,19 @@ class DropManager:
             self._last_settings_update = current_time
         return self._drop_settings
 
-    async def _get_characters(self, locked_rarities):
+    async def _get_characters(self):
         """Get characters with caching (Postgres version)"""
         current_time = datetime.now()
         if (self._characters_cache is None or 
             self._last_characters_update is None or 
             (current_time - self._last_characters_update).total_seconds() > self._characters_cache_time):
             
-            # Fetch all characters not in locked rarities
+            # Fetch all characters; locked rarities are skipped when picking so the cache can be shared
             try:
                 async with self.db.pool.acquire() as conn:
-                    
-                    if locked_rarities:
-                        rows = await conn.fetch(
-                            "SELECT character_id, name, rarity, file_id, img_url, is_video, anime, type FROM characters WHERE rarity != ALL($1)",
-                            locked_rarities
-                        )
-                    else:
-                        rows = await conn.fetch(
-                            "SELECT character_id, name, rarity, file_id, img_url, is_video, anime, type FROM characters"
-                        )
+                    rows = await conn.fetch(
+                        "SELECT character_id, name, rarity, file_id, img_url, is_video, anime, type FROM characters"
+                    )
                     
                 # Group by rarity
                 rarity_groups = {}
@@ -1148,10 +1111,17 @@ class DropManager:
         
         return self._characters_cache
 
-    async def get_random_character(self, locked_rarities=None):
-        """Get random character from database, respecting locked rarities and weights"""
+    async def get_random_character(self, locked_rarities=None, reserved=None, count_drop=True):
+        """Get random character from database, respecting locked rarities and weights.
+
+        ``reserved`` maps rarity to drops already promised but not yet counted
+        (the warm-up queue); with ``count_drop=False`` the daily counter is left
+        for the caller to bump when the drop actually goes out.
+        """
         if locked_rarities is None:
             locked_rarities = []
+        if reserved is None:
+            reserved = {}
         
         try:
             # Get drop settings with caching
@@ -1165,7 +1135,7 @@ class DropManager:
             daily_drops = settings.get('daily_drops', {})
             
             # Get characters with caching
-            rarity_groups = await self._get_characters(locked_rarities)
+            rarity_groups = await self._get_characters()
             
             if not rarity_groups:
                 return None
@@ -1176,12 +1146,12 @@ class DropManager:
                 rarity = group['_id']
                 base_weight = rarity_weights.get(rarity, 0)
                 
-                # Skip rarities with weight 0 or reached daily limit
-                if base_weight <= 0:
+                # Skip locked rarities, rarities with weight 0 or reached daily limit
+                if base_weight <= 0 or rarity in locked_rarities:
                     continue
                 
                 daily_limit = daily_limits.get(rarity)
-                current_drops = daily_drops.get(rarity, 0)
+                current_drops = daily_drops.get(rarity, 0) + reserved.get(rarity, 0)
                 
                 if daily_limit is not None and current_drops >= daily_limit:
                     continue
@@ -1205,10 +1175,11 @@ class DropManager:
             selected_character = random.choice(characters)
             
             # Update daily drops counter asynchronously
-            try:
-                asyncio.create_task(self.db.increment_daily_drops(selected_rarity))
-            except Exception as e:
-                print(f"Error updating daily drops: {e}")
+            if count_drop:
+                try:
+                    asyncio.create_task(self.db.increment_daily_drops(selected_rarity))
+                except Exception as e:
+                    print(f"Error updating daily drops: {e}")
             
             return selected_character
             
@@ -1236,22 +1207,6 @@ async def remove_drop_after_timeout(chat_id, message_id):
     return
         
 
-async def preload_next_characters(chat_id, locked_rarities, n=3):
-    try:
-        db = get_database()
-        drop_manager = DropManager(db)
-        queue = preloaded_next_character[chat_id]
-        while len(queue) < n:
-            character = await drop_manager.get_random_character(locked_rarities)
-            if character:
-                queue.append(character)
-            else:
-                break
-    except Exception as e:
-        print(f"Error in preload_next_characters for chat {chat_id}: {e}")
-        # import traceback
-        # traceback.print_exc()
-
 @Client.on_message(filters.command("setalldroptime", prefixes=["/", ".", "!"]))
 async def set_all_droptime_command(client: Client, message: Message):
     user_id = message.from_user.id
@@ -1589,9 +1544,7 @@ async def process_character_collection(client: Client, message: Message, charact
             bonus = None
             if random.random() < 0.4:
                 bonus = random.randint(30, 50)
-                user = await db.get_user(user_id)
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + bonus})
+                await db.credit(user_id, 'shards', bonus, 'collect_bonus')
                 bonus_text = f"⚡️ <b>Bonus!</b> You received <b>{bonus}</b> extra 🎐 shards for collecting!\n"
             
             msg = (
@@ -1660,9 +1613,8 @@ async def clear_cache_command(client: Client, message: Message):
         from modules.postgres_database import clear_all_caches
         clear_all_caches()
         
-        # Clear the DropManager cache by resetting the class cache
-        DropManager._characters_cache = None
-        DropManager._last_characters_update = None
+        # Drop prepared drops and the shared DropManager's character cache
+        drop_warmup.clear()
         
         await message.reply_text("✅ <b>All caches have been cleared! Fresh data will be fetched from the database.</b>")
         
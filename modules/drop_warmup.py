@@ -0,0 +1,315 @@
+"""
+Drop warm-up queue.
+
+When a group's message counter fired, the drop path picked a character
+(loading the whole catalog through a fresh DropManager), checked the daily
+limit, looked up the media reference, and only then sent. The old
+``preloaded_next_character`` deque that was meant to skip this was never
+filled.
+
+``DropWarmup`` keeps the next few drops per active group ready in the
+background:
+
+- each character is chosen by the shared drop sampler;
+- a slot is reserved against its rarity's daily limit, so queued drops
+  across all groups can't overshoot the limit;
+- its media is resolved to a stored Telegram file_id, or to a URL that
+  passed a HEAD check.
+
+When the counter fires, ``process_drop`` takes the next prepared drop and
+commits its reservation, and ``send_drop_message`` sends the media resolved
+here.
+
+Prepared drops expire once they have waited a few of the group's own drop
+intervals (within fixed bounds), so busy groups churn their queue quickly
+while slower groups still get to use theirs. A background sweep releases
+expired drops and their reservations even in groups that stopped dropping,
+so a quiet group can't starve a rarity's daily limit. The sampler's
+catalog cache is keyed to the search index generation, so it reloads after
+any change to the characters table. A drop prepared before such a change is
+checked against the rebuilt index when it is taken. Rarities locked after a
+drop was prepared are skipped too.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, Iterable, Optional
+
+from cachetools import TTLCache
+
+from modules.http_client import http_client
+from modules.media_refs import media_refs
+from modules.postgres_database import get_database
+from modules.search_index import get_search_index
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_DEPTH = 3  # prepared drops kept per group
+PREPARED_MIN_AGE = 120  # seconds a prepared drop (and its reservation) is held at least
+PREPARED_MAX_AGE = 1800  # seconds a prepared drop is held at most, however slowly its group drops
+INTERVAL_SMOOTHING = 0.3  # weight of the newest gap in a group's average drop interval
+IDLE_GROUP_TTL = 3600  # seconds without a drop before a group is forgotten
+SWEEP_INTERVAL = 30  # seconds between sweeps for expired drops and idle groups
+MAX_PICK_ATTEMPTS = 5  # extra picks allowed per refill when media checks fail
+
+# Fields that must be unchanged for a drop prepared before a catalog change to be used
+CHECKED_FIELDS = ('name', 'rarity', 'anime', 'file_id', 'img_url', 'is_video')
+
+# Media URL checks
+URL_CHECK_TTL = 3600  # seconds a HEAD result is trusted
+URL_CHECK_TIMEOUT = 10  # seconds
+BROKEN_URL_STATUSES = {404, 410}
+
+
+@dataclass
+class PreparedDrop:
+    character: Dict
+    rarity: str
+    media: Optional[str]
+    from_ref: bool
+    generation: int = 0  # search index generation the character was read at
+    max_age: float = PREPARED_MIN_AGE
+    prepared_at: float = field(default_factory=time.time)
+
+    def is_stale(self) -> bool:
+        return time.time() - self.prepared_at > self.max_age
+
+
+class DropWarmup:
+    """Per-group queues of pre-selected drops with daily-limit reservations"""
+
+    def __init__(self, depth: int = PREFETCH_DEPTH):
+        self.depth = depth
+        self._queues: Dict[int, Deque[PreparedDrop]] = {}
+        self._reserved: Dict[str, int] = {}
+        self._refills: Dict[int, asyncio.Task] = {}
+        self._last_used: Dict[int, float] = {}
+        self._intervals: Dict[int, float] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+        self._url_checks: TTLCache = TTLCache(maxsize=5000, ttl=URL_CHECK_TTL)
+        self._sampler = None
+        self._sampler_generation = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'prepared': 0,
+            'discarded': 0,
+            'changed': 0,
+            'broken_media': 0,
+        }
+
+    def sampler(self):
+        """Shared DropManager, so its catalog cache survives between drops"""
+        if self._sampler is None:
+            from modules.drop import DropManager
+            self._sampler = DropManager(get_database())
+            # Daily counters must be current for reservations; the database layer caches settings itself
+            self._sampler._settings_cache_time = 0
+        generation = get_search_index().generation
+        if generation != self._sampler_generation:
+            # The catalog changed since the cache was filled; reload it on the next pick
+            self._sampler._characters_cache = None
+            self._sampler_generation = generation
+        return self._sampler
+
+    @property
+    def reserved(self) -> Dict[str, int]:
+        return dict(self._reserved)
+
+    def _reserve(self, rarity: str):
+        self._reserved[rarity] = self._reserved.get(rarity, 0) + 1
+
+    def _release(self, prepared: PreparedDrop):
+        left = self._reserved.get(prepared.rarity, 0) - 1
+        if left > 0:
+            self._reserved[prepared.rarity] = left
+        else:
+            self._reserved.pop(prepared.rarity, None)
+
+    def _note_drop(self, chat_id: int):
+        now = time.time()
+        last = self._last_used.get(chat_id)
+        if last is not None and now - last < IDLE_GROUP_TTL:
+            gap = now - last
+            average = self._intervals.get(chat_id)
+            self._intervals[chat_id] = gap if average is None else average + INTERVAL_SMOOTHING * (gap - average)
+        self._last_used[chat_id] = now
+
+    def max_age(self, chat_id: int) -> float:
+        """How long a drop prepared now for a group may wait: the whole queue plus one interval of slack."""
+        interval = self._intervals.get(chat_id)
+        if interval is None:
+            return PREPARED_MIN_AGE
+        return min(PREPARED_MAX_AGE, max(PREPARED_MIN_AGE, interval * (self.depth + 1)))
+
+    def take(self, chat_id: int, locked_rarities: Iterable[str] = ()) -> Optional[PreparedDrop]:
+        """Pop the next usable prepared drop for a group and count it against the daily limit."""
+        self._note_drop(chat_id)
+        locked = set(locked_rarities or ())
+        queue = self._queues.get(chat_id)
+        while queue:
+            prepared = queue.popleft()
+            self._release(prepared)
+            if prepared.is_stale() or prepared.rarity in locked:
+                self.stats['discarded'] += 1
+                continue
+            if not self._still_current(prepared):
+                self.stats['changed'] += 1
+                continue
+            self.stats['hits'] += 1
+            try:
+                asyncio.create_task(get_database().increment_daily_drops(prepared.rarity))
+            except Exception as e:
+                logger.warning(f"Error updating daily drops: {e}")
+            return prepared
+        self.stats['misses'] += 1
+        return None
+
+    def _still_current(self, prepared: PreparedDrop) -> bool:
+        """Whether a drop prepared before a catalog change still matches the catalog."""
+        index = get_search_index()
+        if prepared.generation == index.generation:
+            return True
+        if not index.ready:
+            # Not rebuilt yet, so the character can't be checked; pick a fresh one instead
+            return False
+        row = index.get(prepared.character.get('character_id'))
+        if row is None:
+            return False
+        return all(row.get(key) == prepared.character.get(key) for key in CHECKED_FIELDS if key in row)
+
+    async def pick_now(self, locked_rarities: Iterable[str] = ()) -> Optional[Dict]:
+        """Pick and count a drop on the spot when a group's queue is empty."""
+        character = await self.sampler().get_random_character(list(locked_rarities or ()), reserved=self._reserved)
+        return dict(character) if character else None
+
+    def schedule_refill(self, chat_id: int):
+        """Top up a group's queue in the background."""
+        self._last_used.setdefault(chat_id, time.time())
+        self._ensure_sweeper()
+        task = self._refills.get(chat_id)
+        if task is not None and not task.done():
+            return
+        self._refills[chat_id] = asyncio.create_task(self._refill(chat_id))
+
+    async def _refill(self, chat_id: int):
+        try:
+            db = get_database()
+            settings = await db.get_drop_settings() or {}
+            locked = settings.get('locked_rarities', [])
+            queue = self._queues.setdefault(chat_id, deque())
+            sampler = self.sampler()
+            generation = self._sampler_generation
+            attempts = 0
+            while len(queue) < self.depth and attempts < self.depth + MAX_PICK_ATTEMPTS:
+                attempts += 1
+                character = await sampler.get_random_character(locked, reserved=self._reserved, count_drop=False)
+                if not character:
+                    break
+                character = dict(character)
+                media, from_ref = await media_refs.resolve(character)
+                if not from_ref and not await self._media_reachable(media):
+                    self.stats['broken_media'] += 1
+                    logger.warning(f"Skipping drop of character {character.get('character_id')}: media unreachable")
+                    continue
+                self._reserve(character['rarity'])
+                queue.append(PreparedDrop(character, character['rarity'], media, from_ref, generation,
+                                          self.max_age(chat_id)))
+                self.stats['prepared'] += 1
+        except Exception as e:
+            logger.error(f"Error warming drops for chat {chat_id}: {e}")
+        finally:
+            if self._refills.get(chat_id) is asyncio.current_task():
+                del self._refills[chat_id]
+
+    async def _media_reachable(self, url: Optional[str]) -> bool:
+        if not url:
+            return False
+        if not url.startswith('http'):
+            # A bare Telegram file_id; nothing to check over HTTP
+            return True
+        cached = self._url_checks.get(url)
+        if cached is not None:
+            return cached
+        try:
+            response = await http_client.request('HEAD', url, retries=0, timeout=URL_CHECK_TIMEOUT, allow_redirects=True)
+            ok = response.status not in BROKEN_URL_STATUSES
+        except Exception as e:
+            # Network trouble is not proof the file is gone; let the send decide
+            logger.debug(f"HEAD check failed for {url}: {e}")
+            return True
+        self._url_checks[url] = ok
+        return ok
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None and not self._sweeper.done():
+            return
+        try:
+            self._sweeper = asyncio.get_running_loop().create_task(self._run_sweeper())
+        except RuntimeError:
+            self._sweeper = None
+
+    async def _run_sweeper(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping prepared drops: {e}")
+
+    def sweep(self):
+        """Release expired prepared drops and forget groups that stopped dropping."""
+        now = time.time()
+        for chat_id, last_used in list(self._last_used.items()):
+            if now - last_used > IDLE_GROUP_TTL:
+                self.discard(chat_id)
+        for queue in self._queues.values():
+            fresh = [prepared for prepared in queue if not prepared.is_stale()]
+            if len(fresh) == len(queue):
+                continue
+            for prepared in queue:
+                if prepared.is_stale():
+                    self._release(prepared)
+                    self.stats['discarded'] += 1
+            queue.clear()
+            queue.extend(fresh)
+
+    def discard(self, chat_id: int):
+        """Release a group's prepared drops."""
+        task = self._refills.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+        for prepared in self._queues.pop(chat_id, ()):
+            self._release(prepared)
+        self._last_used.pop(chat_id, None)
+        self._intervals.pop(chat_id, None)
+
+    def clear(self):
+        """Drop every prepared drop and the sampler's catalog cache."""
+        for task in self._refills.values():
+            task.cancel()
+        self._refills.clear()
+        self._queues.clear()
+        self._reserved.clear()
+        self._last_used.clear()
+        self._intervals.clear()
+        self._sampler = None
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['groups'] = len(self._queues)
+        stats['queued'] = sum(len(q) for q in self._queues.values())
+        stats['reserved'] = sum(self._reserved.values())
+        return stats
+
+
+# Global instance
+drop_warmup = DropWarmup()
+
+
+def get_drop_warmup() -> DropWarmup:
+    """Get the process-wide drop warm-up queue"""
+    return drop_warmup
@@ -5,6 +5,9 @@ from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from modules.postgres_database import get_database, get_postgres_pool
 from modules.decorators import auto_register_user
+from modules.lock_manager import user_lock
+from modules.currency_ledger import currency_ledger
+from cachetools import LRUCache
 import re
 
 # Exchange constants
@@ -12,39 +15,44 @@ TOKENS_PER_SHARD = 35  # 1 shard = 35 tokens
 DAILY_EXCHANGE_LIMIT = 3000000  # 30 lakh tokens = 3,000,000 tokens
 MAX_SHARDS_PER_DAY = DAILY_EXCHANGE_LIMIT // TOKENS_PER_SHARD  # 85,714 shards max per day
 
+# user_id -> (UTC day, tokens exchanged that day); the exchange_quota row is authoritative
+_daily_exchanged = LRUCache(maxsize=10000)
+
+# Check the quota, debit tokens, credit shards and log history in one statement. The user row
+# is locked first, so concurrent exchanges by the same user apply one after the other.
+EXCHANGE_SQL = '''
+    WITH u AS (
+        SELECT COALESCE(wallet, 0) AS wallet FROM users WHERE user_id = $1 FOR UPDATE
+    ), quota AS (
+        INSERT INTO exchange_quota AS q (user_id, day, tokens)
+        SELECT $1, $4, $2 FROM u WHERE u.wallet >= $2 AND $2 <= $5
+        ON CONFLICT (user_id, day) DO UPDATE SET tokens = q.tokens + EXCLUDED.tokens
+        WHERE q.tokens + EXCLUDED.tokens <= $5
+        RETURNING tokens
+    ), debit AS (
+        UPDATE users SET wallet = COALESCE(wallet, 0) - $2, shards = COALESCE(shards, 0) + $3
+        WHERE user_id = $1 AND EXISTS (SELECT 1 FROM quota)
+        RETURNING COALESCE(wallet, 0) AS wallet, COALESCE(shards, 0) AS shards
+    ), logged AS (
+        INSERT INTO exchange_history (user_id, tokens_spent, shards_received)
+        SELECT $1, $2, $3 FROM debit
+    )
+    SELECT (SELECT wallet FROM u) AS wallet_before,
+           (SELECT tokens FROM quota) AS daily_exchanged,
+           (SELECT tokens FROM exchange_quota WHERE user_id = $1 AND day = $4) AS daily_before,
+           debit.wallet, debit.shards
+    FROM (SELECT 1) AS one
+    LEFT JOIN debit ON TRUE
+'''
+
+
+def _quota_day():
+    return datetime.utcnow().date()
+
+
 class ExchangeManager:
     """Manages token to shard exchanges"""
     
-    # Class-level locks dictionary for per-user concurrency control
-    _user_locks = {}
-    _locks_lock = asyncio.Lock()  # Protects the _user_locks dictionary itself
-    
-    @classmethod
-    async def get_user_lock(cls, user_id: int) -> asyncio.Lock:
-        """Get or create a lock for a specific user"""
-        async with cls._locks_lock:
-            if user_id not in cls._user_locks:
-                cls._user_locks[user_id] = asyncio.Lock()
-            return cls._user_locks[user_id]
-    
-    @classmethod
-    async def cleanup_old_locks(cls, max_locks: int = 1000):
-        """Clean up old locks to prevent memory leaks"""
-        async with cls._locks_lock:
-            if len(cls._user_locks) > max_locks:
-                # Remove locks that are not currently acquired
-                to_remove = []
-                for user_id, lock in cls._user_locks.items():
-                    if not lock.locked():
-                        to_remove.append(user_id)
-                        if len(to_remove) >= len(cls._user_locks) - max_locks:
-                            break
-                
-                for user_id in to_remove:
-                    del cls._user_locks[user_id]
-                
-                print(f"Cleaned up {len(to_remove)} unused exchange locks")
-    
     @staticmethod
     async def ensure_exchange_table():
         """Create the exchange_history table if it doesn't exist"""
@@ -67,7 +75,24 @@ class ExchangeManager:
                     
                     CREATE INDEX IF NOT EXISTS idx_exchange_user_date 
                     ON exchange_history(user_id, exchange_date);
+
+                    CREATE TABLE IF NOT EXISTS exchange_quota (
+                        user_id BIGINT NOT NULL,
+                        day DATE NOT NULL,
+                        tokens BIGINT NOT NULL DEFAULT 0,
+                        PRIMARY KEY (user_id, day)
+                    );
                 ''')
+                # Carry today's exchanges over from before the quota table existed
+                await conn.execute('''
+                    INSERT INTO exchange_quota (user_id, day, tokens)
+                    SELECT user_id, $1::date, SUM(tokens_spent)
+                    FROM exchange_history
+                    WHERE exchange_date >= $1::date
+                    GROUP BY user_id
+                    ON CONFLICT (user_id, day) DO NOTHING
+                ''', _quota_day())
+                await conn.execute("DELETE FROM exchange_quota WHERE day < $1::date - 7", _quota_day())
                 print("Exchange history table ensured")
                 return True
         except Exception as e:
@@ -76,22 +101,23 @@ class ExchangeManager:
     
     @classmethod
     async def get_user_daily_exchange(cls, user_id: int) -> int:
-        """Get the total tokens exchanged by user today with optional locking"""
+        """Get the total tokens exchanged by user today (UTC day)"""
+        day = _quota_day()
+        cached = _daily_exchanged.get(user_id)
+        if cached and cached[0] == day:
+            return cached[1]
         try:
             pool = get_postgres_pool()
             if not pool:
                 return 0
                 
             async with pool.acquire() as conn:
-                # Get tokens exchanged in the last 24 hours
-                row = await conn.fetchrow('''
-                    SELECT COALESCE(SUM(tokens_spent), 0) as total_tokens
-                    FROM exchange_history 
-                    WHERE user_id = $1 
-                    AND exchange_date >= NOW() - INTERVAL '24 hours'
-                ''', user_id)
-                
-                return int(row['total_tokens']) if row else 0
+                tokens = await conn.fetchval(
+                    "SELECT tokens FROM exchange_quota WHERE user_id = $1 AND day = $2", user_id, day
+                )
+            tokens = int(tokens or 0)
+            _daily_exchanged[user_id] = (day, tokens)
+            return tokens
         except Exception as e:
             print(f"Error getting user daily exchange: {e}")
             return 0
@@ -100,8 +126,7 @@ class ExchangeManager:
     async def get_user_balances(cls, user_id: int, use_lock: bool = False) -> Dict[str, int]:
         """Get user's current token and shard balances with optional locking"""
         if use_lock:
-            user_lock = await cls.get_user_lock(user_id)
-            async with user_lock:
+            async with user_lock('exchange', user_id):
                 return await cls._get_user_balances_unlocked(user_id)
         else:
             return await cls._get_user_balances_unlocked(user_id)
@@ -133,29 +158,13 @@ class ExchangeManager:
     
     @classmethod
     async def execute_exchange(cls, user_id: int, tokens_to_exchange: int) -> Dict[str, Any]:
-        """Execute a token to shard exchange with user-specific locking and retry mechanism"""
-        # Get user-specific lock to prevent concurrent exchanges for the same user
-        user_lock = await cls.get_user_lock(user_id)
-        
+        """Execute a token to shard exchange with a retry mechanism"""
         # Implement retry mechanism for transient failures
         max_retries = 3
         for attempt in range(max_retries):
             try:
-                # Use timeout to prevent indefinite blocking
-                await asyncio.wait_for(user_lock.acquire(), timeout=30.0)
-                try:
-                    return await cls._execute_exchange_locked(user_id, tokens_to_exchange)
-                finally:
-                    user_lock.release()
-            except asyncio.TimeoutError:
-                if attempt == max_retries - 1:
-                    return {
-                        "success": False,
-                        "error": "timeout_error",
-                        "message": "Exchange operation timed out. Please try again later."
-                    }
-                # Wait before retry with exponential backoff
-                await asyncio.sleep(0.5 * (2 ** attempt))
+                # The exchange statement locks the user's row, so no application lock is needed
+                return await cls._execute_exchange_once(user_id, tokens_to_exchange)
             except Exception as e:
                 if attempt == max_retries - 1:
                     return {
@@ -173,8 +182,8 @@ class ExchangeManager:
         }
     
     @staticmethod
-    async def _execute_exchange_locked(user_id: int, tokens_to_exchange: int) -> Dict[str, Any]:
-        """Internal method that executes exchange while already holding user lock"""
+    async def _execute_exchange_once(user_id: int, tokens_to_exchange: int) -> Dict[str, Any]:
+        """Internal method that runs one attempt of the exchange statement"""
         try:
             # Validate exchange amount
             if tokens_to_exchange < TOKENS_PER_SHARD:
@@ -193,6 +202,16 @@ class ExchangeManager:
                 }
             
             shards_to_receive = tokens_to_exchange // TOKENS_PER_SHARD
+            day = _quota_day()
+            
+            # Counters only grow within a day, so a cached total over the limit is final
+            cached = _daily_exchanged.get(user_id)
+            if cached and cached[0] == day and cached[1] + tokens_to_exchange > DAILY_EXCHANGE_LIMIT:
+                return {
+                    "success": False,
+                    "error": "daily_limit_exceeded",
+                    "message": f"Daily exchange limit exceeded. You can exchange {max(0, DAILY_EXCHANGE_LIMIT - cached[1]):,} more tokens today"
+                }
             
             pool = get_postgres_pool()
             if not pool:
@@ -203,66 +222,46 @@ class ExchangeManager:
                 }
             
             async with pool.acquire() as conn:
-                # Start transaction with isolation level for consistency
-                async with conn.transaction(isolation='serializable'):
-                    # Check user balances with row-level locking
-                    user_row = await conn.fetchrow('''
-                        SELECT wallet, shards 
-                        FROM users 
-                        WHERE user_id = $1
-                        FOR UPDATE
-                    ''', user_id)
-                    
-                    if not user_row:
-                        return {
-                            "success": False,
-                            "error": "user_not_found",
-                            "message": "User not found in database"
-                        }
-                    
-                    current_tokens = int(user_row['wallet']) if user_row['wallet'] else 0
-                    current_shards = int(user_row['shards']) if user_row['shards'] else 0
-                    
-                    # Check if user has enough tokens
-                    if current_tokens < tokens_to_exchange:
-                        return {
-                            "success": False,
-                            "error": "insufficient_tokens",
-                            "message": f"You need {tokens_to_exchange:,} tokens but only have {current_tokens:,}"
-                        }
-                    
-                    # Check daily limit
-                    daily_exchanged = await ExchangeManager.get_user_daily_exchange(user_id)
-                    if daily_exchanged + tokens_to_exchange > DAILY_EXCHANGE_LIMIT:
-                        remaining_limit = DAILY_EXCHANGE_LIMIT - daily_exchanged
-                        return {
-                            "success": False,
-                            "error": "daily_limit_exceeded",
-                            "message": f"Daily exchange limit exceeded. You can exchange {remaining_limit:,} more tokens today"
-                        }
-                    
-                    # Update user balances
-                    await conn.execute('''
-                        UPDATE users 
-                        SET wallet = wallet - $1, shards = shards + $2
-                        WHERE user_id = $3
-                    ''', tokens_to_exchange, shards_to_receive, user_id)
-                    
-                    # Record the exchange
-                    await conn.execute('''
-                        INSERT INTO exchange_history (user_id, tokens_spent, shards_received)
-                        VALUES ($1, $2, $3)
-                    ''', user_id, tokens_to_exchange, shards_to_receive)
-                    
+                row = await conn.fetchrow(
+                    EXCHANGE_SQL, user_id, tokens_to_exchange, shards_to_receive, day, DAILY_EXCHANGE_LIMIT
+                )
+            
+            if row['wallet_before'] is None:
+                return {
+                    "success": False,
+                    "error": "user_not_found",
+                    "message": "User not found in database"
+                }
+            
+            if row['wallet'] is None:
+                if row['wallet_before'] < tokens_to_exchange:
                     return {
-                        "success": True,
-                        "tokens_spent": tokens_to_exchange,
-                        "shards_received": shards_to_receive,
-                        "new_token_balance": current_tokens - tokens_to_exchange,
-                        "new_shard_balance": current_shards + shards_to_receive,
-                        "daily_exchanged": daily_exchanged + tokens_to_exchange,
-                        "daily_remaining": DAILY_EXCHANGE_LIMIT - (daily_exchanged + tokens_to_exchange)
+                        "success": False,
+                        "error": "insufficient_tokens",
+                        "message": f"You need {tokens_to_exchange:,} tokens but only have {row['wallet_before']:,}"
                     }
+                daily_exchanged = int(row['daily_before'] or 0)
+                _daily_exchanged[user_id] = (day, daily_exchanged)
+                return {
+                    "success": False,
+                    "error": "daily_limit_exceeded",
+                    "message": f"Daily exchange limit exceeded. You can exchange {max(0, DAILY_EXCHANGE_LIMIT - daily_exchanged):,} more tokens today"
+                }
+            
+            daily_exchanged = int(row['daily_exchanged'])
+            _daily_exchanged[user_id] = (day, daily_exchanged)
+            currency_ledger.record(user_id, 'wallet', -tokens_to_exchange, row['wallet'], 'exchange')
+            currency_ledger.record(user_id, 'shards', shards_to_receive, row['shards'], 'exchange')
+            
+            return {
+                "success": True,
+                "tokens_spent": tokens_to_exchange,
+                "shards_received": shards_to_receive,
+                "new_token_balance": row['wallet'],
+                "new_shard_balance": row['shards'],
+                "daily_exchanged": daily_exchanged,
+                "daily_remaining": DAILY_EXCHANGE_LIMIT - daily_exchanged
+            }
                     
         except Exception as e:
             print(f"Error executing exchange: {e}")
@@ -281,14 +280,6 @@ async def exchange_command(client: Client, message: Message):
     user_id = message.from_user.id
     args = message.text.split()
     
-    # Ensure exchange table exists
-    await exchange_manager.ensure_exchange_table()
-    
-    # Get user balances and daily exchange info with locking for consistency
-    balances = await exchange_manager.get_user_balances(user_id, use_lock=True)
-    daily_exchanged = await exchange_manager.get_user_daily_exchange(user_id)
-    daily_remaining = DAILY_EXCHANGE_LIMIT - daily_exchanged
-    
     # If user provided an amount, try to exchange
     if len(args) > 1:
         try:
@@ -351,6 +342,9 @@ async def exchange_command(client: Client, message: Message):
             return
     
     # Show exchange interface
+    balances = await exchange_manager.get_user_balances(user_id)
+    daily_exchanged = await exchange_manager.get_user_daily_exchange(user_id)
+    daily_remaining = DAILY_EXCHANGE_LIMIT - daily_exchanged
     max_possible_shards = min(balances["tokens"] // TOKENS_PER_SHARD, daily_remaining // TOKENS_PER_SHARD)
     max_possible_tokens = max_possible_shards * TOKENS_PER_SHARD
     
@@ -556,16 +550,4 @@ async def init_exchange_system():
     """Initialize the exchange system"""
     await exchange_manager.ensure_exchange_table()
     
-    # Start periodic lock cleanup task
-    asyncio.create_task(periodic_lock_cleanup())
-    
     print("Exchange system initialized")
-
-async def periodic_lock_cleanup():
-    """Periodic task to clean up unused locks"""
-    while True:
-        try:
-            await asyncio.sleep(3600)  # Run every hour
-            await ExchangeManager.cleanup_old_locks()
-        except Exception as e:
-            print(f"Error in periodic lock cleanup: {e}")
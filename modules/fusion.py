@@ -5,13 +5,10 @@ from modules.sell import SELL_PRICES, get_sell_multiplier
 from modules.trade import action_manager
 from datetime import datetime
 from modules.decorators import check_banned
-import asyncio
+from modules.lock_manager import user_lock
 import random
 import logging
 
-# Async locks for fusion operations
-_fusion_locks = {}
-
 # Fusion configuration
 FUSION_CONFIG = {
     "elite_chance": 0.3,  # 30% chance to get elite card
@@ -47,12 +44,7 @@ async def fuse_command(client: Client, message: Message):
     user_id = message.from_user.id
     db = get_database()
     
-    # Get or create lock for this user
-    if user_id not in _fusion_locks:
-        _fusion_locks[user_id] = asyncio.Lock()
-    lock = _fusion_locks[user_id]
-    
-    async with lock:
+    async with user_lock('fusion', user_id):
         try:
             # Check if user has any active action
             if await action_manager.is_user_busy(db, user_id):
@@ -183,8 +175,7 @@ async def fuse_command(client: Client, message: Message):
                 multiplier = get_sell_multiplier()
                 tokens = int((price1 + price2) * multiplier)
                 
-                wallet = user.get('wallet', 0) + tokens
-                await db.update_user(user_id, {'characters': chars, 'wallet': wallet})
+                await db.apply_currency(user_id, {'wallet': tokens}, 'fusion', set_fields={'characters': chars})
                 
                 # Log transaction
                 await db.log_user_transaction(user_id, "fusion_tokens", {
@@ -211,10 +202,6 @@ async def fuse_command(client: Client, message: Message):
             await message.reply_text("❌ An error occurred during fusion. Please try again!")
             # Clear user action on error
             await action_manager.clear_user_action(db, user_id)
-        finally:
-            # Clean up lock
-            if user_id in _fusion_locks:
-                del _fusion_locks[user_id]
 
 def setup_fusion_handlers(app: Client):
     app.add_handler(filters.command("fuse")(fuse_command))
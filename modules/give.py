@@ -190,40 +190,35 @@ async def massgive_command(client: Client, message: Message):
         except ValueError:
             await message.reply_text(f"❌ <b>Invalid character ID: {cid}</b>")
             return
-    # Get character objects
-    user_data = await db.get_user(user_id)
-    owned_characters = user_data.get('characters', []) if user_data else []
-    owned_counts = {cid: owned_characters.count(cid) for cid in set(owned_characters)}
-    # Build the list of char_ids to gift, up to the number owned for each
-    requested_counts = {cid: char_ids_int.count(cid) for cid in set(char_ids_int)}
-    # Remove the check for insufficient copies
-    # If we reach here, all requests are valid
-    characters = []
+    # Get character objects (one query for all distinct ids)
+    id_to_char = {char['character_id']: char for char in await db.get_characters_by_ids(list(set(char_ids_int)))}
     for cid in char_ids_int:
-        char = await db.get_character(cid)
-        if not char:
+        if cid not in id_to_char:
             await message.reply_text(f"❌ <b>Character not found: {cid}</b>")
             return
-        characters.append(char)
+    characters = [id_to_char[cid] for cid in char_ids_int]
     
     # Check if user is owner - if so, execute directly
     if is_owner(user_id):
         # Execute the action directly for owner
-        now = datetime.utcnow()
-        collection_history = [{
-            'character_id': cid,
-            'collected_at': now.isoformat(),
-            'source': 'give'
-        } for cid in char_ids_int]
-        await db.users.update_one(
-            {'user_id': target_user.id},
-            {
-                '$push': {
-                    'characters': {'$each': char_ids_int},
-                    'collection_history': {'$each': collection_history}
+        if hasattr(db, 'add_characters'):
+            await db.add_characters(target_user.id, char_ids_int, source='give')
+        else:
+            now = datetime.utcnow()
+            collection_history = [{
+                'character_id': cid,
+                'collected_at': now.isoformat(),
+                'source': 'give'
+            } for cid in char_ids_int]
+            await db.users.update_one(
+                {'user_id': target_user.id},
+                {
+                    '$push': {
+                        'characters': {'$each': char_ids_int},
+                        'collection_history': {'$each': collection_history}
+                    }
                 }
-            }
-        )
+            )
         await message.reply_text(f"✅ <b>Characters given to {target_user.first_name}!</b>")
         
         # Send log to both channels
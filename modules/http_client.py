@@ -0,0 +1,286 @@
+"""
+Shared outbound HTTP client.
+
+One aiohttp session is created at startup and reused by every module, so
+requests to PokeAPI, Catbox, ImgBB, Pastebin and the Bot API ride on
+keep-alive connections instead of paying a DNS lookup and TLS handshake per
+call. The client adds per-host concurrency limits, retries with jittered
+exponential backoff and a small opt-in response cache, bounded in bytes,
+that revalidates with ETag/Last-Modified. POSTs are not idempotent: they are
+not retried unless the caller asks, and then only when the request
+can't have reached the server or was explicitly refused (408/429).
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional, Union
+from urllib.parse import urlparse
+
+import aiohttp
+from cachetools import LRUCache
+from multidict import CIMultiDict
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings
+TOTAL_CONNECTION_LIMIT = 100
+DEFAULT_PER_HOST_LIMIT = 10
+DNS_CACHE_TTL = 300  # seconds
+KEEPALIVE_TIMEOUT = 60  # seconds
+DEFAULT_TIMEOUT = 30  # seconds
+
+# Hosts that need a tighter (or looser) cap than DEFAULT_PER_HOST_LIMIT
+HOST_LIMITS = {
+    'pokeapi.co': 16,
+    'catbox.moe': 4,
+    'api.imgbb.com': 4,
+    'api.cloudinary.com': 4,
+    'pastebin.com': 2,
+    'api.telegram.org': 20,
+}
+
+# Retry policy
+DEFAULT_RETRIES = 2
+BACKOFF_BASE = 0.5  # seconds
+BACKOFF_MAX = 8.0  # seconds
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+# Statuses that mean a non-idempotent request was not processed
+SAFE_RETRY_STATUSES = {408, 429}
+
+# Response cache (GET only)
+RESPONSE_CACHE_BYTES = 16 * 1024 * 1024  # total size of cached bodies
+MAX_CACHED_BODY = 512 * 1024  # larger bodies are never cached
+DEFAULT_CACHE_TTL = 3600  # seconds a cached body is served without revalidation
+
+
+class HttpStatusError(Exception):
+    """Raised when a retryable status persists through every attempt"""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} from {url}")
+        self.status = status
+        self.url = url
+
+
+@dataclass
+class HttpResponse:
+    """Fully-read response, safe to use after the connection is released"""
+    status: int
+    headers: CIMultiDict
+    body: bytes
+    url: str
+    from_cache: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self, encoding: str = 'utf-8') -> str:
+        return self.body.decode(encoding, errors='replace')
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+@dataclass
+class _CachedResponse:
+    response: HttpResponse
+    stored_at: float
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    ttl: float = DEFAULT_CACHE_TTL
+    hits: int = field(default=0)
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.stored_at < self.ttl
+
+
+class HttpClient:
+    """Pooled aiohttp session with per-host limits, retries and an ETag-aware cache"""
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._cache: LRUCache = LRUCache(maxsize=RESPONSE_CACHE_BYTES,
+                                         getsizeof=lambda cached: len(cached.response.body) or 1)
+        self._start_lock: Optional[asyncio.Lock] = None
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'errors': 0,
+            'cache_hits': 0,
+            'revalidated': 0,
+        }
+
+    async def start(self):
+        """Create the shared session (idempotent)."""
+        if self._session is not None and not self._session.closed:
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._session is not None and not self._session.closed:
+                return
+            connector = aiohttp.TCPConnector(
+                limit=TOTAL_CONNECTION_LIMIT,
+                limit_per_host=max(HOST_LIMITS.values()),
+                ttl_dns_cache=DNS_CACHE_TTL,
+                use_dns_cache=True,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=DEFAULT_TIMEOUT),
+            )
+            logger.info("Shared HTTP client started")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def _semaphore_for(self, url: str) -> asyncio.Semaphore:
+        host = (urlparse(url).hostname or '').lower()
+        sem = self._host_semaphores.get(host)
+        if sem is None:
+            sem = asyncio.Semaphore(HOST_LIMITS.get(host, DEFAULT_PER_HOST_LIMIT))
+            self._host_semaphores[host] = sem
+        return sem
+
+    @staticmethod
+    def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+        # Full jitter: uniform in [0, base * 2^attempt]
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+    async def request(self, method: str, url: str, *, retries: int = DEFAULT_RETRIES,
+                      timeout: Optional[float] = None, idempotent: bool = True,
+                      data: Union[Any, Callable[[], Any]] = None, **kwargs) -> HttpResponse:
+        """Send a request and return the fully-read response.
+
+        ``data`` may be a zero-argument callable; it is called once per attempt so
+        single-use bodies like ``aiohttp.FormData`` can be retried. With
+        ``idempotent=False`` only connection failures and 408/429 are retried,
+        so a request the server may have processed is never sent twice.
+        Raises the last error when every attempt fails.
+        """
+        retry_statuses = RETRY_STATUSES if idempotent else SAFE_RETRY_STATUSES
+        retry_errors = (aiohttp.ClientError, asyncio.TimeoutError) if idempotent else (aiohttp.ClientConnectorError,)
+        session = await self._get_session()
+        if timeout is not None:
+            kwargs['timeout'] = aiohttp.ClientTimeout(total=timeout)
+        last_error: Optional[BaseException] = None
+
+        for attempt in range(retries + 1):
+            body = data() if callable(data) else data
+            retry_after = None
+            try:
+                async with self._semaphore_for(url):
+                    self.stats['requests'] += 1
+                    async with session.request(method, url, data=body, **kwargs) as resp:
+                        payload = await resp.read()
+                        response = HttpResponse(
+                            status=resp.status,
+                            headers=CIMultiDict(resp.headers),
+                            body=payload,
+                            url=str(resp.url),
+                        )
+                if response.status not in retry_statuses or attempt == retries:
+                    return response
+                retry_after = response.headers.get('Retry-After')
+                last_error = HttpStatusError(response.status, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                if attempt == retries or not isinstance(e, retry_errors):
+                    break
+            self.stats['retries'] += 1
+            await asyncio.sleep(self._backoff_delay(attempt, retry_after))
+
+        self.stats['errors'] += 1
+        raise last_error
+
+    async def get(self, url: str, *, cache: bool = False, cache_ttl: float = DEFAULT_CACHE_TTL,
+                  headers: Optional[Dict[str, str]] = None, **kwargs) -> HttpResponse:
+        """GET with optional response caching and conditional revalidation."""
+        if not cache:
+            return await self.request('GET', url, headers=headers, **kwargs)
+
+        cached: Optional[_CachedResponse] = self._cache.get(url)
+        if cached is not None and cached.is_fresh():
+            cached.hits += 1
+            self.stats['cache_hits'] += 1
+            return cached.response
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached.etag:
+                request_headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                request_headers['If-Modified-Since'] = cached.last_modified
+
+        response = await self.request('GET', url, headers=request_headers, **kwargs)
+        if response.status == 304 and cached is not None:
+            cached.stored_at = time.time()
+            self.stats['revalidated'] += 1
+            return cached.response
+        if response.status == 200 and len(response.body) <= MAX_CACHED_BODY:
+            self._cache[url] = _CachedResponse(
+                response=HttpResponse(response.status, response.headers, response.body, response.url, from_cache=True),
+                stored_at=time.time(),
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+                ttl=cache_ttl,
+            )
+        return response
+
+    async def get_json(self, url: str, *, cache: bool = False, **kwargs) -> Optional[Any]:
+        """GET a JSON document; returns None on non-200 responses."""
+        response = await self.get(url, cache=cache, **kwargs)
+        if response.status != 200:
+            return None
+        return response.json()
+
+    async def post(self, url: str, *, retries: int = 0, **kwargs) -> HttpResponse:
+        """POST without retries unless the caller opts in; see ``request(idempotent=False)``."""
+        return await self.request('POST', url, retries=retries, idempotent=False, **kwargs)
+
+    def invalidate(self, url: str):
+        self._cache.pop(url, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['cached_responses'] = len(self._cache)
+        stats['cached_bytes'] = self._cache.currsize
+        return stats
+
+
+# Global instance
+http_client = HttpClient()
+
+
+def get_http_client() -> HttpClient:
+    """Get the shared HTTP client"""
+    return http_client
+
+
+async def init_http_client():
+    """Start the shared HTTP client (called once at startup)"""
+    await http_client.start()
+
+
+async def close_http_client():
+    """Close the shared HTTP client"""
+    await http_client.close()
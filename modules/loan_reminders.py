@@ -0,0 +1,128 @@
+"""
+Loan reminder and overdue processing.
+
+Each cycle does a fixed number of statements, however many loans are due:
+
+- ``mark_overdue_loans`` flags every loan past its due date as defaulted in
+  one UPDATE. The late penalty itself is still computed at repayment from
+  the days overdue, so nothing is charged twice.
+- ``get_users_with_active_loans_for_reminder`` selects users that need a
+  reminder through the partial ``idx_users_active_loans`` index.
+- Reminders go out through a small worker pool that shares the broadcast
+  engine's token bucket, since Telegram's limit is per bot.
+- ``mark_loan_reminders_sent`` stamps all delivered reminders in one UPDATE.
+
+Loan columns are created by ``run_column_migrations`` at startup, so the
+loop no longer runs DDL every cycle.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pyrogram.errors import FloodWait
+
+from modules.broadcast_engine import broadcast_engine
+from modules.postgres_database import get_database
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 8
+MAX_ATTEMPTS = 3  # FloodWait retries per reminder
+
+
+def _due_datetime(loan_due) -> Optional[datetime]:
+    if isinstance(loan_due, str):
+        try:
+            loan_due = datetime.fromisoformat(loan_due)
+        except ValueError:
+            return None
+    if loan_due and loan_due.tzinfo is None:
+        loan_due = loan_due.replace(tzinfo=timezone.utc)
+    return loan_due
+
+
+def format_loan_reminder(user: Dict, now: datetime) -> str:
+    loan_amount = int(user.get('loan_amount') or 0)
+    loan_due_dt = _due_datetime(user.get('loan_due'))
+    if loan_due_dt:
+        delta = loan_due_dt - now
+        if delta.total_seconds() > 0:
+            status = f"⏳ <b>Time left:</b> {delta.days}d {delta.seconds // 3600}h"
+        else:
+            overdue = now - loan_due_dt
+            status = f"⚠️ <b>Overdue:</b> {overdue.days}d {overdue.seconds // 3600}h"
+    else:
+        status = ""
+    return (
+        "📢 <b>Loan Reminder</b>\n\n"
+        f"• <b>Principal:</b> <code>{loan_amount:,}</code>\n"
+        f"• <b>Due Date (UTC):</b> <code>{loan_due_dt.strftime('%Y-%m-%d %H:%M') if loan_due_dt else 'Unknown'}</code>\n"
+        f"{status}\n\n"
+        "Please repay using <code>/repay</code>. Late penalties apply after the due date."
+    )
+
+
+async def _send_reminder(client, user_id: int, text: str) -> bool:
+    bucket = broadcast_engine.bucket
+    for _ in range(MAX_ATTEMPTS):
+        await bucket.acquire()
+        try:
+            await client.send_message(user_id, text)
+            return True
+        except FloodWait as e:
+            bucket.pause(e.value + 1)
+        except Exception as e:
+            logger.debug(f"Loan reminder to {user_id} failed: {e}")
+            return False
+    return False
+
+
+async def send_loan_reminders(client, users: List[Dict]) -> List[int]:
+    """Send reminders concurrently; returns the users that received one."""
+    now = datetime.now(timezone.utc)
+    queue: asyncio.Queue = asyncio.Queue()
+    for user in users:
+        queue.put_nowait(user)
+    delivered: List[int] = []
+
+    async def worker():
+        while True:
+            try:
+                user = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if await _send_reminder(client, user['user_id'], format_loan_reminder(user, now)):
+                delivered.append(user['user_id'])
+
+    await asyncio.gather(*(worker() for _ in range(min(WORKERS, len(users)))))
+    return delivered
+
+
+async def process_loans(client, min_hours_since_last: int) -> Dict:
+    """One loan cycle: flag overdue loans, send due reminders, stamp them."""
+    db = get_database()
+    defaulted = await db.mark_overdue_loans()
+    users = await db.get_users_with_active_loans_for_reminder(min_hours_since_last=min_hours_since_last)
+    delivered = await send_loan_reminders(client, users) if users else []
+    await db.mark_loan_reminders_sent(delivered)
+    return {'defaulted': len(defaulted), 'due': len(users), 'reminded': len(delivered)}
+
+
+async def loan_reminder_loop(client):
+    from modules.tokens import LOAN_TEST_MINUTES
+    testing = bool(LOAN_TEST_MINUTES and LOAN_TEST_MINUTES > 0)
+    # Frequency: hourly; if testing minutes are enabled, check every minute
+    sleep_seconds = 60 if testing else 3600
+    min_hours = 1 if testing else 24
+    while True:
+        try:
+            result = await process_loans(client, min_hours)
+            if result['defaulted'] or result['due']:
+                logger.info(f"Loan cycle: {result}")
+            await asyncio.sleep(sleep_seconds)
+        except Exception as e:
+            logger.error(f"Error in loan reminder loop: {e}")
+            # Backoff on unexpected errors
+            await asyncio.sleep(60)
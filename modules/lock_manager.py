@@ -0,0 +1,245 @@
+"""
+Keyed lock manager.
+
+Handlers used to keep their own ``{user_id: asyncio.Lock()}`` dictionaries
+(sell, gift, fusion, propose, exchange, safari and every game in
+``tokens.py``). These grew with every user who ever ran a command, and some
+handlers deleted a lock while other tasks were still waiting on it.
+
+``LockManager`` hands out locks by key, e.g. ``('sell', user_id)``:
+
+- an entry exists only while someone holds or waits for it, and is removed
+  when the last reference goes away;
+- several keys (both sides of a trade or gift) are acquired in one
+  consistent order, so two opposite operations can't deadlock;
+- acquisition can time out with ``LockTimeout``;
+- contention, wait times and timeouts are counted.
+
+With ``DISTRIBUTED_LOCKS`` enabled, each key is also taken as a Postgres
+session advisory lock. That keeps the locks correct when more than one bot
+process shares the database. All of a process's advisory locks live on one
+dedicated connection outside the pool, used only for the short lock and
+unlock calls, so holders never pin pool connections their own bodies need.
+"""
+
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Hashable, List, Optional
+
+from config import DISTRIBUTED_LOCKS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = None  # wait indefinitely unless the caller sets a timeout
+ADVISORY_POLL_INTERVAL = 0.05  # seconds between pg_try_advisory_lock attempts
+ADVISORY_POLL_MAX = 0.5
+
+
+class LockTimeout(asyncio.TimeoutError):
+    """Raised when a keyed lock could not be acquired in time"""
+
+    def __init__(self, key: Hashable, timeout: float):
+        super().__init__(f"Timed out after {timeout}s waiting for lock {key!r}")
+        self.key = key
+        self.timeout = timeout
+
+
+class _Entry:
+    __slots__ = ('lock', 'refs')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+def _order(key: Hashable) -> str:
+    return repr(key)
+
+
+def advisory_key(key: Hashable) -> int:
+    """Stable signed 64-bit id for a lock key, as pg_advisory_lock expects"""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+class LockManager:
+    """Reference-counted async locks by key, with optional advisory locks"""
+
+    def __init__(self, distributed: bool = DISTRIBUTED_LOCKS):
+        self.distributed = distributed
+        self._entries: Dict[Hashable, _Entry] = {}
+        self._session = None  # dedicated connection holding the advisory locks
+        self._session_lock: Optional[asyncio.Lock] = None
+        self.stats = {
+            'acquired': 0,
+            'contended': 0,
+            'timeouts': 0,
+            'wait_ms_total': 0.0,
+            'wait_ms_max': 0.0,
+        }
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry.lock.locked()
+
+    def _ref(self, key: Hashable) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.refs += 1
+        return entry
+
+    def _unref(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        entry.refs -= 1
+        if entry.refs <= 0:
+            del self._entries[key]
+
+    async def _acquire_one(self, key: Hashable, deadline: Optional[float]):
+        entry = self._ref(key)
+        contended = entry.lock.locked()
+        started = time.monotonic()
+        try:
+            if deadline is None:
+                await entry.lock.acquire()
+            else:
+                await asyncio.wait_for(entry.lock.acquire(), max(0.0, deadline - started))
+        except asyncio.TimeoutError:
+            self._unref(key)
+            self.stats['timeouts'] += 1
+            raise LockTimeout(key, round(deadline - started, 3))
+        except BaseException:
+            self._unref(key)
+            raise
+        waited = (time.monotonic() - started) * 1000
+        self.stats['acquired'] += 1
+        if contended:
+            self.stats['contended'] += 1
+            self.stats['wait_ms_total'] += waited
+            self.stats['wait_ms_max'] = max(self.stats['wait_ms_max'], round(waited, 2))
+
+    def _release_one(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is not None and entry.lock.locked():
+            entry.lock.release()
+        self._unref(key)
+
+    async def _advisory_call(self, query: str, key: Hashable):
+        # One connection serves every holder, so calls on it are serialized
+        if self._session_lock is None:
+            self._session_lock = asyncio.Lock()
+        async with self._session_lock:
+            if self._session is None or self._session.is_closed():
+                from modules.postgres_database import open_dedicated_connection
+                self._session = await open_dedicated_connection()
+            try:
+                return await self._session.fetchval(query, advisory_key(key))
+            except Exception:
+                if self._session.is_closed():
+                    # The session died, and with it every advisory lock it held
+                    logger.error("Advisory lock connection lost; reconnecting on next use")
+                    self._session = None
+                raise
+
+    async def _advisory_acquire(self, keys: List[Hashable], deadline: Optional[float],
+                                timeout: Optional[float]) -> List[Hashable]:
+        taken = []
+        try:
+            for key in keys:
+                delay = ADVISORY_POLL_INTERVAL
+                while not await self._advisory_call("SELECT pg_try_advisory_lock($1)", key):
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self.stats['timeouts'] += 1
+                        raise LockTimeout(key, timeout)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, ADVISORY_POLL_MAX)
+                taken.append(key)
+        except BaseException:
+            await self._advisory_release(taken)
+            raise
+        return taken
+
+    async def _advisory_release(self, keys: List[Hashable]):
+        for key in reversed(keys):
+            try:
+                await self._advisory_call("SELECT pg_advisory_unlock($1)", key)
+            except Exception as e:
+                logger.error(f"Error releasing advisory lock {key!r}: {e}")
+
+    def lock(self, *keys: Hashable, timeout: Optional[float] = DEFAULT_TIMEOUT) -> 'KeyedLock':
+        """Lock for ``async with``; keys are de-duplicated and taken in a fixed order.
+
+        On timeout nothing stays held and ``LockTimeout`` is raised. The
+        returned object can be entered again once the previous block exits.
+        """
+        return KeyedLock(self, keys, timeout)
+
+    @asynccontextmanager
+    async def _hold(self, keys, timeout: Optional[float]):
+        ordered = sorted(set(keys), key=_order)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        held: List[Hashable] = []
+        try:
+            for key in ordered:
+                await self._acquire_one(key, deadline)
+                held.append(key)
+            if self.distributed:
+                taken = await self._advisory_acquire(ordered, deadline, timeout)
+                try:
+                    yield
+                finally:
+                    await self._advisory_release(taken)
+            else:
+                yield
+        finally:
+            for key in reversed(held):
+                self._release_one(key)
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['active_keys'] = len(self._entries)
+        stats['held'] = sum(1 for entry in self._entries.values() if entry.lock.locked())
+        stats['wait_ms_total'] = round(stats['wait_ms_total'], 2)
+        return stats
+
+
+class KeyedLock:
+    """``async with`` handle for one or more keys of a LockManager"""
+
+    def __init__(self, manager: LockManager, keys, timeout: Optional[float]):
+        self._manager = manager
+        self.keys = tuple(keys)
+        self.timeout = timeout
+        self._held = None
+
+    def locked(self) -> bool:
+        return any(self._manager.locked(key) for key in self.keys)
+
+    async def __aenter__(self):
+        held = self._manager._hold(self.keys, self.timeout)
+        await held.__aenter__()
+        self._held = held
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        held, self._held = self._held, None
+        return await held.__aexit__(exc_type, exc, tb)
+
+
+# Global instance
+lock_manager = LockManager()
+
+
+def get_lock_manager() -> LockManager:
+    """Get the process-wide lock manager"""
+    return lock_manager
+
+
+def user_lock(namespace: str, user_id: int, timeout: Optional[float] = DEFAULT_TIMEOUT) -> KeyedLock:
+    """Lock one user's operations in ``namespace`` (e.g. 'sell', 'pay')."""
+    return lock_manager.lock((namespace, user_id), timeout=timeout)
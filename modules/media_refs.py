@@ -0,0 +1,194 @@
+"""
+Telegram media references for character cards.
+
+Character media lives on Catbox/Cloudinary. Sending by URL makes Telegram
+download the file again on every drop, /check or collection page, which is
+slow and fails outright when the host is. The first successful send of a
+character's media returns a Telegram ``file_id``; this module records it per
+character (in memory and in ``character_media_refs``) and hands it out for
+later sends, so Telegram reuses the file it already has.
+
+A reference is tied to the URL it was harvested from, so editing a character's
+media makes the old reference unused. References Telegram rejects
+(``FILE_REFERENCE_EXPIRED`` and friends) are dropped and re-harvested from the
+URL on the retry.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from cachetools import LRUCache, TTLCache
+
+logger = logging.getLogger(__name__)
+
+REF_CACHE_SIZE = 20000
+# Remember "no reference stored" for a while so misses don't hit the database each send
+MISSING_TTL = 600  # seconds
+
+# RPC error ids meaning a stored file_id can no longer be used
+STALE_REFERENCE_ERRORS = {
+    'FILE_REFERENCE_EXPIRED',
+    'FILE_REFERENCE_EMPTY',
+    'FILE_REFERENCE_INVALID',
+    'FILE_ID_INVALID',
+    'MEDIA_EMPTY',
+    'WEBPAGE_MEDIA_EMPTY',
+}
+
+
+@dataclass
+class MediaRef:
+    character_id: int
+    media_type: str  # 'photo' or 'video'
+    file_id: str
+    file_unique_id: Optional[str] = None
+    source_url: Optional[str] = None
+
+
+def media_type_of(character: Dict) -> str:
+    return 'video' if character.get('is_video', False) else 'photo'
+
+
+def remote_source(character: Dict) -> Optional[str]:
+    """What the character would be sent from without a harvested reference."""
+    return character.get('img_url') or character.get('file_id')
+
+
+def is_stale_reference_error(error: Exception) -> bool:
+    error_id = getattr(error, 'ID', None) or ''
+    if error_id in STALE_REFERENCE_ERRORS:
+        return True
+    text = str(error).upper()
+    return any(name in text for name in STALE_REFERENCE_ERRORS)
+
+
+def extract_file_ids(message, media_type: str) -> Optional[Tuple[str, Optional[str]]]:
+    """(file_id, file_unique_id) of the media on a sent message, if any."""
+    if message is None or isinstance(message, bool):
+        return None
+    media = None
+    if media_type == 'video':
+        media = getattr(message, 'video', None) or getattr(message, 'animation', None)
+    else:
+        media = getattr(message, 'photo', None)
+    if media is None or not getattr(media, 'file_id', None):
+        return None
+    return media.file_id, getattr(media, 'file_unique_id', None)
+
+
+class MediaReferenceStore:
+    """Character id -> Telegram file_id, backed by character_media_refs"""
+
+    def __init__(self, maxsize: int = REF_CACHE_SIZE):
+        self._refs: LRUCache = LRUCache(maxsize=maxsize)
+        self._missing: TTLCache = TTLCache(maxsize=maxsize, ttl=MISSING_TTL)
+        self.stats = {
+            'ref_hits': 0,
+            'url_sends': 0,
+            'harvested': 0,
+            'expired': 0,
+        }
+
+    @staticmethod
+    def _db():
+        from modules.postgres_database import get_database
+        db = get_database()
+        return db if hasattr(db, 'get_media_ref') else None
+
+    async def get(self, character_id: int) -> Optional[MediaRef]:
+        ref = self._refs.get(character_id)
+        if ref is not None or character_id in self._missing:
+            return ref
+        db = self._db()
+        row = await db.get_media_ref(character_id) if db else None
+        if row:
+            ref = MediaRef(**row)
+            self._refs[character_id] = ref
+        else:
+            self._missing[character_id] = True
+        return ref
+
+    async def prefetch(self, character_ids: Iterable[int]):
+        """Load references for many characters with one query."""
+        wanted = [i for i in dict.fromkeys(character_ids)
+                  if i not in self._refs and i not in self._missing]
+        db = self._db()
+        if not wanted or not db:
+            return
+        rows = await db.get_media_refs(wanted)
+        for row in rows:
+            self._refs[row['character_id']] = MediaRef(**row)
+        for character_id in wanted:
+            if character_id not in self._refs:
+                self._missing[character_id] = True
+
+    def peek_source(self, character: Dict) -> Tuple[Optional[str], bool]:
+        """Like ``resolve`` but memory-only, for code that builds media synchronously."""
+        return self._pick(character, self._refs.get(character.get('character_id')))
+
+    async def resolve(self, character: Dict) -> Tuple[Optional[str], bool]:
+        """Return ``(media, from_ref)``: the stored file_id when valid, else the remote source."""
+        character_id = character.get('character_id')
+        ref = await self.get(character_id) if character_id is not None else None
+        return self._pick(character, ref)
+
+    def _pick(self, character: Dict, ref: Optional[MediaRef]) -> Tuple[Optional[str], bool]:
+        source = remote_source(character)
+        if ref is not None and ref.media_type == media_type_of(character) and ref.source_url == source:
+            self.stats['ref_hits'] += 1
+            return ref.file_id, True
+        self.stats['url_sends'] += 1
+        return source, False
+
+    async def record(self, character: Dict, message) -> Optional[MediaRef]:
+        """Harvest the file_id from a message that was sent from the remote URL."""
+        character_id = character.get('character_id')
+        source = remote_source(character)
+        # Only URL sends are worth remembering; a bare file_id is already a reference
+        if character_id is None or not source or not str(source).startswith('http'):
+            return None
+        media_type = media_type_of(character)
+        ids = extract_file_ids(message, media_type)
+        if not ids:
+            return None
+        existing = self._refs.get(character_id)
+        if existing is not None and existing.file_id == ids[0] and existing.source_url == source:
+            return existing
+        ref = MediaRef(character_id, media_type, ids[0], ids[1], source)
+        self._refs[character_id] = ref
+        self._missing.pop(character_id, None)
+        self.stats['harvested'] += 1
+        db = self._db()
+        if db:
+            try:
+                await db.save_media_ref(ref.character_id, ref.media_type, ref.file_id, ref.file_unique_id, ref.source_url)
+            except Exception as e:
+                logger.warning(f"Could not persist media ref for character {character_id}: {e}")
+        return ref
+
+    async def forget(self, character_id: int):
+        """Drop a reference Telegram rejected; the next send re-harvests it."""
+        self._refs.pop(character_id, None)
+        self._missing[character_id] = True
+        self.stats['expired'] += 1
+        db = self._db()
+        if db:
+            try:
+                await db.delete_media_ref(character_id)
+            except Exception as e:
+                logger.warning(f"Could not delete media ref for character {character_id}: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['cached'] = len(self._refs)
+        return stats
+
+
+# Global instance
+media_refs = MediaReferenceStore()
+
+
+def get_media_refs() -> MediaReferenceStore:
+    """Get the process-wide media reference store"""
+    return media_refs
@@ -0,0 +1,568 @@
+"""
+Streaming media upload pipeline.
+
+Character media sent to the bot is re-hosted on Catbox/ImgBB/Cloudinary so it
+can be dropped by URL. Uploads used to download the whole file from Telegram
+(to disk or memory), then push it with a blocking call, which held up drops in
+every group for the length of the upload.
+
+Here the file is streamed from ``client.stream_media`` straight into an
+aiohttp multipart body. Chunks are spooled to a temp file as they arrive, so
+a fallback host or a retry reopens the file and replays what has already been
+read instead of downloading again. Uploads run in a
+bounded pool on top of the shared HTTP client, which applies its per-host
+connection caps. If the first host fails, or stops taking data once it has
+started, the next host in the list is started alongside it and the first URL
+to come back wins. Time spent waiting on Telegram does not count as a stall.
+Spooled bytes are capped across the pool, so large files queue instead of
+filling the disk.
+Progress is reported through an optional callback, which the admin upload
+flow uses to keep its "processing" message up to date.
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+import aiohttp
+
+from config import CLOUDINARY_API_KEY, CLOUDINARY_API_SECRET, CLOUDINARY_CLOUD_NAME, IMGBB_API_KEY
+from modules.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+# Pool settings
+MAX_CONCURRENT_UPLOADS = 3
+CHUNK_TIMEOUT = 60  # seconds to wait for the next chunk from Telegram
+UPLOAD_TIMEOUT = 300  # seconds for one upload request
+HOST_RETRIES = 1  # extra attempts per host, replayed from the spooled file
+STALL_TIMEOUT = 20  # seconds a host may go without taking a chunk before the next one is started
+STALL_CHECK_INTERVAL = 5  # seconds between stall checks
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024  # media spooled to temp files across all running uploads
+READ_CHUNK_SIZE = 256 * 1024  # bytes read from the spool per request body chunk
+PROGRESS_INTERVAL = 3  # minimum seconds between progress callbacks
+
+CATBOX_API_URL = "https://catbox.moe/user/api.php"
+IMGBB_API_URL = f"https://api.imgbb.com/1/upload?key={IMGBB_API_KEY}"
+
+# Upload limits per host, in bytes
+HOST_MAX_SIZE = {
+    'catbox': 200 * 1024 * 1024,
+    'imgbb': 32 * 1024 * 1024,
+    'cloudinary': 100 * 1024 * 1024,
+}
+
+# Hosts tried per media type, in order of preference
+HOST_ORDER = {
+    'photo': ('catbox', 'imgbb', 'cloudinary'),
+    'video': ('cloudinary', 'catbox'),
+}
+
+DEFAULT_FILENAMES = {
+    'photo': ('upload.jpg', 'image/jpeg'),
+    'video': ('upload.mp4', 'video/mp4'),
+}
+
+# Hosts that can't be used because their credentials aren't configured
+UNCONFIGURED_HOSTS = {
+    host for host, configured in (
+        ('imgbb', bool(IMGBB_API_KEY)),
+        ('cloudinary', bool(CLOUDINARY_CLOUD_NAME and CLOUDINARY_API_KEY and CLOUDINARY_API_SECRET)),
+    ) if not configured
+}
+
+HOST_NAMES = {
+    'catbox': 'Catbox',
+    'imgbb': 'ImgBB',
+    'cloudinary': 'Cloudinary',
+}
+
+_job_ids = itertools.count(1)
+
+
+class UploadError(Exception):
+    """Raised by a host uploader when the host did not return a usable URL"""
+
+
+@dataclass
+class UploadJob:
+    """State of one upload, handed to progress callbacks"""
+    job_id: int
+    media_type: str
+    total: Optional[int] = None
+    received: int = 0
+    state: str = 'queued'  # queued, uploading, done, failed
+    hosts: List[str] = field(default_factory=list)
+    host: Optional[str] = None
+    url: Optional[str] = None
+    started_at: float = field(default_factory=time.time)
+
+    @property
+    def percent(self) -> Optional[int]:
+        if not self.total:
+            return None
+        return min(100, int(self.received * 100 / self.total))
+
+
+ProgressCallback = Callable[[UploadJob], Awaitable[None]]
+
+
+class _MediaStream:
+    """Reads a Telegram file once into a temp file and lets any number of readers replay it"""
+
+    def __init__(self, client, file_id: str, on_chunk: Callable[[int], None],
+                 max_bytes: Optional[int] = None):
+        self._client = client
+        self._file_id = file_id
+        self._on_chunk = on_chunk
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._path: Optional[str] = None
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            fd, self._path = tempfile.mkstemp(prefix='upload-')
+            os.close(fd)
+            self._task = asyncio.create_task(self._pump())
+
+    async def _pump(self):
+        source = self._client.stream_media(self._file_id).__aiter__()
+        spool = open(self._path, 'wb')
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(source.__anext__(), timeout=CHUNK_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                if self._max_bytes is not None and self._size + len(chunk) > self._max_bytes:
+                    raise UploadError("Media is larger than any upload host accepts")
+                await asyncio.to_thread(spool.write, chunk)
+                await asyncio.to_thread(spool.flush)
+                async with self._changed:
+                    self._size += len(chunk)
+                    self._changed.notify_all()
+                self._on_chunk(len(chunk))
+        except BaseException as e:
+            self._error = e if not isinstance(e, asyncio.TimeoutError) else UploadError("Timed out reading media from Telegram")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            spool.close()
+            async with self._changed:
+                self._done = True
+                self._changed.notify_all()
+
+    async def reader(self, progress: Optional['_SendProgress'] = None) -> AsyncIterator[bytes]:
+        """Yield the file from the start, waiting for bytes still in flight."""
+        self.start()
+        if progress is not None:
+            progress.restart()
+        # Each attempt gets its own handle, so retries and hedged hosts read independently
+        spool = open(self._path, 'rb')
+        offset = 0
+        try:
+            while True:
+                async with self._changed:
+                    if offset >= self._size and not self._done and progress is not None:
+                        progress.paused = True
+                    while offset >= self._size and not self._done:
+                        await self._changed.wait()
+                    available = self._size - offset
+                    if available <= 0:
+                        if self._error is not None:
+                            raise self._error
+                        return
+                chunk = await asyncio.to_thread(spool.read, min(available, READ_CHUNK_SIZE))
+                if progress is not None:
+                    progress.sent()
+                offset += len(chunk)
+                yield chunk
+        finally:
+            spool.close()
+            if progress is not None:
+                progress.paused = True
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError as e:
+                logger.warning(f"Could not remove upload spool {self._path}: {e}")
+            self._path = None
+
+
+class _SendProgress:
+    """Tracks when one host last took a chunk of the request body"""
+
+    def __init__(self):
+        self.first_sent: Optional[float] = None
+        self.last_sent = 0.0
+        self.paused = False  # waiting on Telegram, or the body is fully sent
+
+    def restart(self):
+        self.first_sent = None
+        self.paused = False
+
+    def sent(self):
+        self.last_sent = time.time()
+        if self.first_sent is None:
+            self.first_sent = self.last_sent
+        self.paused = False
+
+    def stalled(self, now: float) -> bool:
+        return (self.first_sent is not None and not self.paused
+                and now - self.last_sent > STALL_TIMEOUT)
+
+
+class _HostStream:
+    """One host's view of a shared media stream, recording its send progress"""
+
+    def __init__(self, stream: _MediaStream):
+        self._stream = stream
+        self.progress = _SendProgress()
+
+    def reader(self) -> AsyncIterator[bytes]:
+        return self._stream.reader(self.progress)
+
+
+class _ByteBudget:
+    """Caps the media bytes buffered by running uploads"""
+
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._used = 0
+        self._changed: Optional[asyncio.Condition] = None
+
+    def _get_changed(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def clamp(self, size: int) -> int:
+        # A file bigger than the whole budget still runs, once nothing else is buffered
+        return min(size, self._capacity)
+
+    def available(self, size: int) -> bool:
+        return self._used + self.clamp(size) <= self._capacity
+
+    async def acquire(self, size: int) -> int:
+        size = self.clamp(size)
+        changed = self._get_changed()
+        async with changed:
+            await changed.wait_for(lambda: self._used + size <= self._capacity)
+            self._used += size
+        return size
+
+    async def release(self, size: int):
+        changed = self._get_changed()
+        async with changed:
+            self._used -= size
+            changed.notify_all()
+
+
+async def _upload_catbox(stream: _HostStream, filename: str, content_type: str, media_type: str) -> str:
+    def form():
+        data = aiohttp.FormData()
+        data.add_field('reqtype', 'fileupload')
+        data.add_field('fileToUpload', stream.reader(), filename=filename, content_type=content_type)
+        return data
+
+    response = await http_client.post(CATBOX_API_URL, data=form, timeout=UPLOAD_TIMEOUT, retries=HOST_RETRIES)
+    text = response.text().strip()
+    if response.status == 200 and text.startswith("https"):
+        return text
+    raise UploadError(f"Catbox returned status {response.status}: {text[:200]}")
+
+
+async def _upload_imgbb(stream: _HostStream, filename: str, content_type: str, media_type: str) -> str:
+    def form():
+        data = aiohttp.FormData()
+        data.add_field('image', stream.reader(), filename=filename, content_type=content_type)
+        return data
+
+    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    response = await http_client.post(IMGBB_API_URL, data=form, headers=headers,
+                                      timeout=UPLOAD_TIMEOUT, retries=HOST_RETRIES)
+    if response.status != 200:
+        raise UploadError(f"ImgBB returned status {response.status}: {response.text()[:200]}")
+    result = response.json()
+    url = (result.get('data') or {}).get('url')
+    if not url:
+        raise UploadError(f"ImgBB returned an unexpected response: {result}")
+    return url
+
+
+def _cloudinary_signature(params: Dict[str, str]) -> str:
+    to_sign = '&'.join(f"{key}={params[key]}" for key in sorted(params))
+    return hashlib.sha1((to_sign + CLOUDINARY_API_SECRET).encode()).hexdigest()
+
+
+async def _upload_cloudinary(stream: _HostStream, filename: str, content_type: str, media_type: str) -> str:
+    resource_type = 'video' if media_type == 'video' else 'image'
+    url = f"https://api.cloudinary.com/v1_1/{CLOUDINARY_CLOUD_NAME}/{resource_type}/upload"
+
+    def form():
+        # Signed fresh per attempt; Cloudinary rejects stale timestamps
+        params = {'timestamp': str(int(time.time()))}
+        data = aiohttp.FormData()
+        data.add_field('api_key', CLOUDINARY_API_KEY)
+        data.add_field('timestamp', params['timestamp'])
+        data.add_field('signature', _cloudinary_signature(params))
+        data.add_field('file', stream.reader(), filename=filename, content_type=content_type)
+        return data
+
+    response = await http_client.post(url, data=form, timeout=UPLOAD_TIMEOUT, retries=HOST_RETRIES)
+    if response.status != 200:
+        raise UploadError(f"Cloudinary returned status {response.status}: {response.text()[:200]}")
+    secure_url = response.json().get('secure_url')
+    if not secure_url:
+        raise UploadError("Cloudinary response had no secure_url")
+    return secure_url
+
+
+HOST_UPLOADERS = {
+    'catbox': _upload_catbox,
+    'imgbb': _upload_imgbb,
+    'cloudinary': _upload_cloudinary,
+}
+
+
+class MediaUploadPipeline:
+    """Bounded pool of streaming uploads with hedged fallback hosts"""
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_UPLOADS):
+        self._max_concurrent = max_concurrent
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._buffer = _ByteBudget(MAX_BUFFERED_BYTES)
+        self.jobs: Dict[int, UploadJob] = {}
+        self.stats = {
+            'uploads': 0,
+            'failed': 0,
+            'fallbacks': 0,
+            'bytes': 0,
+        }
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_concurrent)
+        return self._slots
+
+    def hosts_for(self, media_type: str, file_size: Optional[int] = None) -> List[str]:
+        hosts = tuple(h for h in HOST_ORDER.get(media_type, HOST_ORDER['photo']) if h not in UNCONFIGURED_HOSTS)
+        if file_size:
+            hosts = tuple(h for h in hosts if file_size <= HOST_MAX_SIZE.get(h, file_size))
+        return list(hosts)
+
+    async def upload(self, client, file_id: str, media_type: str = 'photo', *,
+                     file_size: Optional[int] = None, file_name: Optional[str] = None,
+                     mime_type: Optional[str] = None, hosts: Optional[Sequence[str]] = None,
+                     progress: Optional[ProgressCallback] = None) -> Optional[str]:
+        """Stream a Telegram file to the first host that accepts it.
+
+        Returns the hosted URL, or None when every host failed.
+        """
+        default_name, default_type = DEFAULT_FILENAMES.get(media_type, DEFAULT_FILENAMES['photo'])
+        filename = file_name or default_name
+        content_type = mime_type or default_type
+        job = UploadJob(next(_job_ids), media_type, total=file_size,
+                        hosts=list(hosts) if hosts else self.hosts_for(media_type, file_size))
+        if not job.hosts:
+            logger.warning(f"No upload host accepts a {media_type} of {file_size} bytes")
+            return None
+
+        # Unknown sizes reserve the most any of the hosts would accept
+        max_bytes = max(HOST_MAX_SIZE.get(h, 0) for h in job.hosts) or None
+        reserve = file_size or max_bytes or MAX_BUFFERED_BYTES
+
+        self.jobs[job.job_id] = job
+        reporter = _ProgressNotifier(job, progress)
+        try:
+            slots = self._get_slots()
+            if slots.locked() or not self._buffer.available(reserve):
+                await reporter.emit(force=True)
+            async with slots:
+                reserved = await self._buffer.acquire(reserve)
+                try:
+                    job.state = 'uploading'
+                    job.started_at = time.time()
+                    stream = _MediaStream(client, file_id, lambda n: self._on_chunk(job, reporter, n),
+                                          max_bytes=max_bytes)
+                    try:
+                        url = await self._race_hosts(job, stream, filename, content_type)
+                    finally:
+                        await stream.close()
+                finally:
+                    await self._buffer.release(reserved)
+            job.url = url
+            job.state = 'done' if url else 'failed'
+            self.stats['uploads' if url else 'failed'] += 1
+            await reporter.emit(force=True)
+            return url
+        except Exception as e:
+            logger.error(f"Upload {job.job_id} failed: {e}")
+            job.state = 'failed'
+            self.stats['failed'] += 1
+            await reporter.emit(force=True)
+            return None
+        finally:
+            await reporter.wait()
+            self.jobs.pop(job.job_id, None)
+
+    def _on_chunk(self, job: UploadJob, reporter: '_ProgressNotifier', size: int):
+        job.received += size
+        self.stats['bytes'] += size
+        reporter.poke()
+
+    async def _race_hosts(self, job: UploadJob, stream: _MediaStream, filename: str, content_type: str) -> Optional[str]:
+        pending: Dict[asyncio.Task, str] = {}
+        senders: Dict[asyncio.Task, _HostStream] = {}
+        remaining = list(job.hosts)
+
+        def launch():
+            host = remaining.pop(0)
+            if host != job.hosts[0]:
+                self.stats['fallbacks'] += 1
+            sender = _HostStream(stream)
+            task = asyncio.create_task(HOST_UPLOADERS[host](sender, filename, content_type, job.media_type))
+            pending[task] = host
+            senders[task] = sender
+            job.host = host
+
+        launch()
+        try:
+            while pending:
+                timeout = STALL_CHECK_INTERVAL if remaining else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Hedge only when every running host has stopped taking data
+                    now = time.time()
+                    if all(senders[task].progress.stalled(now) for task in pending):
+                        logger.info(f"Upload {job.job_id}: {', '.join(pending.values())} stalled, starting {remaining[0]}")
+                        launch()
+                    continue
+                for task in done:
+                    host = pending.pop(task)
+                    senders.pop(task, None)
+                    try:
+                        url = task.result()
+                    except Exception as e:
+                        logger.warning(f"Upload {job.job_id} to {host} failed: {e}")
+                        continue
+                    job.host = host
+                    return url
+                # Everything that finished failed; move on to the next host
+                if remaining:
+                    launch()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def active_jobs(self) -> List[UploadJob]:
+        return list(self.jobs.values())
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['active'] = sum(1 for job in self.jobs.values() if job.state == 'uploading')
+        stats['queued'] = sum(1 for job in self.jobs.values() if job.state == 'queued')
+        return stats
+
+
+class _ProgressNotifier:
+    """Calls a progress callback at most every PROGRESS_INTERVAL seconds, one call at a time"""
+
+    def __init__(self, job: UploadJob, callback: Optional[ProgressCallback]):
+        self._job = job
+        self._callback = callback
+        self._last = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def poke(self):
+        if self._callback is None or (self._task is not None and not self._task.done()):
+            return
+        if time.time() - self._last < PROGRESS_INTERVAL:
+            return
+        self._task = asyncio.create_task(self._call())
+
+    async def emit(self, force: bool = False):
+        if self._callback is None:
+            return
+        await self.wait()
+        if force or time.time() - self._last >= PROGRESS_INTERVAL:
+            await self._call()
+
+    async def wait(self):
+        if self._task is not None and not self._task.done():
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _call(self):
+        self._last = time.time()
+        try:
+            await self._callback(self._job)
+        except Exception as e:
+            logger.debug(f"Upload progress callback failed: {e}")
+
+
+def _format_size(size: int) -> str:
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def format_progress(job: UploadJob, label: str = "upload") -> str:
+    """One-line HTML status for an upload job."""
+    if job.state == 'queued':
+        return f"<i>Your {label} is queued, please wait...</i>"
+    if job.state == 'done':
+        return f"<i>{label.capitalize()} uploaded to {HOST_NAMES.get(job.host, job.host)}.</i>"
+    if job.state == 'failed':
+        return f"<i>{label.capitalize()} upload failed.</i>"
+    host = f" to {HOST_NAMES.get(job.host, job.host)}" if job.host else ""
+    if job.percent is not None:
+        return (f"<i>Uploading your {label}{host}... {job.percent}% "
+                f"({_format_size(job.received)} / {_format_size(job.total)})</i>")
+    return f"<i>Uploading your {label}{host}... {_format_size(job.received)}</i>"
+
+
+def message_progress(message, label: str = "upload") -> ProgressCallback:
+    """Progress callback that keeps ``message`` edited with the upload status."""
+    last_text = {'text': None}
+
+    async def report(job: UploadJob):
+        text = format_progress(job, label)
+        if text == last_text['text']:
+            return
+        last_text['text'] = text
+        await message.edit_text(text)
+
+    return report
+
+
+# Global instance
+upload_pipeline = MediaUploadPipeline()
+
+
+def get_upload_pipeline() -> MediaUploadPipeline:
+    """Get the process-wide upload pipeline"""
+    return upload_pipeline
+
+
+async def upload_media(client, file_id: str, media_type: str = 'photo', **kwargs) -> Optional[str]:
+    """Upload a Telegram file through the shared pipeline; returns the URL or None"""
+    return await upload_pipeline.upload(client, file_id, media_type, **kwargs)
@@ -1,15 +1,18 @@
 """
 Media Utilities for Pyrogram Client
-Wrapper functions for sending media with proper session management
+Wrapper functions for sending media with proper session management.
+Character media goes through the media reference store so repeat sends reuse
+Telegram's file_id instead of making it fetch the remote URL again.
 """
 
 import asyncio
 import time
 import random
-from typing import Optional, Union
+from typing import Dict, Optional, Tuple, Union
 from pyrogram import Client
 from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo
 from .session_manager import get_unique_id, mark_id_used
+from .media_refs import media_refs, is_stale_reference_error, remote_source
 
 async def send_photo_safe(
     client: Client,
@@ -173,6 +176,73 @@ async def send_media_group_safe(
     
     return None
 
+async def _send_with_media_ref(send, character: Dict, resolved: Optional[Tuple[Optional[str], bool]] = None):
+    """Call ``send(media_type, media)`` with the best source for ``character``.
+
+    Uses the stored file_id when there is one; if Telegram rejects it, the
+    reference is dropped and the send is retried from the remote URL. A send
+    from the URL harvests the new file_id. ``resolved`` is a ``(media, from_ref)``
+    pair already looked up by the caller.
+    """
+    media_type = 'video' if character.get('is_video', False) else 'photo'
+    media, from_ref = resolved if resolved is not None else await media_refs.resolve(character)
+    try:
+        result = await send(media_type, media)
+    except Exception as e:
+        if not from_ref or not is_stale_reference_error(e):
+            raise
+        print(f"⚠️ Stale file reference for character {character.get('character_id')}, re-harvesting")
+        await media_refs.forget(character.get('character_id'))
+        media, from_ref = remote_source(character), False
+        result = await send(media_type, media)
+    if not from_ref:
+        await media_refs.record(character, result)
+    return result
+
+async def send_character_media(
+    client: Client,
+    chat_id: Union[int, str],
+    character: Dict,
+    caption: Optional[str] = None,
+    resolved: Optional[Tuple[Optional[str], bool]] = None,
+    **kwargs
+) -> Message:
+    """Send a character's photo/video to a chat, preferring its cached file_id"""
+    async def send(media_type, media):
+        if media_type == 'video':
+            return await client.send_video(chat_id=chat_id, video=media, caption=caption, **kwargs)
+        return await client.send_photo(chat_id=chat_id, photo=media, caption=caption, **kwargs)
+    return await _send_with_media_ref(send, character, resolved)
+
+async def reply_character_media(
+    message: Message,
+    character: Dict,
+    caption: Optional[str] = None,
+    **kwargs
+) -> Message:
+    """Reply to ``message`` with a character's photo/video, preferring its cached file_id"""
+    async def send(media_type, media):
+        if media_type == 'video':
+            return await message.reply_video(video=media, caption=caption, **kwargs)
+        return await message.reply_photo(photo=media, caption=caption, **kwargs)
+    return await _send_with_media_ref(send, character)
+
+async def edit_character_media(
+    target,
+    character: Dict,
+    caption: Optional[str] = None,
+    parse_mode=None,
+    **kwargs
+):
+    """Replace the media of a message (or a callback query's message) with a character's media"""
+    async def send(media_type, media):
+        input_media = InputMediaVideo(media=media, caption=caption, parse_mode=parse_mode) if media_type == 'video' \
+            else InputMediaPhoto(media=media, caption=caption, parse_mode=parse_mode)
+        if hasattr(target, 'edit_message_media'):  # CallbackQuery
+            return await target.edit_message_media(media=input_media, **kwargs)
+        return await target.edit_media(media=input_media, **kwargs)
+    return await _send_with_media_ref(send, character)
+
 def add_delay_between_media():
     """
     Add a small delay between media sends to prevent rate limiting
@@ -4,8 +4,6 @@ import os
 from typing import List, Optional, Tuple
 from typing import Optional
 
-import aiohttp
-import aiohttp
 from pyrogram import Client, filters
 from pyrogram.types import (
     CallbackQuery,
@@ -16,6 +14,7 @@ from pyrogram.types import (
 
 from modules.battle import RARITY_MOVES, RARITY_STATS
 from modules.decorators import auto_register_user
+from modules.http_client import http_client
 from modules.postgres_database import get_database
 
 
@@ -45,6 +44,8 @@ TYPE_EMOJIS = {
 
 _MOVE_CACHE: dict[str, List[dict]] = {}
 _STATS_CACHE: dict[str, dict] = {}
+# Move data on PokeAPI is effectively static; keep fetched details for a day
+MOVE_DETAIL_CACHE_TTL = 86400
 
 # Load Necrozma forms data once
 NECROZMA_FORMS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "necrozma_forms.json")
@@ -262,57 +263,54 @@ async def fetch_pokeapi_stats(pokemon_name: str) -> Optional[dict]:
     clean_name = POKEMON_NAME_MAP.get(name_key, name_key).replace(' ', '-')
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"https://pokeapi.co/api/v2/pokemon/{clean_name}") as response:
-                if response.status != 200:
-                    print(f"Failed to fetch {clean_name} from PokeAPI. Status: {response.status}")
-                    return None
-
-                data = await response.json()
-
-                # Extract base stats
-                base_stats = {}
-                for stat in data.get('stats', []):
-                    stat_name = stat['stat']['name']
-                    base_value = stat['base_stat']
-                    mapping = {
-                        'hp': 'hp',
-                        'attack': 'atk',
-                        'defense': 'def',
-                        'special-attack': 'spa',
-                        'special-defense': 'spd',
-                        'speed': 'spe'
-                    }
-                    if stat_name in mapping:
-                        base_stats[mapping[stat_name]] = base_value
-
-                # Ensure all stats exist
-                for s in ['hp','atk','def','spa','spd','spe']:
-                    base_stats.setdefault(s, 0)
-
-                # Max-level stats
-                IV = 31
-                EV = 252
-                LEVEL = 100
-                max_level_stats = {}
-                for stat_name, base in base_stats.items():
-                    if stat_name == 'hp':
-                        max_level_stats[stat_name] = int(((base * 2 + IV + EV // 4) * LEVEL) / 100 + LEVEL + 10)
-                    else:
-                        max_level_stats[stat_name] = int(((base * 2 + IV + EV // 4) * LEVEL) / 100 + 5)
-
-                result = {
-                    'base_stats': base_stats,
-                    'max_level_stats': max_level_stats,
-                    'types': [t['type']['name'].title() for t in data.get('types', [])],
-                    'height': data.get('height', 0) / 10,  # meters
-                    'weight': data.get('weight', 0) / 10,  # kg
-                    'abilities': [a['ability']['name'].replace('-', ' ').title() for a in data.get('abilities', [])]
-                }
-
-                # Cache the fresh result
-                _STATS_CACHE[name_key] = result
-                return result
+        data = await http_client.get_json(f"https://pokeapi.co/api/v2/pokemon/{clean_name}")
+        if data is None:
+            print(f"Failed to fetch {clean_name} from PokeAPI.")
+            return None
+
+        # Extract base stats
+        base_stats = {}
+        for stat in data.get('stats', []):
+            stat_name = stat['stat']['name']
+            base_value = stat['base_stat']
+            mapping = {
+                'hp': 'hp',
+                'attack': 'atk',
+                'defense': 'def',
+                'special-attack': 'spa',
+                'special-defense': 'spd',
+                'speed': 'spe'
+            }
+            if stat_name in mapping:
+                base_stats[mapping[stat_name]] = base_value
+
+        # Ensure all stats exist
+        for s in ['hp','atk','def','spa','spd','spe']:
+            base_stats.setdefault(s, 0)
+
+        # Max-level stats
+        IV = 31
+        EV = 252
+        LEVEL = 100
+        max_level_stats = {}
+        for stat_name, base in base_stats.items():
+            if stat_name == 'hp':
+                max_level_stats[stat_name] = int(((base * 2 + IV + EV // 4) * LEVEL) / 100 + LEVEL + 10)
+            else:
+                max_level_stats[stat_name] = int(((base * 2 + IV + EV // 4) * LEVEL) / 100 + 5)
+
+        result = {
+            'base_stats': base_stats,
+            'max_level_stats': max_level_stats,
+            'types': [t['type']['name'].title() for t in data.get('types', [])],
+            'height': data.get('height', 0) / 10,  # meters
+            'weight': data.get('weight', 0) / 10,  # kg
+            'abilities': [a['ability']['name'].replace('-', ' ').title() for a in data.get('abilities', [])]
+        }
+
+        # Cache the fresh result
+        _STATS_CACHE[name_key] = result
+        return result
 
     except Exception as e:
         print(f"Error fetching PokeAPI stats for {pokemon_name}: {e}")
@@ -369,8 +367,12 @@ async def _stats_text(character: dict) -> str:
 
     return stats_text
 
-async def _fetch_pokeapi_moves(pokemon_name: str, session: aiohttp.ClientSession) -> Optional[List[dict]]:
-    """Fetch top damaging moves for a Pokémon, ensuring moves of all its types are included."""
+async def _fetch_pokeapi_moves(pokemon_name: str) -> Optional[List[dict]]:
+    """Fetch top damaging moves for a Pokémon, ensuring moves of all its types are included.
+
+    Requests go through the shared HTTP client. Move details rarely change, so
+    they are served from the client's response cache across Pokémon.
+    """
     
     name_key = normalize_name(pokemon_name)
     if not name_key:
@@ -384,10 +386,9 @@ async def _fetch_pokeapi_moves(pokemon_name: str, session: aiohttp.ClientSession
 
     try:
         # Fetch Pokémon details
-        resp = await session.get(f"https://pokeapi.co/api/v2/pokemon/{clean_name}")
-        if resp.status != 200:
+        data = await http_client.get_json(f"https://pokeapi.co/api/v2/pokemon/{clean_name}")
+        if data is None:
             return None
-        data = await resp.json()
 
         stats = {s["stat"]["name"]: s["base_stat"] for s in data.get("stats", [])}
         atk = stats.get("attack", 0)
@@ -414,10 +415,13 @@ async def _fetch_pokeapi_moves(pokemon_name: str, session: aiohttp.ClientSession
             if not murl:
                 return
             async with sem:
-                r = await session.get(murl)
-                if r.status != 200:
+                try:
+                    # Move documents are small and shared by many Pokémon, so they are worth caching
+                    j = await http_client.get_json(murl, cache=True, cache_ttl=MOVE_DETAIL_CACHE_TTL)
+                except Exception:
+                    return
+                if j is None:
                     return
-                j = await r.json()
                 power = j.get("power")
                 accuracy = j.get("accuracy")
                 mtype = (j.get("type", {}) or {}).get("name", "Unknown").title()
@@ -573,10 +577,9 @@ async def _moves_text(character: dict) -> str:
     if not parsed_moves:
         name = character.get("name") or ""
         try:
-            async with aiohttp.ClientSession() as session:
-                api_moves = await _fetch_pokeapi_moves(name, session)
-                if api_moves:
-                    parsed_moves = api_moves
+            api_moves = await _fetch_pokeapi_moves(name)
+            if api_moves:
+                parsed_moves = api_moves
         except Exception:
             parsed_moves = []
 
@@ -1,16 +1,21 @@
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
 import gc
 import json
 import logging
 import random
 import time
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
 import aiohttp
 import asyncpg
 from cachetools import TTLCache
 
+from modules.collection_view import invalidate_all_collection_views, invalidate_collection_view
+from modules.currency_ledger import CURRENCIES, currency_ledger
+from modules.search_index import invalidate_search_index
+from modules.user_cache import user_cache
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -25,6 +30,9 @@ _user_stats_cache = TTLCache(maxsize=100, ttl=600)  # 10 minutes
 _leaderboard_cache = TTLCache(maxsize=3, ttl=180)  # 3 minutes
 _chat_settings_cache = TTLCache(maxsize=25, ttl=900)  # 15 minutes
 
+# Account whose admin-granted ('give'/'massgive') copies don't count as collecting
+EXCLUDED_COLLECTOR_ID = 6669536790
+
 # Performance tracking
 _performance_stats = {
     'total_queries': 0,
@@ -110,6 +118,13 @@ def clear_all_caches():
     _user_stats_cache.clear()
     _leaderboard_cache.clear()
     _chat_settings_cache.clear()
+    invalidate_all_collection_views()
+    invalidate_search_index()
+
+def _current_week_start():
+    """Monday (UTC) of the current week; battle results and counters are keyed by it"""
+    today = datetime.utcnow().date()
+    return today - timedelta(days=today.weekday())
 
 def get_postgres_pool():
     """Get the PostgreSQL connection pool"""
@@ -118,6 +133,12 @@ def get_postgres_pool():
         raise RuntimeError("PostgreSQL pool not initialized. Call init_database() first.")
     return _pg_pool
 
+async def open_dedicated_connection():
+    """Open a connection outside the pool, for session state that outlives one query (advisory locks)"""
+    if _postgres_uri is None:
+        raise RuntimeError("PostgreSQL pool not initialized. Call init_database() first.")
+    return await asyncpg.connect(_postgres_uri, command_timeout=30)
+
 async def init_database(postgres_uri: str):
     """Initialize PostgreSQL connection pool"""
     global _pg_pool, _postgres_uri, _db_instance
@@ -207,6 +228,11 @@ async def run_column_migrations():
             ALTER TABLE users
             ADD COLUMN IF NOT EXISTS last_safari TIMESTAMP;
         ''')
+        # Loan reminder/overdue scans only touch users with an active loan
+        await conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_users_active_loans
+            ON users (loan_due, last_loan_reminder) WHERE loan_active = TRUE;
+        ''')
         # Characters table columns
         await conn.execute('''
             DO $$
@@ -275,6 +301,9 @@ async def run_column_migrations():
                 claimed_by BIGINT[] DEFAULT ARRAY[]::BIGINT[]
             );
         ''')
+        await conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_redeem_codes_lower_code ON redeem_codes (LOWER(code));
+        ''')
         
         # Create battles table
         await conn.execute('''
@@ -301,8 +330,331 @@ async def run_column_migrations():
             CREATE INDEX IF NOT EXISTS idx_battles_opponent_id ON battles(opponent_id);
             CREATE INDEX IF NOT EXISTS idx_battles_status ON battles(status);
             CREATE INDEX IF NOT EXISTS idx_battles_battle_id ON battles(battle_id);
+            CREATE INDEX IF NOT EXISTS idx_battles_pair_created ON battles(challenger_id, opponent_id, created_at);
         ''')
         
+        # Battle results: one compact row per finished battle keyed by week,
+        # team/log payloads in cold storage, and per-user win/loss counters
+        # that are updated as each result is recorded
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS battle_results (
+                battle_id VARCHAR(100) PRIMARY KEY,
+                week_start DATE NOT NULL,
+                challenger_id BIGINT NOT NULL,
+                opponent_id BIGINT NOT NULL,
+                winner_id BIGINT,
+                loser_id BIGINT,
+                outcome VARCHAR(20) NOT NULL,
+                rounds INTEGER DEFAULT 0,
+                duration_seconds INTEGER DEFAULT 0,
+                winner_tokens BIGINT DEFAULT 0,
+                loser_tokens BIGINT DEFAULT 0,
+                finished_at TIMESTAMP NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_battle_results_week_winner ON battle_results(week_start, winner_id);
+            CREATE INDEX IF NOT EXISTS idx_battle_results_challenger ON battle_results(challenger_id, finished_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_battle_results_opponent ON battle_results(opponent_id, finished_at DESC);
+            
+            CREATE TABLE IF NOT EXISTS battle_logs (
+                battle_id VARCHAR(100) PRIMARY KEY,
+                challenger_team JSONB DEFAULT '[]',
+                opponent_team JSONB DEFAULT '[]',
+                battle_log JSONB DEFAULT '[]',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            
+            CREATE TABLE IF NOT EXISTS battle_stats (
+                user_id BIGINT PRIMARY KEY,
+                wins INTEGER DEFAULT 0,
+                losses INTEGER DEFAULT 0,
+                draws INTEGER DEFAULT 0,
+                week_start DATE,
+                weekly_wins INTEGER DEFAULT 0,
+                weekly_losses INTEGER DEFAULT 0,
+                last_battle_at TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_battle_stats_weekly ON battle_stats(week_start, weekly_wins DESC);
+            CREATE INDEX IF NOT EXISTS idx_battle_stats_wins ON battle_stats(wins DESC);
+        ''')
+        
+        # One-time backfill of results and counters from battles finished
+        # before battle_results existed
+        await conn.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM battle_results) AND NOT EXISTS (SELECT 1 FROM battle_stats) THEN
+                    INSERT INTO battle_results (
+                        battle_id, week_start, challenger_id, opponent_id, winner_id, loser_id,
+                        outcome, rounds, duration_seconds, finished_at
+                    )
+                    SELECT battle_id,
+                           date_trunc('week', finished_at)::date,
+                           challenger_id, opponent_id, winner_id,
+                           CASE WHEN winner_id IS NULL THEN NULL
+                                WHEN winner_id = challenger_id THEN opponent_id
+                                ELSE challenger_id END,
+                           CASE WHEN winner_id IS NULL THEN 'draw' ELSE 'win' END,
+                           COALESCE(current_round, 0),
+                           GREATEST(0, EXTRACT(EPOCH FROM finished_at - created_at))::int,
+                           finished_at
+                    FROM battles
+                    WHERE status = 'finished' AND finished_at IS NOT NULL
+                    ON CONFLICT (battle_id) DO NOTHING;
+                    
+                    INSERT INTO battle_stats (
+                        user_id, wins, losses, draws, week_start, weekly_wins, weekly_losses, last_battle_at
+                    )
+                    SELECT user_id,
+                           COUNT(*) FILTER (WHERE result = 'win'),
+                           COUNT(*) FILTER (WHERE result = 'loss'),
+                           COUNT(*) FILTER (WHERE result = 'draw'),
+                           date_trunc('week', now() AT TIME ZONE 'UTC')::date,
+                           COUNT(*) FILTER (WHERE result = 'win' AND week_start = date_trunc('week', now() AT TIME ZONE 'UTC')::date),
+                           COUNT(*) FILTER (WHERE result = 'loss' AND week_start = date_trunc('week', now() AT TIME ZONE 'UTC')::date),
+                           MAX(finished_at)
+                    FROM (
+                        SELECT winner_id AS user_id, 'win' AS result, week_start, finished_at
+                        FROM battle_results WHERE winner_id IS NOT NULL
+                        UNION ALL
+                        SELECT loser_id, 'loss', week_start, finished_at
+                        FROM battle_results WHERE loser_id IS NOT NULL
+                        UNION ALL
+                        SELECT challenger_id, 'draw', week_start, finished_at
+                        FROM battle_results WHERE outcome = 'draw'
+                        UNION ALL
+                        SELECT opponent_id, 'draw', week_start, finished_at
+                        FROM battle_results WHERE outcome = 'draw'
+                    ) r
+                    GROUP BY user_id
+                    ON CONFLICT (user_id) DO NOTHING;
+                END IF;
+            END$$;
+        ''')
+        
+        # Per-character ownership counters and holders, kept in sync with
+        # users.characters by a trigger so every write path updates them
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS character_owners (
+                character_id INTEGER NOT NULL,
+                user_id BIGINT NOT NULL,
+                copies INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (character_id, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_character_owners_top ON character_owners(character_id, copies DESC);
+            CREATE INDEX IF NOT EXISTS idx_character_owners_user ON character_owners(user_id);
+            
+            CREATE TABLE IF NOT EXISTS character_ownership_stats (
+                character_id INTEGER PRIMARY KEY,
+                unique_owners INTEGER NOT NULL DEFAULT 0,
+                total_copies INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            
+            CREATE OR REPLACE FUNCTION sync_character_ownership() RETURNS trigger AS $fn$
+            DECLARE
+                old_chars INTEGER[] := '{}';
+                new_chars INTEGER[] := '{}';
+                added INTEGER[] := '{}';
+                removed INTEGER[] := '{}';
+                owner_id BIGINT;
+                hint TEXT;
+                old_len INTEGER;
+                delta RECORD;
+                old_n INTEGER;
+                new_n INTEGER;
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    old_chars := COALESCE(OLD.characters, '{}');
+                    owner_id := OLD.user_id;
+                END IF;
+                IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                    new_chars := COALESCE(NEW.characters, '{}');
+                    owner_id := NEW.user_id;
+                END IF;
+                
+                -- Work out only what changed, so the hot paths don't rescan whole collections
+                old_len := cardinality(old_chars);
+                hint := current_setting('app.characters_removed', true);
+                IF TG_OP <> 'UPDATE' THEN
+                    added := new_chars;
+                    removed := old_chars;
+                ELSIF cardinality(new_chars) >= old_len AND new_chars[1:old_len] = old_chars THEN
+                    -- Append (claims, purchases, received trades): the delta is the tail
+                    added := new_chars[old_len + 1:cardinality(new_chars)];
+                ELSIF hint IS NOT NULL AND hint <> '' AND split_part(hint, ':', 1)::bigint = owner_id
+                      AND cardinality(new_chars) = old_len - cardinality(split_part(hint, ':', 2)::integer[]) THEN
+                    -- move_characters announces the multiset it removes
+                    removed := split_part(hint, ':', 2)::integer[];
+                    PERFORM set_config('app.characters_removed', '', true);
+                ELSE
+                    -- Arbitrary rewrite: fall back to the full multiset diff
+                    added := new_chars;
+                    removed := old_chars;
+                END IF;
+                
+                FOR delta IN
+                    SELECT character_id, SUM(n)::int AS n
+                    FROM (
+                        SELECT c AS character_id, 1 AS n FROM unnest(added) AS c
+                        UNION ALL
+                        SELECT c, -1 FROM unnest(removed) AS c
+                    ) changes
+                    WHERE character_id IS NOT NULL
+                    GROUP BY character_id
+                    HAVING SUM(n) <> 0
+                    -- Fixed lock order, so concurrent trades over the same characters can't deadlock
+                    ORDER BY character_id
+                LOOP
+                    SELECT copies INTO old_n FROM character_owners
+                    WHERE character_id = delta.character_id AND user_id = owner_id
+                    FOR UPDATE;
+                    old_n := COALESCE(old_n, 0);
+                    new_n := GREATEST(0, old_n + delta.n);
+                    
+                    IF new_n > 0 THEN
+                        INSERT INTO character_owners (character_id, user_id, copies)
+                        VALUES (delta.character_id, owner_id, new_n)
+                        ON CONFLICT (character_id, user_id) DO UPDATE SET copies = EXCLUDED.copies;
+                    ELSE
+                        DELETE FROM character_owners
+                        WHERE character_id = delta.character_id AND user_id = owner_id;
+                    END IF;
+                    
+                    INSERT INTO character_ownership_stats (character_id, unique_owners, total_copies, updated_at)
+                    VALUES (
+                        delta.character_id,
+                        GREATEST(0, (new_n > 0)::int - (old_n > 0)::int),
+                        GREATEST(0, new_n - old_n),
+                        CURRENT_TIMESTAMP
+                    )
+                    ON CONFLICT (character_id) DO UPDATE SET
+                        unique_owners = GREATEST(0, character_ownership_stats.unique_owners
+                            + (new_n > 0)::int - (old_n > 0)::int),
+                        total_copies = GREATEST(0, character_ownership_stats.total_copies
+                            + new_n - old_n),
+                        updated_at = CURRENT_TIMESTAMP;
+                END LOOP;
+                RETURN NULL;
+            END
+            $fn$ LANGUAGE plpgsql;
+        ''')
+        
+        # One-time backfill, done under a lock so no update slips in between
+        # the snapshot and the trigger going live
+        await conn.execute('''
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'trg_sync_character_ownership') THEN
+                    LOCK TABLE users IN SHARE ROW EXCLUSIVE MODE;
+                    DELETE FROM character_owners;
+                    DELETE FROM character_ownership_stats;
+                    
+                    INSERT INTO character_owners (character_id, user_id, copies)
+                    SELECT c, u.user_id, COUNT(*)
+                    FROM users u, unnest(u.characters) AS c
+                    WHERE c IS NOT NULL
+                    GROUP BY c, u.user_id;
+                    
+                    INSERT INTO character_ownership_stats (character_id, unique_owners, total_copies)
+                    SELECT character_id, COUNT(*), SUM(copies)
+                    FROM character_owners
+                    GROUP BY character_id;
+                    
+                    CREATE TRIGGER trg_sync_character_ownership
+                    AFTER INSERT OR DELETE OR UPDATE OF characters ON users
+                    FOR EACH ROW EXECUTE PROCEDURE sync_character_ownership();
+                END IF;
+            END$$;
+        ''')
+        
+        # Telegram file_ids harvested from the first send of each character's media
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS character_media_refs (
+                character_id INTEGER PRIMARY KEY,
+                media_type VARCHAR(10) NOT NULL,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                source_url TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+        
+        # Append-only record of wallet/bank/shard changes, written in batches by modules.currency_ledger
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS currency_ledger (
+                id BIGSERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                currency VARCHAR(10) NOT NULL,
+                delta BIGINT NOT NULL,
+                balance BIGINT,
+                reason VARCHAR(32) NOT NULL,
+                counterparty BIGINT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_currency_ledger_user ON currency_ledger (user_id, created_at);
+        ''')
+
+        # Auctions and their escrowed bids (modules.auction_engine)
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS auctions (
+                auction_id VARCHAR(64) PRIMARY KEY,
+                character_id INTEGER NOT NULL,
+                base_price BIGINT NOT NULL,
+                min_increment BIGINT NOT NULL DEFAULT 10000,
+                creator_id BIGINT,
+                end_time TIMESTAMPTZ NOT NULL,
+                status VARCHAR(10) NOT NULL DEFAULT 'active',
+                highest_bid BIGINT,
+                highest_bidder BIGINT,
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+                closed_at TIMESTAMPTZ
+            );
+            CREATE INDEX IF NOT EXISTS idx_auctions_active_end ON auctions (end_time) WHERE status = 'active';
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_auctions_active_character ON auctions (character_id) WHERE status = 'active';
+            CREATE TABLE IF NOT EXISTS auction_bids (
+                id BIGSERIAL PRIMARY KEY,
+                auction_id VARCHAR(64) NOT NULL REFERENCES auctions (auction_id),
+                user_id BIGINT NOT NULL,
+                amount BIGINT NOT NULL,
+                status VARCHAR(10) NOT NULL DEFAULT 'held',
+                created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_auction_bids_auction ON auction_bids (auction_id, amount DESC);
+        ''')
+        # Auction times were naive UTC; the engine now compares timezone-aware datetimes
+        await conn.execute('''
+            DO $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM information_schema.columns
+                           WHERE table_name = 'auctions' AND column_name = 'end_time'
+                             AND data_type = 'timestamp without time zone') THEN
+                    ALTER TABLE auctions
+                        ALTER COLUMN end_time TYPE TIMESTAMPTZ USING end_time AT TIME ZONE 'UTC',
+                        ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at AT TIME ZONE 'UTC',
+                        ALTER COLUMN closed_at TYPE TIMESTAMPTZ USING closed_at AT TIME ZONE 'UTC';
+                    ALTER TABLE auction_bids
+                        ALTER COLUMN created_at TYPE TIMESTAMPTZ USING created_at AT TIME ZONE 'UTC';
+                END IF;
+            END $$;
+        ''')
+
+        # Broadcast jobs and their resume cursor (modules.broadcast_engine)
+        await conn.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                started_by BIGINT,
+                payload JSONB NOT NULL,
+                status VARCHAR(10) NOT NULL DEFAULT 'running',
+                phase VARCHAR(10) NOT NULL DEFAULT 'users',
+                cursor_id BIGINT,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                pruned INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        ''')
+
         # Ensure all required columns exist (for existing tables)
         await conn.execute('''
             DO $$
@@ -400,6 +752,7 @@ class PostgresDatabase:
                         last_loan_reminder IS NULL
                         OR last_loan_reminder <= NOW() - make_interval(hours => $1::int)
                       )
+                    ORDER BY loan_due
                     """,
                     min_hours_since_last,
                 )
@@ -417,6 +770,37 @@ class PostgresDatabase:
                 )
         except Exception as e:
             logger.error(f"Error marking loan reminder sent for {user_id}: {e}")
+
+    async def mark_loan_reminders_sent(self, user_ids: List[int]):
+        """Stamp last_loan_reminder for a batch of users in one statement."""
+        if not user_ids:
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE users SET last_loan_reminder = NOW() WHERE user_id = ANY($1::bigint[])",
+                    user_ids,
+                )
+        except Exception as e:
+            logger.error(f"Error marking {len(user_ids)} loan reminders sent: {e}")
+
+    async def mark_overdue_loans(self) -> List[int]:
+        """Flag every active loan past its due date as defaulted; returns the newly defaulted users."""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    """
+                    UPDATE users SET loan_defaulted = TRUE
+                    WHERE loan_active = TRUE
+                      AND loan_due < (NOW() AT TIME ZONE 'UTC')
+                      AND loan_defaulted IS NOT TRUE
+                    RETURNING user_id
+                    """
+                )
+                return [row['user_id'] for row in rows]
+        except Exception as e:
+            logger.error(f"Error marking overdue loans: {e}")
+            return []
     async def ensure_loan_columns(self):
         """Ensure loan columns exist on users."""
         try:
@@ -494,6 +878,7 @@ class PostgresDatabase:
         """Remove character from all users' collections but keep in database."""
         async with self.pool.acquire() as conn:
             await conn.execute("UPDATE users SET characters = array_remove(characters, $1)", character_id)
+        invalidate_all_collection_views()
         return True
     async def delete_character(self, character_id: int):
         """Delete character from database and remove from all user collections."""
@@ -505,6 +890,8 @@ class PostgresDatabase:
         # Invalidate character cache
         if character_id in _character_cache:
             del _character_cache[character_id]
+        invalidate_all_collection_views()
+        invalidate_search_index()
         return True
     async def edit_character(self, character_id: int, update_data: dict):
         """Edit character fields by character_id."""
@@ -524,6 +911,8 @@ class PostgresDatabase:
         # Invalidate character cache so updates are reflected
         if character_id in _character_cache:
             del _character_cache[character_id]
+        invalidate_all_collection_views()
+        invalidate_search_index()
         return True
     async def add_character(self, character_data: dict):
         """Add a new character to the database and return its ID."""
@@ -552,7 +941,56 @@ class PostgresDatabase:
                 data.get("mega", False),
                 data.get("type")
             )
+            invalidate_search_index()
             return result["character_id"] if result else None
+
+    async def add_characters_bulk(self, characters: list) -> list:
+        """Insert many characters in one statement; returns their new IDs in input order."""
+        if not characters:
+            return []
+        columns = {
+            'name': [], 'anime': [], 'rarity': [], 'file_id': [], 'img_url': [],
+            'is_video': [], 'added_by': [], 'mega': [], 'type': [],
+        }
+        for data in characters:
+            anime = data.get("anime")
+            columns['name'].append(data.get("name"))
+            columns['anime'].append(anime if anime and anime.strip() else "Unknown Anime")
+            columns['rarity'].append(data.get("rarity"))
+            columns['file_id'].append(data.get("file_id"))
+            columns['img_url'].append(data.get("img_url"))
+            columns['is_video'].append(bool(data.get("is_video", False)))
+            columns['added_by'].append(data.get("added_by"))
+            columns['mega'].append(bool(data.get("mega", False)))
+            columns['type'].append(data.get("type"))
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                # IDs are drawn per input row and returned with its ordinal, so the mapping
+                # back to the input does not depend on sequence or RETURNING order
+                rows = await conn.fetch(
+                    """
+                    WITH input AS (
+                        SELECT t.*, nextval(pg_get_serial_sequence('characters', 'character_id')) AS character_id
+                        FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::text[],
+                                    $6::boolean[], $7::bigint[], $8::boolean[], $9::text[])
+                             WITH ORDINALITY AS t(name, anime, rarity, file_id, img_url, is_video, added_by, mega, type, ord)
+                    ), inserted AS (
+                        INSERT INTO characters (character_id, name, anime, rarity, file_id, img_url, is_video, added_by, mega, type, created_at)
+                        SELECT character_id, name, anime, rarity, file_id, img_url, is_video, added_by, mega, type, CURRENT_TIMESTAMP
+                        FROM input
+                        ORDER BY ord
+                        RETURNING character_id
+                    )
+                    SELECT input.character_id
+                    FROM input JOIN inserted USING (character_id)
+                    ORDER BY input.ord
+                    """,
+                    columns['name'], columns['anime'], columns['rarity'], columns['file_id'], columns['img_url'],
+                    columns['is_video'], columns['added_by'], columns['mega'], columns['type']
+                )
+        invalidate_search_index()
+        return [row['character_id'] for row in rows]
+
     async def add_user_to_group(self, user_id, group_id):
         """Stub for add_user_to_group to prevent AttributeError. Does nothing."""
         pass
@@ -716,6 +1154,7 @@ class PostgresDatabase:
         safe_entries = convert(sold_entries)
         try:
             await self.pool.execute(query, new_characters, wallet_delta, json.dumps(safe_entries), user_id)
+            invalidate_collection_view(user_id)
         except Exception as e:
             pass  # Error handling, optionally print or raise
             raise
@@ -813,6 +1252,398 @@ class PostgresDatabase:
             pass  # Error fetching all user IDs
             return []
 
+    async def get_broadcast_targets(self, phase: str, after: Optional[int], limit: int) -> List[int]:
+        """Next page of broadcast recipients after ``after``, in id order ('users' or 'groups')."""
+        if phase == 'users':
+            query = "SELECT user_id AS id FROM users WHERE $1::bigint IS NULL OR user_id > $1 ORDER BY user_id LIMIT $2"
+        else:
+            query = "SELECT chat_id AS id FROM chat_settings WHERE $1::bigint IS NULL OR chat_id > $1 ORDER BY chat_id LIMIT $2"
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(query, after, limit)
+        return [row['id'] for row in rows]
+
+    async def prune_dead_chats(self, chat_ids: List[int]) -> int:
+        """Forget groups the bot can no longer post to: chat settings and users' group membership."""
+        if not chat_ids:
+            return 0
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                status = await conn.execute("DELETE FROM chat_settings WHERE chat_id = ANY($1::bigint[])", chat_ids)
+                await conn.execute("""
+                    UPDATE users
+                    SET groups = ARRAY(SELECT g FROM unnest(groups) AS g WHERE g <> ALL($1::bigint[]))
+                    WHERE groups && $1::bigint[]
+                """, chat_ids)
+        return int(status.split()[-1])
+
+    async def create_broadcast(self, started_by: int, payload: Dict) -> int:
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                "INSERT INTO broadcasts (started_by, payload) VALUES ($1, $2::jsonb) RETURNING id",
+                started_by, json.dumps(payload)
+            )
+
+    async def get_running_broadcasts(self) -> List[Dict]:
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id")
+        broadcasts = []
+        for row in rows:
+            job = dict(row)
+            if isinstance(job['payload'], str):
+                job['payload'] = json.loads(job['payload'])
+            broadcasts.append(job)
+        return broadcasts
+
+    async def checkpoint_broadcast(self, broadcast_id: int, phase: str, cursor_id: Optional[int], sent: int,
+                                   failed: int, pruned: int, status: str = 'running'):
+        """Persist a broadcast's progress so a restart resumes after ``cursor_id``."""
+        async with self.pool.acquire() as conn:
+            await conn.execute("""
+                UPDATE broadcasts
+                SET phase = $2, cursor_id = $3, sent = $4, failed = $5, pruned = $6, status = $7,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = $1
+            """, broadcast_id, phase, cursor_id, sent, failed, pruned, status)
+
+    async def set_store_offers_bulk(self, user_ids: list, offers: list) -> int:
+        """Write many users' store offers (JSON strings) in one statement; returns rows updated."""
+        if not user_ids:
+            return 0
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(
+                """
+                UPDATE users AS u SET store_offer = v.offer::jsonb
+                FROM unnest($1::bigint[], $2::text[]) AS v(user_id, offer)
+                WHERE u.user_id = v.user_id
+                """,
+                user_ids, offers
+            )
+        return int(status.split()[-1])
+
+    async def clear_store_offers(self) -> int:
+        """Clear every store offer so each is regenerated on the user's next /mystore."""
+        async with self.pool.acquire() as conn:
+            status = await conn.execute("UPDATE users SET store_offer = NULL WHERE store_offer IS NOT NULL")
+        return int(status.split()[-1])
+
+    async def get_active_actions(self) -> list:
+        """(user_id, active_action) for every user with a persisted action, for rehydrating the registry."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT user_id, active_action FROM users WHERE active_action IS NOT NULL")
+        return [(row['user_id'], row['active_action']) for row in rows]
+
+    async def set_active_actions_bulk(self, user_ids: list, actions: list) -> int:
+        """Write many users' active actions (JSON strings, None clears) in one statement; returns rows updated."""
+        if not user_ids:
+            return 0
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(
+                """
+                UPDATE users AS u SET active_action = v.action::jsonb
+                FROM unnest($1::bigint[], $2::text[]) AS v(user_id, action)
+                WHERE u.user_id = v.user_id
+                """,
+                user_ids, actions
+            )
+        return int(status.split()[-1])
+
+    async def apply_currency(self, user_id: int, deltas: Dict[str, int], reason: str,
+                             set_fields: Optional[Dict[str, Any]] = None,
+                             counterparty: Optional[int] = None,
+                             where: Optional[Dict[str, Any]] = None,
+                             cooldown: Optional[Tuple[str, timedelta]] = None) -> Optional[Dict[str, int]]:
+        """Apply signed currency deltas to one user in a single guarded UPDATE.
+
+        Negative deltas only apply if the balance covers them, and ``set_fields``
+        (e.g. a claim timestamp) is written in the same statement. ``where``
+        adds ``column = value`` preconditions. ``cooldown`` is ``(column,
+        period)``: the update only applies if ``column`` is unset or at least
+        ``period`` older than the value ``set_fields`` writes to it. Returns the
+        new balances, or None if the user is missing or a guard failed. With
+        nothing to change (e.g. a zero amount) it returns the current balances.
+        """
+        deltas = {currency: int(amount) for currency, amount in deltas.items() if amount}
+        unknown = set(deltas) - set(CURRENCIES)
+        if unknown:
+            raise ValueError(f"Unknown currency: {', '.join(sorted(unknown))}")
+        set_clauses, guards, params = [], [], [user_id]
+        for currency, amount in deltas.items():
+            params.append(amount)
+            set_clauses.append(f"{currency} = COALESCE({currency}, 0) + ${len(params)}")
+            if amount < 0:
+                guards.append(f"COALESCE({currency}, 0) + ${len(params)} >= 0")
+        set_params = {}
+        for key, value in (set_fields or {}).items():
+            params.append(self._user_column_value(key, value))
+            set_clauses.append(f"{key} = ${len(params)}")
+            set_params[key] = len(params)
+        for key, value in (where or {}).items():
+            params.append(value)
+            guards.append(f"{key} = ${len(params)}")
+        if cooldown:
+            column, period = cooldown
+            if column not in set_params:
+                raise ValueError(f"cooldown column {column} must be set in set_fields")
+            params.append(period)
+            guards.append(f"({column} IS NULL OR {column} <= ${set_params[column]} - ${len(params)}::interval)")
+        returning = ', '.join(f"COALESCE({currency}, 0) AS {currency}" for currency in CURRENCIES)
+        guard_sql = ''.join(f" AND {guard}" for guard in guards)
+        if set_clauses:
+            sql = f"UPDATE users SET {', '.join(set_clauses)} WHERE user_id = $1{guard_sql} RETURNING {returning}"
+        else:
+            sql = f"SELECT {returning} FROM users WHERE user_id = $1{guard_sql}"
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(sql, *params)
+        if not row:
+            return None
+        if set_fields and 'characters' in set_fields:
+            invalidate_collection_view(user_id)
+        balances = dict(row)
+        for currency, amount in deltas.items():
+            currency_ledger.record(user_id, currency, amount, balances[currency], reason, counterparty)
+        return balances
+
+    async def buy_store_character(self, user_id: int, char_id: int, currency: str, price: int,
+                                  date: str) -> Optional[Dict[str, int]]:
+        """Pay for a store offer character and add it to the collection in one UPDATE.
+
+        Only applies while ``char_id`` is the pending purchase of today's offer
+        and not yet purchased, so a double confirm can't charge twice. Returns
+        the new balances, or None if the purchase was not applied.
+        """
+        if currency not in CURRENCIES:
+            raise ValueError(f"Unknown currency: {currency}")
+        returning = ', '.join(f"COALESCE({c}, 0) AS {c}" for c in CURRENCIES)
+        sql = f"""
+            UPDATE users
+            SET {currency} = COALESCE({currency}, 0) - $3,
+                characters = array_append(COALESCE(characters, '{{}}'::integer[]), $2::integer),
+                store_offer = jsonb_set(store_offer, '{{purchased}}',
+                                        COALESCE(store_offer->'purchased', '[]'::jsonb) || to_jsonb($2::integer))
+                              || '{{"pending_buy": null}}'::jsonb
+            WHERE user_id = $1
+              AND COALESCE({currency}, 0) >= $3
+              AND store_offer->>'date' = $4
+              AND store_offer->'pending_buy' = to_jsonb($2::integer)
+              AND NOT COALESCE(store_offer->'purchased', '[]'::jsonb) @> to_jsonb($2::integer)
+            RETURNING {returning}
+        """
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(sql, user_id, char_id, price, date)
+        if not row:
+            return None
+        invalidate_collection_view(user_id)
+        balances = dict(row)
+        currency_ledger.record(user_id, currency, -price, balances[currency], 'store_purchase')
+        return balances
+
+    async def credit(self, user_id: int, currency: str, amount: int, reason: str,
+                     counterparty: Optional[int] = None) -> Optional[int]:
+        """Add to a balance; returns the new balance, or None if the user is missing."""
+        if amount < 0:
+            raise ValueError("credit amount must not be negative")
+        balances = await self.apply_currency(user_id, {currency: amount}, reason, counterparty=counterparty)
+        return balances[currency] if balances else None
+
+    async def debit(self, user_id: int, currency: str, amount: int, reason: str,
+                    counterparty: Optional[int] = None) -> Optional[int]:
+        """Take from a balance if it covers ``amount``; returns the new balance, or None if it doesn't."""
+        if amount < 0:
+            raise ValueError("debit amount must not be negative")
+        balances = await self.apply_currency(user_id, {currency: -amount}, reason, counterparty=counterparty)
+        return balances[currency] if balances else None
+
+    async def transfer(self, from_user_id: int, to_user_id: int, currency: str, amount: int,
+                       reason: str) -> Optional[int]:
+        """Move ``amount`` between two users in one statement.
+
+        Returns the sender's new balance, or None if the sender can't cover it,
+        the receiver doesn't exist, or both are the same user.
+        """
+        if currency not in CURRENCIES:
+            raise ValueError(f"Unknown currency: {currency}")
+        if amount <= 0 or from_user_id == to_user_id:
+            return None
+        sql = f"""
+            WITH src AS (
+                UPDATE users SET {currency} = COALESCE({currency}, 0) - $3
+                WHERE user_id = $1 AND COALESCE({currency}, 0) >= $3
+                  AND EXISTS (SELECT 1 FROM users WHERE user_id = $2)
+                RETURNING {currency}
+            ), dst AS (
+                UPDATE users SET {currency} = COALESCE({currency}, 0) + $3
+                WHERE user_id = $2 AND EXISTS (SELECT 1 FROM src)
+                RETURNING {currency}
+            )
+            SELECT (SELECT {currency} FROM src) AS sender, (SELECT {currency} FROM dst) AS receiver
+        """
+        for attempt in range(2):
+            try:
+                async with self.pool.acquire() as conn:
+                    row = await conn.fetchrow(sql, from_user_id, to_user_id, amount)
+                break
+            except asyncpg.exceptions.DeadlockDetectedError:
+                # Two opposite transfers locked each other's rows; the other one went through
+                if attempt:
+                    raise
+        if row is None or row['sender'] is None:
+            return None
+        currency_ledger.record(from_user_id, currency, -amount, row['sender'], reason, to_user_id)
+        currency_ledger.record(to_user_id, currency, amount, row['receiver'], reason, from_user_id)
+        return row['sender']
+
+    async def insert_ledger_entries(self, entries: list):
+        """Write buffered currency ledger entries in one statement."""
+        if not entries:
+            return
+        user_ids, currencies, deltas, balances, reasons, counterparties, created = zip(*entries)
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO currency_ledger (user_id, currency, delta, balance, reason, counterparty, created_at)
+                SELECT user_id, currency, delta, balance, reason, counterparty, to_timestamp(created)::timestamp
+                FROM unnest($1::bigint[], $2::text[], $3::bigint[], $4::bigint[], $5::text[], $6::bigint[], $7::float8[])
+                     AS t(user_id, currency, delta, balance, reason, counterparty, created)
+                """,
+                list(user_ids), list(currencies), list(deltas), list(balances),
+                list(reasons), list(counterparties), list(created)
+            )
+
+    async def create_auction(self, auction_id: str, character_id: int, base_price: int, end_time: datetime,
+                             creator_id: int, min_increment: int = 10000) -> Optional[Dict]:
+        """Insert an active auction; returns it, or None if the character is already being auctioned."""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                INSERT INTO auctions (auction_id, character_id, base_price, min_increment, creator_id, end_time)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT DO NOTHING
+                RETURNING *
+            """, auction_id, character_id, base_price, min_increment, creator_id, end_time)
+        return dict(row) if row else None
+
+    async def get_active_auctions(self) -> List[Dict]:
+        """All active auctions, soonest ending first."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch("SELECT * FROM auctions WHERE status = 'active' ORDER BY end_time")
+        return [dict(row) for row in rows]
+
+    async def get_due_auction_ids(self, now: datetime) -> List[str]:
+        """Ids of active auctions whose end time has passed (served by the partial end_time index)."""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT auction_id FROM auctions WHERE status = 'active' AND end_time <= $1 ORDER BY end_time", now
+            )
+        return [row['auction_id'] for row in rows]
+
+    async def place_auction_bid(self, auction_id: str, user_id: int, amount: int, now: datetime) -> Dict:
+        """Escrow a bid and refund the previous highest bidder in one statement.
+
+        The bidder's wallet is only debited if it covers the bid, and the bid
+        only counts if the auction is still open, the bidder isn't already on
+        top and the amount meets the minimum. ``result['wallet']`` is None
+        when the bid was rejected; the other fields explain why.
+        """
+        sql = """
+            WITH auc AS (
+                SELECT auction_id, base_price, min_increment, highest_bid, highest_bidder
+                FROM auctions
+                WHERE auction_id = $1 AND status = 'active' AND end_time > $4
+                FOR UPDATE
+            ), ok AS (
+                SELECT * FROM auc
+                WHERE highest_bidder IS DISTINCT FROM $2
+                  AND $3 >= CASE WHEN highest_bid IS NULL THEN base_price ELSE highest_bid + min_increment END
+            ), hold AS (
+                UPDATE users SET wallet = wallet - $3
+                WHERE user_id = $2 AND COALESCE(wallet, 0) >= $3 AND EXISTS (SELECT 1 FROM ok)
+                RETURNING wallet
+            ), refund AS (
+                UPDATE users u SET wallet = COALESCE(u.wallet, 0) + ok.highest_bid
+                FROM ok
+                WHERE u.user_id = ok.highest_bidder AND ok.highest_bid IS NOT NULL AND EXISTS (SELECT 1 FROM hold)
+                RETURNING u.wallet
+            ), top AS (
+                UPDATE auctions SET highest_bid = $3, highest_bidder = $2
+                WHERE auction_id = $1 AND EXISTS (SELECT 1 FROM hold)
+            ), released AS (
+                UPDATE auction_bids SET status = 'refunded'
+                WHERE auction_id = $1 AND status = 'held' AND EXISTS (SELECT 1 FROM hold)
+            ), bid AS (
+                INSERT INTO auction_bids (auction_id, user_id, amount, created_at)
+                SELECT $1, $2, $3, $4 FROM hold
+            )
+            SELECT EXISTS (SELECT 1 FROM auc) AS open,
+                   (SELECT highest_bid FROM auc) AS previous_bid,
+                   (SELECT highest_bidder FROM auc) AS previous_bidder,
+                   (SELECT CASE WHEN highest_bid IS NULL THEN base_price ELSE highest_bid + min_increment END
+                    FROM auc) AS min_bid,
+                   (SELECT wallet FROM hold) AS wallet,
+                   (SELECT wallet FROM refund) AS refunded_wallet
+        """
+        async with self.pool.acquire() as conn:
+            row = dict(await conn.fetchrow(sql, auction_id, user_id, amount, now))
+        if row['wallet'] is not None:
+            currency_ledger.record(user_id, 'wallet', -amount, row['wallet'], 'auction_bid')
+            if row['previous_bidder'] is not None and row['previous_bid']:
+                currency_ledger.record(row['previous_bidder'], 'wallet', row['previous_bid'],
+                                       row['refunded_wallet'], 'auction_refund', user_id)
+        return row
+
+    async def close_auction(self, auction_id: str, now: datetime, cancel: bool = False) -> Optional[Dict]:
+        """Settle (or cancel) an active auction in one statement.
+
+        Settling hands the character to the highest bidder, whose escrow
+        becomes the payment. Cancelling refunds the escrow instead. Returns
+        the closed auction, or None if it was not active anymore.
+        """
+        if cancel:
+            outcome = """
+                released AS (
+                    UPDATE auction_bids b SET status = 'refunded' FROM auc
+                    WHERE b.auction_id = auc.auction_id AND b.status = 'held'
+                ), payout AS (
+                    UPDATE users u SET wallet = COALESCE(u.wallet, 0) + auc.highest_bid
+                    FROM auc WHERE u.user_id = auc.highest_bidder AND auc.highest_bid IS NOT NULL
+                    RETURNING u.wallet
+                )
+            """
+        else:
+            outcome = """
+                released AS (
+                    UPDATE auction_bids b SET status = 'won' FROM auc
+                    WHERE b.auction_id = auc.auction_id AND b.status = 'held'
+                ), payout AS (
+                    UPDATE users u SET
+                        characters = COALESCE(u.characters, '{}'::integer[]) || auc.character_id,
+                        collection_history = COALESCE(u.collection_history, '[]'::jsonb) || jsonb_build_array(
+                            jsonb_build_object('character_id', auc.character_id, 'collected_at', $4::text,
+                                               'source', 'auction'))
+                    FROM auc WHERE u.user_id = auc.highest_bidder
+                    RETURNING u.wallet
+                )
+            """
+        sql = f"""
+            WITH auc AS (
+                UPDATE auctions SET status = $2, closed_at = $3
+                WHERE auction_id = $1 AND status = 'active'
+                RETURNING *
+            ), {outcome}
+            SELECT auc.*, (SELECT wallet FROM payout) AS winner_wallet FROM auc
+        """
+        async with self.pool.acquire() as conn:
+            args = (auction_id, 'cancelled', now) if cancel else (auction_id, 'settled', now, now.isoformat())
+            row = await conn.fetchrow(sql, *args)
+        if row is None:
+            return None
+        auction = dict(row)
+        if auction['highest_bidder'] is not None:
+            if cancel and auction['highest_bid']:
+                currency_ledger.record(auction['highest_bidder'], 'wallet', auction['highest_bid'],
+                                       auction['winner_wallet'], 'auction_refund')
+            elif not cancel:
+                invalidate_collection_view(auction['highest_bidder'])
+        return auction
+
     async def get_characters_by_ids(self, char_ids: list) -> list:
         """Fetch characters by a list of character IDs."""
         if not char_ids:
@@ -927,19 +1758,15 @@ class PostgresDatabase:
                     """,
                     user_id, username, first_name, last_name
                 )
+            user_cache.remember(user_id, first_name, last_name, username)
             return True
         except Exception as e:
             logger.error(f"Error syncing user profile for {user_id}: {e}")
             return False
     
-    async def update_user(self, user_id: int, update_data: dict):
-        """Update user data"""
-        import json
-        set_clauses = []
-        params = []
-        idx = 1
-        from datetime import datetime
-        
+    @staticmethod
+    def _user_column_value(key: str, value):
+        """Convert a users column value the way asyncpg expects it"""
         def convert(obj):
             if isinstance(obj, dict):
                 return {k: convert(v) for k, v in obj.items()}
@@ -950,23 +1777,31 @@ class PostgresDatabase:
             else:
                 return obj
         
+        # Serialize dicts and lists for JSONB columns
+        if key in ['active_action', 'collection_preferences'] and isinstance(value, dict):
+            value = json.dumps(convert(value))
+        elif key == 'collection_history' and isinstance(value, list):
+            value = json.dumps(convert(value))
+        elif key == 'store_offer' and isinstance(value, dict):
+            value = json.dumps(convert(value))
+        elif key == 'claimed_achievements' and isinstance(value, list):
+            value = json.dumps(convert(value))
+        elif key == 'last_propose' and value:
+            if isinstance(value, str):
+                try:
+                    value = datetime.fromisoformat(value)
+                except Exception:
+                    pass  # If conversion fails, keep as is
+        return value
+
+    async def update_user(self, user_id: int, update_data: dict):
+        """Update user data"""
+        set_clauses = []
+        params = []
+        idx = 1
+        
         for key, value in update_data.items():
-            # Serialize dicts and lists for JSONB columns
-            if key in ['active_action', 'collection_preferences'] and isinstance(value, dict):
-                value = json.dumps(convert(value))
-            elif key == 'collection_history' and isinstance(value, list):
-                value = json.dumps(convert(value))
-            elif key == 'store_offer' and isinstance(value, dict):
-                value = json.dumps(convert(value))
-            elif key == 'claimed_achievements' and isinstance(value, list):
-                value = json.dumps(convert(value))
-            elif key == 'last_propose' and value:
-                if isinstance(value, str):
-                    try:
-                        value = datetime.fromisoformat(value)
-                    except Exception:
-                        pass  # If conversion fails, keep as is
-            
+            value = self._user_column_value(key, value)
             set_clauses.append(f"{key} = ${idx}")
             params.append(value)
             idx += 1
@@ -976,6 +1811,8 @@ class PostgresDatabase:
         params.append(user_id)
         async with self.pool.acquire() as conn:
             await conn.execute(sql, *params)
+        if 'characters' in update_data:
+            invalidate_collection_view(user_id)
         return True
 
     async def ensure_collection_handler_column(self):
@@ -1085,6 +1922,57 @@ class PostgresDatabase:
             logger.error(f"Error getting character by file_id: {e}")
             return None
     
+    async def get_media_ref(self, character_id: int) -> Optional[Dict]:
+        """Get the harvested Telegram file_id for a character's media"""
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(
+                    "SELECT character_id, media_type, file_id, file_unique_id, source_url FROM character_media_refs WHERE character_id = $1",
+                    character_id
+                )
+                return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"Error getting media ref for {character_id}: {e}")
+            return None
+
+    async def get_media_refs(self, character_ids: list) -> List[Dict]:
+        """Get harvested file_ids for many characters in one query"""
+        if not character_ids:
+            return []
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT character_id, media_type, file_id, file_unique_id, source_url FROM character_media_refs WHERE character_id = ANY($1::int[])",
+                    list(character_ids)
+                )
+                return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting media refs: {e}")
+            return []
+
+    async def save_media_ref(self, character_id: int, media_type: str, file_id: str,
+                             file_unique_id: Optional[str] = None, source_url: Optional[str] = None):
+        """Store (or replace) the harvested file_id for a character's media"""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO character_media_refs (character_id, media_type, file_id, file_unique_id, source_url, updated_at)
+                VALUES ($1, $2, $3, $4, $5, CURRENT_TIMESTAMP)
+                ON CONFLICT (character_id) DO UPDATE SET
+                    media_type = EXCLUDED.media_type,
+                    file_id = EXCLUDED.file_id,
+                    file_unique_id = EXCLUDED.file_unique_id,
+                    source_url = EXCLUDED.source_url,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                character_id, media_type, file_id, file_unique_id, source_url
+            )
+
+    async def delete_media_ref(self, character_id: int):
+        """Forget a file_id Telegram no longer accepts"""
+        async with self.pool.acquire() as conn:
+            await conn.execute("DELETE FROM character_media_refs WHERE character_id = $1", character_id)
+
     async def character_exists(self, character_id: int) -> bool:
         """Check if a character exists by character_id"""
         try:
@@ -1178,6 +2066,7 @@ class PostgresDatabase:
                     END
                 WHERE user_id = $1
             """, user_id, json.dumps(entry))
+        invalidate_collection_view(user_id)
     async def remove_character_from_user(self, user_id: int, character_id: int):
         """Remove character from user's collection"""
         try:
@@ -1201,27 +2090,115 @@ class PostgresDatabase:
                     # If no rows were affected, we're done
                     if result.split()[-1] == '0':
                         break
+            invalidate_collection_view(user_id)
                 
         except Exception as e:
             pass  # Error removing character from user
     async def remove_single_character_from_user(self, user_id: int, character_id: int):
         """Remove a single instance of character_id from user's characters array (not all)."""
         try:
-            async with self.pool.acquire() as conn:
-                # Get current characters array
-                row = await conn.fetchrow("SELECT characters FROM users WHERE user_id = $1", user_id)
-                if not row or not row['characters']:
-                    return False
-                chars = list(row['characters'])
-                if character_id in chars:
-                    chars.remove(character_id)
-                    await conn.execute("UPDATE users SET characters = $1 WHERE user_id = $2", chars, user_id)
-                    return True
-                return False
+            result = await self.move_characters(user_id, [character_id])
+            return result['ok']
         except Exception as e:
             pass  # Error removing single character
             return False
-    
+
+    async def add_characters(self, user_id: int, char_ids: List[int], source: str = 'collected') -> bool:
+        """Append many characters (duplicates allowed) and their history entries in one UPDATE."""
+        if not char_ids:
+            return False
+        now = datetime.utcnow().isoformat()
+        history = [{'character_id': cid, 'collected_at': now, 'source': source} for cid in char_ids]
+        async with self.pool.acquire() as conn:
+            status = await conn.execute("""
+                UPDATE users
+                SET characters = COALESCE(characters, '{}'::integer[]) || $2::integer[],
+                    collection_history = COALESCE(collection_history, '[]'::jsonb) || $3::jsonb
+                WHERE user_id = $1
+            """, user_id, list(char_ids), json.dumps(history))
+        invalidate_collection_view(user_id)
+        return status.split()[-1] != '0'
+
+    async def move_characters(self, from_user_id: int, char_ids: List[int], to_user_id: Optional[int] = None,
+                              wallet_delta: int = 0, reason: str = 'sell', source: str = 'gift',
+                              log_sold: bool = False) -> Dict[str, Any]:
+        """Remove a multiset of characters from one user, optionally handing them to another.
+
+        Ownership counts are checked, copies removed, the recipient's collection
+        and history extended and ``wallet_delta`` credited in one statement, so
+        a 500-card masssell is a single round trip. It is all or nothing: if
+        any id is short of copies (or the recipient doesn't exist) nothing
+        changes. Returns ``{'ok', 'results': {cid: {'requested', 'owned'}}, 'wallet'}``.
+        """
+        char_ids = [int(cid) for cid in char_ids]
+        if not char_ids or from_user_id == to_user_id:
+            return {'ok': False, 'results': {}, 'wallet': None}
+        now = datetime.utcnow().isoformat()
+        sold = [{'character_id': cid, 'sold_at': now, 'source': 'sold'} for cid in char_ids] if log_sold else []
+        received = [{'character_id': cid, 'collected_at': now, 'source': source} for cid in char_ids]
+        sql = """
+            WITH req AS (
+                SELECT c, count(*)::int AS k FROM unnest($2::integer[]) AS r(c) GROUP BY c
+            ), src AS (
+                SELECT characters FROM users WHERE user_id = $1 FOR UPDATE
+            ), dst AS (
+                SELECT user_id FROM users WHERE user_id = $5 FOR UPDATE
+            ), owned AS (
+                SELECT t.c, t.ord, row_number() OVER (PARTITION BY t.c ORDER BY t.ord) AS n
+                FROM src, unnest(src.characters) WITH ORDINALITY AS t(c, ord)
+            ), counts AS (
+                SELECT req.c, req.k, COALESCE(h.have, 0)::int AS have
+                FROM req LEFT JOIN (SELECT c, count(*) AS have FROM owned GROUP BY c) h USING (c)
+            ), verdict AS (
+                SELECT EXISTS (SELECT 1 FROM src)
+                       AND ($5::bigint IS NULL OR EXISTS (SELECT 1 FROM dst))
+                       AND (SELECT bool_and(have >= k) FROM counts) AS ok
+            ), removed AS (
+                UPDATE users SET
+                    characters = COALESCE((
+                        SELECT array_agg(o.c ORDER BY o.ord) FROM owned o LEFT JOIN req USING (c)
+                        WHERE o.n > COALESCE(req.k, 0)
+                    ), '{}'::integer[]),
+                    wallet = COALESCE(wallet, 0) + $3,
+                    collection_history = COALESCE(collection_history, '[]'::jsonb) || $4::jsonb
+                WHERE user_id = $1 AND (SELECT ok FROM verdict)
+                RETURNING wallet
+            ), added AS (
+                UPDATE users SET
+                    characters = COALESCE(characters, '{}'::integer[]) || $2::integer[],
+                    collection_history = COALESCE(collection_history, '[]'::jsonb) || $6::jsonb
+                WHERE user_id = $5 AND (SELECT ok FROM verdict)
+                RETURNING user_id
+            )
+            SELECT counts.c, counts.k, counts.have,
+                   (SELECT ok FROM verdict) AS ok, (SELECT wallet FROM removed) AS wallet
+            FROM counts
+        """
+        for attempt in range(2):
+            try:
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        # Lets the ownership trigger apply just this multiset instead of diffing the arrays
+                        await conn.execute("SELECT set_config('app.characters_removed', $1, true)",
+                                           f"{from_user_id}:{{{','.join(map(str, char_ids))}}}")
+                        rows = await conn.fetch(sql, from_user_id, char_ids, int(wallet_delta), json.dumps(sold),
+                                                to_user_id, json.dumps(received))
+                break
+            except asyncpg.exceptions.DeadlockDetectedError:
+                # Two opposite gifts locked each other's rows; the other one went through
+                if attempt:
+                    raise
+        results = {row['c']: {'requested': row['k'], 'owned': row['have']} for row in rows}
+        ok = bool(rows) and bool(rows[0]['ok']) and rows[0]['wallet'] is not None
+        wallet = rows[0]['wallet'] if ok else None
+        if ok:
+            invalidate_collection_view(from_user_id)
+            if to_user_id is not None:
+                invalidate_collection_view(to_user_id)
+            if wallet_delta:
+                currency_ledger.record(from_user_id, 'wallet', int(wallet_delta), wallet, reason, to_user_id)
+        return {'ok': ok, 'results': results, 'wallet': wallet}
+
     async def get_random_character(self, locked_rarities=None):
         """Get a random character"""
         try:
@@ -1962,6 +2939,8 @@ class PostgresDatabase:
         params.append(user_id)
         async with self.pool.acquire() as conn:
             await conn.execute(sql, *params)
+        if 'characters' in set_fields or 'characters' in push_fields:
+            invalidate_collection_view(user_id)
         return True
     
     async def find(self, query: dict = None, projection: dict = None):
@@ -2045,20 +3024,66 @@ class PostgresDatabase:
             logger.error(f"Error in get_character_collectors for character {character_id}: {e}")
             return []
         
+    async def get_character_ownership_stats(self, character_id: int) -> Dict[str, int]:
+        """Unique owners and total copies of a character (point lookup on character_ownership_stats)."""
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(
+                    "SELECT unique_owners, total_copies FROM character_ownership_stats WHERE character_id = $1",
+                    int(character_id)
+                )
+                if row:
+                    return {'unique_owners': row['unique_owners'], 'total_copies': row['total_copies']}
+        except Exception as e:
+            logger.error(f"Error in get_character_ownership_stats for character {character_id}: {e}")
+        return {'unique_owners': 0, 'total_copies': 0}
+
+    async def get_character_collector_count(self, character_id: int) -> int:
+        """Number of users who own character_id, excluding admin-granted copies (same rule as get_character_collectors)."""
+        try:
+            char_id_int = int(character_id)
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(
+                    f"""
+                    SELECT s.unique_owners,
+                        EXISTS (
+                            SELECT 1
+                            FROM character_owners o
+                            JOIN users u ON u.user_id = o.user_id
+                            WHERE o.character_id = $1 AND o.user_id = {EXCLUDED_COLLECTOR_ID}
+                            AND EXISTS (
+                                SELECT 1
+                                FROM jsonb_array_elements(COALESCE(u.collection_history, '[]'::jsonb)) AS entry
+                                WHERE entry->>'character_id' = $1::text
+                                AND entry->>'source' IN ('give', 'massgive')
+                            )
+                        ) AS excluded
+                    FROM character_ownership_stats s
+                    WHERE s.character_id = $1
+                    """,
+                    char_id_int
+                )
+                if not row:
+                    return 0
+                return max(0, row['unique_owners'] - (1 if row['excluded'] else 0))
+        except Exception as e:
+            logger.error(f"Error in get_character_collector_count for character {character_id}: {e}")
+            return 0
+
     async def get_top_collectors(self, character_id: int, limit: int = 5) -> list:
         """Return the top users who have collected the given character_id, with name, username, and count, excluding those who got it ONLY via admin commands."""
         try:
             char_id_int = int(character_id)
             async with self.pool.acquire() as conn:
                 rows = await conn.fetch(
-                    """
-                    SELECT u.user_id, u.first_name AS name, u.username,
-                        (SELECT COUNT(*) FROM unnest(u.characters) AS c WHERE c = $1) AS count
-                    FROM users u
-                    WHERE $1 = ANY(u.characters)
+                    f"""
+                    SELECT o.user_id, u.first_name AS name, u.username, o.copies AS count
+                    FROM character_owners o
+                    JOIN users u ON u.user_id = o.user_id
+                    WHERE o.character_id = $1
                     AND (
-                        -- Exclude user 6669536790 if they got this character via 'give' or 'massgive'
-                        u.user_id != 6669536790
+                        -- Exclude user {EXCLUDED_COLLECTOR_ID} if they got this character via 'give' or 'massgive'
+                        o.user_id != {EXCLUDED_COLLECTOR_ID}
                         OR
                         NOT EXISTS (
                             SELECT 1 
@@ -2067,7 +3092,7 @@ class PostgresDatabase:
                             AND entry->>'source' IN ('give', 'massgive')
                         )
                     )
-                    ORDER BY count DESC
+                    ORDER BY o.copies DESC
                     LIMIT $2
                     """,
                     char_id_int, limit
@@ -2084,14 +3109,14 @@ class PostgresDatabase:
         try:
             async with self.pool.acquire() as conn:
                 rows = await conn.fetch(
-                    '''
-                    SELECT u.user_id, u.first_name AS name, u.username,
-                        (SELECT COUNT(*) FROM unnest(u.characters) AS c WHERE c = $2) AS count
-                    FROM users u
-                    WHERE $2 = ANY(u.characters) AND $1::bigint = ANY(u.groups)
+                    f'''
+                    SELECT o.user_id, u.first_name AS name, u.username, o.copies AS count
+                    FROM character_owners o
+                    JOIN users u ON u.user_id = o.user_id
+                    WHERE o.character_id = $2 AND $1::bigint = ANY(u.groups)
                     AND (
-                        -- Exclude user 6669536790 if they got this character via 'give' or 'massgive'
-                        u.user_id != 6669536790
+                        -- Exclude user {EXCLUDED_COLLECTOR_ID} if they got this character via 'give' or 'massgive'
+                        o.user_id != {EXCLUDED_COLLECTOR_ID}
                         OR
                         NOT EXISTS (
                             SELECT 1 
@@ -2100,7 +3125,7 @@ class PostgresDatabase:
                             AND entry->>'source' IN ('give', 'massgive')
                         )
                     )
-                    ORDER BY count DESC
+                    ORDER BY o.copies DESC
                     LIMIT 10
                     ''', chat_id, character_id
                 )
@@ -2191,6 +3216,78 @@ class PostgresDatabase:
                 code, user_id
             )
 
+    async def claim_redeem_code(self, code: str, user_id: int) -> Dict[str, Any]:
+        """Claim a code and credit its reward in one statement.
+
+        The claim only succeeds while ``claims < max_claims`` and the user is
+        not in ``claimed_by``, so concurrent claimers can't over-claim.
+        ``status`` is 'ok', 'invalid', 'exhausted', 'claimed', 'missing'
+        (the character was deleted) or 'no_user'.
+        """
+        sql = """
+            WITH code_row AS (
+                SELECT $2 = ANY(COALESCE(r.claimed_by, '{}'::bigint[])) AS claimed,
+                       r.type IN ('token', 'shard')
+                           OR EXISTS (SELECT 1 FROM characters c WHERE c.character_id = r.character_id) AS reward_exists
+                FROM redeem_codes r WHERE LOWER(r.code) = LOWER($1)
+            ), claim AS (
+                UPDATE redeem_codes r
+                SET claims = r.claims + 1,
+                    claimed_by = array_append(COALESCE(r.claimed_by, '{}'::bigint[]), $2)
+                WHERE LOWER(r.code) = LOWER($1)
+                  AND r.claims < r.max_claims
+                  AND NOT ($2 = ANY(COALESCE(r.claimed_by, '{}'::bigint[])))
+                  AND EXISTS (SELECT 1 FROM users WHERE user_id = $2)
+                  AND (r.type IN ('token', 'shard')
+                       OR EXISTS (SELECT 1 FROM characters c WHERE c.character_id = r.character_id))
+                RETURNING r.type, r.character_id, r.token_amount, r.shard_amount, r.claims, r.max_claims
+            ), credited AS (
+                UPDATE users u
+                SET wallet = COALESCE(u.wallet, 0)
+                        + CASE WHEN c.type = 'token' THEN COALESCE(c.token_amount, 0) ELSE 0 END,
+                    shards = COALESCE(u.shards, 0)
+                        + CASE WHEN c.type = 'shard' THEN COALESCE(c.shard_amount, 0) ELSE 0 END,
+                    characters = CASE WHEN c.type IN ('token', 'shard') THEN u.characters
+                        ELSE COALESCE(u.characters, '{}'::integer[]) || c.character_id END,
+                    collection_history = CASE WHEN c.type IN ('token', 'shard') THEN u.collection_history
+                        ELSE COALESCE(u.collection_history, '[]'::jsonb) || jsonb_build_array(jsonb_build_object(
+                            'character_id', c.character_id, 'collected_at', $3::text, 'source', 'redeem'))
+                        END
+                FROM claim c
+                WHERE u.user_id = $2
+                RETURNING COALESCE(u.wallet, 0) AS wallet, COALESCE(u.shards, 0) AS shards
+            )
+            SELECT EXISTS (SELECT 1 FROM code_row) AS found,
+                   (SELECT claimed FROM code_row) AS claimed,
+                   (SELECT reward_exists FROM code_row) AS reward_exists,
+                   EXISTS (SELECT 1 FROM users WHERE user_id = $2) AS user_found,
+                   claim.*, credited.wallet, credited.shards
+            FROM (SELECT 1) AS one
+            LEFT JOIN claim ON TRUE
+            LEFT JOIN credited ON TRUE
+        """
+        async with self.pool.acquire() as conn:
+            row = dict(await conn.fetchrow(sql, code, user_id, datetime.utcnow().isoformat()))
+        if row['wallet'] is not None:
+            row['status'] = 'ok'
+            if row['type'] == 'token':
+                currency_ledger.record(user_id, 'wallet', row['token_amount'] or 0, row['wallet'], 'redeem')
+            elif row['type'] == 'shard':
+                currency_ledger.record(user_id, 'shards', row['shard_amount'] or 0, row['shards'], 'redeem')
+            else:
+                invalidate_collection_view(user_id)
+        elif not row['found']:
+            row['status'] = 'invalid'
+        elif not row['user_found']:
+            row['status'] = 'no_user'
+        elif row['claimed']:
+            row['status'] = 'claimed'
+        elif not row['reward_exists']:
+            row['status'] = 'missing'
+        else:
+            row['status'] = 'exhausted'
+        return row
+
     async def add_tdgoal_claim(self, user_id: int, today: str, task_id: str):
      async with self.pool.acquire() as conn:
         # Fetch current claimed
@@ -2221,6 +3318,8 @@ class PostgresDatabase:
             sql = f"UPDATE users SET {', '.join(set_clauses)}"
             async with self.pool.acquire() as conn:
                 await conn.execute(sql)
+            if 'characters' in unset_fields:
+                invalidate_all_collection_views()
             return True
         # You can add more logic for $set, $inc, etc. if needed
         return False
@@ -2499,36 +3598,20 @@ class PostgresDatabase:
     async def get_weekly_battle_winners(self, limit: int = 10):
         """Get users with most battle wins in the current week (Monday to Sunday)."""
         try:
-            from datetime import datetime, timedelta
-            
-            # Calculate the start of the current week (Monday)
-            now = datetime.utcnow()
-            days_since_monday = now.weekday()  # Monday is 0, Sunday is 6
-            start_of_week = now - timedelta(days=days_since_monday)
-            start_of_week = start_of_week.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-            # End of week is next Monday
-            end_of_week = start_of_week + timedelta(days=7)
-            
             query = """
             SELECT 
-                u.user_id,
+                s.user_id,
                 u.first_name,
-                COUNT(*) as wins_count
-            FROM users u
-            JOIN battles b ON u.user_id = b.winner_id
-            WHERE 
-                b.winner_id IS NOT NULL
-                AND b.status = 'finished'
-                AND b.finished_at >= $1
-                AND b.finished_at < $2
-            GROUP BY u.user_id, u.first_name
-            ORDER BY wins_count DESC
-            LIMIT $3
+                s.weekly_wins AS wins_count
+            FROM battle_stats s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.week_start = $1 AND s.weekly_wins > 0
+            ORDER BY s.weekly_wins DESC
+            LIMIT $2
             """
             
             async with self.pool.acquire() as conn:
-                rows = await conn.fetch(query, start_of_week, end_of_week, limit)
+                rows = await conn.fetch(query, _current_week_start(), limit)
             
             winners = []
             for row in rows:
@@ -2544,6 +3627,116 @@ class PostgresDatabase:
             logger.error(f"Error getting weekly battle winners: {e}")
             return []
 
+    async def record_battle_result(self, result: Dict[str, Any], challenger_team=None,
+                                   opponent_team=None, battle_log=None) -> bool:
+        """Record a finished battle once and bump both players' counters.
+        
+        ``result`` holds battle_id, challenger_id, opponent_id, winner_id,
+        loser_id, outcome ('win', 'draw', 'forfeit'), rounds, duration_seconds,
+        winner_tokens, loser_tokens and finished_at. Recording the same battle
+        twice is a no-op. Returns True if the result was new.
+        """
+        week_start = _current_week_start()
+        winner_id = result.get('winner_id')
+        loser_id = result.get('loser_id')
+        outcome = result.get('outcome') or ('win' if winner_id else 'draw')
+        
+        # (user_id, wins, losses, draws) deltas for the counters
+        deltas = []
+        if winner_id:
+            deltas.append((winner_id, 1, 0, 0))
+        if loser_id:
+            deltas.append((loser_id, 0, 1, 0))
+        if outcome == 'draw':
+            deltas.extend([(result['challenger_id'], 0, 0, 1), (result['opponent_id'], 0, 0, 1)])
+        
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    inserted = await conn.fetchval("""
+                        INSERT INTO battle_results (
+                            battle_id, week_start, challenger_id, opponent_id, winner_id, loser_id,
+                            outcome, rounds, duration_seconds, winner_tokens, loser_tokens, finished_at
+                        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                        ON CONFLICT (battle_id) DO NOTHING
+                        RETURNING 1
+                    """,
+                        result['battle_id'], week_start, result['challenger_id'], result['opponent_id'],
+                        winner_id, loser_id, outcome, result.get('rounds', 0),
+                        result.get('duration_seconds', 0), result.get('winner_tokens', 0),
+                        result.get('loser_tokens', 0), result.get('finished_at') or datetime.now()
+                    )
+                    if not inserted:
+                        return False
+                    
+                    if deltas:
+                        await conn.executemany("""
+                            INSERT INTO battle_stats AS s (
+                                user_id, wins, losses, draws, week_start, weekly_wins, weekly_losses, last_battle_at
+                            ) VALUES ($1, $2, $3, $4, $5, $2, $3, $6)
+                            ON CONFLICT (user_id) DO UPDATE SET
+                                wins = s.wins + EXCLUDED.wins,
+                                losses = s.losses + EXCLUDED.losses,
+                                draws = s.draws + EXCLUDED.draws,
+                                weekly_wins = CASE WHEN s.week_start = EXCLUDED.week_start
+                                                   THEN s.weekly_wins + EXCLUDED.weekly_wins
+                                                   ELSE EXCLUDED.weekly_wins END,
+                                weekly_losses = CASE WHEN s.week_start = EXCLUDED.week_start
+                                                     THEN s.weekly_losses + EXCLUDED.weekly_losses
+                                                     ELSE EXCLUDED.weekly_losses END,
+                                week_start = EXCLUDED.week_start,
+                                last_battle_at = EXCLUDED.last_battle_at
+                        """, [(uid, w, l, d, week_start, datetime.now()) for uid, w, l, d in deltas])
+                    
+                    if challenger_team is not None or battle_log is not None:
+                        await conn.execute("""
+                            INSERT INTO battle_logs (battle_id, challenger_team, opponent_team, battle_log)
+                            VALUES ($1, $2, $3, $4)
+                            ON CONFLICT (battle_id) DO NOTHING
+                        """, result['battle_id'], json.dumps(challenger_team or []),
+                            json.dumps(opponent_team or []), json.dumps(battle_log or []))
+            return True
+        except Exception as e:
+            logger.error(f"Error recording battle result: {e}")
+            return False
+
+    async def get_battle_record(self, user_id: int) -> Dict[str, int]:
+        """All-time and current-week win/loss counters for a user."""
+        record = {'wins': 0, 'losses': 0, 'draws': 0, 'weekly_wins': 0, 'weekly_losses': 0}
+        try:
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow("""
+                    SELECT wins, losses, draws, week_start, weekly_wins, weekly_losses
+                    FROM battle_stats WHERE user_id = $1
+                """, user_id)
+            if row:
+                record.update(wins=row['wins'], losses=row['losses'], draws=row['draws'])
+                if row['week_start'] == _current_week_start():
+                    record.update(weekly_wins=row['weekly_wins'], weekly_losses=row['weekly_losses'])
+        except Exception as e:
+            logger.error(f"Error getting battle record: {e}")
+        return record
+
+    async def get_battle_history(self, user_id: int, limit: int = 5) -> List[Dict[str, Any]]:
+        """Most recent finished battles a user took part in."""
+        try:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT * FROM (
+                        (SELECT * FROM battle_results WHERE challenger_id = $1
+                         ORDER BY finished_at DESC LIMIT $2)
+                        UNION ALL
+                        (SELECT * FROM battle_results WHERE opponent_id = $1
+                         ORDER BY finished_at DESC LIMIT $2)
+                    ) r
+                    ORDER BY finished_at DESC
+                    LIMIT $2
+                """, user_id, limit)
+            return [dict(row) for row in rows]
+        except Exception as e:
+            logger.error(f"Error getting battle history: {e}")
+            return []
+
 class PostgresCursor:
     """Cursor-like object for PostgreSQL queries"""
     def __init__(self, db, query: dict = None, projection: dict = None):
@@ -1,5 +1,3 @@
-import asyncio
-from collections import defaultdict
 from datetime import datetime, timedelta
 import os
 import random
@@ -21,6 +19,7 @@ from modules.postgres_database import get_database
 
 from .decorators import is_og, is_owner
 from .decorators import check_banned
+from .lock_manager import user_lock
 
 # Default propose weights and locked rarities
 DEFAULT_PROPOSE_WEIGHTS = {
@@ -40,9 +39,6 @@ DEFAULT_PROPOSE_WEIGHTS = {
 }
 DEFAULT_LOCKED = ["Premium", "Limited Edition", "Ultimate", "Supreme", "Mega Evolution"]
 
-# Add per-user locks to prevent propose spam
-user_locks = defaultdict(asyncio.Lock)
-
 # Special configuration: user with boosted propose privileges
 SPECIAL_PROPOSE_USER_ID = 7950419313  # 100% acceptance, 60% chance for Zenith/Mythic/Elite
 
@@ -55,7 +51,8 @@ def should_get_special_rarities(user_id: int) -> bool:
 async def propose_command(client: Client, message: Message):
     """Handle character proposal"""
     user_id = message.from_user.id
-    async with user_locks[user_id]:
+    # Per-user lock to prevent propose spam
+    async with user_lock('propose', user_id):
         try:
             db = get_database()
             # Get user data
@@ -257,9 +254,7 @@ async def propose_command(client: Client, message: Message):
                 except Exception as e:
                     print(f"Error sending rejection in propose_command: {e}")
             # Only now, after a valid proposal attempt, deduct tokens and set cooldown
-            new_wallet = current_wallet - settings['propose_cost']
-            await db.update_user(user_id, {
-                'wallet': new_wallet,
+            await db.apply_currency(user_id, {'wallet': -settings['propose_cost']}, 'propose', set_fields={
                 'last_propose': datetime.now().isoformat()
             })
         except Exception as e:
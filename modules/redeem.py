@@ -4,12 +4,15 @@ from datetime import datetime
 import random
 import string
 from .decorators import is_owner, is_og, is_sudo, check_banned
+from cachetools import LRUCache
 import os
 
 # Import database based on configuration
 from modules.postgres_database import get_database, get_rarity_emoji, RARITIES, RARITY_EMOJIS, get_rarity_display
 from .logging_utils import send_redeem_log
 
+# Codes that reached max_claims; claims never go down, so late claimers are turned away here
+_exhausted_codes = LRUCache(maxsize=4096)
 
 
 def generate_redeem_code(length=8):
@@ -239,94 +242,96 @@ async def sredeem_command(client: Client, message: Message):
 @check_banned
 async def redeem_command(client: Client, message: Message):
     user_id = message.from_user.id
-    db = get_database()
     args = message.text.split()[1:]
-    user = await db.get_user(user_id)
-    if not user:
-        return
     if not args:
         await message.reply_text(
             "<b>ᴜsᴀɢᴇ: /redeem code</b>"
         )
         return
-    code = args[0].upper()
-    db = get_database()
-    code = code.strip()  # Remove whitespace
-    redeem_data = await db.get_redeem_code(code)
-    if not redeem_data:
-        await message.reply_text("❌ Invalid redeem code!")
-        return
-    if redeem_data['claims'] >= redeem_data['max_claims']:
+    code = args[0].upper().strip()
+    if code in _exhausted_codes:
         await message.reply_text(
             "<b>❌ ᴛʜɪs ᴄᴏᴅᴇ ʜᴀs ʙᴇᴇɴ ᴜsᴇᴅ ᴜᴘ!</b>"
         )
         return
-    if user_id in redeem_data['claimed_by']:
-        await message.reply_text(
-            "<b>❌ ʏᴏᴜ ʜᴀᴠᴇ ᴀʟʀᴇᴀᴅʏ ᴄʟᴀɪᴍᴇᴅ ᴛʜɪs ᴄᴏᴅᴇ!</b>"
-        )
-        return
-    try:     # --- TOKEN REDEEM ---
-        if redeem_data.get('type') == 'token':
-                    token_amount = redeem_data['token_amount']
-                    await db.update_user(user_id, {'wallet': user.get('wallet', 0) + token_amount})
-                    await db.update_redeem_code_claim(code, user_id)
-                    msg = (
-                        "<b>✅ ᴛᴏᴋᴇɴ ᴄᴏᴅᴇ ʀᴇᴅᴇᴇᴍᴇᴅ sᴜᴄᴄᴇssғᴜʟʟʏ!</b>\n\n"
-                        f"💰 ʏᴏᴜ ʀᴇᴄᴇɪᴠᴇᴅ: `{token_amount}` ᴛᴏᴋᴇɴs"
-                    )
-                    await send_redeem_log(
-                        client,
-                        message.from_user,
-                        'token',
-                        code,
-                        1,
-                        {'token_amount': token_amount}
-                    )
-                # --- SHARD REDEEM ---
-        elif redeem_data.get('type') == 'shard':
-                    shard_amount = redeem_data['shard_amount']
-                    await db.update_user(user_id, {'shards': user.get('shards', 0) + shard_amount})
-                    await db.update_redeem_code_claim(code, user_id)
-                    msg = (
-                        "<b>✅ sʜᴀʀᴅ ᴄᴏᴅᴇ ʀᴇᴅᴇᴇᴍᴇᴅ sᴜᴄᴄᴇssғᴜʟʟʏ!</b>\n\n"
-                        f"🎐 ʏᴏᴜ ʀᴇᴄᴇɪᴠᴇᴅ: `{shard_amount}` sʜᴀʀᴅs"
-                    )
-                    await send_redeem_log(
-                        client,
-                        message.from_user,
-                        'shard',
-                        code,
-                        1,
-                        {'shard_amount': shard_amount}
-                    )
-                # --- CHARACTER REDEEM ---
+    db = get_database()
+    try:
+        # Claim and reward happen in one statement, so a busy group can't over-claim a code
+        result = await db.claim_redeem_code(code, user_id)
+        status = result['status']
+        if result.get('claims') is not None and result['claims'] >= result['max_claims']:
+            _exhausted_codes[code] = True
+        if status == 'no_user':
+            return
+        if status == 'invalid':
+            await message.reply_text("❌ Invalid redeem code!")
+            return
+        if status == 'exhausted':
+            _exhausted_codes[code] = True
+            await message.reply_text(
+                "<b>❌ ᴛʜɪs ᴄᴏᴅᴇ ʜᴀs ʙᴇᴇɴ ᴜsᴇᴅ ᴜᴘ!</b>"
+            )
+            return
+        if status == 'claimed':
+            await message.reply_text(
+                "<b>❌ ʏᴏᴜ ʜᴀᴠᴇ ᴀʟʀᴇᴀᴅʏ ᴄʟᴀɪᴍᴇᴅ ᴛʜɪs ᴄᴏᴅᴇ!</b>"
+            )
+            return
+        if status != 'ok':
+            raise Exception("Character not found")
+        # --- TOKEN REDEEM ---
+        if result['type'] == 'token':
+            token_amount = result['token_amount']
+            msg = (
+                "<b>✅ ᴛᴏᴋᴇɴ ᴄᴏᴅᴇ ʀᴇᴅᴇᴇᴍᴇᴅ sᴜᴄᴄᴇssғᴜʟʟʏ!</b>\n\n"
+                f"💰 ʏᴏᴜ ʀᴇᴄᴇɪᴠᴇᴅ: `{token_amount}` ᴛᴏᴋᴇɴs"
+            )
+            await send_redeem_log(
+                client,
+                message.from_user,
+                'token',
+                code,
+                1,
+                {'token_amount': token_amount}
+            )
+        # --- SHARD REDEEM ---
+        elif result['type'] == 'shard':
+            shard_amount = result['shard_amount']
+            msg = (
+                "<b>✅ sʜᴀʀᴅ ᴄᴏᴅᴇ ʀᴇᴅᴇᴇᴍᴇᴅ sᴜᴄᴄᴇssғᴜʟʟʏ!</b>\n\n"
+                f"🎐 ʏᴏᴜ ʀᴇᴄᴇɪᴠᴇᴅ: `{shard_amount}` sʜᴀʀᴅs"
+            )
+            await send_redeem_log(
+                client,
+                message.from_user,
+                'shard',
+                code,
+                1,
+                {'shard_amount': shard_amount}
+            )
+        # --- CHARACTER REDEEM ---
         else:
-                    character = await db.get_character(redeem_data['character_id'])
-                    if not character:
-                        raise Exception("Character not found")
-                    await db.add_character_to_user(user_id, character['character_id'], source='redeem')
-                    await db.update_redeem_code_claim(code, user_id)
-                    rarity_emoji = get_rarity_emoji(character['rarity'])
-                    msg = (
-                        f"<b>🎯 Look You Redeemed A {character['rarity']} Character</b>\n\n"
-                        f"<b>✨ Name:</b> {character['name']}\n"
-                        f"<b>{rarity_emoji} Rarity:</b> {character['rarity']}\n"
-                        f"<b>🎥 Anime:</b> {character.get('anime', '-') }\n\n"
-                        f"<b>You can take a look at your collection using /mycollection.</b>"
-                    )
-                    await send_redeem_log(
-                        client,
-                        message.from_user,
-                        'character',
-                        code,
-                        1,
-                        {
-                            'name': character['name'],
-                            'rarity': character['rarity'],
-                            'character_id': character['character_id']
-                        }
-                    )
+            character = await db.get_character(result['character_id'])
+            rarity_emoji = get_rarity_emoji(character['rarity'])
+            msg = (
+                f"<b>🎯 Look You Redeemed A {character['rarity']} Character</b>\n\n"
+                f"<b>✨ Name:</b> {character['name']}\n"
+                f"<b>{rarity_emoji} Rarity:</b> {character['rarity']}\n"
+                f"<b>🎥 Anime:</b> {character.get('anime', '-') }\n\n"
+                f"<b>You can take a look at your collection using /mycollection.</b>"
+            )
+            await send_redeem_log(
+                client,
+                message.from_user,
+                'character',
+                code,
+                1,
+                {
+                    'name': character['name'],
+                    'rarity': character['rarity'],
+                    'character_id': character['character_id']
+                }
+            )
         await message.reply_text(msg)
     except Exception as e:
         print(f"Error in redeem transaction: {e}")
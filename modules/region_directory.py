@@ -0,0 +1,95 @@
+"""
+Region (anime) directory.
+
+``/canime`` ran a ``SELECT DISTINCT anime ... ILIKE`` on every letter and page
+button, and ``/sanime`` and the collection's per-region totals counted
+characters per region one query at a time. The directory answers all of
+these from memory: sorted region names bucketed by first character, each
+region's character ids and rarity histogram, and the rendered ``/canime``
+keyboard pages. It is built from the catalog search index rather than loaded
+separately.
+"""
+
+import logging
+from typing import Dict, List, Tuple
+
+from modules.search_index import CatalogSearchIndex, DerivedView, load_derived_view
+
+logger = logging.getLogger(__name__)
+
+DIGITS_BUCKET = '0-9'
+
+
+def bucket_key(name: str) -> str:
+    """First-character bucket a region name is listed under."""
+    first = name[0]
+    return first.upper() if first.isalpha() else first
+
+
+class RegionDirectory(DerivedView):
+    """Sorted regions with per-region ids, counts and rarity histograms"""
+
+    def __init__(self):
+        super().__init__()
+        self.names: List[str] = []
+        self._buckets: Dict[str, List[str]] = {}
+        self._ids: Dict[str, List[int]] = {}
+        self._rarities: Dict[str, Dict[str, int]] = {}
+        self.unassigned = 0
+
+    def _build(self, index: CatalogSearchIndex):
+        ids: Dict[str, List[int]] = {}
+        rarities: Dict[str, Dict[str, int]] = {}
+        unassigned = 0
+        for char_id in sorted(index.characters):
+            row = index.characters[char_id]
+            anime = (row.get('anime') or '').strip()
+            if not anime:
+                unassigned += 1
+                continue
+            ids.setdefault(anime, []).append(char_id)
+            histogram = rarities.setdefault(anime, {})
+            rarity = row.get('rarity')
+            histogram[rarity] = histogram.get(rarity, 0) + 1
+
+        # Case-insensitive order, like the old ORDER BY anime under the default collation
+        names = sorted(ids, key=lambda n: (n.lower(), n))
+        buckets: Dict[str, List[str]] = {}
+        for name in names:
+            buckets.setdefault(bucket_key(name), []).append(name)
+        buckets[DIGITS_BUCKET] = [n for n in names if n[0].isdigit()]
+
+        self.names = names
+        self._buckets = buckets
+        self._ids = ids
+        self._rarities = rarities
+        self.unassigned = unassigned
+        logger.info(f"Region directory built: {len(names)} regions")
+
+    def names_for(self, letter: str) -> List[str]:
+        """Region names starting with ``letter`` (``'0-9'`` for any digit)."""
+        if letter == DIGITS_BUCKET:
+            return self._buckets.get(DIGITS_BUCKET, [])
+        return self._buckets.get(bucket_key(letter) if letter else letter, [])
+
+    def character_ids(self, region: str) -> List[int]:
+        return self._ids.get((region or '').strip(), [])
+
+    def count(self, region: str) -> int:
+        return len(self.character_ids(region))
+
+    def rarity_histogram(self, region: str) -> Dict[str, int]:
+        return self._rarities.get((region or '').strip(), {})
+
+    def counts(self) -> List[Tuple[str, int]]:
+        """(region, characters) pairs, largest region first."""
+        return sorted(((name, len(ids)) for name, ids in self._ids.items()), key=lambda x: (-x[1], x[0].lower()))
+
+
+# Global instance
+region_directory = RegionDirectory()
+
+
+async def get_region_directory(db) -> RegionDirectory:
+    """Get the region directory, rebuilding it if the catalog changed"""
+    return await load_derived_view(region_directory, db)
@@ -17,6 +17,7 @@ from pyrogram.enums import ChatType
 from .decorators import check_banned
 from .postgres_database import get_database, get_rarity_emoji, RARITIES, RARITY_EMOJIS
 from .logging_utils import send_token_log
+from .lock_manager import user_lock
 
 # Safari Zone constants
 SAFARI_COST = 55000  # 10 tokens to enter
@@ -37,12 +38,6 @@ CATCH_RATES = {
 # Active Safari Zone sessions
 active_safari_sessions: Dict[int, Dict] = {}
 
-# Safari Zone locks to prevent race conditions
-safari_locks: Dict[int, asyncio.Lock] = {}
-
-# Battle locks to prevent multiple engagements
-battle_locks: Dict[int, asyncio.Lock] = {}
-
 @check_banned
 async def safari_command(client: Client, message: Message):
     """Handle /safari command - Show Safari Zone information"""
@@ -56,10 +51,7 @@ async def safari_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Initialize lock for user if not exists
-    if user_id not in safari_locks:
-        safari_locks[user_id] = asyncio.Lock()
-    
-    async with safari_locks[user_id]:
+    async with user_lock('safari', user_id):
         db = get_database()
         
         # Get user data
@@ -138,10 +130,7 @@ async def enter_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Initialize lock for user if not exists
-    if user_id not in safari_locks:
-        safari_locks[user_id] = asyncio.Lock()
-    
-    async with safari_locks[user_id]:
+    async with user_lock('safari', user_id):
         db = get_database()
         
         # Get user data
@@ -196,8 +185,9 @@ async def enter_command(client: Client, message: Message):
             return
         
         # Deduct tokens and start Safari session
-        new_wallet = wallet - SAFARI_COST
-        await db.update_user(user_id, {'wallet': new_wallet})
+        if await db.debit(user_id, 'wallet', SAFARI_COST, 'safari') is None:
+            await message.reply_text("❌ <b>Insufficient tokens to enter Safari Zone!</b>")
+            return
         
         # Create Safari session (no time limit)
         active_safari_sessions[user_id] = {
@@ -266,10 +256,7 @@ async def hunt_command(client: Client, message: Message):
     user_id = message.from_user.id
     
     # Initialize lock for user if not exists
-    if user_id not in safari_locks:
-        safari_locks[user_id] = asyncio.Lock()
-    
-    async with safari_locks[user_id]:
+    async with user_lock('safari', user_id):
         db = get_database()
         
         # Get user data
@@ -478,10 +465,7 @@ async def safari_callback_handler(client: Client, callback_query: CallbackQuery)
 async def handle_hunt_engage(client: Client, callback_query: CallbackQuery, user_id: int, pokemon_id: int):
     """Handle engaging with a Pokemon"""
     # Initialize battle lock for user if not exists
-    if user_id not in battle_locks:
-        battle_locks[user_id] = asyncio.Lock()
-    
-    async with battle_locks[user_id]:
+    async with user_lock('battle', user_id):
         session = active_safari_sessions[user_id]
         
         # Check if already in battle
@@ -524,10 +508,7 @@ async def handle_hunt_engage(client: Client, callback_query: CallbackQuery, user
 async def handle_hunt_throw(client: Client, callback_query: CallbackQuery, user_id: int):
     """Handle throwing a Safari Ball"""
     # Initialize battle lock for user if not exists
-    if user_id not in battle_locks:
-        battle_locks[user_id] = asyncio.Lock()
-    
-    async with battle_locks[user_id]:
+    async with user_lock('battle', user_id):
         session = active_safari_sessions[user_id]
         
         # Check if user has Safari Balls
@@ -698,10 +679,7 @@ async def show_throwing_animation(client: Client, callback_query: CallbackQuery,
 async def handle_hunt_run(client: Client, callback_query: CallbackQuery, user_id: int):
     """Handle running away from current Pokemon"""
     # Initialize battle lock for user if not exists
-    if user_id not in battle_locks:
-        battle_locks[user_id] = asyncio.Lock()
-    
-    async with battle_locks[user_id]:
+    async with user_lock('battle', user_id):
         session = active_safari_sessions[user_id]
         
         # Get current Pokemon info before clearing
@@ -0,0 +1,524 @@
+"""
+In-memory search index over the character catalog.
+
+Inline search used to run COUNT + ILIKE + LIMIT/OFFSET queries against
+PostgreSQL on every keystroke. The catalog is small and changes rarely, so it
+is loaded once into memory and indexed:
+
+- normalized tokens of name, region (anime) and type, kept in sorted
+  vocabularies so prefix lookups are a bisect instead of a scan
+- trigram sets per token for typo-tolerant (fuzzy) matching
+- id, rarity and region buckets for exact lookups
+
+Result lists are cached per normalized query and paged with keyset offsets
+(the id of the last result sent), so scrolling stays stable even if the index
+is rebuilt between pages. If that character is gone, id-ordered results seek
+to the next larger id and ranked results fall back to the position sent with
+the offset. Any change to the characters table should call
+``invalidate_search_index()``; the next query reloads the catalog.
+"""
+
+import asyncio
+import logging
+import re
+from abc import ABC, abstractmethod
+import time
+import unicodedata
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from cachetools import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Reload the catalog at least this often even without invalidation
+INDEX_MAX_AGE = 1800  # seconds
+QUERY_CACHE_SIZE = 1024
+FUZZY_THRESHOLD = 0.35
+FUZZY_MAX_EXPANSIONS = 8
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Ranking tiers for name matches (lower is better)
+TIER_EXACT = 0
+TIER_STARTS_WITH = 1
+TIER_TOKENS = 2
+TIER_SUBSTRING = 3
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase and strip accents so 'Pokémon' matches 'pokemon'."""
+    if not text:
+        return ""
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(text.lower().split())
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"${token}$"
+    if len(padded) < 3:
+        return {padded}
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _FieldIndex:
+    """Token postings for one field with sorted vocabulary and trigram lookup"""
+
+    def __init__(self):
+        self.postings: Dict[str, Set[int]] = {}
+        self.vocab: List[str] = []
+        self._trigram_tokens: Dict[str, Set[str]] = {}
+
+    def add(self, char_id: int, text: Optional[str]):
+        for token in tokenize(text):
+            self.postings.setdefault(token, set()).add(char_id)
+
+    def finalize(self):
+        self.vocab = sorted(self.postings)
+        for token in self.vocab:
+            for gram in trigrams(token):
+                self._trigram_tokens.setdefault(gram, set()).add(token)
+
+    def prefix_tokens(self, prefix: str) -> Iterable[str]:
+        i = bisect_left(self.vocab, prefix)
+        while i < len(self.vocab) and self.vocab[i].startswith(prefix):
+            yield self.vocab[i]
+            i += 1
+
+    def prefix_ids(self, prefix: str) -> Set[int]:
+        ids: Set[int] = set()
+        for token in self.prefix_tokens(prefix):
+            ids |= self.postings[token]
+        return ids
+
+    def fuzzy_tokens(self, token: str) -> List[Tuple[float, str]]:
+        """Vocabulary tokens similar to ``token`` as (jaccard, token), best first."""
+        grams = trigrams(token)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._trigram_tokens.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        scored = []
+        for candidate, common in shared.items():
+            union = len(grams) + len(trigrams(candidate)) - common
+            similarity = common / union if union else 0.0
+            if similarity >= FUZZY_THRESHOLD:
+                scored.append((similarity, candidate))
+        scored.sort(key=lambda x: (-x[0], x[1]))
+        return scored[:FUZZY_MAX_EXPANSIONS]
+
+
+class SearchResult:
+    """Ranked character ids for one query, with keyset pagination"""
+
+    __slots__ = ('ids', 'kind', 'id_ordered', '_positions')
+
+    def __init__(self, ids: List[int], kind: str, id_ordered: bool = False):
+        self.ids = ids
+        self.kind = kind
+        self.id_ordered = id_ordered
+        self._positions: Optional[Dict[int, int]] = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def page(self, offset: Optional[str], limit: int) -> Tuple[List[int], str]:
+        """Return ``(ids, next_offset)``.
+
+        ``offset`` is either empty, ``k<last_id>[.<position>]`` (keyset) or a
+        legacy integer position. ``next_offset`` is '' on the last page.
+        """
+        start = 0
+        if offset:
+            if offset.startswith('k'):
+                start = self._seek(offset[1:])
+            else:
+                try:
+                    start = max(0, int(offset))
+                except ValueError:
+                    start = 0
+        chunk = self.ids[start:start + limit]
+        end = start + len(chunk)
+        next_offset = f"k{chunk[-1]}.{end}" if chunk and end < len(self.ids) else ""
+        return chunk, next_offset
+
+    def _seek(self, anchor: str) -> int:
+        """Position right after the keyset anchor, even if that id left the results"""
+        last_id, _, position = anchor.partition('.')
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            return 0
+        if self._positions is None:
+            self._positions = {char_id: i for i, char_id in enumerate(self.ids)}
+        found = self._positions.get(last_id)
+        if found is not None:
+            return found + 1
+        if self.id_ordered:
+            return bisect_right(self.ids, last_id)
+        try:
+            return min(max(0, int(position)), len(self.ids))
+        except ValueError:
+            return 0
+
+
+class CatalogSearchIndex:
+    """Whole-catalog index answering inline searches from memory"""
+
+    def __init__(self):
+        self.characters: Dict[int, Dict] = {}
+        self.version = 0
+        self._ids: List[int] = []
+        self._built_at = 0.0
+        self._generation = 1  # bumped by invalidate()
+        self._built_generation = 0  # generation the current snapshot reflects
+        self._lock: Optional[asyncio.Lock] = None
+        self._names: Dict[int, str] = {}
+        self._animes: Dict[int, str] = {}
+        self._name_index = _FieldIndex()
+        self._anime_index = _FieldIndex()
+        self._type_index = _FieldIndex()
+        self._by_anime: Dict[str, List[int]] = {}
+        self._by_rarity: Dict[str, List[int]] = {}
+        self._anime_names: List[str] = []
+        self._type_names: List[str] = []
+        self._rarity_levels: Dict[str, int] = {}
+        self._queries: LRUCache = LRUCache(maxsize=QUERY_CACHE_SIZE)
+        self.stats = {
+            'builds': 0,
+            'queries': 0,
+            'query_cache_hits': 0,
+            'build_ms': 0.0,
+        }
+
+    @property
+    def generation(self) -> int:
+        """Bumped on every invalidate(), before the rebuild that follows"""
+        return self._generation
+
+    @property
+    def ready(self) -> bool:
+        return self._built_generation == self._generation and time.time() - self._built_at < INDEX_MAX_AGE
+
+    async def ensure_loaded(self, db):
+        """Build the index on first use or after invalidation."""
+        if self.ready:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.ready:
+                return
+            # An invalidate() during the fetch leaves the new snapshot stale, so the next query reloads
+            generation = self._generation
+            characters = await db.get_all_characters()
+            if not characters and self.characters:
+                # Keep serving the previous snapshot if the reload failed
+                logger.warning("Catalog reload returned no rows; keeping previous search index")
+                self._built_at = time.time()
+                self._built_generation = generation
+                return
+            self.build(characters, generation)
+
+    def build(self, characters: List[Dict], generation: Optional[int] = None):
+        from modules.postgres_database import RARITIES
+
+        if generation is None:
+            generation = self._generation
+
+        started = time.perf_counter()
+        self.characters = {}
+        self._names = {}
+        self._animes = {}
+        self._name_index = _FieldIndex()
+        self._anime_index = _FieldIndex()
+        self._type_index = _FieldIndex()
+        self._by_anime = {}
+        self._by_rarity = {}
+        anime_names: Dict[str, str] = {}
+        type_names: Dict[str, str] = {}
+
+        for row in characters:
+            char_id = row.get('character_id')
+            if char_id is None:
+                continue
+            self.characters[char_id] = row
+            name, anime, char_type = row.get('name'), row.get('anime'), row.get('type')
+            self._names[char_id] = normalize(name)
+            self._animes[char_id] = normalize(anime)
+            self._name_index.add(char_id, name)
+            self._anime_index.add(char_id, anime)
+            if char_type:
+                # Tokenizing splits dual types, so 'poison' finds 'Grass/Poison'
+                self._type_index.add(char_id, char_type)
+                type_names.setdefault(char_type, char_type)
+            if anime:
+                anime_names.setdefault(anime, anime)
+                self._by_anime.setdefault(normalize(anime), []).append(char_id)
+            self._by_rarity.setdefault(row.get('rarity'), []).append(char_id)
+
+        self._ids = sorted(self.characters)
+        for bucket in self._by_anime.values():
+            bucket.sort()
+        for bucket in self._by_rarity.values():
+            bucket.sort()
+        for field_index in (self._name_index, self._anime_index, self._type_index):
+            field_index.finalize()
+        self._anime_names = sorted(anime_names.values())
+        self._type_names = sorted(type_names.values())
+        self._rarity_levels = dict(RARITIES)
+
+        self._queries.clear()
+        self.version += 1
+        self._built_at = time.time()
+        self._built_generation = generation
+        self.stats['builds'] += 1
+        self.stats['build_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info(f"Search index built: {len(self.characters)} characters in {self.stats['build_ms']}ms")
+
+    def invalidate(self):
+        self._generation += 1
+
+    def get(self, char_id: int) -> Optional[Dict]:
+        return self.characters.get(char_id)
+
+    def rows(self, ids: Iterable[int]) -> List[Dict]:
+        return [self.characters[i] for i in ids if i in self.characters]
+
+    def _rank_key(self, char_id: int):
+        row = self.characters[char_id]
+        return -self._rarity_levels.get(row.get('rarity'), 0), char_id
+
+    def _match_tokens(self, field_index: _FieldIndex, tokens: List[str]) -> Set[int]:
+        """Ids whose field has a token starting with every query token."""
+        ids: Optional[Set[int]] = None
+        for token in tokens:
+            hits = field_index.prefix_ids(token)
+            ids = hits if ids is None else ids & hits
+            if not ids:
+                return set()
+        return ids or set()
+
+    def _match_fuzzy(self, field_index: _FieldIndex, tokens: List[str]) -> Dict[int, float]:
+        """Ids matching every token approximately, with a summed similarity score."""
+        scores: Optional[Dict[int, float]] = None
+        for token in tokens:
+            token_scores: Dict[int, float] = {}
+            # Exact prefixes still count fully, so 'pikac charzard' works
+            for candidate in field_index.prefix_tokens(token):
+                for char_id in field_index.postings[candidate]:
+                    token_scores[char_id] = 1.0
+            if len(token) >= 3:
+                for similarity, candidate in field_index.fuzzy_tokens(token):
+                    for char_id in field_index.postings[candidate]:
+                        if similarity > token_scores.get(char_id, 0.0):
+                            token_scores[char_id] = similarity
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {i: s + token_scores[i] for i, s in scores.items() if i in token_scores}
+            if not scores:
+                return {}
+        return scores or {}
+
+    def _search_names(self, query: str, tokens: List[str]) -> List[int]:
+        tiers: Dict[int, int] = {}
+        for char_id in self._match_tokens(self._name_index, tokens):
+            name = self._names[char_id]
+            if name == query:
+                tiers[char_id] = TIER_EXACT
+            elif name.startswith(query):
+                tiers[char_id] = TIER_STARTS_WITH
+            else:
+                tiers[char_id] = TIER_TOKENS
+        # Plain substring matches ('chu' in 'pikachu') keep the old ILIKE behaviour
+        for char_id, name in self._names.items():
+            if char_id not in tiers and query in name:
+                tiers[char_id] = TIER_SUBSTRING
+        return sorted(tiers, key=lambda i: (tiers[i],) + self._rank_key(i))
+
+    def _search_animes(self, query: str, tokens: List[str]) -> List[int]:
+        ids = self._match_tokens(self._anime_index, tokens)
+        ids.update(i for i, anime in self._animes.items() if query in anime)
+        return sorted(ids)
+
+    def _search_fuzzy(self, tokens: List[str]) -> List[int]:
+        scores = self._match_fuzzy(self._name_index, tokens)
+        if not scores:
+            scores = self._match_fuzzy(self._anime_index, tokens)
+        return sorted(scores, key=lambda i: (-scores[i],) + self._rank_key(i))
+
+    def search(self, query: str) -> SearchResult:
+        """Ranked results for a free-text inline query.
+
+        Order of precedence mirrors the old SQL handler: id, exact region,
+        name, rarity prefix, region substring; type and fuzzy matching run last.
+        """
+        self.stats['queries'] += 1
+        query = normalize(query)
+        cached = self._queries.get(query)
+        if cached is not None:
+            self.stats['query_cache_hits'] += 1
+            return cached
+
+        result = self._search_uncached(query)
+        self._queries[query] = result
+        return result
+
+    def _search_uncached(self, query: str) -> SearchResult:
+        if not query:
+            return SearchResult(self._ids, 'all', id_ordered=True)
+
+        if query.isdigit():
+            char_id = int(query)
+            if char_id in self.characters:
+                return SearchResult([char_id], 'id', id_ordered=True)
+
+        exact_anime = self._by_anime.get(query)
+        if exact_anime:
+            return SearchResult(exact_anime, 'anime', id_ordered=True)
+
+        tokens = tokenize(query)
+        names = self._search_names(query, tokens) if tokens else []
+        if names:
+            return SearchResult(names, 'name')
+
+        for rarity in self._rarity_levels:
+            if rarity.lower().startswith(query):
+                return SearchResult(self._by_rarity.get(rarity, []), 'rarity', id_ordered=True)
+
+        animes = self._search_animes(query, tokens) if tokens else []
+        if animes:
+            return SearchResult(animes, 'anime', id_ordered=True)
+
+        types = self._match_tokens(self._type_index, tokens) if tokens else set()
+        if types:
+            return SearchResult(sorted(types, key=self._rank_key), 'type')
+
+        if tokens:
+            fuzzy = self._search_fuzzy(tokens)
+            if fuzzy:
+                return SearchResult(fuzzy, 'fuzzy')
+        return SearchResult([], 'none')
+
+    def search_characters(self, term: str, limit: int) -> List[Dict]:
+        """Characters whose name or region matches ``term``, best first."""
+        query = normalize(term)
+        if not query:
+            ids = sorted(self.characters, key=lambda i: (self._names[i], i))
+            return self.rows(ids[:limit])
+        tokens = tokenize(query)
+        ids = self._search_names(query, tokens) if tokens else []
+        if len(ids) < limit:
+            seen = set(ids)
+            ids += [i for i in self._search_animes(query, tokens) if i not in seen] if tokens else []
+        if not ids and tokens:
+            ids = self._search_fuzzy(tokens)
+        return self.rows(ids[:limit])
+
+    @staticmethod
+    def _match_values(values: List[str], term: str, limit: int) -> List[str]:
+        query = normalize(term)
+        if not query:
+            return values[:limit]
+        tokens = tokenize(query)
+        prefix, contains, fuzzy = [], [], []
+        for value in values:
+            normalized = normalize(value)
+            value_tokens = tokenize(value)
+            if normalized.startswith(query) or all(any(vt.startswith(t) for vt in value_tokens) for t in tokens):
+                prefix.append(value)
+            elif query in normalized:
+                contains.append(value)
+        matches = prefix + contains
+        if not matches and tokens:
+            grams = trigrams(''.join(tokens))
+            scored = []
+            for value in values:
+                other = trigrams(''.join(tokenize(value)))
+                union = len(grams | other)
+                similarity = len(grams & other) / union if union else 0.0
+                if similarity >= FUZZY_THRESHOLD:
+                    scored.append((similarity, value))
+            fuzzy = [value for _, value in sorted(scored, key=lambda x: (-x[0], x[1]))]
+            matches = fuzzy
+        return matches[:limit]
+
+    def anime_names(self, term: str = '', limit: int = 20) -> List[str]:
+        """Distinct region names matching ``term`` (prefix matches first)."""
+        return self._match_values(self._anime_names, term, limit)
+
+    def type_names(self, term: str = '', limit: int = 20) -> List[str]:
+        """Distinct type names matching ``term`` (prefix matches first)."""
+        return self._match_values(self._type_names, term, limit)
+
+    def get_stats(self) -> Dict:
+        stats = dict(self.stats)
+        stats['characters'] = len(self.characters)
+        stats['version'] = self.version
+        stats['cached_queries'] = len(self._queries)
+        return stats
+
+
+# Global instance
+search_index = CatalogSearchIndex()
+
+
+def get_search_index() -> CatalogSearchIndex:
+    """Get the process-wide catalog search index"""
+    return search_index
+
+
+async def get_loaded_search_index(db) -> CatalogSearchIndex:
+    """Get the search index, building it first if needed"""
+    await search_index.ensure_loaded(db)
+    return search_index
+
+
+def invalidate_search_index():
+    """Mark the index stale after a change to the characters table"""
+    search_index.invalidate()
+
+
+class DerivedView(ABC):
+    """Base for catalog views computed from the search index.
+
+    A view is rebuilt when the index version moves on, which happens after
+    every invalidation (upload, edit, rename, delete, bulk import), so it
+    never needs invalidating itself. Rendered pages are memoized per view
+    until the next rebuild.
+    """
+
+    def __init__(self):
+        self.version = -1
+        self._pages: Dict[Tuple, object] = {}
+
+    def build(self, index: CatalogSearchIndex):
+        self._build(index)
+        self._pages = {}
+        self.version = index.version
+
+    @abstractmethod
+    def _build(self, index: CatalogSearchIndex):
+        """Recompute the view from a freshly built index."""
+
+    def page(self, key: Tuple, build: Callable[[], object]):
+        """Memoize rendered page text/markup until the next rebuild."""
+        page = self._pages.get(key)
+        if page is None:
+            page = build()
+            self._pages[key] = page
+        return page
+
+
+async def load_derived_view(view: DerivedView, db) -> DerivedView:
+    """Return ``view``, rebuilding it first if the catalog changed"""
+    index = await get_loaded_search_index(db)
+    if view.version != index.version:
+        view.build(index)
+    return view
@@ -3,7 +3,6 @@ SELL MODULE
 
 Policy: Never remove or alter 'collected' entries from collection_history when a character is sold or transferred. Only append new entries for 'sold', 'gift', etc. This ensures daily/total collection stats are always accurate.
 """
-import asyncio
 from collections import Counter
 from datetime import datetime, timedelta
 import os
@@ -21,6 +20,7 @@ from modules.postgres_database import get_database, get_rarity_emoji
 
 from .decorators import check_banned
 from .trade import action_manager
+from .lock_manager import user_lock
 
 
 
@@ -43,9 +43,6 @@ SELL_PRICES = {
     "Premium": 5000000
 }
 
-# Async locks for sell confirmations
-_sell_locks = {}
-
 # Session storage for sell confirmation
 _temp_data = {}
 
@@ -179,10 +176,7 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
         await callback_query.answer("❌ Access Denied: Only the user who initiated this sell can use these buttons.", show_alert=True)
         return
     
-    # Get or create lock for this user
-    if user_id not in _sell_locks:
-        _sell_locks[user_id] = asyncio.Lock()
-    lock = _sell_locks[user_id]
+    lock = user_lock('sell', user_id)
     
     if callback_query.data == "cancel_last_sell":
         async with lock:
@@ -192,9 +186,6 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
             if user_id in _masssell_temp:
                 del _masssell_temp[user_id]
             await callback_query.edit_message_text("❌ Last sell or masssell action cancelled!")
-            # Clean up lock
-            if user_id in _sell_locks:
-                del _sell_locks[user_id]
         return
     
     if user_id not in _temp_data:
@@ -210,9 +201,6 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
             )
             await action_manager.clear_user_action(db, user_id)
             del _temp_data[user_id]
-            # Clean up lock
-            if user_id in _sell_locks:
-                del _sell_locks[user_id]
         return
     
     if callback_query.data == "sell_confirm":
@@ -242,9 +230,7 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
                             "❌ Session expired! Please try again!"
                         )
                         await action_manager.clear_user_action(db, user_id)
-                        # Clean up lock and processing flag
-                        if user_id in _sell_locks:
-                            del _sell_locks[user_id]
+                        # Clean up processing flag
                         _processing_sells.discard(user_id)
                         return
                     
@@ -259,9 +245,7 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
                         )
                         await action_manager.clear_user_action(db, user_id)
                         del _temp_data[user_id]
-                        # Clean up lock and processing flag
-                        if user_id in _sell_locks:
-                            del _sell_locks[user_id]
+                        # Clean up processing flag
                         _processing_sells.discard(user_id)
                         return
                     # Remove only one instance of the character
@@ -306,9 +290,7 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
                     })
                     await action_manager.clear_user_action(db, user_id)
                     del _temp_data[user_id]
-                    # Clean up lock and processing flag
-                    if user_id in _sell_locks:
-                        del _sell_locks[user_id]
+                    # Clean up processing flag
                     _processing_sells.discard(user_id)
                 except Exception as e:
                     print(f"Error in sell confirmation for user {user_id}: {e}")
@@ -320,9 +302,7 @@ async def handle_sell_callback(client: Client, callback_query: CallbackQuery):
                     await action_manager.clear_user_action(db, user_id)
                     if user_id in _temp_data:
                         del _temp_data[user_id]
-                    # Clean up lock and processing flag
-                    if user_id in _sell_locks:
-                        del _sell_locks[user_id]
+                    # Clean up processing flag
                     _processing_sells.discard(user_id)
         except Exception as e:
             print(f"Error in sell confirmation for user {user_id}: {e}")
@@ -439,10 +419,7 @@ async def handle_masssell_callback(client: Client, callback_query: CallbackQuery
         await callback_query.answer("❌ Access Denied: Only the user who initiated this masssell can use these buttons.", show_alert=True)
         return
     
-    # Get or create lock for this user
-    if user_id not in _sell_locks:
-        _sell_locks[user_id] = asyncio.Lock()
-    lock = _sell_locks[user_id]
+    lock = user_lock('sell', user_id)
     
     # Always clear both masssell and massgift session data for this user after confirm/cancel
     def clear_all_mass_sessions():
@@ -459,9 +436,6 @@ async def handle_masssell_callback(client: Client, callback_query: CallbackQuery
         await callback_query.edit_message_text("❌ Mass sell cancelled!")
         clear_all_mass_sessions()
         await action_manager.clear_user_action(db, user_id)
-        # Clean up lock
-        if user_id in _sell_locks:
-            del _sell_locks[user_id]
         return
     elif callback_query.data == "masssell_confirm":
         # Set processing flag IMMEDIATELY to prevent spam clicks
@@ -481,19 +455,14 @@ async def handle_masssell_callback(client: Client, callback_query: CallbackQuery
                 return
             async with lock:
                 # Robust: Only allow confirmation if active_action is masssell
-                # Fetch user_data and active_action inside the lock to ensure latest state
-                user_data = await db.get_user(user_id)
-                active_action = user_data.get('active_action') if user_data else None
-                if not isinstance(active_action, dict):
-                    active_action = {}
+                # Read active_action inside the lock to ensure latest state
+                active_action = action_manager.get(user_id) or {}
                 
                 if active_action.get('type') != 'masssell':
                     await callback_query.edit_message_text("❌ This masssell session is no longer valid (another action was started or confirmed).", disable_web_page_preview=True)
                     clear_all_mass_sessions()
                     await action_manager.clear_user_action(db, user_id)
-                    # Clean up lock and processing flag
-                    if user_id in _sell_locks:
-                        del _sell_locks[user_id]
+                    # Clean up processing flag
                     _processing_sells.discard(user_id)
                     return
                 if user_id in _masssell_temp and _masssell_temp[user_id].get('completed'):
@@ -503,40 +472,50 @@ async def handle_masssell_callback(client: Client, callback_query: CallbackQuery
                 if user_id not in _masssell_temp:
                     await callback_query.edit_message_text("❌ Session expired! Please try again!")
                     clear_all_mass_sessions()
-                    # Clean up lock and processing flag
-                    if user_id in _sell_locks:
-                        del _sell_locks[user_id]
+                    # Clean up processing flag
                     _processing_sells.discard(user_id)
                     return
                 data = _masssell_temp[user_id]
                 # Show processing answer immediately
                 await callback_query.answer("Processing masssell...", show_alert=False)
-                # Fetch only needed fields
-                user_data = await db.get_user(user_id)
-                owned_chars = user_data.get('characters', []) if user_data else []
                 to_remove = list(data['char_ids'])
-                new_chars = owned_chars.copy()
-                for cid in to_remove:
-                    if cid in new_chars:
-                        new_chars.remove(cid)
                 # If selling a lot, show processing message first
                 if len(to_remove) > 50:
                     await callback_query.edit_message_text("⏳ Processing your mass sell... Please wait...")
-                # Create sold entries for collection history
-                sold_entries = []
-                now = datetime.now()
-                for cid in to_remove:
-                    sold_entries.append({
+                if hasattr(db, 'move_characters'):
+                    # Count check, removal, sold entries and payout in one set-based statement
+                    result = await db.move_characters(user_id, to_remove, wallet_delta=data['total_tokens'],
+                                                      reason='masssell', log_sold=True)
+                    if not result['ok']:
+                        missing = [f"{cid} (have {r['owned']}, need {r['requested']})"
+                                   for cid, r in result['results'].items() if r['owned'] < r['requested']]
+                        await callback_query.edit_message_text(
+                            "❌ You no longer own all of these characters!"
+                            + (f"\n\nMissing: {', '.join(missing[:20])}" if missing else "")
+                        )
+                        clear_all_mass_sessions()
+                        await action_manager.clear_user_action(db, user_id)
+                        # Clean up processing flag
+                        _processing_sells.discard(user_id)
+                        return
+                else:
+                    # Fallback for Mongo
+                    user_data = await db.get_user(user_id)
+                    owned_chars = user_data.get('characters', []) if user_data else []
+                    # Drop one owned copy per requested id in a single pass
+                    pending = Counter(to_remove)
+                    new_chars = []
+                    for cid in owned_chars:
+                        if pending[cid]:
+                            pending[cid] -= 1
+                        else:
+                            new_chars.append(cid)
+                    now = datetime.now()
+                    sold_entries = [{
                         'character_id': cid,
                         'sold_at': now.isoformat(),
                         'source': 'sold'
-                    })
-                # Atomic wallet update and collection history update
-                # Use atomic update for Postgres
-                if hasattr(db, 'update_user_atomic'):
-                    await db.update_user_atomic(user_id, new_chars, data['total_tokens'], sold_entries)
-                else:
-                    # Fallback for Mongo
+                    } for cid in to_remove]
                     await db.users.update_one(
                         {'user_id': user_id},
                         {
@@ -549,9 +528,7 @@ async def handle_masssell_callback(client: Client, callback_query: CallbackQuery
                 await action_manager.clear_user_action(db, user_id)
                 _masssell_temp[user_id]['completed'] = True
                 clear_all_mass_sessions()
-                # Clean up lock and processing flag
-                if user_id in _sell_locks:
-                    del _sell_locks[user_id]
+                # Clean up processing flag
                 _processing_sells.discard(user_id)
         except Exception as e:
             print(f"Error in masssell confirmation for user {user_id}: {e}")
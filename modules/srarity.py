@@ -10,6 +10,7 @@ from pyrogram.types import (
 )
 
 from modules.postgres_database import get_database
+from modules.catalog_stats import get_catalog_stats
 
 from .decorators import check_banned
 
@@ -132,49 +133,33 @@ async def show_rarity_menu(callback_query: CallbackQuery):
         reply_markup=reply_markup
     )
 
+def _render_rarity_page(characters, total_pages, rarity):
+    """Return (text, total_pages) for one page of a rarity listing"""
+    if not characters:
+        return "<b>❌ No characters available in this rarity!</b>", total_pages
+    msg = ""
+    for char in characters:
+        msg += f"<code>({char['character_id']})</code> {RARITY_EMOJIS.get(rarity, '')} {char['name']}\n"
+    return msg, total_pages
+
 async def show_rarity_list(callback_query: CallbackQuery, rarity: str, page: int):
     db = get_database()
     items_per_page = 15
     try:
-        # Use SQL query for PostgreSQL instead of MongoDB find()
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                # Get total count
-                count_result = await conn.fetchrow(
-                    "SELECT COUNT(*) FROM characters WHERE rarity = $1",
-                    rarity
-                )
-                total = count_result[0] if count_result else 0
-                
-                # Get characters for current page
-                offset = (page - 1) * items_per_page
-                characters = await conn.fetch(
-                    "SELECT character_id, name FROM characters WHERE rarity = $1 ORDER BY character_id LIMIT $2 OFFSET $3",
-                    rarity, items_per_page, offset
-                )
+            # Pages are sliced from pre-sorted id arrays and rendered once per catalog version
+            stats = await get_catalog_stats(db)
+            msg, total_pages = stats.page(
+                ('srarity', rarity, page, items_per_page),
+                lambda: _render_rarity_page(*stats.rarity_page(rarity, page, items_per_page), rarity)
+            )
         else:  # MongoDB
             characters = await db.characters.find({'rarity': rarity}, {'character_id': 1, 'name': 1}).sort('character_id', 1).to_list(None)
             total = len(characters)
             start_idx = (page - 1) * items_per_page
             end_idx = start_idx + items_per_page
-            characters = characters[start_idx:end_idx]
-        
-        total_pages = (total + items_per_page - 1) // items_per_page or 1
-        
-        # Initialize msg variable
-        msg = ""
-        
-        if not characters:
-            msg += "<b>❌ No characters available in this rarity!</b>"
-        else:
-            for char in characters:
-                if hasattr(db, 'pool'):  # PostgreSQL
-                    char_id = char['character_id']
-                    name = char['name']
-                else:  # MongoDB
-                    char_id = char['character_id']
-                    name = char['name']
-                msg += f"<code>({char_id})</code> {RARITY_EMOJIS.get(rarity, '')} {name}\n"
+            total_pages = (total + items_per_page - 1) // items_per_page or 1
+            msg, _ = _render_rarity_page(characters[start_idx:end_idx], total_pages, rarity)
         
         reply_markup = get_rarity_keyboard(rarity, page, total_pages)
         await callback_query.message.edit_text(msg, reply_markup=reply_markup)
@@ -6,6 +6,7 @@ import os
 # Import database based on configuration
 
 from modules.postgres_database import get_database, RARITY_EMOJIS, RARITIES
+from modules.catalog_stats import get_catalog_stats
 
 from datetime import datetime, timedelta
 from config import BOT_VERSION
@@ -90,10 +91,6 @@ async def stats_command(client: Client, message: Message):
                 users_result = await conn.fetchrow("SELECT COUNT(*) FROM users")
                 total_users = users_result[0] if users_result else 0
                 
-                # Get total characters
-                chars_result = await conn.fetchrow("SELECT COUNT(*) FROM characters")
-                total_characters = chars_result[0] if chars_result else 0
-                
                 # Get total harem count (sum of all characters in users' collections)
                 harem_result = await conn.fetchrow("""
                     SELECT COALESCE(SUM(
@@ -105,23 +102,12 @@ async def stats_command(client: Client, message: Message):
                     ), 0) FROM users
                 """)
                 total_harem = harem_result[0] if harem_result else 0
-                
-                # Get character count by rarity
-                rarity_counts_result = await conn.fetch("""
-                    SELECT rarity, COUNT(*) as count 
-                    FROM characters 
-                    GROUP BY rarity 
-                    ORDER BY rarity
-                """)
-                rarity_counts = [{'count': row['count'], '_id': row['rarity']} for row in rarity_counts_result]
-                
-                # Get latest characters
-                latest_chars_result = await conn.fetch("""
-                    SELECT name FROM characters 
-                    ORDER BY character_id DESC 
-                    LIMIT 5
-                """)
-                latest_chars = [{'name': row['name']} for row in latest_chars_result]
+            
+            # Catalog totals, rarity distribution and latest additions come from memory
+            catalog = await get_catalog_stats(db)
+            total_characters = catalog.total
+            rarity_counts = [{'count': count, '_id': rarity} for rarity, count in catalog.by_rarity.items() if rarity]
+            latest_chars = [{'name': char.get('name')} for char in catalog.latest]
                 
         else:  # MongoDB
             # Get total groups using union of chat_settings and users.groups
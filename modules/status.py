@@ -6,10 +6,12 @@ import os
 
 # Import database based on configuration
 from .postgres_database import get_database, get_rarity_emoji, RARITIES, RARITY_EMOJIS, get_rarity_display
+from .user_cache import user_cache
 from datetime import datetime
 import random
 import asyncio
 from modules.collection import batch_fetch_characters
+from modules.catalog_stats import get_catalog_stats
 import time
 
 # Remove @check_banned so banned users can use status
@@ -42,9 +44,7 @@ async def status_command(client: Client, message: Message):
         unique_collected = len(unique_ids)
         
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                all_characters_result = await conn.fetchrow("SELECT COUNT(*) FROM characters")
-                all_characters = all_characters_result[0] if all_characters_result else 0
+            all_characters = (await get_catalog_stats(db)).total
         else:  # MongoDB
             all_characters = await db.characters.count_documents({})
         
@@ -212,6 +212,7 @@ async def status_command(client: Client, message: Message):
                     async for member in client.get_chat_members(message.chat.id):
                         if not member.user.is_bot:
                             chat_members.append(member.user.id)
+                            user_cache.observe(member.user)
                 except Exception as e:
                     pass
                 pass
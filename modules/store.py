@@ -1,4 +1,3 @@
-import random
 from datetime import datetime
 ## No shared daily_store import needed for per-user store
 from pyrogram import Client, filters
@@ -6,6 +5,13 @@ from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton,
 from modules.postgres_database import get_database
 from pyrogram.enums import ChatType
 from modules.decorators import owner_only
+from modules.store_offers import (
+    RARITY_WEIGHTS,
+    get_store_sampler,
+    pad_offer,
+    refresh_all_offers,
+    weighted_sample,
+)
 
 RARITY_EMOJIS = {
     "Common": "⚪️",
@@ -88,75 +94,15 @@ def get_store_keyboard(refreshes):
     
     return InlineKeyboardMarkup(buttons) if buttons else None
 
-# Define weights for rarities
-RARITY_WEIGHTS = {
-    "Common": 1,
-    "Medium": 1,
-    "Rare": 1,
-    "Legendary": 1,
-    "Exclusive": 1,
-    "Elite": 1,
-    "Limited Edition": 1,
-    "Ultimate":1,
-    "Ethereal": 1,
-    "Mythic": 1,
-    "Zenith": 1,
-    "Premium": 3,  # Added Premium with weight 1
-    "Mega Evolution": 0  # Added Mega Evolution with weight 1
-    # "Supreme" is excluded
-}
-
 def get_weighted_random_characters_sync(all_chars, count=10):
-    # Prepare weights
+    # Weighted selection without replacement, padded with repeats if the pool is too small
     weights = [RARITY_WEIGHTS.get(c["rarity"], 1) for c in all_chars]
-    # Select without replacement, but with weights
-    selected = []
-    pool = all_chars[:]
-    pool_weights = weights[:]
-    
-    # First try to select without replacement
-    for _ in range(min(count, len(pool))):
-        if not pool:
-            break
-        chosen = random.choices(pool, weights=pool_weights, k=1)[0]
-        selected.append(chosen)
-        idx = pool.index(chosen)
-        pool.pop(idx)
-        pool_weights.pop(idx)
-    
-    # If we still need more characters, duplicate some from the selected ones
-    while len(selected) < count:
-        if selected:
-            # Randomly select from already selected characters
-            chosen = random.choice(selected)
-            selected.append(chosen)
-        else:
-            # If no characters were selected at all, this shouldn't happen but handle it
-            break
-    return selected
+    return pad_offer(weighted_sample(all_chars, weights, count), count)
 
 async def get_weighted_random_characters(db, count=10):
-    # Use PostgreSQL aggregation to get store-eligible characters
-    # This method already handles filtering for Supreme rarity, is_video=True, and excluded IDs
-    # Request more characters than needed to account for potential filtering
-    request_count = max(count * 2, 20)  # Request at least 20 characters to ensure we get enough
-    eligible_chars = await db.get_store_eligible_characters(request_count)
-    
-    if not eligible_chars:
-        return []
-    
-    # Apply weighted random selection from the filtered characters
-    selected = get_weighted_random_characters_sync(eligible_chars, count)
-    
-    # If we still don't have enough characters, try to get more from the database
-    if len(selected) < count and len(eligible_chars) < request_count:
-        # Try to get more characters from the database
-        additional_chars = await db.get_store_eligible_characters(request_count * 2)
-        if additional_chars:
-            # Combine and deduplicate
-            all_chars = eligible_chars + [c for c in additional_chars if c not in eligible_chars]
-            selected = get_weighted_random_characters_sync(all_chars, count)
-    return selected
+    # Sampled in memory from the store-eligible catalog (no Supreme, videos or excluded IDs)
+    sampler = await get_store_sampler(db)
+    return sampler.rows(sampler.sample(count))
 
 async def get_daily_store_offer(db, user_id):
     """Get or generate the shared daily store offer for all users."""
@@ -283,8 +229,9 @@ async def refresh_store_callback(client: Client, callback_query: CallbackQuery):
         await callback_query.answer("Not enough tokens for refresh!", show_alert=True)
         return
     # Deduct tokens if not free
-    if not free_refresh:
-        await db.update_user(user_id, {"wallet": user["wallet"] - REFRESH_COST})
+    if not free_refresh and await db.debit(user_id, "wallet", REFRESH_COST, "store_refresh") is None:
+        await callback_query.answer("Not enough tokens for refresh!", show_alert=True)
+        return
     # Generate new offer using fast random sampling
     offer_chars = await get_weighted_random_characters(db, 10)
     
@@ -478,29 +425,20 @@ async def confirm_buy_callback(client: Client, callback_query: CallbackQuery):
         if user.get("wallet", 0) < price:
             await callback_query.answer("Not enough tokens!", show_alert=True)
             return
-    # Deduct tokens, add character, mark as purchased, clear pending
+    # Deduct tokens, add character, mark as purchased, clear pending — all in one guarded UPDATE
     if char["rarity"] == "Ultimate":
-        await db.update_user(user_id, {
-            "shards": user["shards"] - ULTIMATE_SHARD_PRICE,
-            "characters": user.get("characters", []) + [char_id],
-            "store_offer": {
-                **offer,
-                "purchased": purchased + [char_id],
-                "pending_buy": None,
-                "date": today
-            }
-        })
+        purchase = await db.buy_store_character(user_id, char_id, "shards", ULTIMATE_SHARD_PRICE, today)
     else:
-        await db.update_user(user_id, {
-            "wallet": user["wallet"] - price,
-            "characters": user.get("characters", []) + [char_id],
-            "store_offer": {
-                **offer,
-                "purchased": purchased + [char_id],
-                "pending_buy": None,
-                "date": today
-            }
-        })
+        purchase = await db.buy_store_character(user_id, char_id, "wallet", price, today)
+    if purchase is None:
+        # Either a concurrent confirm got there first or the balance no longer covers it
+        user = await db.get_user(user_id) or {}
+        latest = user.get("store_offer") or {}
+        if isinstance(latest, dict) and char_id in (latest.get("purchased") or []):
+            await callback_query.answer("Already purchased today.", show_alert=True)
+        else:
+            await callback_query.answer("Not enough 🎐 Shards!" if char["rarity"] == "Ultimate" else "Not enough tokens!", show_alert=True)
+        return
     # Log transaction
     await db.log_user_transaction(user_id, "store_purchase", {
         "character_id": char_id,
@@ -560,19 +498,13 @@ async def cancel_buy_callback(client: Client, callback_query: CallbackQuery):
 @Client.on_message(filters.command("refreshallstores"))
 @owner_only
 async def refresh_all_stores_command(client: Client, message: Message):
+    # /refreshallstores lazy: clear offers and let each user's next /mystore generate one
     db = get_database()
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    user_ids = await db.get_all_user_ids()
-    updated = 0
-    for user_id in user_ids:
-        offer_chars = await get_weighted_random_characters(db, 10)
-        offer = {
-            "date": today,
-            "characters": [c.get("character_id") or c.get("id") or c.get("_id") for c in offer_chars],
-            "refreshes": 0
-        }
-        await db.update_user(user_id, {"store_offer": offer})
-        updated += 1
-    await message.reply(f"✅ Refreshed store for <b>{updated}</b> users.")
+    lazy = len(message.command) > 1 and message.command[1].lower() == "lazy"
+    updated = await refresh_all_offers(db, lazy=lazy)
+    if lazy:
+        await message.reply(f"✅ Cleared store for <b>{updated}</b> users; new offers are generated on their next /mystore.")
+    else:
+        await message.reply(f"✅ Refreshed store for <b>{updated}</b> users.")
 
 
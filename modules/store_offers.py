@@ -0,0 +1,172 @@
+"""
+Daily store offer generation.
+
+Store offers used to be drawn per user from the database. Each draw probed
+``information_schema``, ran a ``COUNT`` and an ``ORDER BY RANDOM()`` query,
+then re-weighted the handful of rows it got back with an O(n²) list
+``index``/``pop`` loop. ``/refreshallstores`` did that once per user and then
+wrote each offer with its own ``UPDATE``.
+
+``StoreSampler`` keeps the store-eligible catalog as ids plus cumulative
+rarity weights, so an offer is a weighted sample without replacement taken
+in memory. It is derived from the catalog search index and rebuilt when the
+index version changes. ``refresh_all_offers`` samples every user's offer in
+process and writes them in chunked ``UPDATE ... FROM unnest(...)``
+statements. In lazy mode it only clears the offers, and each user's offer
+is generated on their first ``/mystore`` of the day.
+"""
+
+import heapq
+import json
+import logging
+import random
+from bisect import bisect_right
+from datetime import datetime
+from itertools import accumulate
+from typing import Dict, List, Optional, Sequence
+
+from modules.search_index import CatalogSearchIndex, DerivedView, load_derived_view
+
+logger = logging.getLogger(__name__)
+
+OFFER_SIZE = 10
+WRITE_CHUNK = 5000  # offers per UPDATE statement
+
+# Define weights for rarities
+RARITY_WEIGHTS = {
+    "Common": 1,
+    "Medium": 1,
+    "Rare": 1,
+    "Legendary": 1,
+    "Exclusive": 1,
+    "Elite": 1,
+    "Limited Edition": 1,
+    "Ultimate":1,
+    "Ethereal": 1,
+    "Mythic": 1,
+    "Zenith": 1,
+    "Premium": 3,  # Added Premium with weight 1
+    "Mega Evolution": 0  # Added Mega Evolution with weight 1
+    # "Supreme" is excluded
+}
+
+STORE_EXCLUDED_RARITIES = {"Supreme"}
+STORE_EXCLUDED_IDS = {531, 664, 678, 849, 853, 877, 957, 1109, 1248, 1305}
+
+
+def weighted_sample(items: Sequence, weights: Sequence[float], k: int) -> List:
+    """Draw up to ``k`` distinct items, each draw weighted among the items not yet drawn.
+
+    Uses Efraimidis-Spirakis keys (``u ** (1 / w)``), so it is a single
+    O(n log k) pass. Items with weight 0 are never drawn.
+    """
+    keyed = [(random.random() ** (1.0 / w), i) for i, w in enumerate(weights) if w > 0]
+    return [items[i] for _, i in heapq.nlargest(k, keyed)]
+
+
+def pad_offer(selected: List, count: int) -> List:
+    """Repeat already-selected entries when the pool is smaller than the offer."""
+    padded = list(selected)
+    while selected and len(padded) < count:
+        padded.append(random.choice(selected))
+    return padded
+
+
+def is_store_eligible(row: Dict) -> bool:
+    return (
+        row.get('rarity') not in STORE_EXCLUDED_RARITIES
+        and row.get('character_id') not in STORE_EXCLUDED_IDS
+        and row.get('is_video') not in (True, 'true')
+    )
+
+
+class StoreSampler(DerivedView):
+    """Store-eligible character ids with cumulative rarity weights"""
+
+    def __init__(self):
+        super().__init__()
+        self.ids: List[int] = []
+        self._weights: List[int] = []
+        self._cum_weights: List[int] = []
+        self._characters: Dict[int, Dict] = {}
+
+    def _build(self, index: CatalogSearchIndex):
+        ids, weights = [], []
+        for char_id in sorted(index.characters):
+            row = index.characters[char_id]
+            weight = RARITY_WEIGHTS.get(row.get('rarity'), 1)
+            if weight > 0 and is_store_eligible(row):
+                ids.append(char_id)
+                weights.append(weight)
+        self.ids = ids
+        self._weights = weights
+        self._cum_weights = list(accumulate(weights))
+        # The index swaps in a new dict on rebuild, so this stays a consistent snapshot
+        self._characters = index.characters
+        logger.info(f"Store sampler built: {len(ids)} eligible characters")
+
+    def sample(self, count: int = OFFER_SIZE) -> List[int]:
+        """Character ids for one offer: weighted, distinct while the pool allows."""
+        if not self.ids:
+            return []
+        if count * 2 > len(self.ids):
+            return pad_offer(weighted_sample(self.ids, self._weights, count), count)
+        # Few picks from a large pool: weighted draws with rejection of repeats
+        total = self._cum_weights[-1]
+        chosen: List[int] = []
+        seen = set()
+        while len(chosen) < count:
+            char_id = self.ids[bisect_right(self._cum_weights, random.random() * total)]
+            if char_id not in seen:
+                seen.add(char_id)
+                chosen.append(char_id)
+        return chosen
+
+    def rows(self, ids: Sequence[int]) -> List[Dict]:
+        return [self._characters[i] for i in ids if i in self._characters]
+
+
+# Global instance
+store_sampler = StoreSampler()
+
+
+async def get_store_sampler(db) -> StoreSampler:
+    """Get the store sampler, rebuilding it if the catalog changed"""
+    return await load_derived_view(store_sampler, db)
+
+
+def new_offer(character_ids: List[int], date: Optional[str] = None, refreshes: int = 0) -> Dict:
+    return {
+        "date": date or datetime.utcnow().strftime("%Y-%m-%d"),
+        "characters": character_ids,
+        "refreshes": refreshes,
+        "purchased": [],
+        "pending_buy": None
+    }
+
+
+async def refresh_all_offers(db, lazy: bool = False) -> int:
+    """Give every user a fresh store offer; returns how many users were refreshed.
+
+    With ``lazy`` the offers are only cleared and each one is generated on the
+    user's next ``/mystore``.
+    """
+    if lazy and hasattr(db, 'pool'):
+        return await db.clear_store_offers()
+
+    user_ids = await db.get_all_user_ids()
+    sampler = await get_store_sampler(db)
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    if not hasattr(db, 'pool'):
+        for user_id in user_ids:
+            await db.update_user(user_id, {"store_offer": new_offer(sampler.sample(), today)})
+        return len(user_ids)
+
+    updated = 0
+    for start in range(0, len(user_ids), WRITE_CHUNK):
+        chunk = user_ids[start:start + WRITE_CHUNK]
+        offers = [json.dumps(new_offer(sampler.sample(), today)) for _ in chunk]
+        updated += await db.set_store_offers_bulk(chunk, offers)
+    logger.info(f"Refreshed store offers for {updated} users")
+    return updated
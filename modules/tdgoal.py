@@ -3,6 +3,7 @@ from pyrogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineK
 from .decorators import check_banned
 import os
 from modules.postgres_database import get_database
+from modules.catalog_stats import get_catalog_stats
 
 
 from datetime import datetime
@@ -216,10 +217,8 @@ async def tdgoal_callback(client: Client, callback_query: CallbackQuery):
                 # First, let's check if there are any Ultimate characters in the database
                 if hasattr(db, 'pool'):
                     try:
-                        async with db.pool.acquire() as conn:
-                            count_result = await conn.fetchrow("SELECT COUNT(*) FROM characters WHERE rarity = 'Ultimate'")
-                            ultimate_count = count_result[0] if count_result else 0
-                            print(f"tdgoal_callback: Found {ultimate_count} Ultimate characters in database")
+                        ultimate_count = (await get_catalog_stats(db)).count('Ultimate')
+                        print(f"tdgoal_callback: Found {ultimate_count} Ultimate characters in database")
                     except Exception as e:
                         print(f"tdgoal_callback error counting Ultimate characters: {e}")
                 
@@ -1,10 +1,12 @@
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Set
 import re
 import asyncpg
+from cachetools import TTLCache
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from modules.postgres_database import get_database, get_postgres_pool
+from modules.postgres_database import get_postgres_pool
 from modules.decorators import auto_register_user
 
 # Team management system for Pokemon collector bot
@@ -24,12 +26,65 @@ BANNED_TYPES = {
     "unknown",
 }
 
+# Team state cache: an edit session reads the team (with catalog details and
+# ownership) once, applies swap/move/add/remove in memory and writes it back
+# with a single statement.
+TEAM_STATE_TTL = 600  # 10 minutes
+_team_state_cache = TTLCache(maxsize=5000, ttl=TEAM_STATE_TTL)
+_team_table_ready = False
+
+
+@dataclass
+class TeamState:
+    """In-memory copy of a user's active team"""
+    user_id: int
+    team_name: str = "My Team"
+    pokemon_ids: List[int] = field(default_factory=list)
+    members: Dict[int, Dict] = field(default_factory=dict)  # character_id -> catalog row
+    owned_ids: Set[int] = field(default_factory=set)  # team members the user still owns
+    team_id: Optional[int] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    def member_name(self, pokemon_id: int) -> str:
+        member = self.members.get(pokemon_id)
+        return member['name'] if member else "Unknown Pokemon"
+
+    def details(self) -> List[Dict]:
+        """Catalog rows for the team, in team order."""
+        return [self.members[pid] for pid in self.pokemon_ids if pid in self.members]
+
+    def rarity_count(self, rarity: str) -> int:
+        return sum(1 for member in self.details() if (member.get('rarity') or '').strip() == rarity)
+
+    def add(self, pokemon_id: int, info: Dict):
+        self.pokemon_ids.append(pokemon_id)
+        self.members[pokemon_id] = info
+        self.owned_ids.add(pokemon_id)
+
+    def remove(self, pokemon_id: int):
+        self.pokemon_ids.remove(pokemon_id)
+
+    def swap(self, index1: int, index2: int):
+        self.pokemon_ids[index1], self.pokemon_ids[index2] = self.pokemon_ids[index2], self.pokemon_ids[index1]
+
+    def move(self, from_index: int, to_index: int):
+        self.pokemon_ids.insert(to_index, self.pokemon_ids.pop(from_index))
+
+    def reverse(self):
+        self.pokemon_ids.reverse()
+
+
 class TeamManager:
     """Manages Pokemon teams for users"""
     
     @staticmethod
     async def ensure_team_table():
         """Create teams table if it doesn't exist"""
+        global _team_table_ready
+        if _team_table_ready:
+            return True
+        
         pool = get_postgres_pool()
         if not pool:
             return False
@@ -51,6 +106,7 @@ class TeamManager:
                     CREATE INDEX IF NOT EXISTS idx_teams_user_id ON teams(user_id);
                     CREATE INDEX IF NOT EXISTS idx_teams_active ON teams(user_id, is_active);
                 ''')
+                _team_table_ready = True
                 return True
         except Exception as e:
             print(f"Error creating teams table: {e}")
@@ -87,51 +143,152 @@ class TeamManager:
             return None
 
     @staticmethod
-    async def create_or_update_team(user_id: int, pokemon_ids: List[int], team_name: str = "My Team") -> bool:
-        """Create new team or update existing one"""
-        print(f"DEBUG: create_or_update_team called for user {user_id}")
-        print(f"DEBUG: New pokemon_ids order: {pokemon_ids}")
+    async def get_team_state(user_id: int, refresh: bool = False) -> Optional[TeamState]:
+        """Load the user's team, catalog rows and ownership in one query (cached).
+        
+        Pass refresh=True at the start of an edit session to re-read the database.
+        """
+        if not refresh:
+            state = _team_state_cache.get(user_id)
+            if state is not None:
+                return state
         
         pool = get_postgres_pool()
         if not pool:
-            return False
-            
+            return None
+        
         try:
             async with pool.acquire() as conn:
-                # Check if user has an active team
-                existing = await conn.fetchrow('''
-                    SELECT id FROM teams WHERE user_id = $1 AND is_active = TRUE
-                ''', user_id)
-                
-                if existing:
-                    # Update existing team
-                    print(f"DEBUG: Updating existing team with IDs: {pokemon_ids}")
-                    await conn.execute('''
-                        UPDATE teams 
-                        SET pokemon_ids = $1, team_name = $2, updated_at = CURRENT_TIMESTAMP
-                        WHERE user_id = $3 AND is_active = TRUE
-                    ''', pokemon_ids, team_name, user_id)
-                else:
-                    # Create new team
-                    print(f"DEBUG: Creating new team with IDs: {pokemon_ids}")
-                    await conn.execute('''
-                        INSERT INTO teams (user_id, team_name, pokemon_ids)
-                        VALUES ($1, $2, $3)
-                    ''', user_id, team_name, pokemon_ids)
-                
-                # Verify the update
-                updated_team = await conn.fetchrow('''
-                    SELECT pokemon_ids FROM teams WHERE user_id = $1 AND is_active = TRUE
+                rows = await conn.fetch('''
+                    WITH team AS (
+                        SELECT id, team_name, pokemon_ids, created_at, updated_at
+                        FROM teams
+                        WHERE user_id = $1 AND is_active = TRUE
+                        ORDER BY updated_at DESC
+                        LIMIT 1
+                    )
+                    SELECT t.id, t.team_name, t.pokemon_ids, t.created_at, t.updated_at,
+                           c.character_id, c.name, c.rarity, c.anime, c.img_url, c.file_id, c.is_video, c.type,
+                           COALESCE(c.character_id = ANY(u.characters::int[]), FALSE) AS owned
+                    FROM team t
+                    LEFT JOIN LATERAL unnest(t.pokemon_ids) AS m(character_id) ON TRUE
+                    LEFT JOIN characters c ON c.character_id = m.character_id
+                    LEFT JOIN users u ON u.user_id = $1
                 ''', user_id)
-                if updated_team:
-                    print(f"DEBUG: Team updated successfully. New DB order: {updated_team['pokemon_ids']}")
-                else:
-                    print("DEBUG: Failed to verify team update")
-                
-                return True
+        except Exception as e:
+            print(f"Error loading team state: {e}")
+            return None
+        
+        if not rows:
+            _team_state_cache.pop(user_id, None)
+            return None
+        
+        first = rows[0]
+        state = TeamState(
+            user_id=user_id,
+            team_name=first['team_name'],
+            pokemon_ids=list(first['pokemon_ids'] or []),
+            team_id=first['id'],
+            created_at=first['created_at'],
+            updated_at=first['updated_at'],
+        )
+        for row in rows:
+            if row['character_id'] is None:
+                continue
+            state.members[row['character_id']] = {
+                'character_id': row['character_id'],
+                'name': row['name'],
+                'rarity': row['rarity'],
+                'anime': row['anime'],
+                'img_url': row['img_url'],
+                'file_id': row['file_id'],
+                'is_video': row['is_video'],
+                'type': row['type']
+            }
+            if row['owned']:
+                state.owned_ids.add(row['character_id'])
+        
+        _team_state_cache[user_id] = state
+        return state
+
+    @staticmethod
+    async def _write_team(user_id: int, pokemon_ids: List[int], team_name: str):
+        """Update the active team or create it, as one statement."""
+        pool = get_postgres_pool()
+        if not pool:
+            return None
+        async with pool.acquire() as conn:
+            return await conn.fetchrow('''
+                WITH updated AS (
+                    UPDATE teams
+                    SET pokemon_ids = $2, team_name = $3, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = $1 AND is_active = TRUE
+                    RETURNING id, created_at, updated_at
+                ), inserted AS (
+                    INSERT INTO teams (user_id, team_name, pokemon_ids)
+                    SELECT $1, $3, $2
+                    WHERE NOT EXISTS (SELECT 1 FROM updated)
+                    RETURNING id, created_at, updated_at
+                )
+                SELECT id, created_at, updated_at FROM updated
+                UNION ALL
+                SELECT id, created_at, updated_at FROM inserted
+                LIMIT 1
+            ''', user_id, pokemon_ids, team_name)
+
+    @staticmethod
+    async def save_team_state(state: TeamState) -> bool:
+        """Persist an edited team state with a single write."""
+        try:
+            row = await TeamManager._write_team(state.user_id, state.pokemon_ids, state.team_name)
+        except Exception as e:
+            print(f"Error saving team: {e}")
+            row = None
+        if not row:
+            # The in-memory copy no longer matches the database
+            _team_state_cache.pop(state.user_id, None)
+            return False
+        state.team_id = row['id']
+        state.created_at = row['created_at']
+        state.updated_at = row['updated_at']
+        _team_state_cache[state.user_id] = state
+        return True
+
+    @staticmethod
+    def invalidate_team_state(user_id: int):
+        _team_state_cache.pop(user_id, None)
+
+    @staticmethod
+    async def create_or_update_team(user_id: int, pokemon_ids: List[int], team_name: str = "My Team") -> bool:
+        """Create new team or update existing one"""
+        try:
+            row = await TeamManager._write_team(user_id, pokemon_ids, team_name)
+            return row is not None
         except Exception as e:
             print(f"Error creating/updating team: {e}")
             return False
+        finally:
+            TeamManager.invalidate_team_state(user_id)
+
+    @staticmethod
+    async def _get_candidate_info(user_id: int, pokemon_id: int) -> Optional[Dict]:
+        """Catalog row for a Pokemon plus whether the user owns it, in one query."""
+        pool = get_postgres_pool()
+        if not pool:
+            return None
+        try:
+            async with pool.acquire() as conn:
+                row = await conn.fetchrow('''
+                    SELECT c.character_id, c.name, c.rarity, c.anime, c.img_url, c.file_id, c.is_video, c.type,
+                           COALESCE(c.character_id = ANY(u.characters::int[]), FALSE) AS owned
+                    FROM characters c
+                    LEFT JOIN users u ON u.user_id = $1
+                    WHERE c.character_id = $2
+                ''', user_id, pokemon_id)
+                return dict(row) if row else None
+        except Exception as e:
+            print(f"Error getting Pokemon info: {e}")
+            return None
 
     @staticmethod
     async def add_pokemon_to_team(user_id: int, pokemon_id: int) -> tuple[bool, str]:
@@ -140,174 +297,107 @@ class TeamManager:
         await TeamManager.ensure_team_table()
         
         # Validate ownership defensively (don't rely only on command-level checks)
-        if not await TeamManager.user_owns_pokemon(user_id, pokemon_id):
-            pokemon_name = await TeamManager.get_pokemon_name(pokemon_id)
-            return False, f"❌ You don't own {pokemon_name}!"
+        candidate = await TeamManager._get_candidate_info(user_id, pokemon_id)
+        if not candidate or not candidate['owned']:
+            pokemon_name = candidate['name'] if candidate else "Unknown Pokemon"
+            return False, f"❌ You don't own {pokemon_name}! Use <code>/mycollection</code> to see your Pokemon."
 
-        # Fetch Pokemon info for validations (type and rarity)
-        pokemon_info = await TeamManager.get_pokemon_info(pokemon_id)
-        pokemon_name_for_msgs = pokemon_info.get('name') or await TeamManager.get_pokemon_name(pokemon_id)
-        ptype_raw = (pokemon_info.get('type') or '').strip()
+        pokemon_name_for_msgs = candidate['name']
+        ptype_raw = (candidate.get('type') or '').strip()
         # Normalize and split multi-types on common separators
         type_tokens = [t.strip().lower() for part in re.split(r"[|/,+]", ptype_raw) for t in [part] if t.strip()] if ptype_raw else []
         # If any token is banned, reject
         if any(t in BANNED_TYPES for t in type_tokens) or (not type_tokens and 'unknown' in BANNED_TYPES):
             return False, f"❌ {pokemon_name_for_msgs} cannot be added to teams."
 
+        info = {k: candidate[k] for k in ('character_id', 'name', 'rarity', 'anime', 'img_url', 'file_id', 'is_video', 'type')}
+
         # Get current team
-        team = await TeamManager.get_user_team(user_id)
+        state = await TeamManager.get_team_state(user_id)
         
-        if not team:
+        if not state:
             # Create new team with this Pokemon
-            success = await TeamManager.create_or_update_team(user_id, [pokemon_id])
-            if success:
-                # Get Pokemon name for better message
-                pokemon_name = pokemon_name_for_msgs
-                return True, f"✅ Team created with {pokemon_name}!"
+            state = TeamState(user_id=user_id)
+            state.add(pokemon_id, info)
+            if await TeamManager.save_team_state(state):
+                return True, f"✅ Team created with {pokemon_name_for_msgs}!"
             else:
                 return False, "Failed to create team"
         
-        current_pokemon = team['pokemon_ids']
-        
         # Check if Pokemon is already in team
-        if pokemon_id in current_pokemon:
-            pokemon_name = pokemon_name_for_msgs
-            return False, f"❌ {pokemon_name} is already in your team!"
+        if pokemon_id in state.pokemon_ids:
+            return False, f"❌ {pokemon_name_for_msgs} is already in your team!"
         
         # Check team size limit
-        if len(current_pokemon) >= MAX_TEAM_SIZE:
+        if len(state.pokemon_ids) >= MAX_TEAM_SIZE:
             return False, f"❌ Team is full! Maximum {MAX_TEAM_SIZE} Pokemon allowed."
 
         # Enforce maximum 3 Pokemon per rarity in team
-        try:
-            candidate_rarity = (pokemon_info.get('rarity') or '').strip()
-            pool = get_postgres_pool()
-            if pool and candidate_rarity:
-                async with pool.acquire() as conn:
-                    rows = await conn.fetch(
-                        '''SELECT rarity FROM characters WHERE character_id = ANY($1::int[])''',
-                        current_pokemon
-                    )
-                    rarity_counts = {}
-                    for r in rows:
-                        rstr = (r['rarity'] or '').strip()
-                        rarity_counts[rstr] = rarity_counts.get(rstr, 0) + 1
-                    if rarity_counts.get(candidate_rarity, 0) >= 3:
-                        return False, f"❌ You can have at most 3 Pokemon of {candidate_rarity} rarity in your team."
-        except Exception:
-            # If counting fails, do not block; proceed gracefully
-            pass
+        candidate_rarity = (candidate.get('rarity') or '').strip()
+        if candidate_rarity and state.rarity_count(candidate_rarity) >= 3:
+            return False, f"❌ You can have at most 3 Pokemon of {candidate_rarity} rarity in your team."
         
         # Add Pokemon to team
-        current_pokemon.append(pokemon_id)
-        success = await TeamManager.create_or_update_team(user_id, current_pokemon, team['team_name'])
-        if success:
-            pokemon_name = pokemon_name_for_msgs
-            return True, f"✅ {pokemon_name} added to your team!"
+        state.add(pokemon_id, info)
+        if await TeamManager.save_team_state(state):
+            return True, f"✅ {pokemon_name_for_msgs} added to your team!"
         else:
             return False, "Failed to add Pokemon to team"
 
     @staticmethod
     async def remove_pokemon_from_team(user_id: int, pokemon_id: int) -> tuple[bool, str]:
         """Remove a Pokemon from user's team"""
-        team = await TeamManager.get_user_team(user_id)
+        state = await TeamManager.get_team_state(user_id)
         
-        if not team:
+        if not state:
             return False, "❌ You don't have an active team!"
         
-        current_pokemon = team['pokemon_ids']
-        
-        if pokemon_id not in current_pokemon:
+        if pokemon_id not in state.pokemon_ids:
             pokemon_name = await TeamManager.get_pokemon_name(pokemon_id)
             return False, f"❌ {pokemon_name} is not in your team!"
         
         # Remove Pokemon from team
-        current_pokemon.remove(pokemon_id)
-        success = await TeamManager.create_or_update_team(user_id, current_pokemon, team['team_name'])
-        if success:
-            pokemon_name = await TeamManager.get_pokemon_name(pokemon_id)
+        pokemon_name = state.member_name(pokemon_id)
+        state.remove(pokemon_id)
+        if await TeamManager.save_team_state(state):
             return True, f"✅ {pokemon_name} removed from your team!"
         else:
             return False, "Failed to remove Pokemon from team"
 
     @staticmethod
-    async def get_team_details(user_id: int) -> Optional[Dict]:
+    async def get_team_details(user_id: int, refresh: bool = False) -> Optional[Dict]:
         """Get detailed information about user's team including Pokemon details"""
-        print(f"DEBUG: get_team_details called for user {user_id}")
-        db = get_database()
-        team = await TeamManager.get_user_team(user_id)
-        
-        if team:
-            print(f"DEBUG: Retrieved team pokemon_ids from DB: {team['pokemon_ids']}")
+        state = await TeamManager.get_team_state(user_id, refresh=refresh)
         
-        if not team or not team['pokemon_ids']:
+        if not state or not state.pokemon_ids:
             return None
         
         try:
             # Filter out any pokemon that the user no longer owns
-            try:
-                user_collection = await db.get_user_collection(user_id)
-                owned_ids = {p.get('character_id') for p in user_collection}
-            except Exception:
-                owned_ids = set()
-
-            original_ids = list(team['pokemon_ids'])
-            print(f"DEBUG: Original IDs from team: {original_ids}")
-            valid_ids = [pid for pid in original_ids if pid in owned_ids]
-            print(f"DEBUG: Valid IDs after ownership check: {valid_ids}")
+            valid_ids = [pid for pid in state.pokemon_ids if pid in state.owned_ids]
 
             # If stored team has unowned pokemon, auto-correct it in DB
-            if valid_ids != original_ids:
-                print(f"DEBUG: Auto-correcting team due to unowned Pokemon")
-                await TeamManager.create_or_update_team(user_id, valid_ids, team['team_name'])
+            if valid_ids != state.pokemon_ids:
+                state.pokemon_ids = valid_ids
+                await TeamManager.save_team_state(state)
 
             if not valid_ids:
                 return {
-                    'team_name': team['team_name'],
+                    'team_name': state.team_name,
                     'pokemon_count': 0,
                     'pokemon_details': [],
-                    'created_at': team['created_at'],
+                    'created_at': state.created_at,
                     'updated_at': datetime.utcnow()
                 }
 
-            # Get Pokemon details from characters table for valid ids only
-            pool = get_postgres_pool()
-            async with pool.acquire() as conn:
-                rows = await conn.fetch('''
-                    SELECT character_id, name, rarity, anime, img_url, file_id, is_video, type
-                    FROM characters 
-                    WHERE character_id = ANY($1::int[])
-                ''', valid_ids)
-                
-                # Create a lookup dictionary for Pokemon details
-                pokemon_lookup = {}
-                for row in rows:
-                    pokemon_lookup[row['character_id']] = {
-                        'character_id': row['character_id'],
-                        'name': row['name'],
-                        'rarity': row['rarity'],
-                        'anime': row['anime'],
-                        'img_url': row['img_url'],
-                        'file_id': row['file_id'],
-                        'is_video': row['is_video'],
-                        'type': row['type']
-                    }
-                
-                # Build pokemon_details in the correct order based on valid_ids
-                pokemon_details = []
-                for pokemon_id in valid_ids:
-                    if pokemon_id in pokemon_lookup:
-                        pokemon_details.append(pokemon_lookup[pokemon_id])
-                
-                print(f"DEBUG: Final pokemon_details order: {[p['character_id'] for p in pokemon_details]}")
-                
-                return {
-                    'team_name': team['team_name'],
-                    'pokemon_count': len(pokemon_details),
-                    'pokemon_details': pokemon_details,
-                    'created_at': team['created_at'],
-                    'updated_at': team['updated_at']
-                }
+            pokemon_details = state.details()
+            return {
+                'team_name': state.team_name,
+                'pokemon_count': len(pokemon_details),
+                'pokemon_details': pokemon_details,
+                'created_at': state.created_at,
+                'updated_at': state.updated_at
+            }
         except Exception as e:
             print(f"Error getting team details: {e}")
             return None
@@ -315,13 +405,16 @@ class TeamManager:
     @staticmethod
     async def user_owns_pokemon(user_id: int, pokemon_id: int) -> bool:
         """Check if user owns a specific Pokemon"""
-        db = get_database()
-        try:
-            user_collection = await db.get_user_collection(user_id)
-            for pokemon in user_collection:
-                if pokemon.get('character_id') == pokemon_id:
-                    return True
+        pool = get_postgres_pool()
+        if not pool:
             return False
+        try:
+            async with pool.acquire() as conn:
+                owned = await conn.fetchval(
+                    "SELECT $2 = ANY(characters::int[]) FROM users WHERE user_id = $1",
+                    user_id, pokemon_id
+                )
+                return bool(owned)
         except Exception as e:
             print(f"Error checking Pokemon ownership: {e}")
             return False
@@ -368,13 +461,12 @@ class TeamManager:
     @staticmethod
     async def swap_pokemon_positions(user_id: int, position1: int, position2: int) -> tuple[bool, str]:
         """Swap two Pokemon positions in the team"""
-        team = await TeamManager.get_user_team(user_id)
+        state = await TeamManager.get_team_state(user_id)
         
-        if not team:
+        if not state:
             return False, "❌ You don't have an active team!"
         
-        current_pokemon = team['pokemon_ids']
-        team_size = len(current_pokemon)
+        team_size = len(state.pokemon_ids)
         
         # Validate positions (1-based to 0-based conversion)
         pos1_idx = position1 - 1
@@ -390,21 +482,12 @@ class TeamManager:
             return False, "❌ You can't swap a Pokemon with itself!"
         
         # Get Pokemon names for confirmation message
-        pokemon1_name = await TeamManager.get_pokemon_name(current_pokemon[pos1_idx])
-        pokemon2_name = await TeamManager.get_pokemon_name(current_pokemon[pos2_idx])
-        
-        # Perform the swap
-        print(f"DEBUG: Before swap - Pokemon IDs: {current_pokemon}")
-        print(f"DEBUG: Swapping positions {position1} ({pos1_idx}) and {position2} ({pos2_idx})")
-        print(f"DEBUG: Pokemon at pos {position1}: {current_pokemon[pos1_idx]}")
-        print(f"DEBUG: Pokemon at pos {position2}: {current_pokemon[pos2_idx]}")
+        pokemon1_name = state.member_name(state.pokemon_ids[pos1_idx])
+        pokemon2_name = state.member_name(state.pokemon_ids[pos2_idx])
         
-        current_pokemon[pos1_idx], current_pokemon[pos2_idx] = current_pokemon[pos2_idx], current_pokemon[pos1_idx]
-        
-        print(f"DEBUG: After swap - Pokemon IDs: {current_pokemon}")
-        
-        # Update the team
-        success = await TeamManager.create_or_update_team(user_id, current_pokemon, team['team_name'])
+        # Perform the swap and persist it
+        state.swap(pos1_idx, pos2_idx)
+        success = await TeamManager.save_team_state(state)
         
         if success:
             return True, f"✅ Successfully swapped positions!\n🔄 {pokemon1_name} (Position {position1}) ↔ {pokemon2_name} (Position {position2})"
@@ -414,13 +497,12 @@ class TeamManager:
     @staticmethod
     async def move_pokemon_to_position(user_id: int, from_position: int, to_position: int) -> tuple[bool, str]:
         """Move a Pokemon from one position to another, shifting others"""
-        team = await TeamManager.get_user_team(user_id)
+        state = await TeamManager.get_team_state(user_id)
         
-        if not team:
+        if not state:
             return False, "❌ You don't have an active team!"
         
-        current_pokemon = team['pokemon_ids']
-        team_size = len(current_pokemon)
+        team_size = len(state.pokemon_ids)
         
         # Validate positions (1-based to 0-based conversion)
         from_idx = from_position - 1
@@ -436,20 +518,11 @@ class TeamManager:
             return False, "❌ Pokemon is already in that position!"
         
         # Get Pokemon name for confirmation
-        pokemon_name = await TeamManager.get_pokemon_name(current_pokemon[from_idx])
-        
-        # Remove Pokemon from original position and insert at new position
-        print(f"DEBUG: Before move - Pokemon IDs: {current_pokemon}")
-        print(f"DEBUG: Moving from position {from_position} ({from_idx}) to position {to_position} ({to_idx})")
-        print(f"DEBUG: Pokemon to move: {current_pokemon[from_idx]}")
+        pokemon_name = state.member_name(state.pokemon_ids[from_idx])
         
-        pokemon_to_move = current_pokemon.pop(from_idx)
-        current_pokemon.insert(to_idx, pokemon_to_move)
-        
-        print(f"DEBUG: After move - Pokemon IDs: {current_pokemon}")
-        
-        # Update the team
-        success = await TeamManager.create_or_update_team(user_id, current_pokemon, team['team_name'])
+        # Remove Pokemon from original position, insert at new position and persist
+        state.move(from_idx, to_idx)
+        success = await TeamManager.save_team_state(state)
         
         if success:
             return True, f"✅ Successfully moved {pokemon_name} from position {from_position} to position {to_position}!"
@@ -466,7 +539,7 @@ async def team_command(client: Client, message: Message):
     # Ensure team table exists
     await TeamManager.ensure_team_table()
     
-    team_details = await TeamManager.get_team_details(user_id)
+    team_details = await TeamManager.get_team_details(user_id, refresh=True)
     
     if not team_details:
         # No team exists, show minimal hint
@@ -521,13 +594,7 @@ async def addteam_command(client: Client, message: Message):
         await message.reply_text("❌ Please provide a valid Pokemon ID (number).")
         return
     
-    # Check if user owns this Pokemon
-    if not await TeamManager.user_owns_pokemon(user_id, pokemon_id):
-        pokemon_name = await TeamManager.get_pokemon_name(pokemon_id)
-        await message.reply_text(f"❌ You don't own {pokemon_name}! Use <code>/mycollection</code> to see your Pokemon.")
-        return
-    
-    # Add Pokemon to team
+    # Add Pokemon to team (ownership is validated there)
     success, msg = await TeamManager.add_pokemon_to_team(user_id, pokemon_id)
     
     if success:
@@ -572,8 +639,8 @@ async def editteam_command(client: Client, message: Message):
     # Ensure team table exists
     await TeamManager.ensure_team_table()
     
-    # Get current team
-    team_details = await TeamManager.get_team_details(user_id)
+    # Get current team (fresh read starts the edit session)
+    team_details = await TeamManager.get_team_details(user_id, refresh=True)
     
     if not team_details or not team_details['pokemon_details']:
         await message.reply_text(
@@ -643,9 +710,9 @@ async def moveteam_command(client: Client, message: Message):
 async def check_team_edit_access(callback_query: CallbackQuery) -> bool:
     """Check if user has access to edit team (simple version)"""
     callback_user_id = callback_query.from_user.id
-    team = await TeamManager.get_user_team(callback_user_id)
+    state = await TeamManager.get_team_state(callback_user_id)
     
-    if not team or not team.get('pokemon_ids'):
+    if not state or not state.pokemon_ids:
         await callback_query.answer("❌ Access denied! You don't have a team to edit.", show_alert=True)
         return False
     
@@ -851,11 +918,11 @@ async def team_callback_handler(client: Client, callback_query: CallbackQuery):
         if not await check_team_edit_access_with_id(callback_query, data):
             return
         user_id = callback_query.from_user.id
-        team = await TeamManager.get_user_team(user_id)
+        state = await TeamManager.get_team_state(user_id)
         
-        if team and team['pokemon_ids']:
-            reversed_pokemon = list(reversed(team['pokemon_ids']))
-            success = await TeamManager.create_or_update_team(user_id, reversed_pokemon, team['team_name'])
+        if state and state.pokemon_ids:
+            state.reverse()
+            success = await TeamManager.save_team_state(state)
             
             if success:
                 await callback_query.answer("✅ Team order reversed!", show_alert=True)
@@ -17,6 +17,8 @@ from modules.postgres_database import get_database
 from .decorators import check_banned, is_og, is_owner, is_sudo, require_membership
 from .logging_utils import send_token_log
 from .admin_approval import AdminAction, create_approval_request
+from .lock_manager import user_lock
+from .action_registry import action_manager
 
 # BALANCE
 @check_banned
@@ -66,10 +68,7 @@ async def balance_command(client: Client, message: Message):
 @check_banned
 async def deposit_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in financial_locks:
-        financial_locks[user_id] = asyncio.Lock()
-    
-    async with financial_locks[user_id]:
+    async with user_lock('financial', user_id):
         db = get_database()
         args = message.text.split()
         if len(args) < 2:
@@ -79,17 +78,9 @@ async def deposit_command(client: Client, message: Message):
             amount = int(args[1])
             if amount <= 0:
                 raise ValueError
-            user = await db.get_user(user_id)
-            wallet = user.get('wallet', 0)
-            if wallet is None:
-                wallet = 0
-            if wallet < amount:
+            if await db.apply_currency(user_id, {'wallet': -amount, 'bank': amount}, 'deposit') is None:
                 await message.reply_text("❌ <b>You don't have enough tokens in your wallet!</b>")
                 return
-            bank = user.get('bank', 0)
-            if bank is None:
-                bank = 0
-            await db.update_user(user_id, {'wallet': wallet - amount, 'bank': bank + amount})
             await message.reply_text(f"✅ <b>Successfully deposited</b> <code>{amount:,}</code> <b>tokens to your bank!</b>")
         except ValueError:
             await message.reply_text("❌ <b>Please provide a valid positive number!</b>")
@@ -98,10 +89,7 @@ async def deposit_command(client: Client, message: Message):
 @check_banned
 async def withdraw_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in financial_locks:
-        financial_locks[user_id] = asyncio.Lock()
-    
-    async with financial_locks[user_id]:
+    async with user_lock('financial', user_id):
         db = get_database()
         args = message.text.split()
         if len(args) < 2:
@@ -111,17 +99,9 @@ async def withdraw_command(client: Client, message: Message):
             amount = int(args[1])
             if amount <= 0:
                 raise ValueError
-            user = await db.get_user(user_id)
-            wallet = user.get('wallet', 0)
-            if wallet is None:
-                wallet = 0
-            bank = user.get('bank', 0)
-            if bank is None:
-                bank = 0
-            if bank < amount:
+            if await db.apply_currency(user_id, {'wallet': amount, 'bank': -amount}, 'withdraw') is None:
                 await message.reply_text("❌ <b>You don't have enough tokens in your bank!</b>")
                 return
-            await db.update_user(user_id, {'wallet': wallet + amount, 'bank': bank - amount})
             await message.reply_text(f"✅ <b>Successfully withdrew</b> <code>{amount:,}</code> <b>tokens from your bank!</b>")
             return
         except ValueError:
@@ -150,8 +130,12 @@ async def daily_command(client: Client, message: Message):
             )
             return
     reward = 5000
-    wallet = user.get('wallet', 0)
-    await db.update_user(user_id, {'wallet': wallet + reward, 'last_daily': now})
+    # The cooldown is checked again in the UPDATE, so concurrent claims are paid once
+    claimed = await db.apply_currency(user_id, {'wallet': reward}, 'daily', set_fields={'last_daily': now},
+                                      cooldown=('last_daily', timedelta(days=1)))
+    if claimed is None:
+        await message.reply_text("❌ <b>You've already claimed your daily reward!</b>")
+        return
     await message.reply_text(f"✅ <b>Daily reward claimed!</b>\n\n💰 You received: <b>{reward:,}</b> tokens")
 
 # WEEKLY
@@ -177,8 +161,12 @@ async def weekly_command(client: Client, message: Message):
             )
             return
     reward = 15000
-    wallet = user.get('wallet', 0)
-    await db.update_user(user_id, {'wallet': wallet + reward, 'last_weekly': now})
+    # The cooldown is checked again in the UPDATE, so concurrent claims are paid once
+    claimed = await db.apply_currency(user_id, {'wallet': reward}, 'weekly', set_fields={'last_weekly': now},
+                                      cooldown=('last_weekly', timedelta(days=7)))
+    if claimed is None:
+        await message.reply_text("❌ <b>You've already claimed your weekly reward!</b>")
+        return
     await message.reply_text(f"✅ <b>Weekly reward claimed!</b>\n\n💰 You received: <b>{reward:,}</b> tokens")
 
 # MONTHLY
@@ -204,8 +192,12 @@ async def monthly_command(client: Client, message: Message):
             )
             return
     reward = 35000
-    wallet = user.get('wallet', 0)
-    await db.update_user(user_id, {'wallet': wallet + reward, 'last_monthly': now})
+    # The cooldown is checked again in the UPDATE, so concurrent claims are paid once
+    claimed = await db.apply_currency(user_id, {'wallet': reward}, 'monthly', set_fields={'last_monthly': now},
+                                      cooldown=('last_monthly', timedelta(days=30)))
+    if claimed is None:
+        await message.reply_text("❌ <b>You've already claimed your monthly reward!</b>")
+        return
     await message.reply_text(f"✅ <b>Monthly reward claimed!</b>\n\n💰 You received: <b>{reward:,}</b> tokens")
 
 # GIVE TOKENS (ADMIN, REPLY)
@@ -251,8 +243,7 @@ async def give_tokens(client: Client, message: Message):
                     'collection_preferences': {'mode': 'default', 'filter': None}
                 })
             else:
-                new_balance = target_data.get('wallet', 0) + amount
-                await db.update_user(target_user.id, {'wallet': new_balance})
+                await db.credit(target_user.id, 'wallet', amount, 'admin_give', counterparty=user_id)
             
             await message.reply_text(f"✅ <b>{amount:,} tokens given to {target_user.first_name}!</b>")
             
@@ -332,8 +323,9 @@ async def take_tokens(client: Client, message: Message):
         # Check if user is owner - if so, execute directly
         if is_owner(user_id):
             # Execute the action directly for owner
-            new_balance = wallet - amount
-            await db.update_user(target_user.id, {'wallet': new_balance})
+            if await db.debit(target_user.id, 'wallet', amount, 'admin_take', counterparty=user_id) is None:
+                await message.reply_text("❌ <b>User doesn't have enough tokens!</b>")
+                return
             
             await message.reply_text(f"✅ <b>{amount:,} tokens taken from {target_user.first_name}!</b>")
             
@@ -384,10 +376,7 @@ async def take_tokens(client: Client, message: Message):
 @check_banned
 async def pay_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in financial_locks:
-        financial_locks[user_id] = asyncio.Lock()
-    
-    async with financial_locks[user_id]:
+    async with user_lock('financial', user_id):
         now = datetime.utcnow()
         last_used = pay_last_used.get(user_id)
         if last_used and (now - last_used).total_seconds() < PAY_COOLDOWN:
@@ -424,8 +413,7 @@ async def pay_command(client: Client, message: Message):
         if not sender_data:
             await message.reply_text("❌ <b>You don't have an account!</b>")
             return
-        sender_wallet = sender_data.get('wallet', 0)
-        if sender_wallet < amount:
+        if (sender_data.get('wallet', 0) or 0) < amount:
             await message.reply_text("❌ <b>You don't have enough tokens!</b>")
             return
         receiver_data = await db.get_user(receiver.id)
@@ -434,15 +422,14 @@ async def pay_command(client: Client, message: Message):
                 'user_id': receiver.id,
                 'username': receiver.username,
                 'first_name': receiver.first_name,
-                'wallet': amount,
+                'wallet': 0,
                 'bank': 0,
                 'characters': [],
                 'groups': []
             })
-        else:
-            receiver_wallet = receiver_data.get('wallet', 0)
-            await db.update_user(receiver.id, {'wallet': receiver_wallet + amount})
-        await db.update_user(sender.id, {'wallet': sender_wallet - amount})
+        if await db.transfer(sender.id, receiver.id, 'wallet', amount, 'pay') is None:
+            await message.reply_text("❌ <b>You don't have enough tokens!</b>")
+            return
         await message.reply_text(f"✅ <b>Payment successful!</b>\n\n💰 <b>{amount:,}</b> tokens paid to {receiver.mention}")
 
         # Log transaction for both sender and receiver
@@ -495,15 +482,13 @@ async def shards_pay(client: Client, message: Message):
             'first_name': receiver.first_name,
             'wallet': 0,
             'bank': 0,
-            'shards': amount,
+            'shards': 0,
             'characters': [],
             'groups': []
         })
-    else:
-        receiver_shards = receiver_data.get('shards', 0)
-        await db.update_user(receiver.id, {'shards': receiver_shards + amount})
-    sender_shards = sender_data.get('shards', 0)
-    await db.update_user(user_id, {'shards': sender_shards - amount})
+    if await db.transfer(user_id, receiver.id, 'shards', amount, 'shards_pay') is None:
+        await message.reply_text("❌ <b>You don't have enough 🎐 shards!</b>")
+        return
     await message.reply_text(f"✅ <b>Shards payment successful!</b>\n\n🎐 <b>{amount:,}</b> shards paid to {receiver.mention}")
 
 # GIVE SHARDS (ADMIN, REPLY)
@@ -546,8 +531,7 @@ async def give_shards(client: Client, message: Message):
                 'collection_preferences': {'mode': 'default', 'filter': None}
             })
         else:
-            new_balance = target_data.get('shards', 0) + amount
-            await db.update_user(target_user.id, {'shards': new_balance})
+            await db.credit(target_user.id, 'shards', amount, 'admin_give', counterparty=user_id)
         await message.reply_text(f"✅ <b>Successfully gave</b> <code>{amount:,}</code> <b>🎐 shards to</b> {target_user.mention}")
     except ValueError:
         await message.reply_text("❌ <b>Please provide a valid positive number!</b>")
@@ -581,37 +565,27 @@ async def take_shards(client: Client, message: Message):
         if shards < amount:
             await message.reply_text("❌ <b>User doesn't have enough 🎐 shards!</b>")
             return
-        new_balance = shards - amount
-        await db.update_user(target_user.id, {'shards': new_balance})
+        if await db.debit(target_user.id, 'shards', amount, 'admin_take', counterparty=user_id) is None:
+            await message.reply_text("❌ <b>User doesn't have enough 🎐 shards!</b>")
+            return
         await message.reply_text(f"✅ <b>Successfully taken</b> <code>{amount:,}</code> <b>🎐 shards from</b> {target_user.mention}")
     except ValueError:
         await message.reply_text("❌ <b>Please provide a valid positive number!</b>")
 
 
 
-# Cooldown and lock dictionaries for each game command
-football_locks = {}
+# Cooldown dictionaries for each game command (locks come from modules.lock_manager)
 football_last_used = {}
-dart_locks = {}
 dart_last_used = {}
-basket_locks = {}
 basket_last_used = {}
-roll_locks = {}
 roll_last_used = {}
-slot_locks = {}
 slot_last_used = {}
-bowl_locks = {}
 bowl_last_used = {}
 
-# Payment locks to prevent farming
-pay_locks = {}
+# Payment cooldowns to prevent farming
 pay_last_used = {}
-sspay_locks = {}
 sspay_last_used = {}
 
-# Financial operation locks to prevent race conditions
-financial_locks = {}
-
 COOLDOWN_MIN = 120
 COOLDOWN_MAX = 180
 football_cooldowns = {}
@@ -726,11 +700,10 @@ async def loan_request_command(client: Client, message: Message):
     preview_total = amount + base_interest
     _, duration_text = get_loan_due()
     pending = {
-        'type': 'loan_request',
         'amount': amount,
         'requested_at': datetime.utcnow().isoformat()
     }
-    await db.update_user(user_id, {'active_action': pending})
+    await action_manager.set_user_action(db, user_id, 'loan_request', pending)
     await message.reply_text(
         "✅ <b>Your loan request has been submitted for owner approval.</b>\n\n"
         f"• <b>Weekly Interest:</b> <code>{int(weekly_interest_rate*100)}%</code>\n"
@@ -795,12 +768,12 @@ async def loan_approve_command(client: Client, message: Message):
     if not user:
         await message.reply_text("❌ <b>User not found.</b>")
         return
-    action = user.get('active_action') or {}
-    if not isinstance(action, dict) or action.get('type') != 'loan_request':
+    action = action_manager.get(target_id) or {}
+    if action.get('type') != 'loan_request':
         await message.reply_text("❌ <b>No pending loan request for this user.</b>")
         return
     try:
-        amount = int(action.get('amount') or 0)
+        amount = int(action_manager.get_action_data(target_id).get('amount') or 0)
     except Exception:
         amount = 0
     if amount <= 0 or amount > MAX_LOAN:
@@ -831,12 +804,10 @@ async def loan_approve_command(client: Client, message: Message):
         await message.reply_text("❌ <b>User not eligible for loan.</b>")
         return
     due, duration_text = get_loan_due()
-    wallet = user.get('wallet', 0) or 0
     weekly_interest_rate, daily_penalty_rate, notes = get_loan_terms(amount)
     base_interest = int(round(amount * weekly_interest_rate))
     base_due = amount + base_interest
-    await db.update_user(target_id, {
-        'wallet': wallet + amount,
+    await db.apply_currency(target_id, {'wallet': amount}, 'loan', set_fields={
         'loan_amount': amount,
         'loan_due': due,
         'loan_active': True,
@@ -844,9 +815,9 @@ async def loan_approve_command(client: Client, message: Message):
         'loan_interest_rate': weekly_interest_rate,
         'loan_penalty_rate': daily_penalty_rate,
         'loan_base_due': base_due,
-        'loan_tier': notes,
-        'active_action': None
+        'loan_tier': notes
     })
+    await action_manager.clear_user_action(db, target_id)
     await message.reply_text(
         f"✅ <b>Approved loan of</b> <code>{amount:,}</code> <b>to</b> <code>{target_id}</code>.\n"
         f"• <b>Base Due in {duration_text}:</b> <code>{base_due:,}</code> (incl. interest)\n"
@@ -886,8 +857,9 @@ async def handle_loan_callback(client: Client, callback_query: CallbackQuery):
         except Exception:
             pass
         return
-    pending = user.get('active_action') or {}
-    if not isinstance(pending, dict) or pending.get('type') != 'loan_request':
+    pending_action = action_manager.get(user_id) or {}
+    pending = action_manager.get_action_data(user_id)
+    if pending_action.get('type') != 'loan_request':
         await callback_query.answer("No pending request", show_alert=True)
         try:
             await callback_query.edit_message_reply_markup(None)
@@ -928,12 +900,10 @@ async def handle_loan_callback(client: Client, callback_query: CallbackQuery):
             await callback_query.answer("User not eligible", show_alert=True)
             return
         due, duration_text = get_loan_due()
-        wallet = user.get('wallet', 0) or 0
         weekly_interest_rate, daily_penalty_rate, notes = get_loan_terms(amount)
         base_interest = int(round(amount * weekly_interest_rate))
         base_due = amount + base_interest
-        await db.update_user(user_id, {
-            'wallet': wallet + amount,
+        await db.apply_currency(user_id, {'wallet': amount}, 'loan', set_fields={
             'loan_amount': amount,
             'loan_due': due,
             'loan_active': True,
@@ -941,9 +911,9 @@ async def handle_loan_callback(client: Client, callback_query: CallbackQuery):
             'loan_interest_rate': weekly_interest_rate,
             'loan_penalty_rate': daily_penalty_rate,
             'loan_base_due': base_due,
-            'loan_tier': notes,
-            'active_action': None
+            'loan_tier': notes
         })
+        await action_manager.clear_user_action(db, user_id)
         # Notify owner and user
         await callback_query.answer("Approved", show_alert=False)
         try:
@@ -964,7 +934,7 @@ async def handle_loan_callback(client: Client, callback_query: CallbackQuery):
             pass
     elif action == 'loan_decline':
         # Clear pending action
-        await db.update_user(user_id, {'active_action': None})
+        await action_manager.clear_user_action(db, user_id)
         await callback_query.answer("Declined", show_alert=False)
         try:
             await client.send_message(user_id, "❌ Your loan request was declined by the owner.")
@@ -1043,8 +1013,8 @@ async def loan_repay_command(client: Client, message: Message):
             + (f" + Penalty <code>{penalty:,}</code> ({overdue_days} day(s))" if penalty else "")
         )
         return
-    await db.update_user(user_id, {
-        'wallet': wallet - total_due,
+    # Only debits while the loan is still active, so concurrent repays can't both pay
+    repaid = await db.apply_currency(user_id, {'wallet': -total_due}, 'loan_repay', where={'loan_active': True}, set_fields={
         'loan_amount': 0,
         'loan_due': None,
         'loan_active': False,
@@ -1054,6 +1024,9 @@ async def loan_repay_command(client: Client, message: Message):
         'loan_base_due': None,
         'loan_tier': None
     })
+    if repaid is None:
+        await message.reply_text("❌ <b>Insufficient wallet balance, or the loan was already repaid.</b>")
+        return
     await message.reply_text(
         "✅ <b>Loan repaid. Thank you!</b>\n"
         f"• <b>Paid:</b> <code>{total_due:,}</code>\n"
@@ -1064,9 +1037,7 @@ async def loan_repay_command(client: Client, message: Message):
 @check_banned
 async def football_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in football_locks:
-        football_locks[user_id] = asyncio.Lock()
-    async with football_locks[user_id]:
+    async with user_lock('football', user_id):
         now = datetime.utcnow()
         last_used = football_last_used.get(user_id)
         cooldown = football_cooldowns.get(user_id, COOLDOWN_MIN)
@@ -1092,12 +1063,9 @@ async def football_command(client: Client, message: Message):
             if dice.dice.value in (4, 5):
                 reward = random.randint(100, 600)
                 db = get_database()
-                user = await db.get_user(user_id)
-                if not user:
+                if await db.credit(user_id, 'shards', reward, 'football_win') is None:
                     await message.reply_text("❌ <b>You need an account to receive rewards. Use /start first!</b>")
                     return
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + reward})
                 await db.log_user_transaction(user_id, "football_win", {
                     "reward": reward,
                     "chat_id": message.chat.id,
@@ -1112,9 +1080,7 @@ async def football_command(client: Client, message: Message):
 @check_banned
 async def dart_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in dart_locks:
-        dart_locks[user_id] = asyncio.Lock()
-    async with dart_locks[user_id]:
+    async with user_lock('dart', user_id):
         now = datetime.utcnow()
         last_used = dart_last_used.get(user_id)
         cooldown = dart_cooldowns.get(user_id, COOLDOWN_MIN)
@@ -1139,12 +1105,9 @@ async def dart_command(client: Client, message: Message):
             if dice.dice.value == 6:
                 reward = random.randint(100, 600)
                 db = get_database()
-                user = await db.get_user(user_id)
-                if not user:
+                if await db.credit(user_id, 'shards', reward, 'dart_win') is None:
                     await message.reply_text("❌ <b>You need an account to receive rewards. Use /start first!</b>")
                     return
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + reward})
                 await db.log_user_transaction(user_id, "dart_win", {
                     "reward": reward,
                     "chat_id": message.chat.id,
@@ -1159,9 +1122,7 @@ async def dart_command(client: Client, message: Message):
 @check_banned
 async def basket_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in basket_locks:
-        basket_locks[user_id] = asyncio.Lock()
-    async with basket_locks[user_id]:
+    async with user_lock('basket', user_id):
         now = datetime.utcnow()
         last_used = basket_last_used.get(user_id)
         cooldown = basket_cooldowns.get(user_id, COOLDOWN_MIN)
@@ -1186,12 +1147,9 @@ async def basket_command(client: Client, message: Message):
             if dice.dice.value in (4, 5):
                 reward = random.randint(100, 600)
                 db = get_database()
-                user = await db.get_user(user_id)
-                if not user:
+                if await db.credit(user_id, 'shards', reward, 'basket_win') is None:
                     await message.reply_text("❌ <b>You need an account to receive rewards. Use /start first!</b>")
                     return
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + reward})
                 await db.log_user_transaction(user_id, "basket_win", {
                     "reward": reward,
                     "chat_id": message.chat.id,
@@ -1206,9 +1164,7 @@ async def basket_command(client: Client, message: Message):
 @check_banned
 async def roll_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in roll_locks:
-        roll_locks[user_id] = asyncio.Lock()
-    async with roll_locks[user_id]:
+    async with user_lock('roll', user_id):
         now = datetime.utcnow()
         last_used = roll_last_used.get(user_id)
         cooldown = roll_cooldowns.get(user_id, COOLDOWN_MIN)
@@ -1246,12 +1202,9 @@ async def roll_command(client: Client, message: Message):
             if rolled == user_number:
                 reward = random.randint(100, 600)
                 db = get_database()
-                user = await db.get_user(user_id)
-                if not user:
+                if await db.credit(user_id, 'shards', reward, 'roll_win') is None:
                     await message.reply_text("❌ <b>You need an account to receive rewards. Use /start first!</b>")
                     return
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + reward})
                 await message.reply_text(f"🎲 <b>Congrats! You guessed {user_number} and rolled {rolled}!</b>\nYou won <b>{reward} 🎐 shards!</b>", reply_to_message_id=message.id)
             else:
                 await message.reply_text(f"🎲 <b>You guessed {user_number}, but rolled {rolled}. No reward this time!</b>", reply_to_message_id=message.id)
@@ -1261,9 +1214,7 @@ async def roll_command(client: Client, message: Message):
 @check_banned
 async def slot_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in slot_locks:
-        slot_locks[user_id] = asyncio.Lock()
-    async with slot_locks[user_id]:
+    async with user_lock('slot', user_id):
         now = datetime.utcnow()
         last_used = slot_last_used.get(user_id)
         cooldown = slot_cooldowns.get(user_id, COOLDOWN_MIN)
@@ -1302,12 +1253,9 @@ async def slot_command(client: Client, message: Message):
             
             if reward > 0:
                 db = get_database()
-                user = await db.get_user(user_id)
-                if not user:
+                if await db.credit(user_id, 'shards', reward, 'slot_win') is None:
                     await message.reply_text("❌ <b>You need an account to receive rewards. Use /start first!</b>")
                     return
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + reward})
                 await db.log_user_transaction(user_id, "slot_win", {
                     "reward": reward,
                     "slot_value": slot_value,
@@ -1323,9 +1271,7 @@ async def slot_command(client: Client, message: Message):
 @check_banned
 async def bowl_command(client: Client, message: Message):
     user_id = message.from_user.id
-    if user_id not in bowl_locks:
-        bowl_locks[user_id] = asyncio.Lock()
-    async with bowl_locks[user_id]:
+    async with user_lock('bowl', user_id):
         now = datetime.utcnow()
         last_used = bowl_last_used.get(user_id)
         cooldown = bowl_cooldowns.get(user_id, COOLDOWN_MIN)
@@ -1364,12 +1310,9 @@ async def bowl_command(client: Client, message: Message):
             
             if reward > 0:
                 db = get_database()
-                user = await db.get_user(user_id)
-                if not user:
+                if await db.credit(user_id, 'shards', reward, 'bowl_win') is None:
                     await message.reply_text("❌ <b>You need an account to receive rewards. Use /start first!</b>")
                     return
-                shards = user.get('shards', 0)
-                await db.update_user(user_id, {'shards': shards + reward})
                 await db.log_user_transaction(user_id, "bowl_win", {
                     "reward": reward,
                     "bowl_value": bowl_value,
@@ -1409,8 +1352,7 @@ REGIONS = {
 }
 
 
-# Explore cooldown and locks
-explore_locks = {}
+# Explore cooldown
 explore_last_used = {}
 explore_message_owners = {}  # Track who owns each explore message
 explore_message_timestamps = {}  # Track when messages were created
@@ -1436,10 +1378,7 @@ async def explore_command(client: Client, message: Message):
         return
     
     # Initialize lock for this user if not exists
-    if user_id not in explore_locks:
-        explore_locks[user_id] = asyncio.Lock()
-    
-    async with explore_locks[user_id]:
+    async with user_lock('explore', user_id):
         # Check if user has an active exploration session
         active_session = None
         for msg_id, owner_id in explore_message_owners.items():
@@ -1557,10 +1496,7 @@ async def explore_callback(client: Client, callback_query: CallbackQuery):
         return
     
     # Initialize lock for this user if not exists
-    if user_id not in explore_locks:
-        explore_locks[user_id] = asyncio.Lock()
-    
-    async with explore_locks[user_id]:
+    async with user_lock('explore', user_id):
         # Check cooldown
         now = datetime.utcnow()
         last_used = explore_last_used.get(user_id)
@@ -1628,19 +1564,10 @@ async def explore_callback(client: Client, callback_query: CallbackQuery):
             
             # Update user's balance
             db = get_database()
-            user = await db.get_user(user_id)
-            if not user:
+            if await db.apply_currency(user_id, {'wallet': tokens_earned, 'shards': shards_earned}, 'explore') is None:
                 await callback_query.answer("❌ You need an account to receive rewards!", show_alert=True)
                 return
             
-            current_tokens = user.get('wallet', 0)
-            current_shards = user.get('shards', 0)
-            
-            await db.update_user(user_id, {
-                'wallet': current_tokens + tokens_earned,
-                'shards': current_shards + shards_earned
-            })
-            
             # Log transaction
             await db.log_user_transaction(user_id, "explore_success", {
                 "planet": planet_name,
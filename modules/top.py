@@ -8,6 +8,7 @@ import os
 
 # Import database based on configuration
 from modules.postgres_database import get_database
+from modules.user_cache import user_cache
 import time
 
 # NOTE: Telegram API Limitation
@@ -19,7 +20,8 @@ import time
 # 2. Periodically syncs names from active users
 # 3. Uses cached names for better performance
 #
-# CURRENT SOLUTION: Try to fetch from Telegram, fallback to database names with smart error handling.
+# CURRENT SOLUTION: Resolve names through the shared user cache (modules/user_cache.py), which batches
+# Telegram lookups per leaderboard and falls back to database names.
 
 # Helper for markdown v2 escaping (minimal)
 def escape_markdown(text, version=2):
@@ -75,6 +77,7 @@ async def distribute_daily_rewards(client: Client):
                 )
         
         message = "🎉 <b>Daily Leaderboard Results</b> 🎉\n\n<b>Top Collectors of the Day:</b>\n\n"
+        await _prefetch_display_names(client, [collector['user_id'] for collector in top_collectors])
         for idx, collector in enumerate(top_collectors, 1):
             if idx in REWARDS:
                 reward = REWARDS[idx]
@@ -107,79 +110,38 @@ async def distribute_daily_rewards(client: Client):
     except Exception as e:
         print(f"Error in distribute_daily_rewards: {e}")
 
+async def _prefetch_display_names(client: Client, user_ids) -> None:
+    """Warm the shared user cache for a whole leaderboard with one batched get_users call."""
+    try:
+        await user_cache.resolve_many(client, user_ids)
+    except Exception as e:
+        print(f"Error prefetching display names: {e}")
+
 async def _fetch_display_name(client: Client, user_id: int, cache: dict | None = None) -> str:
     """Fetch the user's display name from Telegram using user_id, with optional per-call cache."""
     if cache is not None and user_id in cache:
         return cache[user_id]
-    try:
-        user = await client.get_users(user_id)
-        if user and hasattr(user, 'first_name') and user.first_name:
-            name = user.first_name
-        else:
-            name = "Unknown"
-    except Exception as e:
-        print(f"Error fetching user {user_id}: {e}")
-        name = "Unknown"
+    name = await user_cache.get_display_name(client, user_id, "Unknown")
     if cache is not None:
         cache[user_id] = name
     return name
 
 async def _get_user_display_name(client: Client, user_id: int, fallback_name: str = "Unknown") -> str:
-    """Get user's current display name with better error handling and fallback."""
-    try:
-        # Try to get current user info from Telegram
-        user_info = await client.get_users(user_id)
-        if user_info and hasattr(user_info, 'first_name') and user_info.first_name:
-            return user_info.first_name
-        else:
-            print(f"User {user_id} has no first_name attribute or it's empty")
-            return fallback_name
-    except Exception as e:
-        # Handle specific Telegram API errors
-        if "PEER_ID_INVALID" in str(e):
-            print(f"User {user_id}: Bot hasn't interacted with this user yet, using database name")
-            return fallback_name
-        elif "USER_DEACTIVATED" in str(e):
-            print(f"User {user_id}: User account is deactivated, using database name")
-            return fallback_name
-        else:
-            print(f"Failed to fetch user {user_id} from Telegram: {e}")
-            return fallback_name
+    """Get user's current display name from the shared user cache, falling back to the database name."""
+    return await user_cache.get_display_name(client, user_id, fallback_name)
 
 async def _get_user_display_name_smart(client: Client, user_id: int, fallback_name: str = "Unknown") -> str:
-    """Smart user name fetching that handles various Telegram API limitations."""
-    try:
-        # Try to get current user info from Telegram
-        user_info = await client.get_users(user_id)
-        if user_info and hasattr(user_info, 'first_name') and user_info.first_name:
-            # Successfully got current name
-            if user_info.first_name != fallback_name:
-                print(f"User {user_id}: Updated name from '{fallback_name}' to '{user_info.first_name}'")
-                # Try to update the database with the new name
-                try:
-                    db = get_database()
-                    await db.users.update_one(
-                        {'user_id': user_id},
-                        {'$set': {'first_name': user_info.first_name}}
-                    )
-                    print(f"User {user_id}: Database updated with new name '{user_info.first_name}'")
-                except Exception as db_error:
-                    print(f"User {user_id}: Failed to update database: {db_error}")
-            return user_info.first_name
-        else:
-            print(f"User {user_id}: No first_name attribute, using database name")
-            return fallback_name
-    except Exception as e:
-        error_str = str(e)
-        if "PEER_ID_INVALID" in error_str:
-            print(f"User {user_id}: Bot hasn't met this user yet (PEER_ID_INVALID), using database name: '{fallback_name}'")
-        elif "USER_DEACTIVATED" in error_str:
-            print(f"User {user_id}: User account deactivated, using database name: '{fallback_name}'")
-        elif "USER_NOT_FOUND" in error_str:
-            print(f"User {user_id}: User not found, using database name: '{fallback_name}'")
-        else:
-            print(f"User {user_id}: Unknown error '{error_str}', using database name: '{fallback_name}'")
+    """Like _get_user_display_name, but writes a changed name back to the database."""
+    entry = await user_cache.resolve(client, user_id)
+    if not entry or not entry.first_name:
         return fallback_name
+    if entry.first_name != fallback_name:
+        try:
+            db = get_database()
+            await db.sync_user_profile(user_id, entry.username, entry.first_name, entry.last_name)
+        except Exception as db_error:
+            print(f"User {user_id}: Failed to update database: {db_error}")
+    return entry.first_name
 
 async def update_user_name_in_database(user_id: int, new_name: str):
     """Update user's name in the database when they interact with the bot."""
@@ -232,6 +194,7 @@ async def tdtop_command(client: Client, message: Message):
         
         # Fetch current user information from Telegram for updated names
         name_cache = {}  # Cache for this command execution
+        await _prefetch_display_names(client, [collector['user_id'] for collector in top_collectors])
         for idx, collector in enumerate(top_collectors, 1):
             user_id = collector['user_id']
             fallback_name = collector.get('first_name', 'Unknown')
@@ -304,6 +267,7 @@ async def gtop_command(client: Client, message: Message):
             return
         message_text = "<b>🌍 ɢʟᴏʙᴀʟ ᴛᴏᴘ 10 ᴄᴏʟʟᴇᴄᴛᴏʀs 🌍</b>\n\n"
         medals = ["🥇", "🥈", "🥉"]
+        await _prefetch_display_names(client, [collector['user_id'] for collector in top_collectors])
         for idx, collector in enumerate(top_collectors, 1):
             user_id = collector['user_id']
             fallback_name = collector.get('first_name', 'Unknown')
@@ -358,6 +322,7 @@ async def top_command(client: Client, message: Message):
             async for member in client.get_chat_members(chat.id):
                 if hasattr(member, 'user') and hasattr(member.user, 'id'):
                     current_members.add(member.user.id)
+                    user_cache.observe(member.user)
         except Exception as e:
             # If we can't fetch members, fallback to old behavior
             current_members = None
@@ -401,6 +366,7 @@ async def top_command(client: Client, message: Message):
         
         message_text = f"<b>📊 ᴛᴏᴘ 10 ᴄᴏʟʟᴇᴄᴛᴏʀs ɪɴ {escape_markdown(chat.title, version=2)} 📊</b>\n\n"
         medals = ["🥇", "🥈", "🥉"]
+        await _prefetch_display_names(client, [collector['user_id'] for collector in top_collectors])
         for idx, collector in enumerate(top_collectors, 1):
             user_id = collector['user_id']
             fallback_name = collector.get('first_name', 'Unknown')
@@ -453,6 +419,7 @@ async def rgtop_command(client: Client, message: Message):
         return
     message_text = "<b>💰 ɢʟᴏʙᴀʟ ᴛᴏᴘ 10 ʀɪᴄʜᴇsᴛ ᴄᴏʟʟᴇᴄᴛᴏʀs 💰</b>\n\n"
     medals = ["🥇", "🥈", "🥉"]
+    await _prefetch_display_names(client, [user['user_id'] for user in top_rich])
     for idx, user in enumerate(top_rich, 1):
         user_id = user['user_id']
         fallback_name = user.get('first_name', 'Unknown')
@@ -508,6 +475,7 @@ async def btop_command(client: Client, message: Message):
         return
     message_text = "<b>🏦 ᴛᴏᴘ 25 ʙᴀɴᴋ ʙᴀʟᴀɴᴄᴇs 🏦</b>\n\n"
     medals = ["🥇", "🥈", "🥉"]
+    await _prefetch_display_names(client, [user['user_id'] for user in top_bank])
     for idx, user in enumerate(top_bank, 1):
         user_id = user['user_id']
         fallback_name = user.get('first_name', 'Unknown')
@@ -555,6 +523,7 @@ async def sgtop_command(client: Client, message: Message):
         return
     message_text = "<b>🎐 ɢʟᴏʙᴀʟ ᴛᴏᴘ 10 sʜᴀʀᴅ ᴄᴏʟʟᴇᴄᴛᴏʀs 🎐</b>\n\n"
     medals = ["🥇", "🥈", "🥉"]
+    await _prefetch_display_names(client, [user['user_id'] for user in top_shards])
     for idx, user in enumerate(top_shards, 1):
         user_id = user['user_id']
         fallback_name = user.get('first_name', 'Unknown')
@@ -616,6 +585,7 @@ async def wintop_command(client: Client, message: Message):
         
         medals = ["🥇", "🥈", "🥉"]
         
+        await _prefetch_display_names(client, [winner['user_id'] for winner in weekly_winners])
         for idx, winner in enumerate(weekly_winners, 1):
             user_id = winner['user_id']
             fallback_name = winner.get('first_name', 'Unknown')
@@ -688,6 +658,7 @@ async def wtop_command(client: Client, message: Message):
         
         medals = ["🥇", "🥈", "🥉"]
         
+        await _prefetch_display_names(client, [collector['user_id'] for collector in weekly_collectors])
         for idx, collector in enumerate(weekly_collectors, 1):
             user_id = collector['user_id']
             fallback_name = collector.get('first_name', 'Unknown')
@@ -754,6 +725,7 @@ async def test_leaderboard_command(client: Client, message: Message):
                 )
         
         message_text = "🎉 <b>Daily Leaderboard Results</b> 🎉\n\n<b>Top Collectors of the Day:</b>\n\n"
+        await _prefetch_display_names(client, [collector['user_id'] for collector in top_collectors])
         for idx, collector in enumerate(top_collectors, 1):
             if idx in REWARDS:
                 reward = REWARDS[idx]
@@ -884,6 +856,7 @@ async def post_tdtop_to_log_channel(client: Client):
             f"<b>⏰ ɴᴇxᴛ ʀᴇsᴇᴛ ɪɴ:</b> <code>{hours}h {minutes}m</code>\n\n"
         )
         medals = ["🥇", "🥈", "🥉"]
+        await _prefetch_display_names(client, [collector['user_id'] for collector in top_collectors])
         for idx, collector in enumerate(top_collectors, 1):
             user_id = collector['user_id']
             fallback_name = collector.get('first_name', 'Unknown')
@@ -6,48 +6,11 @@ import os
 # Import database based on configuration
 from modules.postgres_database import get_database, get_rarity_emoji, RARITIES, RARITY_EMOJIS, get_rarity_display
 from .decorators import check_banned
-import asyncio
+from .lock_manager import lock_manager
 
-# --- ActionManager remains as a class for now (used by both gift and trade) ---
-class ActionManager:
-    def __init__(self):
-        self.active_actions = {}
-    async def is_user_busy(self, db, user_id):
-        user_data = await db.get_user(user_id)
-        return bool(user_data and user_data.get('active_action'))
-    async def get_user_action(self, db, user_id):
-        user_data = await db.get_user(user_id)
-        active_action = user_data.get('active_action') if user_data else None
-        # Defensive: handle legacy/invalid types
-        if isinstance(active_action, dict):
-            action_type = active_action.get('type')
-            return action_type
-        # If it's a string (bad state), treat as no action
-        return None
-    async def set_user_action(self, db, user_id, action_type, data):
-        action_data = {
-            'type': action_type,
-            'data': data,
-            'timestamp': datetime.now().timestamp()
-        }
-        await db.update_user(user_id, {'active_action': action_data})
-        self.active_actions[user_id] = action_data
-    async def clear_user_action(self, db, user_id):
-        await db.update_user(user_id, {'active_action': None})
-        self.active_actions.pop(user_id, None)
-    def get_action_message(self, action_type):
-        messages = {
-            'gift': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ɢɪғᴛ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
-            'trade': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴛʀᴀᴅᴇ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
-            'sell': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ sᴇʟʟ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
-            'fusion': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ғᴜsɪᴏɴ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
-            'massgift': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴍᴀssɢɪғᴛ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.",
-            'masssell': "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴍᴀsssᴇʟʟ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ."
-        }
-        return messages.get(action_type, "ʏᴏᴜ ʜᴀᴠᴇ ᴀɴ ᴀᴄᴛɪᴠᴇ ᴀᴄᴛɪᴏɴ! ᴘʟᴇᴀsᴇ ᴄᴀɴᴄᴇʟ ɪᴛ ғɪʀsᴛ.")
+# ActionManager is shared by gift, trade, sell and fusion; re-exported here for existing imports
+from .action_registry import ActionManager, action_manager
 
-# Global action manager instance
-action_manager = ActionManager()
 # Module-level storage for active gifts
 _active_gifts = {}
 # Module-level storage for active trades
@@ -56,8 +19,6 @@ _active_trades = {}
 _massgift_temp = {}
 # Processing flags to prevent spam clicks
 _processing_massgifts = set()
-# Async locks for gift confirmations
-_gift_locks = {}
 
 @check_banned
 async def gift_command(client: Client, message: Message):
@@ -67,9 +28,7 @@ async def gift_command(client: Client, message: Message):
     if await action_manager.is_user_busy(db, user.id):
         action_type = await action_manager.get_user_action(db, user.id)
         if isinstance(action_type, str) and action_type:
-            user_data = await db.get_user(user.id)
-            active_action = user_data.get('active_action') if user_data else None
-            action_data = active_action['data'] if isinstance(active_action, dict) else {}
+            action_data = action_manager.get_action_data(user.id)
             keyboard = [[InlineKeyboardButton("❌ Cancel Action", callback_data=f"cancel_{action_type}_{action_data.get('gift_id', action_data.get('trade_id', '') )}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await message.reply_text(
@@ -178,8 +137,7 @@ async def handle_gift_callback(client: Client, callback_query: CallbackQuery):
         await callback_query.answer("Gift not found or expired!", show_alert=True)
         return
     # Prevent double processing (race condition safe)
-    lock = _gift_locks.setdefault(gift_found['gift_id'], asyncio.Lock())
-    async with lock:
+    async with lock_manager.lock(('gift', gift_found['gift_id'])):
         if gift_found.get('completed'):
             await callback_query.answer("This gift has already been processed.", show_alert=True)
             return
@@ -265,8 +223,6 @@ async def handle_gift_callback(client: Client, callback_query: CallbackQuery):
             await action_manager.clear_user_action(db, user.id)
         if gift_owner_id:
             _active_gifts.pop(gift_owner_id, None)
-        # Clean up lock
-        _gift_locks.pop(gift_found['gift_id'], None)
 
 @check_banned
 async def trade_command(client: Client, message: Message):
@@ -276,9 +232,7 @@ async def trade_command(client: Client, message: Message):
     if await action_manager.is_user_busy(db, user.id):
         action_type = await action_manager.get_user_action(db, user.id)
         if isinstance(action_type, str) and action_type:
-            user_data = await db.get_user(user.id)
-            active_action = user_data.get('active_action') if user_data else None
-            action_data = active_action['data'] if isinstance(active_action, dict) else {}
+            action_data = action_manager.get_action_data(user.id)
             keyboard = [[InlineKeyboardButton("❌ Cancel Action", callback_data=f"cancel_{action_type}_{action_data.get('gift_id', action_data.get('trade_id', '') )}")]]
             reply_markup = InlineKeyboardMarkup(keyboard)
             await message.reply_text(
@@ -477,8 +431,7 @@ async def handle_cancel_callback(client: Client, callback_query: CallbackQuery):
         return
     action_type = parts[1]
     action_id = '_'.join(parts[2:])
-    user_data = await db.get_user(user.id)
-    active_action = user_data.get('active_action') if user_data else None
+    active_action = action_manager.get(user.id)
     # If no active_action or not a dict, just clear and succeed
     if not active_action or not isinstance(active_action, dict):
         await action_manager.clear_user_action(db, user.id)
@@ -614,16 +567,43 @@ async def massgift_command(client: Client, message: Message):
     msg += f"\n\n<b>Recipient:</b> {target_user.mention}\n\nAre you sure you want to gift these Characters?"
     await message.reply_text(msg, reply_markup=reply_markup)
 
+async def _move_characters_fallback(db, user_id, target_id, char_ids, now):
+    """Mongo version of move_characters for a gift; returns {'ok': False} if the sender lacks a copy"""
+    from collections import Counter
+    user_data = await db.get_user(user_id)
+    owned_chars = user_data.get('characters', []) if user_data else []
+    pending = Counter(char_ids)
+    owned_counts = Counter(owned_chars)
+    if any(owned_counts[cid] < count for cid, count in pending.items()):
+        return {'ok': False}
+    # Drop one owned copy per gifted id in a single pass
+    new_chars = []
+    for cid in owned_chars:
+        if pending[cid]:
+            pending[cid] -= 1
+        else:
+            new_chars.append(cid)
+    collection_history = [{
+        'character_id': cid,
+        'collected_at': now.isoformat(),
+        'source': 'gift'
+    } for cid in char_ids]
+    await db.users.update_one({'user_id': user_id}, {'$set': {'characters': new_chars}})
+    await db.users.update_one(
+        {'user_id': target_id},
+        {'$push': {'characters': {'$each': char_ids}, 'collection_history': {'$each': collection_history}}}
+    )
+    return {'ok': True}
+
 @check_banned
 async def handle_massgift_callback(client: Client, callback_query: CallbackQuery):
     await callback_query.answer()
     user_id = callback_query.from_user.id
     db = get_database()
     
-    # Get or create lock for this user
-    if user_id not in _gift_locks:
-        _gift_locks[user_id] = asyncio.Lock()
-    lock = _gift_locks[user_id]
+    # Lock sender and recipient together so two massgifts into the same collection can't overwrite each other
+    target_id = _massgift_temp.get(user_id, {}).get('target_id')
+    lock = lock_manager.lock(('gift', user_id), ('gift', target_id or user_id))
     
     # Always clear both massgift and masssell session data for this user after confirm/cancel
     def clear_all_mass_sessions():
@@ -654,18 +634,14 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
             
             async with lock:
                 try:
-                    # Re-fetch user data inside the lock to ensure we have the latest state
-                    user_data = await db.get_user(user_id)
-                    active_action = user_data.get('active_action', {}) if user_data else {}
+                    active_action = action_manager.get(user_id) or {}
                     
                     # Check if massgift session is still valid
                     if user_id not in _massgift_temp:
                         await callback_query.edit_message_text("❌ Session expired! Please try again!")
                         clear_all_mass_sessions()
                         await action_manager.clear_user_action(db, user_id)
-                        # Clean up lock and processing flag
-                        if user_id in _gift_locks:
-                            del _gift_locks[user_id]
+                        # Clean up processing flag
                         _processing_massgifts.discard(user_id)
                         return
                     
@@ -681,9 +657,7 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                         await callback_query.edit_message_text("❌ This massgift session is no longer valid (another action was started or confirmed).", disable_web_page_preview=True)
                         clear_all_mass_sessions()
                         await action_manager.clear_user_action(db, user_id)
-                        # Clean up lock and processing flag
-                        if user_id in _gift_locks:
-                            del _gift_locks[user_id]
+                        # Clean up processing flag
                         _processing_massgifts.discard(user_id)
                         return
                     try:
@@ -691,34 +665,9 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                         target_id = data['target_id']
                         char_ids = data['char_ids']
                         id_to_char = data.get('id_to_char', {})
-                        # Remove from sender
-                        user_data = await db.get_user(user_id)
-                        owned_chars = user_data.get('characters', []) if user_data else []
-                        new_chars = owned_chars.copy()
-                        for cid in char_ids:
-                            if cid in new_chars:
-                                new_chars.remove(cid)
-                        # Add to recipient
                         now = datetime.now()
-                        collection_history = [{
-                            'character_id': cid,
-                            'collected_at': now,
-                            'source': 'gift'
-                        } for cid in char_ids]
-                        # Remove characters from sender
-                        await db.update_user(user_id, {'characters': new_chars})
-                        
-                        # Add characters to recipient
-                        target_data = await db.get_user(target_id)
-                        if target_data:
-                            target_chars = target_data.get('characters', []) + char_ids
-                            target_history = target_data.get('collection_history', []) + collection_history
-                            await db.update_user(target_id, {
-                                'characters': target_chars,
-                                'collection_history': target_history
-                            })
-                        else:
-                            # Create new user if doesn't exist
+                        if not await db.get_user(target_id):
+                            # Create the recipient so the move below has a row to add to
                             await db.add_user({
                                 'user_id': target_id,
                                 'username': None,
@@ -726,8 +675,7 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                                 'coins': 0,
                                 'wallet': 0,
                                 'bank': 0,
-                                'characters': char_ids,
-                                'collection_history': collection_history,
+                                'characters': [],
                                 'last_daily': None,
                                 'last_weekly': None,
                                 'last_monthly': None,
@@ -738,6 +686,19 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                                     'filter': None
                                 }
                             })
+                        if hasattr(db, 'move_characters'):
+                            # Count check, removal from sender and delivery with history in one statement
+                            result = await db.move_characters(user_id, char_ids, to_user_id=target_id, source='gift')
+                        else:
+                            # Fallback for Mongo
+                            result = await _move_characters_fallback(db, user_id, target_id, char_ids, now)
+                        if not result['ok']:
+                            await callback_query.edit_message_text("❌ You no longer own all of these characters!")
+                            await action_manager.clear_user_action(db, user_id)
+                            clear_all_mass_sessions()
+                            # Clean up processing flag
+                            _processing_massgifts.discard(user_id)
+                            return
                         # Log transaction for sender
                         await db.log_user_transaction(user_id, "gift_sent", {
                             "to_user_id": target_id,
@@ -763,9 +724,7 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                         await action_manager.clear_user_action(db, user_id)
                         _massgift_temp[user_id]['completed'] = True
                         clear_all_mass_sessions()
-                        # Clean up lock and processing flag
-                        if user_id in _gift_locks:
-                            del _gift_locks[user_id]
+                        # Clean up processing flag
                         _processing_massgifts.discard(user_id)
                     except Exception as e:
                         print(f"Error in massgift confirmation for user {user_id}: {e}")
@@ -774,9 +733,7 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                         await callback_query.edit_message_text("❌ An error occurred while mass gifting!")
                         await action_manager.clear_user_action(db, user_id)
                         clear_all_mass_sessions()
-                        # Clean up lock and processing flag
-                        if user_id in _gift_locks:
-                            del _gift_locks[user_id]
+                        # Clean up processing flag
                         _processing_massgifts.discard(user_id)
                 except Exception as e:
                     print(f"Error in massgift confirmation for user {user_id}: {e}")
@@ -785,9 +742,7 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
                     await callback_query.edit_message_text("❌ An error occurred while mass gifting!")
                     await action_manager.clear_user_action(db, user_id)
                     clear_all_mass_sessions()
-                    # Clean up lock and processing flag
-                    if user_id in _gift_locks:
-                        del _gift_locks[user_id]
+                    # Clean up processing flag
                     _processing_massgifts.discard(user_id)
         except Exception as e:
             print(f"Error in massgift confirmation for user {user_id}: {e}")
@@ -804,9 +759,6 @@ async def handle_massgift_callback(client: Client, callback_query: CallbackQuery
             await callback_query.edit_message_text("❌ Mass gift cancelled!")
             await action_manager.clear_user_action(db, user_id)
             clear_all_mass_sessions()
-            # Clean up lock
-            if user_id in _gift_locks:
-                del _gift_locks[user_id]
 
 def setup_gift_handlers(app: Client):
     app.add_handler(filters.command("gift")(gift_command))
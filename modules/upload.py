@@ -1,20 +1,16 @@
 from pyrogram import filters, Client
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Message, InlineQuery, InlineQueryResultArticle, InlineQueryResultPhoto, InlineQueryResultVideo, InputTextMessageContent
 import re
-import asyncio
 import base64
 import io
 import logging
-import mimetypes
-import os
-import aiohttp
-import cloudinary
-import cloudinary.uploader
 from pyrogram.enums import ParseMode
-import requests
 from config import LOG_CHANNEL_ID, DROPTIME_LOG_CHANNEL, OWNER_ID
 from modules.decorators import admin_only
+from modules.media_upload import get_upload_pipeline, message_progress, upload_media
 from modules.postgres_database import get_database, RARITIES, RARITY_EMOJIS
+from modules.collection_view import invalidate_all_collection_views
+from modules.search_index import get_loaded_search_index, invalidate_search_index
 
 # Constants
 WAIFU = "Pokémon"
@@ -22,15 +18,6 @@ ANIME = "Region"
 SUPPORT_CHAT_ID = LOG_CHANNEL_ID
 LOG_CHANNEL = DROPTIME_LOG_CHANNEL
 
-CATBOX_API_URL = "https://catbox.moe/user/api.php"
-
-# Cloudinary configuration for video uploads
-cloudinary.config(
-    cloud_name="de96qtqav",
-    api_key="755161292211756",
-    api_secret="vO_1lOfhJQs3kI4C5v1E8fywYW8"
-)
-
 upload_details = {}
 # Track user states for conversation flow
 user_states = {}
@@ -164,211 +151,32 @@ async def get_next_character_id():
         return None
 
 
+async def upload_to_catbox(file_id: str, client, **kwargs) -> str:
+    """Upload image to Catbox only."""
+    return await upload_media(client, file_id, 'photo', hosts=['catbox'], **kwargs)
 
-import os
-import mimetypes
-import asyncio
-import aiohttp
-
-import os
-import mimetypes
-import asyncio
-import aiohttp
-
-
-
-async def upload_to_catbox(file_id: str, client) -> str:
-    """Upload image to Catbox (primary method)."""
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # Download file from Telegram
-            file = await asyncio.wait_for(client.download_media(file_id), timeout=120)
-
-            # Load file bytes and filename
-            if isinstance(file, str):
-                filename = os.path.basename(file)
-                with open(file, 'rb') as f:
-                    file_bytes = f.read()
-            elif hasattr(file, 'read'):
-                file.seek(0)
-                file_bytes = file.read()
-                filename = 'upload.jpg'
-            else:
-                raise Exception("Unsupported file type")
-
-            # Guess content type
-            content_type, _ = mimetypes.guess_type(filename)
-            if not content_type:
-                content_type = 'application/octet-stream'
-            
-            # Check file size (Catbox has a 50MB limit)
-            if len(file_bytes) > 50 * 1024 * 1024:
-                raise Exception("File too large for Catbox (max 50MB)")
-            
-            # Ensure filename has proper extension
-            if not filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp')):
-                filename = filename + '.jpg'  # Default to jpg if no extension
-
-            # Use the working logic from the example
-            print(f"[CATBOX DEBUG] Attempt: {attempt + 1}")
-            print(f"[CATBOX DEBUG] Using working Catbox upload logic")
-            print(f"[CATBOX DEBUG] Filename: {filename}, Size: {len(file_bytes)} bytes")
-
-            # Create a temporary file to use with requests
-            import tempfile
-            with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_file:
-                temp_file.write(file_bytes)
-                temp_file_path = temp_file.name
-
-            try:
-                # Use the working logic: reqtype=fileupload and files parameter
-                with open(temp_file_path, "rb") as image_file:
-                    response = requests.post(
-                        CATBOX_API_URL,
-                        data={"reqtype": "fileupload"},
-                        files={"fileToUpload": image_file},
-                        timeout=60
-                    )
 
-                print(f"[CATBOX DEBUG] Status: {response.status_code}, Response: {response.text}")
+async def upload_to_imgbb(file_id: str, client, **kwargs) -> str:
+    """Upload image to ImgBB only."""
+    return await upload_media(client, file_id, 'photo', hosts=['imgbb'], **kwargs)
 
-                if response.status_code == 200 and response.text.startswith("https"):
-                    img_url = response.text.strip()
-                    print(f"[CATBOX DEBUG] Success! URL: {img_url}")
-                    return img_url
-                else:
-                    raise Exception(f"Catbox API returned status {response.status_code}: {response.text}")
-
-            finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_file_path)
-                except:
-                    pass
-
-        except asyncio.TimeoutError:
-            if attempt < max_retries - 1:
-                print(f"[Retry {attempt+1}] Timeout while downloading Telegram media. Retrying...")
-                await asyncio.sleep(2)
-                continue
-            print("Download timed out after multiple attempts.")
-            return None
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"[Retry {attempt+1}] Error uploading to Catbox: {e}. Retrying...")
-                await asyncio.sleep(2)
-                continue
-            print(f"Error uploading to Catbox: {e}")
-            return None
-
-    return None
-
-
-async def upload_to_imgbb(file_id: str, client) -> str:
-    """Upload image to ImgBB (fallback method)."""
-
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # Download file from Telegram
-            file = await asyncio.wait_for(client.download_media(file_id), timeout=120)
-
-            # Load file bytes and filename
-            if isinstance(file, str):
-                filename = os.path.basename(file)
-                with open(file, 'rb') as f:
-                    file_bytes = f.read()
-            elif hasattr(file, 'read'):
-                file.seek(0)
-                file_bytes = file.read()
-                filename = 'upload.jpg'
-            else:
-                raise Exception("Unsupported file type")
-
-            # Guess content type
-            content_type, _ = mimetypes.guess_type(filename)
-            if not content_type:
-                content_type = 'application/octet-stream'
-
-            # Prepare form data
-            timeout = aiohttp.ClientTimeout(total=60)
-            connector = aiohttp.TCPConnector(ssl=False, limit=100, limit_per_host=30)
-            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-                data = aiohttp.FormData()
-                data.add_field('image', file_bytes, filename=filename, content_type=content_type)
-
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                }
 
-                # ImgBB API key in URL
-                api_key = "4b74c2097adb72dfd0cc7941199d8f4c"
-                url = f"https://api.imgbb.com/1/upload?key={api_key}"
-
-                async with session.post(url, data=data, headers=headers) as response:
-                    result_text = await response.text()  # Debug response
-                    if response.status == 200:
-                        result = await response.json()
-                        if 'data' in result and 'url' in result['data']:
-                            return result['data']['url']
-                        else:
-                            raise Exception(f"ImgBB API returned unexpected response: {result}")
-                    else:
-                        raise Exception(f"ImgBB API returned status {response.status}: {result_text}")
-
-        except asyncio.TimeoutError:
-            if attempt < max_retries - 1:
-                print(f"[Retry {attempt+1}] Timeout while downloading Telegram media. Retrying...")
-                await asyncio.sleep(2)
-                continue
-            print("Download timed out after multiple attempts.")
-            return None
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"[Retry {attempt+1}] Error uploading to ImgBB: {e}. Retrying...")
-                await asyncio.sleep(2)
-                continue
-            print(f"Error uploading to ImgBB: {e}")
-            return None
-
-    return None
-
-async def upload_image_with_fallback(file_id: str, client) -> str:
-    """Upload image with Catbox as primary method and ImgBB as fallback."""
-    print("🔄 [UPLOAD] Attempting to upload image to Catbox (primary method)...")
-    
-    # Try Catbox first
-    img_url = await upload_to_catbox(file_id, client)
+async def upload_image_with_fallback(file_id: str, client, **kwargs) -> str:
+    """Upload image with Catbox as primary host and ImgBB/Cloudinary as fallbacks."""
+    img_url = await upload_media(client, file_id, 'photo', **kwargs)
     if img_url:
-        print(f"✅ [UPLOAD] Successfully uploaded to Catbox: {img_url}")
-        return img_url
-    
-    # If Catbox fails, try ImgBB as fallback
-    print("⚠️ [UPLOAD] Catbox upload failed, trying ImgBB as fallback...")
-    img_url = await upload_to_imgbb(file_id, client)
-    if img_url:
-        print(f"✅ [UPLOAD] Successfully uploaded to ImgBB (fallback): {img_url}")
-        return img_url
-    
-    print("❌ [UPLOAD] Both Catbox and ImgBB uploads failed")
-    return None
+        print(f"✅ [UPLOAD] Image uploaded: {img_url}")
+    else:
+        print("❌ [UPLOAD] Image upload failed on every host")
+    return img_url
 
 
-async def upload_video_to_cloudinary(file_id: str, client) -> str:
-    """Upload video to Cloudinary."""
-    try:
-        file = await asyncio.wait_for(client.download_media(file_id), timeout=120)
-        
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: cloudinary.uploader.upload(file, resource_type="video")
-        )
-        return result["secure_url"]
-    except Exception as e:
-        print(f"Error uploading video to Cloudinary: {e}")
-        return None
+async def upload_video_to_cloudinary(file_id: str, client, **kwargs) -> str:
+    """Upload video to Cloudinary, falling back to Catbox."""
+    video_url = await upload_media(client, file_id, 'video', **kwargs)
+    if not video_url:
+        print("Error uploading video: every host failed")
+    return video_url
 
 async def handle_admin_panel(client, message: Message):
     """Handle the admin panel message"""
@@ -394,8 +202,14 @@ async def handle_admin_panel(client, message: Message):
         f"<b>⚙️ Admin Control Panel ⚙️</b>\n\n"
         f"🎀 <b>Total {WAIFU}s:</b> <code>{total_waifus:,}</code>\n"
         f"⛩️ <b>Total {ANIME}s:</b> <code>{total_animes:,}</code>\n"
-        f"🔧 <b>Available Actions:</b>"
     )
+    upload_stats = get_upload_pipeline().get_stats()
+    if upload_stats['active'] or upload_stats['queued']:
+        confirmation_text += (
+            f"📤 <b>Uploads:</b> <code>{upload_stats['active']}</code> running, "
+            f"<code>{upload_stats['queued']}</code> queued\n"
+        )
+    confirmation_text += "🔧 <b>Available Actions:</b>"
     
     # Create a better button grid layout
     keyboard = InlineKeyboardMarkup([
@@ -466,11 +280,17 @@ async def handle_media_upload(client: Client, message: Message):
             parse_mode=ParseMode.HTML
         )
         
-        # Upload based on media type
+        # Stream to the upload hosts, reporting progress on the processing message
+        media = message.video if is_video else message.photo
+        upload_kwargs = {
+            "file_size": media.file_size,
+            "mime_type": getattr(media, "mime_type", None),
+            "progress": message_progress(processing_msg, media_type),
+        }
         if is_video:
-            img_url = await upload_video_to_cloudinary(file_id, client)
+            img_url = await upload_video_to_cloudinary(file_id, client, **upload_kwargs)
         else:
-            img_url = await upload_image_with_fallback(file_id, client)
+            img_url = await upload_image_with_fallback(file_id, client, **upload_kwargs)
         
         if not img_url:
             await processing_msg.edit_text("Upload failed. Please try again.")
@@ -853,6 +673,7 @@ async def confirm_upload_handler(client: Client, callback_query: CallbackQuery):
                 )
                 character_id = result['character_id']
                 db_id = result['id']
+            invalidate_search_index()
         else:  # MongoDB
             result = await db.characters.insert_one(character_data)
             character_id = result.inserted_id
@@ -1354,11 +1175,17 @@ async def handle_edit_image_upload(client: Client, message: Message):
             parse_mode=ParseMode.HTML
         )
         
-        # Upload based on media type
+        # Stream to the upload hosts, reporting progress on the processing message
+        media = message.video if is_video else message.photo
+        upload_kwargs = {
+            "file_size": media.file_size,
+            "mime_type": getattr(media, "mime_type", None),
+            "progress": message_progress(processing_msg, media_type),
+        }
         if is_video:
-            img_url = await upload_video_to_cloudinary(file_id, client)
+            img_url = await upload_video_to_cloudinary(file_id, client, **upload_kwargs)
         else:
-            img_url = await upload_image_with_fallback(file_id, client)
+            img_url = await upload_image_with_fallback(file_id, client, **upload_kwargs)
         
         if not img_url:
             await processing_msg.edit_text("Upload failed. Please try again.")
@@ -1434,6 +1261,7 @@ async def confirm_edit_handler(client: Client, callback_query: CallbackQuery):
                     data['type'],
                     data['character_id']
                 )
+            invalidate_search_index()
         else:  # MongoDB
             await db.characters.update_one(
                 {"_id": data['character_id']},
@@ -1619,17 +1447,8 @@ async def handle_anime_inline_query(client: Client, inline_query: InlineQuery):
         
         # Get unique anime names from existing characters
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                if search_term:
-                    result = await conn.fetch(
-                        "SELECT DISTINCT anime FROM characters WHERE anime IS NOT NULL AND anime != '' AND anime ILIKE $1 ORDER BY anime LIMIT 20",
-                        f"%{search_term}%"
-                    )
-                else:
-                    result = await conn.fetch(
-                        "SELECT DISTINCT anime FROM characters WHERE anime IS NOT NULL AND anime != '' ORDER BY anime LIMIT 20"
-                    )
-                unique_animes = [row['anime'] for row in result]
+            index = await get_loaded_search_index(db)
+            unique_animes = index.anime_names(search_term, limit=20)
         else:  # MongoDB
             if search_term:
                 pipeline = [
@@ -1696,19 +1515,10 @@ async def handle_character_inline_query(client: Client, inline_query: InlineQuer
     try:
         db = get_database()
         
-        # Get characters from database with image URLs
+        # Get characters from the in-memory catalog index
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                if search_term:
-                    result = await conn.fetch(
-                        "SELECT character_id, name, anime, rarity, img_url, is_video, mega, type FROM characters WHERE name ILIKE $1 OR anime ILIKE $1 ORDER BY name LIMIT 20",
-                        f"%{search_term}%"
-                    )
-                else:
-                    result = await conn.fetch(
-                        "SELECT character_id, name, anime, rarity, img_url, is_video, mega, type FROM characters ORDER BY name LIMIT 50"
-                    )
-                characters = [{"character_id": row['character_id'], "name": row['name'], "anime": row['anime'], "rarity": row['rarity'], "img_url": row['img_url'], "is_video": row['is_video'], "mega": row['mega'], "type": row['type']} for row in result]
+            index = await get_loaded_search_index(db)
+            characters = index.search_characters(search_term, limit=20 if search_term else 50)
         else:  # MongoDB
             if search_term:
                 cursor = db.characters.find(
@@ -2069,6 +1879,7 @@ async def confirm_delete_handler(client: Client, callback_query: CallbackQuery):
                     "DELETE FROM characters WHERE character_id = $1",
                     data['character_id']
                 )
+            invalidate_search_index()
         else:  # MongoDB
             # First check if character exists
             result = await db.characters.find_one({"_id": data['character_id']})
@@ -2197,6 +2008,7 @@ async def confirm_reset_handler(client: Client, callback_query: CallbackQuery):
                             break
                 else:
                     print(f"[RESET DEBUG] Character {data['character_id']} not found in any user collections")
+            invalidate_all_collection_views()
         else:  # MongoDB
             # First check if character exists
             result = await db.characters.find_one({"_id": data['character_id']})
@@ -2308,6 +2120,7 @@ async def confirm_rename_anime_handler(client: Client, callback_query: CallbackQ
                     "UPDATE characters SET anime = $1 WHERE anime = $2",
                     new_name, old_name
                 )
+            invalidate_search_index()
         else:  # MongoDB
             # First check if old anime exists
             count = await db.characters.count_documents({"anime": old_name})
@@ -2465,17 +2278,8 @@ async def handle_type_inline_query(client: Client, inline_query: InlineQuery):
         
         # Get unique type names from existing characters
         if hasattr(db, 'pool'):  # PostgreSQL
-            async with db.pool.acquire() as conn:
-                if search_term:
-                    result = await conn.fetch(
-                        "SELECT DISTINCT type FROM characters WHERE type IS NOT NULL AND type != '' AND type ILIKE $1 ORDER BY type LIMIT 20",
-                        f"%{search_term}%"
-                    )
-                else:
-                    result = await conn.fetch(
-                        "SELECT DISTINCT type FROM characters WHERE type IS NOT NULL AND type != '' ORDER BY type LIMIT 20"
-                    )
-                unique_types = [row['type'] for row in result]
+            index = await get_loaded_search_index(db)
+            unique_types = index.type_names(search_term, limit=20)
         else:  # MongoDB
             if search_term:
                 pipeline = [
@@ -2814,6 +2618,7 @@ async def confirm_admin_type_edit_handler(client: Client, callback_query: Callba
                     "SELECT COUNT(*) FROM characters WHERE type = $1",
                     new_type_name
                 )
+            invalidate_search_index()
         else:  # MongoDB
             result = await db.characters.update_many(
                 {"type": old_type_name},
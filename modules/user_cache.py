@@ -0,0 +1,216 @@
+"""
+Process-wide cache of Telegram user display names and usernames.
+
+Leaderboards, battles and collector lists used to call ``client.get_users``
+once per user per render. This cache keeps resolved profiles for a while,
+remembers users Telegram reported as unknown (negative caching), coalesces
+concurrent lookups for the same user and fills misses with a single batched
+``get_users([...])`` call.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from cachetools import TTLCache
+from pyrogram.errors import FloodWait, PeerIdInvalid, UserIdInvalid, UsernameInvalid, UsernameNotOccupied
+
+logger = logging.getLogger(__name__)
+
+# How long a resolved profile is trusted before asking Telegram again
+ENTITY_TTL = 1800  # 30 minutes
+# How long a definitive miss (PEER_ID_INVALID, omitted from a reply, ...) is remembered
+NEGATIVE_TTL = 600  # 10 minutes
+ENTITY_CACHE_SIZE = 20000
+# Errors meaning the peer does not exist, as opposed to the call failing
+MISSING_PEER_ERRORS = (PeerIdInvalid, UserIdInvalid, UsernameInvalid, UsernameNotOccupied)
+# Telegram accepts up to 200 ids per users.GetUsers request
+MAX_BATCH_SIZE = 200
+
+
+@dataclass
+class CachedUser:
+    user_id: int
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    username: Optional[str] = None
+
+    @property
+    def display_name(self) -> Optional[str]:
+        return self.first_name or None
+
+
+class UserEntityCache:
+    """TTL cache of user profiles with negative caching and batched resolution"""
+
+    def __init__(self, ttl: int = ENTITY_TTL, negative_ttl: int = NEGATIVE_TTL, maxsize: int = ENTITY_CACHE_SIZE):
+        self._entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._negative: TTLCache = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self._inflight: Dict[int, asyncio.Future] = {}
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'negative_hits': 0,
+            'api_calls': 0,
+            'observed': 0,
+        }
+
+    def remember(self, user_id: int, first_name: Optional[str] = None, last_name: Optional[str] = None,
+                 username: Optional[str] = None) -> CachedUser:
+        """Store profile fields we already know (from an update or a DB row)."""
+        entry = CachedUser(user_id=user_id, first_name=first_name, last_name=last_name, username=username)
+        self._entries[user_id] = entry
+        self._negative.pop(user_id, None)
+        return entry
+
+    def observe(self, user) -> bool:
+        """Record a pyrogram ``User`` seen on an incoming update.
+
+        Returns True if the profile differs from what was cached, so callers can
+        decide whether the database copy needs refreshing.
+        """
+        if user is None or getattr(user, 'id', None) is None:
+            return False
+        previous = self._entries.get(user.id)
+        self.remember(user.id, user.first_name, getattr(user, 'last_name', None), user.username)
+        self.stats['observed'] += 1
+        return previous is None or (
+            previous.first_name != user.first_name
+            or previous.last_name != getattr(user, 'last_name', None)
+            or previous.username != user.username
+        )
+
+    def peek(self, user_id: int) -> Optional[CachedUser]:
+        """Return the cached profile without ever calling Telegram."""
+        return self._entries.get(user_id)
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+        self._negative.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._negative.clear()
+
+    async def resolve_many(self, client, user_ids: Iterable[int]) -> Dict[int, Optional[CachedUser]]:
+        """Resolve many users with at most one ``get_users`` call per 200 misses.
+
+        Users that could not be resolved map to None. Only definitive misses are
+        negatively cached; ids whose lookup failed (FloodWait, network) are
+        asked for again next time.
+        """
+        results: Dict[int, Optional[CachedUser]] = {}
+        waiting: Dict[int, asyncio.Future] = {}
+        to_fetch: List[int] = []
+
+        for user_id in dict.fromkeys(user_ids):
+            if user_id is None:
+                continue
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self.stats['hits'] += 1
+                results[user_id] = entry
+            elif user_id in self._negative:
+                self.stats['negative_hits'] += 1
+                results[user_id] = None
+            elif user_id in self._inflight:
+                waiting[user_id] = self._inflight[user_id]
+            else:
+                self.stats['misses'] += 1
+                to_fetch.append(user_id)
+
+        if to_fetch:
+            loop = asyncio.get_running_loop()
+            futures = {user_id: loop.create_future() for user_id in to_fetch}
+            self._inflight.update(futures)
+            try:
+                for start in range(0, len(to_fetch), MAX_BATCH_SIZE):
+                    chunk = to_fetch[start:start + MAX_BATCH_SIZE]
+                    fetched, failed = await self._fetch_chunk(client, chunk)
+                    for user_id in chunk:
+                        entry = fetched.get(user_id)
+                        if entry is None and user_id not in failed:
+                            self._negative[user_id] = True
+                        results[user_id] = entry
+                        futures[user_id].set_result(entry)
+            finally:
+                for user_id, future in futures.items():
+                    if not future.done():
+                        future.set_result(None)
+                    self._inflight.pop(user_id, None)
+
+        for user_id, future in waiting.items():
+            try:
+                results[user_id] = await future
+            except Exception:
+                results[user_id] = None
+
+        return results
+
+    async def _fetch_chunk(self, client, user_ids: List[int]) -> Tuple[Dict[int, CachedUser], Set[int]]:
+        """Return ``(fetched, failed)``; ids in neither set are known not to exist."""
+        fetched: Dict[int, CachedUser] = {}
+        try:
+            self.stats['api_calls'] += 1
+            users = await client.get_users(user_ids if len(user_ids) > 1 else user_ids[0])
+            if not isinstance(users, list):
+                users = [users]
+            for user in users:
+                if user is not None:
+                    fetched[user.id] = self.remember(user.id, user.first_name, user.last_name, user.username)
+            return fetched, set()
+        except FloodWait as e:
+            # Splitting the batch would only make more calls; callers fall back to stored names
+            logger.debug(f"get_users hit FloodWait ({e.value}s) for {len(user_ids)} ids")
+            return fetched, set(user_ids)
+        except Exception as e:
+            if len(user_ids) == 1:
+                logger.debug(f"Could not resolve user {user_ids[0]}: {e}")
+                if isinstance(e, MISSING_PEER_ERRORS):
+                    return fetched, set()
+                return fetched, set(user_ids)
+            # One unknown peer fails the whole batch. Bisect, so k bad ids cost
+            # about k * log2(n) calls instead of one call per id.
+            logger.debug(f"Batched get_users failed ({e}), splitting {len(user_ids)} ids")
+        middle = len(user_ids) // 2
+        failed: Set[int] = set()
+        for half in (user_ids[:middle], user_ids[middle:]):
+            half_fetched, half_failed = await self._fetch_chunk(client, half)
+            fetched.update(half_fetched)
+            failed |= half_failed
+        return fetched, failed
+
+    async def resolve(self, client, user_id: int) -> Optional[CachedUser]:
+        return (await self.resolve_many(client, [user_id])).get(user_id)
+
+    async def get_display_names(self, client, user_ids: Iterable[int],
+                                fallbacks: Optional[Dict[int, str]] = None) -> Dict[int, str]:
+        """Map user ids to first names, falling back to ``fallbacks`` or 'Unknown'."""
+        fallbacks = fallbacks or {}
+        ids = list(user_ids)
+        resolved = await self.resolve_many(client, ids) if client else {}
+        names = {}
+        for user_id in ids:
+            entry = resolved.get(user_id) or self.peek(user_id)
+            names[user_id] = (entry.display_name if entry else None) or fallbacks.get(user_id) or "Unknown"
+        return names
+
+    async def get_display_name(self, client, user_id: int, fallback_name: str = "Unknown") -> str:
+        names = await self.get_display_names(client, [user_id], {user_id: fallback_name})
+        return names[user_id]
+
+    def get_stats(self) -> Dict[str, int]:
+        stats = dict(self.stats)
+        stats['cached'] = len(self._entries)
+        stats['negative'] = len(self._negative)
+        return stats
+
+
+# Global instance
+user_cache = UserEntityCache()
+
+
+def get_user_cache() -> UserEntityCache:
+    """Get the process-wide user entity cache"""
+    return user_cache
@@ -8,18 +8,8 @@ if os.environ.get('USE_POSTGRESQL', 'false').lower() == 'true':
     from .postgres_database import get_database, get_rarity_emoji, RARITIES, RARITY_EMOJIS, get_rarity_display
 else:
     from .database import get_database, get_rarity_emoji, RARITIES, RARITY_EMOJIS, get_rarity_display
-import aiohttp
-import asyncio
-import cloudinary
-import cloudinary.uploader
 from modules.postgres_database import get_database
-
-# Configure Cloudinary (replace with your credentials)
-cloudinary.config(
-    cloud_name="de96qtqav",
-    api_key="755161292211756",
-    api_secret="vO_1lOfhJQs3kI4C5v1E8fywYW8"
-)
+from modules.media_upload import message_progress, upload_media
 
 # Rarity data with emojis
 RARITIES = {
@@ -79,26 +69,15 @@ async def vadd_command(client: Client, message: Message):
         return
     # Show processing message
     processing_msg = await message.reply_text("<i>Processing your video upload, please wait...</i>")
-    # Download video file
-    try:
-        import asyncio
-        file = await asyncio.wait_for(client.download_media(message.reply_to_message.video.file_id), timeout=120)
-    except asyncio.TimeoutError:
-        await processing_msg.edit_text("<b>❌ Timeout downloading video from Telegram (120 seconds exceeded).</b>")
-        return
-    except Exception as e:
-        await processing_msg.edit_text("<b>❌ Failed to download video from Telegram.</b>")
-        return
-    # Upload to Cloudinary
-    try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(
-            None,
-            lambda: cloudinary.uploader.upload(file, resource_type="video")
-        )
-        video_url = result["secure_url"]
-    except Exception as e:
-        await processing_msg.edit_text(f"<b>❌ Failed to upload video to Cloudinary. {e}</b>")
+    # Stream the video from Telegram to Cloudinary (Catbox as fallback)
+    video = message.reply_to_message.video
+    video_url = await upload_media(
+        client, video.file_id, 'video',
+        file_size=video.file_size, mime_type=video.mime_type,
+        progress=message_progress(processing_msg, "video")
+    )
+    if not video_url:
+        await processing_msg.edit_text("<b>❌ Failed to upload video. Please try again.</b>")
         return
     db = get_database()
     # Add to DB
@@ -148,24 +127,14 @@ async def vedit_command(client: Client, message: Message):
     # Case 1: Edit video (reply to a video, only <id> provided)
     if message.reply_to_message and message.reply_to_message.video and len(parts) == 2:
         processing_msg = await message.reply_text("<i>Updating the video, please wait...</i>")
-        try:
-            import asyncio
-            file = await asyncio.wait_for(client.download_media(message.reply_to_message.video.file_id), timeout=120)
-        except asyncio.TimeoutError:
-            await processing_msg.edit_text("<b>❌ Timeout downloading new video from Telegram (120 seconds exceeded).</b>")
-            return
-        except Exception as e:
-            await processing_msg.edit_text("<b>❌ Failed to download new video from Telegram.</b>")
-            return
-        try:
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None,
-                lambda: cloudinary.uploader.upload(file, resource_type="video")
-            )
-            video_url = result["secure_url"]
-        except Exception as e:
-            await processing_msg.edit_text(f"<b>❌ Failed to upload new video to Cloudinary. {e}</b>")
+        video = message.reply_to_message.video
+        video_url = await upload_media(
+            client, video.file_id, 'video',
+            file_size=video.file_size, mime_type=video.mime_type,
+            progress=message_progress(processing_msg, "new video")
+        )
+        if not video_url:
+            await processing_msg.edit_text("<b>❌ Failed to upload new video. Please try again.</b>")
             return
         await db.characters.update_one(
             {"_id": char["_id"]},
@@ -5,7 +5,6 @@ from pyrogram.types import (
     CallbackQuery,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
-    InputMediaVideo,
     Message,
 )
 
@@ -18,6 +17,7 @@ from modules.postgres_database import (
 )
 
 from .decorators import check_banned
+from .media_utils import edit_character_media, reply_character_media
 
 
 # Constants
@@ -85,8 +85,9 @@ async def send_video_message(client: Client, message: Message, user_id: int, ind
         keyboard.append([InlineKeyboardButton("❌ Close", callback_data="vid_close")])
         reply_markup = InlineKeyboardMarkup(keyboard)
         # Send video with caption and buttons
-        await message.reply_video(
-            video=character['img_url'],
+        await reply_character_media(
+            message,
+            character,
             caption=caption,
             reply_markup=reply_markup
         )
@@ -138,11 +139,10 @@ async def handle_vidcollection_pagination(client: Client, callback_query: Callba
     reply_markup = InlineKeyboardMarkup(keyboard)
     # Edit the video and caption
     try:
-        await callback_query.edit_message_media(
-            media=InputMediaVideo(
-                media=character['img_url'],
-                caption=caption
-            ),
+        await edit_character_media(
+            callback_query,
+            character,
+            caption=caption,
             reply_markup=reply_markup
         )
     except Exception as e:
@@ -179,6 +179,21 @@ async def vidlist_command(client: Client, message: Message):
         print(f"Error in vidlist_command: {e}")
         await message.reply_text("❌ An error occurred!")
 
+async def _get_ownership_counts(db, character_id):
+    """Return (total copies, unique owners) for a character"""
+    if hasattr(db, 'pool'):  # PostgreSQL: maintained counters
+        stats = await db.get_character_ownership_stats(character_id)
+        return stats['total_copies'], stats['unique_owners']
+    # Count total occurrences of this character in all users' collections
+    pipeline = [
+        {"$match": {"characters": character_id}},
+        {"$project": {"count": {"$size": {"$filter": {"input": "$characters", "as": "c", "cond": {"$eq": ["$$c", character_id]}}}}}},
+    ]
+    user_counts = await db.users.aggregate(pipeline).to_list(length=None)
+    global_count = sum(u['count'] for u in user_counts)
+    unique_owners = await db.users.count_documents({'characters': character_id})
+    return global_count, unique_owners
+
 async def send_vidlist_video(client: Client, message: Message, user_id: int, index: int):
     try:
         video_chars = global_vidlist_data[user_id]['video_chars']
@@ -189,14 +204,7 @@ async def send_vidlist_video(client: Client, message: Message, user_id: int, ind
         db = client.db if hasattr(client, 'db') else None
         if db is None:
             db = get_database()
-        # Count total occurrences of this character in all users' collections
-        pipeline = [
-            {"$match": {"characters": character['character_id']}},
-            {"$project": {"count": {"$size": {"$filter": {"input": "$characters", "as": "c", "cond": {"$eq": ["$$c", character['character_id']]}}}}}},
-        ]
-        user_counts = await db.users.aggregate(pipeline).to_list(length=None)
-        global_count = sum(u['count'] for u in user_counts)
-        unique_owners = await db.users.count_documents({'characters': character['character_id']})
+        global_count, unique_owners = await _get_ownership_counts(db, character['character_id'])
         # Caption
         caption = (
             f"<b>Video Character List (Page {current_page}/{total_chars})</b>\n\n"
@@ -219,8 +227,9 @@ async def send_vidlist_video(client: Client, message: Message, user_id: int, ind
             keyboard.append(nav_buttons)
         keyboard.append([InlineKeyboardButton("❌ Close", callback_data="vidlist_close")])
         reply_markup = InlineKeyboardMarkup(keyboard)
-        await message.reply_video(
-            video=character.get('img_url'),
+        await reply_character_media(
+            message,
+            character,
             caption=caption,
             reply_markup=reply_markup
         )
@@ -253,14 +262,7 @@ async def handle_vidlist_pagination(client: Client, callback_query: CallbackQuer
     db = client.db if hasattr(client, 'db') else None
     if db is None:
         db = get_database()
-    # Count total occurrences of this character in all users' collections
-    pipeline = [
-        {"$match": {"characters": character['character_id']}},
-        {"$project": {"count": {"$size": {"$filter": {"input": "$characters", "as": "c", "cond": {"$eq": ["$$c", character['character_id']]}}}}}},
-    ]
-    user_counts = await db.users.aggregate(pipeline).to_list(length=None)
-    global_count = sum(u['count'] for u in user_counts)
-    unique_owners = await db.users.count_documents({'characters': character['character_id']})
+    global_count, unique_owners = await _get_ownership_counts(db, character['character_id'])
     caption = (
         f"<b>Video Character List (Page {current_index + 1}/{total_chars})</b>\n\n"
         f"<b>👤 Name:</b> {character.get('name', 'Unknown')}\n"
@@ -282,11 +284,10 @@ async def handle_vidlist_pagination(client: Client, callback_query: CallbackQuer
     keyboard.append([InlineKeyboardButton("❌ Close", callback_data="vidlist_close")])
     reply_markup = InlineKeyboardMarkup(keyboard)
     try:
-        await callback_query.edit_message_media(
-            media=InputMediaVideo(
-                media=character.get('img_url'),
-                caption=caption
-            ),
+        await edit_character_media(
+            callback_query,
+            character,
+            caption=caption,
             reply_markup=reply_markup
         )
     except Exception as e: